@@ -0,0 +1,246 @@
+"""
+Допуск запросов с телом (анкеты и загрузки) до чтения тела
+Синхронный воркер gunicorn занят запросом, пока читает тело (до 100 МБ),
+поэтому несколько одновременных или недобросовестных клиентов могут занять
+все воркеры, и главная страница, статика и /api/test перестают отвечать.
+Перед чтением тела запрос проходит три проверки:
+
+- заголовки: Content-Length не больше лимита эндпоинта, допустимый
+  Content-Type - иначе 411/413/415 сразу, тело не читается
+- лимит клиента: token bucket по IP (ADMISSION_RATE запросов в секунду,
+  запас ADMISSION_BURST) - иначе 429 с Retry-After до следующего токена
+- общий лимит: не больше ADMISSION_MAX_IN_FLIGHT анкет одновременно на все
+  воркеры - иначе 503 с Retry-After; по умолчанию на единицу меньше числа
+  воркеров (но не меньше одного), чтобы один воркер всегда оставался для
+  главной страницы и статики. Лимит не меньше числа воркеров - предупреждение
+  при запуске: анкеты снова могут занять все воркеры
+
+Слоты общего лимита - файлы с блокировкой flock в data/admission/: блокировка
+общая для всех процессов и снимается сама, если воркер упал. Корзины токенов
+хранятся в SQLite (data/admission.sqlite3), общей для воркеров gunicorn
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: лимит действует внутри процесса
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+ADMISSION = os.getenv("ADMISSION", "1") == "1"
+ADMISSION_DB_PATH = os.getenv("ADMISSION_DB_PATH", os.path.join(DATA_DIR, "admission.sqlite3"))
+ADMISSION_SLOTS_DIR = os.getenv("ADMISSION_SLOTS_DIR", os.path.join(DATA_DIR, "admission"))
+WORKERS = int(os.getenv("WORKERS", "2"))
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", str(max(1, WORKERS - 1))))
+if ADMISSION and ADMISSION_MAX_IN_FLIGHT >= WORKERS:
+    logger.warning(f"ADMISSION_MAX_IN_FLIGHT={ADMISSION_MAX_IN_FLIGHT} не меньше WORKERS={WORKERS}: "
+                   f"анкеты могут занять все воркеры, главная страница и статика не будут отвечать")
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "5"))  # запросов в секунду с одного IP
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "50"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))  # секунд при перегрузке
+# Число прокси перед сервером (Render - 1): IP клиента берется из X-Forwarded-For
+ADMISSION_TRUSTED_PROXIES = int(os.getenv("ADMISSION_TRUSTED_PROXIES", "0"))
+
+# Как часто удалять корзины неактивных клиентов
+PURGE_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    client TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_buckets_updated_at ON buckets(updated_at);
+"""
+
+ADMISSION_REQUESTS = metrics.counter(
+    'admission_requests_total', "Допуск запросов с телом: admitted - принят, rate_limited - лимит IP (429), "
+    "overloaded - общий лимит (503), too_large/bad_type/length_required - отклонен по заголовкам",
+    ('endpoint', 'result')
+)
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_last_purge = 0.0
+_local_slots = threading.BoundedSemaphore(ADMISSION_MAX_IN_FLIGHT)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+metrics.register_callback('admission_in_flight', "Запросы с телом, принятые воркером и еще не завершенные",
+                          lambda: _in_flight)
+
+
+def _connect() -> sqlite3.Connection:
+    """Открывает соединение с базой лимитов (создает схему при первом вызове)"""
+    global _schema_ready
+
+    if not _schema_ready:
+        os.makedirs(os.path.dirname(ADMISSION_DB_PATH) or '.', exist_ok=True)
+
+    conn = sqlite3.connect(ADMISSION_DB_PATH, timeout=5, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(_SCHEMA)
+                _schema_ready = True
+
+    return conn
+
+
+def client_ip(request) -> str:
+    """IP клиента: за ADMISSION_TRUSTED_PROXIES прокси - из X-Forwarded-For"""
+    if ADMISSION_TRUSTED_PROXIES:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if len(forwarded) >= ADMISSION_TRUSTED_PROXIES:
+            return forwarded[-ADMISSION_TRUSTED_PROXIES]
+    return request.remote_addr or 'unknown'
+
+
+def check_headers(request, max_length: int, content_types: tuple | None) -> tuple[int, str] | None:
+    """
+    Проверка заголовков до чтения тела: (HTTP статус, причина) или None
+    Причина - значение метки result в admission_requests_total
+    """
+    length = request.content_length
+    if length is None:
+        return 411, 'length_required'
+    if length > max_length:
+        return 413, 'too_large'
+    if content_types and request.mimetype not in content_types:
+        return 415, 'bad_type'
+    return None
+
+
+def take_token(client: str, cost: float = 1.0) -> float:
+    """
+    Берет токен из корзины клиента; возвращает 0 - допущен, иначе секунды
+    до появления токена (Retry-After)
+    """
+    global _last_purge
+
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE client = ?", (client,)).fetchone()
+        tokens = ADMISSION_BURST if row is None else \
+            min(ADMISSION_BURST, row['tokens'] + (now - row['updated_at']) * ADMISSION_RATE)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / ADMISSION_RATE
+        conn.execute(
+            "INSERT INTO buckets (client, tokens, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (client) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+            (client, tokens, now)
+        )
+        if now - _last_purge > PURGE_INTERVAL:
+            # Корзина, простоявшая дольше полного наполнения, не отличается от новой
+            _last_purge = now
+            conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - ADMISSION_BURST / ADMISSION_RATE,))
+        conn.execute("COMMIT")
+        return wait
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        # Лимит клиента - защита, а не условие работы: при сбое базы запрос допускается
+        logger.warning(f"Ошибка базы лимитов запросов: {e}")
+        return 0.0
+    finally:
+        conn.close()
+
+
+class Slot:
+    """Место в общем лимите одновременных запросов; release() - освободить"""
+
+    def __init__(self, lock_file=None):
+        self._lock_file = lock_file
+
+    def release(self) -> None:
+        global _in_flight
+
+        if self._lock_file is not None:
+            self._lock_file.close()  # закрытие файла снимает flock
+            self._lock_file = None
+        else:
+            _local_slots.release()
+        with _in_flight_lock:
+            _in_flight -= 1
+
+
+def acquire_slot() -> Slot | None:
+    """Занимает свободный слот без ожидания; None - все слоты заняты"""
+    global _in_flight
+
+    slot = None
+    if fcntl is None:
+        if _local_slots.acquire(blocking=False):
+            slot = Slot()
+    else:
+        os.makedirs(ADMISSION_SLOTS_DIR, exist_ok=True)
+        # Каждый open() - отдельное описание файла: flock различает и потоки одного процесса
+        start = os.getpid() % ADMISSION_MAX_IN_FLIGHT
+        for index in range(ADMISSION_MAX_IN_FLIGHT):
+            path = os.path.join(ADMISSION_SLOTS_DIR, f"slot-{(start + index) % ADMISSION_MAX_IN_FLIGHT}.lock")
+            lock_file = open(path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue
+            slot = Slot(lock_file)
+            break
+
+    if slot is not None:
+        with _in_flight_lock:
+            _in_flight += 1
+    return slot
+
+
+def admit(request, endpoint: str, max_length: int, content_types: tuple | None,
+          limited: bool) -> tuple[Slot | None, tuple[int, str, int | None] | None]:
+    """
+    Решение о допуске запроса: (слот, None) или (None, (HTTP статус, сообщение, Retry-After))
+    limited - запрос занимает место в общем лимите на время обработки
+    """
+    if not ADMISSION:
+        return None, None
+
+    rejected = check_headers(request, max_length, content_types)
+    if rejected is not None:
+        status, reason = rejected
+        ADMISSION_REQUESTS.inc(endpoint=endpoint, result=reason)
+        messages = {
+            'length_required': 'Не указан размер запроса (Content-Length)',
+            'too_large': f'Слишком большой запрос (максимум {max_length // (1024 * 1024) or 1} МБ)',
+            'bad_type': 'Недопустимый тип содержимого',
+        }
+        return None, (status, messages[reason], None)
+
+    wait = take_token(client_ip(request))
+    if wait:
+        ADMISSION_REQUESTS.inc(endpoint=endpoint, result='rate_limited')
+        return None, (429, 'Слишком много запросов, повторите позже', max(1, math.ceil(wait)))
+
+    slot = acquire_slot() if limited else None
+    if limited and slot is None:
+        ADMISSION_REQUESTS.inc(endpoint=endpoint, result='overloaded')
+        return None, (503, 'Сервер перегружен, повторите позже', ADMISSION_RETRY_AFTER)
+
+    ADMISSION_REQUESTS.inc(endpoint=endpoint, result='admitted')
+    return slot, None
@@ -4,13 +4,28 @@
 Не влияет на существующий функционал отправки анкет
 """
 
+import asyncio
+import functools
+import html
 import logging
 import os
-import re
-from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
 from supabase import create_client, Client
 from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from balance_cache import BalanceCache
+from balance_journal import BalanceJournal
+from balance_parser import parse_amount
+from group_registry import GroupRegistry
+from send_scheduler import PRIORITY_BALANCE, PRIORITY_TEXT, SendScheduler
+import balance_reports
+import group_registry
+import ledger_archive
+import metrics
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,24 +38,54 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv("BOT_TOKEN")  # Используем того же бота, что и для анкет
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
 
-# ID групп (читаем из ENV, с fallback на дефолтные значения)
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BALANCE_BOT_MODE = os.getenv("BALANCE_BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("BALANCE_WEBHOOK_URL")  # публичный https URL, например https://example.com/telegram/balance
+WEBHOOK_SECRET = os.getenv("BALANCE_WEBHOOK_SECRET")  # X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_LISTEN = os.getenv("BALANCE_WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("BALANCE_WEBHOOK_PORT", "8081"))
+WEBHOOK_PATH = os.getenv("BALANCE_WEBHOOK_PATH", "telegram/balance")
+
+# Боту нужны только сообщения в группах - остальные типы апдейтов Telegram не присылает
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+# ID исходных групп (читаем из ENV, с fallback на дефолтные значения); они регистрируются
+# в group_balances при первом запуске, дальше список групп живет в БД (group_registry.py)
 GROUP_RU = int(os.getenv("GROUP_RU_ID", "-1002774266933"))  # Русская группа (Shanghai)
 GROUP_ZH_SHANGHAI = int(os.getenv("GROUP_ZH_ID", "-1002468561827"))  # Китайская группа Shanghai
 GROUP_ZH_BEIJING = int(os.getenv("GROUP_ZH_BEIJING_ID", "-1003698590476"))  # Китайская группа Beijing 北京
 
-# Список всех китайских групп
-CHINESE_GROUPS = [GROUP_ZH_SHANGHAI, GROUP_ZH_BEIJING]
+# Кто может подключать и отключать группы командами /enroll и /unenroll
+# (user_id через запятую; пусто - команды отключены)
+BALANCE_ADMIN_IDS = {int(user_id) for user_id in os.getenv("BALANCE_ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Пул потоков для синхронного клиента Supabase: HTTP-запросы к БД
+# не блокируют event loop бота
+BALANCE_DB_POOL_SIZE = int(os.getenv("BALANCE_DB_POOL_SIZE", "8"))
+# Сколько апдейтов обрабатывается одновременно (порядок внутри группы сохраняется)
+BALANCE_CONCURRENT_UPDATES = int(os.getenv("BALANCE_CONCURRENT_UPDATES", "64"))
 
-# Список всех отслеживаемых групп
-ALL_GROUPS = [GROUP_RU] + CHINESE_GROUPS
+# Периодическая сверка кэша балансов с БД (секунд, 0 - отключить)
+BALANCE_RECONCILE_INTERVAL = int(os.getenv("BALANCE_RECONCILE_INTERVAL", "300"))
 
-# Лимиты для валидации
-MAX_TRANSACTION_AMOUNT = Decimal('999999999.99')  # Максимальная сумма транзакции
-MIN_TRANSACTION_AMOUNT = Decimal('0.01')  # Минимальная сумма транзакции
+# Локальный журнал (write-behind): ответ в группу не ждет Supabase,
+# операции выгружаются пачками в фоне (0 - синхронная запись в БД)
+BALANCE_JOURNAL = os.getenv("BALANCE_JOURNAL", "1") == "1"
+BALANCE_FLUSH_INTERVAL = float(os.getenv("BALANCE_FLUSH_INTERVAL", "0.5"))  # секунд между выгрузками
+BALANCE_FLUSH_BATCH = int(os.getenv("BALANCE_FLUSH_BATCH", "200"))  # операций в одном вызове RPC
+BALANCE_FLUSH_MAX_BACKOFF = 60  # максимальная пауза между попытками при недоступности Supabase
 
-# Конфигурация групп (для автоматического создания записей в БД)
-GROUP_CONFIG = {
+# Обслуживание истории в Supabase: секции на месяцы вперед и месячные снимки
+# балансов (функция maintain_balance_ledger), секунд между вызовами (0 - отключить)
+BALANCE_LEDGER_MAINTENANCE_INTERVAL = int(os.getenv("BALANCE_LEDGER_MAINTENANCE_INTERVAL", "21600"))
+
+# Порт метрик Prometheus (http://127.0.0.1:<порт>/metrics, 0 - отключить)
+BALANCE_METRICS_PORT = int(os.getenv("BALANCE_METRICS_PORT", "9101"))
+
+# Исходные группы (регистрируются, если их еще нет в group_balances)
+SEED_GROUPS = {
     GROUP_RU: {'name': 'Русская группа (Shanghai)', 'language': 'ru'},
     GROUP_ZH_SHANGHAI: {'name': '上海中文群组', 'language': 'zh'},
     GROUP_ZH_BEIJING: {'name': '北京中文群组', 'language': 'zh'},
@@ -49,6 +94,86 @@ GROUP_CONFIG = {
 # Инициализация Supabase клиента
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Кэш балансов (бот - единственный писатель group_balances)
+balance_cache = BalanceCache()
+
+# Отслеживаемые группы и их настройки (загружаются из group_balances в post_init)
+groups = GroupRegistry()
+
+db_executor = ThreadPoolExecutor(max_workers=BALANCE_DB_POOL_SIZE, thread_name_prefix="supabase")
+
+# Журнал операций; запись идет в одном отдельном потоке, чтобы медленная
+# выгрузка в Supabase не занимала потоки, нужные ответам
+journal = BalanceJournal() if BALANCE_JOURNAL else None
+journal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+
+# Блокировки групп: транзакции одной группы применяются строго в порядке сообщений
+_group_locks: dict[int, asyncio.Lock] = {}
+
+# Планировщик ответов (лимиты Telegram, подтверждения баланса - в первую очередь)
+send_scheduler: SendScheduler | None = None
+
+# Статистика кэша и журнала - в метриках на момент запроса
+metrics.register_callback('balance_cache_hits_total', "Попадания в кэш балансов",
+                          lambda: balance_cache.stats()['hits'], kind='counter')
+metrics.register_callback('balance_cache_misses_total', "Промахи кэша балансов",
+                          lambda: balance_cache.stats()['misses'], kind='counter')
+metrics.register_callback('balance_cache_drift_total', "Расхождения кэша балансов с БД",
+                          lambda: balance_cache.stats()['drift'], kind='counter')
+metrics.register_callback('balance_groups', "Отслеживаемые группы в реестре", lambda: len(groups.group_ids()))
+metrics.register_callback('balance_journal_pending', "Операции журнала, еще не выгруженные в Supabase",
+                          lambda: journal.pending_count() if journal is not None else None)
+
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронный вызов Supabase в пуле потоков, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_journal(func, *args, **kwargs):
+    """Выполняет запись в локальный журнал в отдельном потоке"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(journal_executor, functools.partial(func, *args, **kwargs))
+
+
+def get_scheduler() -> SendScheduler:
+    """Планировщик отправок бота (создается в event loop приложения)"""
+    global send_scheduler
+    if send_scheduler is None:
+        send_scheduler = SendScheduler()
+    return send_scheduler
+
+
+def enqueue_reply(message, text: str, priority: int = PRIORITY_BALANCE) -> asyncio.Future:
+    """Ставит ответ на сообщение в очередь отправки, возвращает future с результатом"""
+    return get_scheduler().enqueue(
+        message.chat.id, message.reply_text, text=text, parse_mode='HTML',
+        priority=priority, description=f"Ответ в группу {message.chat.id}"
+    )
+
+
+def group_lock(group_id: int) -> asyncio.Lock:
+    """Блокировка группы (asyncio.Lock будит ожидающих в порядке очереди)"""
+    lock = _group_locks.get(group_id)
+    if lock is None:
+        lock = _group_locks[group_id] = asyncio.Lock()
+    return lock
+
+
+async def reconcile_balances_locked() -> list:
+    """
+    Сверка кэша с БД под блокировками всех групп:
+    незавершенные транзакции не дают ложных расхождений
+    Перед сверкой журнал выгружается полностью - иначе БД отстает от кэша
+    """
+    async with AsyncExitStack() as stack:
+        for group_id in sorted(set(groups.group_ids()) | set(_group_locks)):
+            await stack.enter_async_context(group_lock(group_id))
+        if journal is not None:
+            await run_db(flush_journal)
+        return await run_db(reconcile_balances)
+
 
 def format_number(number: Decimal) -> str:
     """Форматирует число с разделителями тысяч"""
@@ -62,44 +187,104 @@ def format_number(number: Decimal) -> str:
     return num_str
 
 
+def fetch_group_balances() -> list[dict]:
+    """Читает балансы всех групп одним запросом (без длинного списка group_id в URL)"""
+    response = metrics.timed_execute(
+        supabase.table('group_balances').select('group_id, current_balance'),
+        'group_balances', 'select'
+    )
+    return response.data or []
+
+
+def warm_up_cache() -> None:
+    """
+    Загружает реестр групп и их балансы в кэш одним запросом при старте
+    Исходные группы (SEED_GROUPS), которых еще нет в БД, регистрируются
+    """
+    rows = group_registry.fetch_groups(supabase)
+    groups.load(rows)
+    loaded = balance_cache.load(rows)
+    for group_id, config in SEED_GROUPS.items():
+        if not groups.known(group_id):
+            row = group_registry.enroll_group(supabase, group_id, config['name'], config['language'],
+                                              group_registry.DEFAULT_CURRENCY)
+            groups.apply([row])
+            balance_cache.load([row])
+            logger.info(f"Создана запись баланса для группы {group_id} ({config['name']})")
+    # Операции, которые не успели попасть в БД до рестарта, новее значений из БД
+    if journal is not None:
+        for group_id, balance in journal.latest_pending_balances().items():
+            balance_cache.set(group_id, balance)
+    logger.info(f"Кэш балансов загружен: {loaded} групп, отслеживается {len(groups.group_ids())}")
+
+
+def refresh_registry() -> list[int]:
+    """Подхватывает изменения настроек групп из БД, возвращает измененные группы"""
+    changed = groups.apply(group_registry.fetch_groups(supabase, groups.since()))
+    if changed:
+        logger.info(f"Реестр групп обновлен: изменено {len(changed)}, отслеживается {len(groups.group_ids())}")
+    return changed
+
+
+def reconcile_balances() -> list:
+    """Сверяет кэш с БД, возвращает список расхождений (group_id, в_кэше, в_БД)"""
+    mismatches = balance_cache.reconcile(fetch_group_balances())
+    stats = balance_cache.stats()
+    logger.info(f"Сверка балансов: расхождений {len(mismatches)}, попаданий в кэш {stats['hits']}, "
+                f"промахов {stats['misses']}, всего расхождений {stats['drift']}")
+    return mismatches
+
+
 def get_current_balance(group_id: int) -> Decimal:
-    """Получает текущий баланс группы из базы данных"""
+    """Получает текущий баланс группы (из кэша, при промахе - из базы данных)"""
+    cached = balance_cache.get(group_id)
+    if cached is not None:
+        return cached
+
     try:
-        response = supabase.table('group_balances').select('current_balance').eq('group_id', group_id).execute()
+        response = metrics.timed_execute(
+            supabase.table('group_balances').select('current_balance').eq('group_id', group_id),
+            'group_balances', 'select'
+        )
 
         if response.data and len(response.data) > 0:
             # Используем str() для безопасной конвертации в Decimal
-            return Decimal(str(response.data[0]['current_balance']))
+            balance = Decimal(str(response.data[0]['current_balance']))
+            balance_cache.set(group_id, balance)
+            return balance
         else:
-            # Если записи нет, создаем её с конфигурацией из GROUP_CONFIG
-            config = GROUP_CONFIG.get(group_id, {'name': f'Group {group_id}', 'language': 'zh'})
+            # Если записи нет, создаем её с настройками из реестра
+            config = groups.config(group_id)
 
-            supabase.table('group_balances').insert({
+            metrics.timed_execute(supabase.table('group_balances').insert({
                 'group_id': group_id,
                 'group_name': config['name'],
                 'current_balance': '0.00',  # Используем строку для точности
                 'language': config['language']
-            }).execute()
+            }), 'group_balances', 'insert')
 
             logger.info(f"Создана запись баланса для группы {group_id} ({config['name']})")
+            balance_cache.set(group_id, Decimal('0'))
             return Decimal('0')
     except Exception as e:
         logger.error(f"Ошибка получения баланса для группы {group_id}: {e}")
         raise
 
 
-def validate_amount(amount: Decimal) -> tuple[bool, str]:
+def validate_amount(amount: Decimal, settings: dict | None = None) -> tuple[bool, str]:
     """
-    Валидирует сумму транзакции
+    Валидирует сумму транзакции по лимитам группы (settings из реестра)
     Возвращает (is_valid, error_message)
     """
     abs_amount = abs(amount)
+    min_amount = settings['min_amount'] if settings else group_registry.DEFAULT_MIN_AMOUNT
+    max_amount = settings['max_amount'] if settings else group_registry.DEFAULT_MAX_AMOUNT
 
-    if abs_amount < MIN_TRANSACTION_AMOUNT:
-        return False, f"Сумма слишком мала. Минимум: {MIN_TRANSACTION_AMOUNT}"
+    if abs_amount < min_amount:
+        return False, f"Сумма слишком мала. Минимум: {min_amount}"
 
-    if abs_amount > MAX_TRANSACTION_AMOUNT:
-        return False, f"Сумма слишком большая. Максимум: {MAX_TRANSACTION_AMOUNT}"
+    if abs_amount > max_amount:
+        return False, f"Сумма слишком большая. Максимум: {max_amount}"
 
     return True, ""
 
@@ -117,34 +302,32 @@ def update_balance(group_id: int, amount: Decimal, user_id: int, username: str,
     Обновляет баланс группы и сохраняет транзакцию
     Возвращает (предыдущий_баланс, новый_баланс)
 
+    Вся операция - один вызов функции apply_balance_transaction в БД:
+    строка баланса блокируется, поэтому одновременные сообщения
+    не теряют обновления (см. supabase_schema.sql)
+
     ВАЖНО: Используем str() для Decimal значений чтобы избежать
     потери точности при конвертации в float
     """
     # Нормализуем сумму до 2 знаков после запятой
     amount = normalize_amount(amount)
-
-    # Получаем текущий баланс
-    previous_balance = get_current_balance(group_id)
-    new_balance = normalize_amount(previous_balance + amount)
+    config = groups.config(group_id)
 
     try:
-        # Обновляем баланс в базе (используем str для сохранения точности)
-        supabase.table('group_balances').update({
-            'current_balance': str(new_balance)
-        }).eq('group_id', group_id).execute()
-
-        # Сохраняем транзакцию (используем str для всех Decimal полей)
-        transaction_type = 'add' if amount > 0 else 'subtract'
-        supabase.table('balance_transactions').insert({
-            'group_id': group_id,
-            'user_id': user_id,
-            'username': username or 'Unknown',
-            'amount': str(amount),
-            'previous_balance': str(previous_balance),
-            'new_balance': str(new_balance),
-            'transaction_type': transaction_type,
-            'message_id': message_id
-        }).execute()
+        response = metrics.timed_execute(supabase.rpc('apply_balance_transaction', {
+            'p_group_id': group_id,
+            'p_amount': str(amount),
+            'p_user_id': user_id,
+            'p_username': username or 'Unknown',
+            'p_message_id': message_id,
+            'p_group_name': config['name'],
+            'p_language': config['language']
+        }), 'apply_balance_transaction', 'rpc')
+
+        row = response.data[0]
+        previous_balance = Decimal(str(row['previous_balance']))
+        new_balance = Decimal(str(row['new_balance']))
+        balance_cache.apply(group_id, previous_balance, new_balance)
 
         logger.info(f"Баланс обновлен для группы {group_id}: {previous_balance} -> {new_balance} (изменение: {amount})")
         return previous_balance, new_balance
@@ -154,7 +337,72 @@ def update_balance(group_id: int, amount: Decimal, user_id: int, username: str,
         raise
 
 
-def format_message_ru(amount: Decimal, previous_balance: Decimal, new_balance: Decimal) -> str:
+def apply_journal_batch(entries: list[dict]) -> None:
+    """Записывает пачку операций журнала в Supabase одним вызовом apply_balance_journal"""
+    items = []
+    for entry in entries:
+        config = groups.config(entry['group_id'])
+        items.append({
+            'seq': entry['seq'],
+            'group_id': entry['group_id'],
+            'group_name': config['name'],
+            'language': config['language'],
+            'user_id': entry['user_id'],
+            'username': entry['username'],
+            'amount': entry['amount'],
+            'previous_balance': entry['previous_balance'],
+            'new_balance': entry['new_balance'],
+            'transaction_type': entry['transaction_type'],
+            'message_id': entry['message_id'],
+            'created_at': datetime.fromtimestamp(entry['created_at'], timezone.utc).isoformat(),
+        })
+    metrics.timed_execute(supabase.rpc('apply_balance_journal', {'p_items': items}), 'apply_balance_journal', 'rpc')
+
+
+def flush_journal() -> int:
+    """Выгружает все невыгруженные операции журнала, возвращает их число"""
+    flushed = journal.flush(apply_journal_batch, BALANCE_FLUSH_BATCH)
+    if flushed:
+        logger.info(f"Журнал: выгружено в Supabase {flushed} операций")
+    return flushed
+
+
+async def record_transaction(group_id: int, amount: Decimal, user_id: int, username: str,
+                             message_id: int) -> tuple[Decimal, Decimal]:
+    """
+    Применяет транзакцию, возвращает (предыдущий_баланс, новый_баланс)
+    Вызывается под блокировкой группы: баланс берется из кэша, операция
+    надежно пишется в локальный журнал, в Supabase она уйдет фоновой выгрузкой
+    Без журнала (BALANCE_JOURNAL=0) - синхронный update_balance
+    """
+    if journal is None:
+        return await run_db(
+            update_balance,
+            group_id=group_id,
+            amount=amount,
+            user_id=user_id,
+            username=username,
+            message_id=message_id
+        )
+
+    amount = normalize_amount(amount)
+    previous_balance = balance_cache.get(group_id)
+    if previous_balance is None:
+        previous_balance = await run_db(get_current_balance, group_id)
+
+    previous_balance, new_balance, created = await run_journal(
+        journal.append, group_id, message_id, user_id, username,
+        amount, previous_balance, previous_balance + amount
+    )
+    if created:
+        balance_cache.set(group_id, new_balance)
+        logger.info(f"Баланс обновлен для группы {group_id}: {previous_balance} -> {new_balance} (изменение: {amount})")
+    else:
+        logger.warning(f"Повторное сообщение {message_id} в группе {group_id} - операция уже учтена")
+    return previous_balance, new_balance
+
+
+def format_message_ru(amount: Decimal, previous_balance: Decimal, new_balance: Decimal, currency: str = '¥') -> str:
     """Форматирует сообщение на русском языке"""
     if amount > 0:
         emoji = "💰"
@@ -169,14 +417,14 @@ def format_message_ru(amount: Decimal, previous_balance: Decimal, new_balance: D
         amount = abs(amount)  # Делаем положительным для отображения
 
     message = f"""{emoji} <b>{title}</b>
-📈 <b>Было:</b> {format_number(previous_balance)} ¥
-{operation_emoji} <b>{operation_text}:</b> {format_number(amount)} ¥
-💎 <b>Итоговый баланс:</b> {format_number(new_balance)} ¥"""
+📈 <b>Было:</b> {format_number(previous_balance)} {currency}
+{operation_emoji} <b>{operation_text}:</b> {format_number(amount)} {currency}
+💎 <b>Итоговый баланс:</b> {format_number(new_balance)} {currency}"""
 
     return message
 
 
-def format_message_zh(amount: Decimal, previous_balance: Decimal, new_balance: Decimal) -> str:
+def format_message_zh(amount: Decimal, previous_balance: Decimal, new_balance: Decimal, currency: str = '¥') -> str:
     """Форматирует сообщение на китайском языке"""
     if amount > 0:
         emoji = "💰"
@@ -191,20 +439,95 @@ def format_message_zh(amount: Decimal, previous_balance: Decimal, new_balance: D
         amount = abs(amount)
 
     message = f"""{emoji} <b>{title}</b>
-📈 <b>之前余额:</b> {format_number(previous_balance)} ¥
-{operation_emoji} <b>{operation_text}:</b> {format_number(amount)} ¥
-💎 <b>当前余额:</b> {format_number(new_balance)} ¥"""
+📈 <b>之前余额:</b> {format_number(previous_balance)} {currency}
+{operation_emoji} <b>{operation_text}:</b> {format_number(amount)} {currency}
+💎 <b>当前余额:</b> {format_number(new_balance)} {currency}"""
 
     return message
 
 
+# Подписи отчетов /today, /week, /top
+REPORT_LABELS = {
+    'ru': {
+        'today': "📊 <b>Итоги за сегодня</b> ({day})",
+        'week': "📅 <b>Итоги за 7 дней</b> ({first} - {last})",
+        'top': "🏆 <b>Топ за 7 дней</b> ({first} - {last})",
+        'deposits': "➕ Пополнения",
+        'withdrawals': "➖ Списания",
+        'opening': "📈 На начало",
+        'balance': "💎 Текущий баланс",
+        'empty': "Операций не было",
+        'ops': "опер.",
+        'day_format': "%d.%m",
+    },
+    'zh': {
+        'today': "📊 <b>今日汇总</b> ({day})",
+        'week': "📅 <b>近7天汇总</b> ({first} - {last})",
+        'top': "🏆 <b>近7天排行</b> ({first} - {last})",
+        'deposits': "➕ 充值",
+        'withdrawals': "➖ 扣除",
+        'opening': "📈 期初余额",
+        'balance': "💎 当前余额",
+        'empty': "暂无记录",
+        'ops': "笔",
+        'day_format': "%m月%d日",
+    },
+}
+
+
+def format_report_today(language: str, day, totals: dict, current_balance: Decimal, currency: str = '¥') -> str:
+    """Итоги дня: пополнения, списания, баланс на начало дня и текущий"""
+    labels = REPORT_LABELS[language]
+    lines = [labels['today'].format(day=day.strftime(labels['day_format']))]
+    if totals['opening_balance'] is None:
+        lines.append(labels['empty'])
+    else:
+        lines.append(f"{labels['deposits']}: {format_number(totals['deposits_sum'])} {currency} "
+                     f"({totals['deposits_count']} {labels['ops']})")
+        lines.append(f"{labels['withdrawals']}: {format_number(totals['withdrawals_sum'])} {currency} "
+                     f"({totals['withdrawals_count']} {labels['ops']})")
+        lines.append(f"{labels['opening']}: {format_number(totals['opening_balance'])} {currency}")
+    lines.append(f"{labels['balance']}: {format_number(current_balance)} {currency}")
+    return "\n".join(lines)
+
+
+def format_report_week(language: str, first_day, last_day, rows: list[dict], totals: dict,
+                       currency: str = '¥') -> str:
+    """Итоги по дням за неделю: +пополнения / -списания -> баланс на конец дня"""
+    labels = REPORT_LABELS[language]
+    day_format = labels['day_format']
+    lines = [labels['week'].format(first=first_day.strftime(day_format), last=last_day.strftime(day_format))]
+    if not rows:
+        lines.append(labels['empty'])
+        return "\n".join(lines)
+    for row in rows:
+        lines.append(f"{row['period_start'].strftime(day_format)}: +{format_number(row['deposits_sum'])} / "
+                     f"-{format_number(row['withdrawals_sum'])} → {format_number(row['closing_balance'])} {currency}")
+    lines.append(f"{labels['deposits']}: {format_number(totals['deposits_sum'])} {currency} "
+                 f"({totals['deposits_count']} {labels['ops']})")
+    lines.append(f"{labels['withdrawals']}: {format_number(totals['withdrawals_sum'])} {currency} "
+                 f"({totals['withdrawals_count']} {labels['ops']})")
+    return "\n".join(lines)
+
+
+def format_report_top(language: str, first_day, last_day, users: list[dict], currency: str = '¥') -> str:
+    """Пользователи по сумме пополнений за неделю"""
+    labels = REPORT_LABELS[language]
+    day_format = labels['day_format']
+    lines = [labels['top'].format(first=first_day.strftime(day_format), last=last_day.strftime(day_format))]
+    if not users:
+        lines.append(labels['empty'])
+    for place, user in enumerate(users, start=1):
+        name = f"@{user['username']}" if user['username'] and user['username'] != 'Unknown' else str(user['user_id'])
+        lines.append(f"{place}. {html.escape(name)} - +{format_number(user['deposits_sum'])} {currency} "
+                     f"({user['deposits_count']} {labels['ops']}), "
+                     f"-{format_number(user['withdrawals_sum'])} {currency}")
+    return "\n".join(lines)
+
+
 def get_language_for_group(group_id: int) -> str:
-    """Возвращает язык для группы"""
-    config = GROUP_CONFIG.get(group_id)
-    if config:
-        return config['language']
-    # По умолчанию китайский для неизвестных групп
-    return 'zh'
+    """Возвращает язык для группы (для неизвестных групп - китайский)"""
+    return groups.config(group_id)['language']
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -216,8 +539,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     chat_id = update.message.chat.id
 
-    # Проверяем, что это одна из наших групп
-    if chat_id not in ALL_GROUPS:
+    # Проверяем, что это одна из наших групп (одно обращение к словарю реестра)
+    settings = groups.get(chat_id)
+    if settings is None:
         return
 
     # Получаем текст сообщения
@@ -226,31 +550,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     # Парсим сообщение на наличие +число или -число
-    # Поддерживаем форматы: +1000, -5000, +1,000, -5,000, +1000.50
-    pattern = r'^([+\-])\s*(\d{1,3}(?:[,\s]?\d{3})*(?:\.\d{1,2})?)$'
-    match = re.match(pattern, text.strip())
-
-    if not match:
+    # Форматы: +1000, -5000, +1,000, +1000.50, ＋1000, +1000¥, +1万 (см. balance_parser.py)
+    amount = parse_amount(text)
+    if amount is None:
         return
 
+    metrics.BALANCE_MESSAGES.inc(result='parsed')
+    started = time.perf_counter()
     try:
-        sign = match.group(1)
-        amount_str = match.group(2).replace(',', '').replace(' ', '')
-
-        # Безопасный парсинг суммы
-        try:
-            amount = Decimal(amount_str)
-        except InvalidOperation:
-            logger.warning(f"Невалидная сумма: {amount_str}")
-            return
-
-        # Применяем знак
-        if sign == '-':
-            amount = -amount
-
         # Валидируем сумму
-        is_valid, error_msg = validate_amount(amount)
+        is_valid, error_msg = validate_amount(amount, settings)
         if not is_valid:
+            metrics.BALANCE_MESSAGES.inc(result='rejected')
             logger.warning(f"Сумма не прошла валидацию: {amount} - {error_msg}")
             return
 
@@ -259,33 +570,331 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         username = update.message.from_user.username if update.message.from_user else None
         message_id = update.message.message_id
 
-        # Обновляем баланс
-        previous_balance, new_balance = update_balance(
-            group_id=chat_id,
-            amount=amount,
-            user_id=user_id,
-            username=username,
-            message_id=message_id
-        )
+        # До захвата блокировки нет ни одного await: задачи встают в очередь
+        # группы в порядке прихода апдейтов, и порядок в истории не нарушается
+        async with group_lock(chat_id):
+            # Обновляем баланс (журнал или HTTP-запрос к Supabase - вне event loop)
+            previous_balance, new_balance = await record_transaction(
+                group_id=chat_id,
+                amount=amount,
+                user_id=user_id,
+                username=username,
+                message_id=message_id
+            )
+
+            # Форматируем ответное сообщение на основе языка группы
+            if settings['language'] == 'ru':
+                response_message = format_message_ru(amount, previous_balance, new_balance, settings['currency'])
+            else:  # zh (китайский) - для всех китайских групп
+                response_message = format_message_zh(amount, previous_balance, new_balance, settings['currency'])
+
+            # Ответ ставится в очередь внутри блокировки - подтверждения идут в порядке
+            # операций; ожидание лимитов Telegram уже не держит блокировку группы
+            reply = enqueue_reply(update.message, response_message)
+
+        await reply
+        metrics.BALANCE_HANDLER_SECONDS.observe(time.perf_counter() - started, handler='message')
+
+        logger.info(f"Обработана транзакция в группе {settings['name']}: {amount}")
+
+    except Exception as e:
+        metrics.BALANCE_MESSAGES.inc(result='failed')
+        logger.error(f"Ошибка обработки сообщения в группе {chat_id}: {e}", exc_info=True)
+
+
+async def is_group_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Проверяет, что автор сообщения - администратор группы"""
+    if not update.effective_user or not update.effective_chat:
+        return False
+    member = await context.bot.get_chat_member(update.effective_chat.id, update.effective_user.id)
+    return member.status in ('administrator', 'creator')
+
+
+@metrics.BALANCE_HANDLER_SECONDS.time(handler='sync')
+async def handle_sync(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /sync - принудительная сверка кэша балансов с БД (только для админов)"""
+    if not update.message or update.message.chat.id not in groups:
+        return
+
+    try:
+        if not await is_group_admin(update, context):
+            return
+
+        mismatches = await reconcile_balances_locked()
+        stats = balance_cache.stats()
+        pending = await run_journal(journal.pending_count) if journal is not None else 0
+        send_stats = get_scheduler().stats()
+        queued = sum(send_stats['queued'].values())
+        if get_language_for_group(update.message.chat.id) == 'ru':
+            text = (f"🔄 <b>Сверка балансов</b>\n"
+                    f"Расхождений: {len(mismatches)}\n"
+                    f"Попаданий в кэш: {stats['hits']}, всего расхождений: {stats['drift']}\n"
+                    f"Ожидают записи в БД: {pending}\n"
+                    f"Очередь отправки: {queued}, ограничений Telegram: {send_stats['retry_after']}")
+        else:
+            text = (f"🔄 <b>余额核对</b>\n"
+                    f"差异: {len(mismatches)}\n"
+                    f"缓存命中: {stats['hits']}, 累计差异: {stats['drift']}\n"
+                    f"待写入数据库: {pending}\n"
+                    f"发送队列: {queued}, Telegram限流: {send_stats['retry_after']}")
+
+        await enqueue_reply(update.message, text, PRIORITY_TEXT)
+    except Exception as e:
+        logger.error(f"Ошибка сверки балансов: {e}", exc_info=True)
+
+
+async def flush_before_report() -> None:
+    """Агрегаты ведутся в БД: перед отчетом выгружаем журнал, чтобы учесть последние операции"""
+    if journal is None:
+        return
+    try:
+        await run_db(flush_journal)
+    except Exception as e:
+        logger.warning(f"Отчет построен без невыгруженных операций журнала: {e}")
+
+
+@metrics.BALANCE_HANDLER_SECONDS.time(handler='today')
+async def handle_today(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /today - пополнения и списания за сегодня"""
+    if not update.message or update.message.chat.id not in groups:
+        return
+
+    chat_id = update.message.chat.id
+    try:
+        await flush_before_report()
+        today = balance_reports.day_start()
+        rows = await run_db(balance_reports.fetch_day_rollups, supabase, chat_id, today)
+        current_balance = balance_cache.get(chat_id)
+        if current_balance is None:
+            current_balance = await run_db(get_current_balance, chat_id)
+        settings = groups.config(chat_id)
+        text = format_report_today(settings['language'], today, balance_reports.summarize(rows), current_balance,
+                                   settings['currency'])
+        await enqueue_reply(update.message, text, PRIORITY_TEXT)
+    except Exception as e:
+        logger.error(f"Ошибка отчета /today в группе {chat_id}: {e}", exc_info=True)
+
+
+@metrics.BALANCE_HANDLER_SECONDS.time(handler='week')
+async def handle_week(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /week - итоги по дням за последние 7 дней"""
+    if not update.message or update.message.chat.id not in groups:
+        return
+
+    chat_id = update.message.chat.id
+    try:
+        await flush_before_report()
+        first_day = balance_reports.day_start(balance_reports.WEEK_DAYS - 1)
+        rows = await run_db(balance_reports.fetch_day_rollups, supabase, chat_id, first_day)
+        settings = groups.config(chat_id)
+        text = format_report_week(settings['language'], first_day, balance_reports.day_start(),
+                                  rows, balance_reports.summarize(rows), settings['currency'])
+        await enqueue_reply(update.message, text, PRIORITY_TEXT)
+    except Exception as e:
+        logger.error(f"Ошибка отчета /week в группе {chat_id}: {e}", exc_info=True)
+
+
+@metrics.BALANCE_HANDLER_SECONDS.time(handler='top')
+async def handle_top(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /top - пользователи с наибольшей суммой пополнений за 7 дней"""
+    if not update.message or update.message.chat.id not in groups:
+        return
+
+    chat_id = update.message.chat.id
+    try:
+        await flush_before_report()
+        first_day = balance_reports.day_start(balance_reports.WEEK_DAYS - 1)
+        rows = await run_db(balance_reports.fetch_user_rollups, supabase, chat_id, first_day)
+        settings = groups.config(chat_id)
+        text = format_report_top(settings['language'], first_day, balance_reports.day_start(),
+                                 balance_reports.rank_users(rows), settings['currency'])
+        await enqueue_reply(update.message, text, PRIORITY_TEXT)
+    except Exception as e:
+        logger.error(f"Ошибка отчета /top в группе {chat_id}: {e}", exc_info=True)
+
+
+def is_registry_admin(update: Update) -> bool:
+    """Подключать и отключать группы могут только пользователи из BALANCE_ADMIN_IDS"""
+    return bool(update.effective_user) and update.effective_user.id in BALANCE_ADMIN_IDS
+
+
+@metrics.BALANCE_HANDLER_SECONDS.time(handler='enroll')
+async def handle_enroll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Команда /enroll [ru|zh] [валюта] [название] - включает учет баланса в этой группе
+    Без аргументов берутся текущие настройки группы (для новой - zh, ¥ и название чата)
+    """
+    if not update.message or not is_registry_admin(update):
+        return
+
+    chat = update.message.chat
+    args = context.args or []
+    current = groups.config(chat.id)
+    language = args[0].lower() if args else current['language']
+    currency = args[1] if len(args) > 1 else current['currency']
+    name = " ".join(args[2:]) or (current['name'] if groups.known(chat.id) else chat.title) or current['name']
+    if language not in group_registry.LANGUAGES or len(currency) > 8 or html.escape(currency) != currency:
+        await enqueue_reply(update.message, "/enroll [ru|zh] [¥|$|₽] [название / 名称]", PRIORITY_TEXT)
+        return
+
+    try:
+        row = await run_db(group_registry.enroll_group, supabase, chat.id, name, language, currency)
+        groups.apply([row])
+        settings = groups.config(chat.id)
+        balance = balance_cache.get(chat.id)
+        if balance is None:
+            balance_cache.load([row])
+            balance = balance_cache.get(chat.id)
+        logger.info(f"Группа {chat.id} ({name}) подключена: язык {language}, валюта {currency}")
 
-        # Форматируем ответное сообщение на основе языка группы
-        language = get_language_for_group(chat_id)
         if language == 'ru':
-            response_message = format_message_ru(amount, previous_balance, new_balance)
-        else:  # zh (китайский) - для всех китайских групп (Shanghai и Beijing)
-            response_message = format_message_zh(amount, previous_balance, new_balance)
-
-        # Отправляем ответ
-        await update.message.reply_text(
-            text=response_message,
-            parse_mode='HTML'
-        )
+            text = (f"✅ <b>Учет баланса включен</b>\n"
+                    f"Группа: {html.escape(settings['name'])}\n"
+                    f"Язык: {language}, валюта: {currency}\n"
+                    f"Баланс: {format_number(balance)} {currency}")
+        else:
+            text = (f"✅ <b>本群已开启余额记录</b>\n"
+                    f"群组: {html.escape(settings['name'])}\n"
+                    f"语言: {language}, 货币: {currency}\n"
+                    f"当前余额: {format_number(balance)} {currency}")
+        await enqueue_reply(update.message, text, PRIORITY_TEXT)
+    except Exception as e:
+        logger.error(f"Ошибка подключения группы {chat.id}: {e}", exc_info=True)
+
 
-        group_name = GROUP_CONFIG.get(chat_id, {}).get('name', str(chat_id))
-        logger.info(f"Обработана транзакция в группе {group_name}: {amount}")
+@metrics.BALANCE_HANDLER_SECONDS.time(handler='unenroll')
+async def handle_unenroll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /unenroll - отключает учет баланса в этой группе (баланс и история сохраняются)"""
+    if not update.message or not is_registry_admin(update):
+        return
 
+    chat_id = update.message.chat.id
+    try:
+        row = await run_db(group_registry.set_group_active, supabase, chat_id, False)
+        if row is None:
+            return
+        groups.apply([row])
+        logger.info(f"Группа {chat_id} отключена от учета баланса")
+        if row.get('language') == 'ru':
+            text = "⏸ <b>Учет баланса отключен</b>\nБаланс сохранен, /enroll включает учет снова"
+        else:
+            text = "⏸ <b>本群已关闭余额记录</b>\n余额已保存, /enroll 可重新开启"
+        await enqueue_reply(update.message, text, PRIORITY_TEXT)
     except Exception as e:
-        logger.error(f"Ошибка обработки сообщения в группе {chat_id}: {e}", exc_info=True)
+        logger.error(f"Ошибка отключения группы {chat_id}: {e}", exc_info=True)
+
+
+async def refresh_registry_periodically() -> None:
+    """Фоновое чтение изменений реестра групп каждые BALANCE_REGISTRY_TTL секунд"""
+    while True:
+        await asyncio.sleep(group_registry.BALANCE_REGISTRY_TTL)
+        try:
+            await run_db(refresh_registry)
+        except Exception as e:
+            logger.error(f"Ошибка обновления реестра групп: {e}")
+
+
+async def reconcile_periodically() -> None:
+    """Фоновая сверка кэша балансов с БД каждые BALANCE_RECONCILE_INTERVAL секунд"""
+    while True:
+        await asyncio.sleep(BALANCE_RECONCILE_INTERVAL)
+        try:
+            await reconcile_balances_locked()
+        except Exception as e:
+            logger.error(f"Ошибка периодической сверки балансов: {e}")
+
+
+async def maintain_ledger_periodically() -> None:
+    """Фоновое обслуживание истории каждые BALANCE_LEDGER_MAINTENANCE_INTERVAL секунд"""
+    while True:
+        await asyncio.sleep(BALANCE_LEDGER_MAINTENANCE_INTERVAL)
+        try:
+            await run_db(ledger_archive.maintain, supabase)
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания истории балансов: {e}")
+
+
+async def flush_journal_periodically() -> None:
+    """
+    Фоновая выгрузка журнала каждые BALANCE_FLUSH_INTERVAL секунд
+    Пока Supabase недоступен, пауза растет до BALANCE_FLUSH_MAX_BACKOFF;
+    операции остаются в журнале и не теряются
+    """
+    delay = BALANCE_FLUSH_INTERVAL
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await run_db(flush_journal)
+            delay = BALANCE_FLUSH_INTERVAL
+        except Exception as e:
+            delay = min(max(delay, BALANCE_FLUSH_INTERVAL) * 2, BALANCE_FLUSH_MAX_BACKOFF)
+            logger.error(f"Ошибка выгрузки журнала в Supabase (повтор через {delay:.0f} с): {e}")
+
+
+async def post_init(application: Application) -> None:
+    """Выгрузка журнала после рестарта, прогрев кэша, запуск фоновых задач"""
+    if journal is not None:
+        try:
+            await run_db(flush_journal)
+        except Exception as e:
+            # Кэш все равно учтет эти операции (warm_up_cache), выгрузка повторится в фоне
+            logger.error(f"Не удалось выгрузить журнал при запуске: {e}")
+    await run_db(warm_up_cache)
+    if journal is not None:
+        application.bot_data['flush_task'] = asyncio.create_task(flush_journal_periodically())
+    if BALANCE_RECONCILE_INTERVAL > 0:
+        application.bot_data['reconcile_task'] = asyncio.create_task(reconcile_periodically())
+    if group_registry.BALANCE_REGISTRY_TTL > 0:
+        application.bot_data['registry_task'] = asyncio.create_task(refresh_registry_periodically())
+    if BALANCE_LEDGER_MAINTENANCE_INTERVAL > 0:
+        application.bot_data['ledger_task'] = asyncio.create_task(maintain_ledger_periodically())
+
+
+async def post_shutdown(application: Application) -> None:
+    """Остановка планировщика отправок и последняя попытка выгрузить журнал"""
+    if send_scheduler is not None:
+        await send_scheduler.close()
+    if journal is None:
+        return
+    try:
+        await run_db(flush_journal)
+    except Exception as e:
+        logger.error(f"Журнал не выгружен при остановке, выгрузка продолжится после запуска: {e}")
+
+
+def build_application() -> Application:
+    """Создает приложение бота со всеми обработчиками"""
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_API_BASE_URL)
+        .concurrent_updates(BALANCE_CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # Команда сверки кэша балансов с БД
+    application.add_handler(CommandHandler('sync', handle_sync, filters=filters.ChatType.GROUPS))
+
+    # Отчеты по агрегатам balance_rollups
+    application.add_handler(CommandHandler('today', handle_today, filters=filters.ChatType.GROUPS))
+    application.add_handler(CommandHandler('week', handle_week, filters=filters.ChatType.GROUPS))
+    application.add_handler(CommandHandler('top', handle_top, filters=filters.ChatType.GROUPS))
+
+    # Подключение и отключение групп (BALANCE_ADMIN_IDS)
+    application.add_handler(CommandHandler('enroll', handle_enroll, filters=filters.ChatType.GROUPS))
+    application.add_handler(CommandHandler('unenroll', handle_unenroll, filters=filters.ChatType.GROUPS))
+
+    # Добавляем обработчик для всех текстовых сообщений в группах
+    application.add_handler(
+        MessageHandler(
+            filters.TEXT & filters.ChatType.GROUPS,
+            handle_message
+        )
+    )
+
+    return application
 
 
 def main():
@@ -300,27 +909,36 @@ def main():
         logger.error("SUPABASE_URL или SUPABASE_KEY не установлены!")
         return
 
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    if BALANCE_BOT_MODE == 'webhook' and (not WEBHOOK_URL or not WEBHOOK_SECRET):
+        logger.error("Для режима webhook нужны BALANCE_WEBHOOK_URL и BALANCE_WEBHOOK_SECRET!")
+        return
 
-    # Добавляем обработчик для всех текстовых сообщений в группах
-    application.add_handler(
-        MessageHandler(
-            filters.TEXT & filters.ChatType.GROUPS,
-            handle_message
-        )
-    )
+    # Создаем приложение
+    application = build_application()
+    metrics.start_http_server(BALANCE_METRICS_PORT)
 
     logger.info("=" * 50)
-    logger.info("Balance bot запущен и готов к работе!")
+    logger.info(f"Balance bot запущен и готов к работе! (режим: {BALANCE_BOT_MODE})")
     logger.info("=" * 50)
-    logger.info("Отслеживаемые группы:")
-    for group_id, config in GROUP_CONFIG.items():
+    logger.info("Группы загружаются из group_balances (реестр), исходные:")
+    for group_id, config in SEED_GROUPS.items():
         logger.info(f"  - {config['name']} (ID: {group_id}, язык: {config['language']})")
     logger.info("=" * 50)
 
     # Запускаем бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if BALANCE_BOT_MODE == 'webhook':
+        # Telegram сам доставляет апдейты POST-запросом; запросы без
+        # правильного секретного токена отклоняются с 403
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES
+        )
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
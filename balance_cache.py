@@ -0,0 +1,89 @@
+"""
+Кэш балансов групп в памяти для balance_bot
+Бот - единственный писатель group_balances, поэтому после каждой
+подтвержденной транзакции кэш обновляется сразу (write-through),
+а сверка с БД нужна только для обнаружения расхождений
+"""
+
+import logging
+import threading
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceCache:
+    """Балансы групп по group_id со счетчиками попаданий и расхождений"""
+
+    def __init__(self):
+        self._balances: dict[int, Decimal] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.drift = 0  # расхождения кэша с БД (при записи и при сверке)
+        self.reconciliations = 0
+
+    def get(self, group_id: int) -> Decimal | None:
+        """Баланс из кэша или None (промах)"""
+        with self._lock:
+            balance = self._balances.get(group_id)
+            if balance is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return balance
+
+    def set(self, group_id: int, balance: Decimal) -> None:
+        with self._lock:
+            self._balances[group_id] = balance
+
+    def load(self, rows: list[dict]) -> int:
+        """Заполняет кэш строками group_balances, возвращает число групп"""
+        with self._lock:
+            for row in rows:
+                self._balances[int(row['group_id'])] = Decimal(str(row['current_balance']))
+            return len(rows)
+
+    def apply(self, group_id: int, previous_balance: Decimal, new_balance: Decimal) -> None:
+        """
+        Обновляет кэш после подтвержденной транзакции
+        Если БД сообщила другой предыдущий баланс - значит кэш разошелся с БД
+        """
+        with self._lock:
+            cached = self._balances.get(group_id)
+            if cached is not None and cached != previous_balance:
+                self.drift += 1
+                logger.warning(f"Кэш баланса группы {group_id} разошелся с БД: {cached} != {previous_balance}")
+            self._balances[group_id] = new_balance
+
+    def reconcile(self, rows: list[dict]) -> list[tuple[int, Decimal | None, Decimal]]:
+        """
+        Сверяет кэш со строками group_balances из БД и принимает значения БД
+        Возвращает список расхождений (group_id, в_кэше, в_БД)
+        """
+        mismatches = []
+        with self._lock:
+            for row in rows:
+                group_id = int(row['group_id'])
+                actual = Decimal(str(row['current_balance']))
+                cached = self._balances.get(group_id)
+                if cached is not None and cached != actual:
+                    mismatches.append((group_id, cached, actual))
+                self._balances[group_id] = actual
+
+            self.drift += len(mismatches)
+            self.reconciliations += 1
+
+        for group_id, cached, actual in mismatches:
+            logger.warning(f"Сверка: баланс группы {group_id} в кэше {cached}, в БД {actual}")
+        return mismatches
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'groups': len(self._balances),
+                'hits': self.hits,
+                'misses': self.misses,
+                'drift': self.drift,
+                'reconciliations': self.reconciliations,
+            }
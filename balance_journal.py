@@ -0,0 +1,171 @@
+"""
+Локальный журнал транзакций баланса (write-behind)
+Каждая операция сначала надежно записывается в SQLite (WAL, synchronous=FULL),
+бот сразу отвечает в группу, а фоновая выгрузка пачками переносит записи
+в Supabase (balance_transactions + group_balances). Незавершенная выгрузка
+повторяется после рестарта; повтор безопасен благодаря уникальности
+(group_id, message_id)
+
+Выгруженные записи хранятся BALANCE_JOURNAL_RETENTION секунд и затем
+удаляются: они нужны только чтобы распознать повторный апдейт Telegram
+с тем же message_id (Telegram повторяет апдейты не дольше суток)
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+JOURNAL_DB_PATH = os.getenv("BALANCE_JOURNAL_PATH", os.path.join(DATA_DIR, "balance_journal.sqlite3"))
+JOURNAL_RETENTION = float(os.getenv("BALANCE_JOURNAL_RETENTION", str(7 * 24 * 3600)))  # секунд
+# Удаление старых записей - не чаще раза в PRUNE_INTERVAL секунд
+PRUNE_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    amount TEXT NOT NULL,
+    previous_balance TEXT NOT NULL,
+    new_balance TEXT NOT NULL,
+    transaction_type TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    flushed_at REAL,
+    UNIQUE (group_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_journal_pending ON journal(flushed_at, seq);
+"""
+
+
+class BalanceJournal:
+    """Журнал операций в SQLite; соединение открывается на каждый вызов (безопасно для потоков)"""
+
+    def __init__(self, path: str = JOURNAL_DB_PATH, retention: float = JOURNAL_RETENTION):
+        self.path = path
+        self.retention = retention
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+        self._flush_lock = threading.Lock()
+        self._pruned_at = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def append(self, group_id: int, message_id: int, user_id: int, username: str | None,
+               amount: Decimal, previous_balance: Decimal, new_balance: Decimal) -> tuple[Decimal, Decimal, bool]:
+        """
+        Записывает операцию
+        Возвращает (предыдущий_баланс, новый_баланс, записано_впервые);
+        для повторного апдейта с тем же message_id - ранее записанные балансы
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "INSERT INTO journal (group_id, message_id, user_id, username, amount, previous_balance, "
+                "new_balance, transaction_type, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (group_id, message_id) DO NOTHING",
+                (group_id, message_id, user_id, username or 'Unknown', str(amount), str(previous_balance),
+                 str(new_balance), 'add' if amount > 0 else 'subtract', time.time())
+            )
+            if cursor.rowcount == 1:
+                return previous_balance, new_balance, True
+
+            row = conn.execute(
+                "SELECT previous_balance, new_balance FROM journal WHERE group_id = ? AND message_id = ?",
+                (group_id, message_id)
+            ).fetchone()
+            return Decimal(row['previous_balance']), Decimal(row['new_balance']), False
+        finally:
+            conn.close()
+
+    def pending(self, limit: int) -> list[dict]:
+        """Невыгруженные записи в порядке записи"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM journal WHERE flushed_at IS NULL ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def pending_count(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM journal WHERE flushed_at IS NULL").fetchone()[0]
+        finally:
+            conn.close()
+
+    def latest_pending_balances(self) -> dict[int, Decimal]:
+        """Последний новый баланс по группам среди невыгруженных записей"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT group_id, new_balance FROM journal WHERE seq IN ("
+                "SELECT MAX(seq) FROM journal WHERE flushed_at IS NULL GROUP BY group_id)"
+            ).fetchall()
+        finally:
+            conn.close()
+        return {row['group_id']: Decimal(row['new_balance']) for row in rows}
+
+    def mark_flushed(self, seqs: list[int]) -> None:
+        conn = self._connect()
+        try:
+            conn.executemany(
+                "UPDATE journal SET flushed_at = ? WHERE seq = ?",
+                [(time.time(), seq) for seq in seqs]
+            )
+        finally:
+            conn.close()
+
+    def prune(self) -> int:
+        """Удаляет записи, выгруженные раньше чем retention секунд назад; возвращает их число"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                "DELETE FROM journal WHERE flushed_at IS NOT NULL AND flushed_at < ?",
+                (time.time() - self.retention,)
+            )
+        finally:
+            conn.close()
+        if cursor.rowcount:
+            logger.info(f"Журнал: удалено выгруженных операций старше {self.retention:.0f} с: {cursor.rowcount}")
+        return cursor.rowcount
+
+    def flush(self, apply_batch, batch_size: int) -> int:
+        """
+        Выгружает все невыгруженные записи пачками через apply_batch(entries)
+        apply_batch должен быть идемпотентным; при ошибке выгрузка
+        останавливается и будет повторена следующим вызовом
+        После успешной выгрузки удаляет устаревшие записи (prune)
+        Возвращает число выгруженных записей
+        """
+        flushed = 0
+        with self._flush_lock:
+            while True:
+                batch = self.pending(batch_size)
+                if not batch:
+                    now = time.monotonic()
+                    if self._pruned_at is None or now - self._pruned_at >= PRUNE_INTERVAL:
+                        self._pruned_at = now
+                        self.prune()
+                    return flushed
+                apply_batch(batch)
+                self.mark_flushed([entry['seq'] for entry in batch])
+                flushed += len(batch)
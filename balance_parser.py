@@ -0,0 +1,70 @@
+"""
+Разбор сообщений о пополнении/списании баланса
+Большинство сообщений в группах - обычная переписка, поэтому сначала
+проверяется первый символ, и только потом запускается регулярное выражение
+
+Поддерживаемые форматы:
+    +1000, -5000, +1,000, +1 000, +1000.50
+    ＋1000, －500 (полноширинные знаки), −500 (знак минуса U+2212)
+    +1000¥, +¥1000, +1000元, +1，000 (полноширинная запятая)
+    +1万, +1.5万 (китайский множитель 10 000)
+"""
+
+import re
+from decimal import Decimal, InvalidOperation
+
+# Знаки операции: ASCII, полноширинные и типографский минус
+_PLUS_SIGNS = '+＋'
+_MINUS_SIGNS = '-－−'
+_SIGNS = frozenset(_PLUS_SIGNS + _MINUS_SIGNS)
+
+# Разделители тысяч: запятые, пробел и неразрывные пробелы (удаляются перед Decimal)
+_THOUSANDS_SEPARATORS = ',， \u00a0\u202f'
+_STRIP_SEPARATORS = str.maketrans('', '', _THOUSANDS_SEPARATORS)
+
+_WAN = Decimal('10000')
+
+_AMOUNT_PATTERN = re.compile(
+    r'\s*(?P<sign>[+＋\-－−])\s*[¥￥]?\s*'
+    r'(?:'
+    r'(?P<wan>\d+(?:\.\d{1,4})?)\s*万'
+    r'|'
+    r'(?P<number>\d{1,3}(?:[,， \u00a0\u202f]?\d{3})*(?:\.\d{1,2})?)'
+    r')'
+    r'\s*[¥￥元]?\s*'
+)
+
+
+def parse_amount(text: str | None) -> Decimal | None:
+    """
+    Возвращает сумму со знаком или None, если сообщение не является операцией
+    Валидация лимитов - в balance_bot.validate_amount
+    """
+    if not text:
+        return None
+
+    # Быстрый отказ: сообщение должно начинаться со знака (возможно после пробелов)
+    first = text[0]
+    if first not in _SIGNS:
+        if not first.isspace():
+            return None
+        stripped = text.lstrip()
+        if not stripped or stripped[0] not in _SIGNS:
+            return None
+
+    match = _AMOUNT_PATTERN.fullmatch(text)
+    if match is None:
+        return None
+
+    try:
+        wan = match.group('wan')
+        if wan is not None:
+            amount = Decimal(wan) * _WAN
+        else:
+            amount = Decimal(match.group('number').translate(_STRIP_SEPARATORS))
+    except InvalidOperation:
+        return None
+
+    if match.group('sign') in _MINUS_SIGNS:
+        amount = -amount
+    return amount
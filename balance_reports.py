@@ -0,0 +1,92 @@
+"""
+Отчеты balance_bot по агрегатам balance_rollups / balance_user_rollups
+Агрегаты ведет триггер в БД (см. supabase_schema.sql), поэтому отчет за
+день или неделю читает не больше нескольких строк на группу и
+пользователя - время не зависит от длины истории транзакций
+"""
+
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+import metrics
+
+# Часовой пояс границ дня - должен совпадать с 'Asia/Shanghai' в supabase_schema.sql
+REPORT_TIMEZONE = ZoneInfo(os.getenv("BALANCE_REPORT_TIMEZONE", "Asia/Shanghai"))
+WEEK_DAYS = 7
+TOP_LIMIT = 10
+
+_SUM_FIELDS = ('deposits_count', 'deposits_sum', 'withdrawals_count', 'withdrawals_sum')
+
+
+def day_start(days_ago: int = 0, now: datetime | None = None) -> datetime:
+    """Полночь (в REPORT_TIMEZONE) дня days_ago дней назад"""
+    now = (now or datetime.now(REPORT_TIMEZONE)).astimezone(REPORT_TIMEZONE)
+    day = now.date() - timedelta(days=days_ago)
+    return datetime(day.year, day.month, day.day, tzinfo=REPORT_TIMEZONE)
+
+
+def fetch_day_rollups(client, group_id: int, since: datetime) -> list[dict]:
+    """Дневные итоги группы начиная с since, по возрастанию дня"""
+    query = (
+        client.table('balance_rollups')
+        .select('period_start, deposits_count, deposits_sum, withdrawals_count, withdrawals_sum, '
+                'opening_balance, closing_balance')
+        .eq('group_id', group_id)
+        .eq('period', 'day')
+        .gte('period_start', since.isoformat())
+        .order('period_start')
+    )
+    response = metrics.timed_execute(query, 'balance_rollups', 'select')
+    return [_decimal_row(row) for row in response.data or []]
+
+
+def fetch_user_rollups(client, group_id: int, since: datetime) -> list[dict]:
+    """Дневные итоги пользователей группы начиная с since"""
+    query = (
+        client.table('balance_user_rollups')
+        .select('user_id, username, deposits_count, deposits_sum, withdrawals_count, withdrawals_sum')
+        .eq('group_id', group_id)
+        .eq('period', 'day')
+        .gte('period_start', since.isoformat())
+    )
+    response = metrics.timed_execute(query, 'balance_user_rollups', 'select')
+    return [_decimal_row(row) for row in response.data or []]
+
+
+def _decimal_row(row: dict) -> dict:
+    """Суммы из PostgREST приходят числами JSON - переводим в Decimal через str()"""
+    result = dict(row)
+    for field in ('deposits_sum', 'withdrawals_sum', 'opening_balance', 'closing_balance'):
+        if field in result and result[field] is not None:
+            result[field] = Decimal(str(result[field]))
+    if 'period_start' in result:
+        result['period_start'] = datetime.fromisoformat(result['period_start']).astimezone(REPORT_TIMEZONE)
+    return result
+
+
+def summarize(rows: list[dict]) -> dict:
+    """Суммирует дневные итоги; opening/closing - первого и последнего дня (None, если строк нет)"""
+    totals = {field: 0 if field.endswith('count') else Decimal('0') for field in _SUM_FIELDS}
+    for row in rows:
+        for field in _SUM_FIELDS:
+            totals[field] += row[field]
+    totals['opening_balance'] = rows[0]['opening_balance'] if rows else None
+    totals['closing_balance'] = rows[-1]['closing_balance'] if rows else None
+    return totals
+
+
+def rank_users(rows: list[dict], limit: int = TOP_LIMIT) -> list[dict]:
+    """Итоги по пользователям за период, по убыванию суммы пополнений"""
+    users: dict[int, dict] = {}
+    for row in rows:
+        user = users.get(row['user_id'])
+        if user is None:
+            user = users[row['user_id']] = {'user_id': row['user_id'], 'username': row['username']}
+            user.update({field: 0 if field.endswith('count') else Decimal('0') for field in _SUM_FIELDS})
+        for field in _SUM_FIELDS:
+            user[field] += row[field]
+        user['username'] = user['username'] or row['username']
+    ranked = sorted(users.values(), key=lambda user: (user['deposits_sum'], user['deposits_count']), reverse=True)
+    return ranked[:limit]
@@ -0,0 +1,187 @@
+"""
+Бенчмарк допуска запросов (admission.py): поток медленных анкет на /api/submit
+против задержки главной страницы, статики и /api/test
+
+Сервер запускается как в продакшене - gunicorn с --workers синхронными
+воркерами - без допуска (ADMISSION=0) и с ним. --flood клиентов непрерывно
+отправляют анкеты с файлом --body-mb МБ со скоростью --bandwidth МБ/с (каждая
+держит воркер секунды), а проверочный клиент раз в --probe-interval с
+запрашивает /, /api/test и /metrics. Печатает задержку проверочных запросов
+p50/p99/max, число таймаутов и ответы на анкеты по статусам
+
+Запуск: python benchmarks/bench_admission.py --workers 2 --flood 6 --duration 15
+"""
+
+import argparse
+import http.client
+import os
+import select
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOUNDARY = 'benchboundary7ZpQx'
+MB = 1024 * 1024
+BLOCK = 64 * 1024
+PROBE_PATHS = ('/', '/api/test', '/metrics')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(port: int, workers: int, tmp: str, admission: bool, max_in_flight: int) -> subprocess.Popen:
+    env = dict(os.environ, DATA_DIR=tmp, UPLOAD_FOLDER=os.path.join(tmp, 'uploads'),
+               QUEUE_DB_PATH=os.path.join(tmp, 'jobs.sqlite3'), WORKERS=str(workers),
+               ADMISSION='1' if admission else '0', ADMISSION_MAX_IN_FLIGHT=str(max_in_flight))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'server:app', '--workers', str(workers),
+         '--bind', f'127.0.0.1:{port}', '--timeout', '120', '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/api/test')
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("gunicorn не запустился (pip install gunicorn)")
+
+
+def slow_submit(port: int, body_mb: float, bandwidth: float) -> str:
+    """Анкета с файлом, отправляемым со скоростью bandwidth; возвращает статус ответа"""
+    payload = os.urandom(BLOCK)
+    size = int(body_mb * MB)
+    head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="name"\r\n\r\nФлуд\r\n'
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="photos"; filename="photo.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode()
+    tail = f'\r\n--{BOUNDARY}--\r\n'.encode()
+    length = len(head) + size + len(tail)
+    sock = socket.create_connection(('127.0.0.1', port), timeout=60)
+    try:
+        sock.sendall(f'POST /api/submit HTTP/1.1\r\nHost: bench\r\nContent-Length: {length}\r\n'
+                     f'Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n\r\n'.encode() + head)
+        sent = 0
+        while sent < size:
+            # Сервер ответил, не дожидаясь тела (отказ по допуску) - дальше не шлем
+            if select.select([sock], [], [], 0)[0]:
+                break
+            block = payload[:min(BLOCK, size - sent)]
+            sock.sendall(block)
+            sent += len(block)
+            time.sleep(len(block) / (bandwidth * MB))
+        else:
+            sock.sendall(tail)
+        response = sock.recv(64)
+        return response.split(b' ', 2)[1].decode() if response else 'closed'
+    except OSError:
+        return 'error'
+    finally:
+        sock.close()
+
+
+def probe(port: int, path: str, timeout: float) -> float | None:
+    """Время ответа на GET, с; None - таймаут или ошибка"""
+    started = time.perf_counter()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        conn.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+        conn.getresponse().read()
+        conn.close()
+        return time.perf_counter() - started
+    except OSError:
+        return None
+
+
+def run(args, tmp: str, admission: bool) -> None:
+    port = free_port()
+    process = start_gunicorn(port, args.workers, tmp, admission, args.max_in_flight)
+    stop = threading.Event()
+    statuses = {}
+    lock = threading.Lock()
+
+    def flood():
+        while not stop.is_set():
+            status = slow_submit(port, args.body_mb, args.bandwidth)
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+            if status in ('429', '503'):
+                stop.wait(0.5)  # клиент без учета Retry-After: повтор почти сразу
+
+    threads = [threading.Thread(target=flood, daemon=True) for _ in range(args.flood)]
+    for thread in threads:
+        thread.start()
+    time.sleep(1)  # флуд успевает занять воркеры
+
+    latencies = {path: [] for path in PROBE_PATHS}
+    timeouts = 0
+    deadline = time.time() + args.duration
+    while time.time() < deadline:
+        for path in PROBE_PATHS:
+            latency = probe(port, path, args.probe_timeout)
+            if latency is None:
+                timeouts += 1
+            else:
+                latencies[path].append(latency * 1000)
+        time.sleep(args.probe_interval)
+
+    stop.set()
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+    samples = sorted(value for values in latencies.values() for value in values)
+    name = 'с допуском' if admission else 'без допуска'
+    if samples:
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        summary = f"p50 {statistics.median(samples):8.1f}  p99 {p99:8.1f}  max {samples[-1]:8.1f} мс"
+    else:
+        summary = "ни одного ответа"
+    print(f"{name:<12} проверка: {summary}, таймаутов {timeouts:>3} из {len(samples) + timeouts}; "
+          f"анкеты: {dict(sorted(statuses.items()))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--flood', type=int, default=6, help="одновременных клиентов с анкетами")
+    parser.add_argument('--body-mb', type=float, default=20)
+    parser.add_argument('--bandwidth', type=float, default=4, help="МБ/с у каждого клиента")
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--probe-interval', type=float, default=0.2)
+    parser.add_argument('--probe-timeout', type=float, default=5)
+    parser.add_argument('--max-in-flight', type=int, help="ADMISSION_MAX_IN_FLIGHT (по умолчанию воркеров - 1): "
+                        "проверяется, что свободный воркер отвечает")
+    args = parser.parse_args()
+    if args.max_in_flight is None:
+        args.max_in_flight = max(1, args.workers - 1)
+
+    print(f"gunicorn: {args.workers} воркера, анкет одновременно {args.max_in_flight}, флуд: {args.flood} клиентов, "
+          f"анкета {args.body_mb:g} МБ со скоростью {args.bandwidth:g} МБ/с")
+    for admission in (False, True):
+        tmp = tempfile.mkdtemp(prefix="admission-")
+        try:
+            run(args, tmp, admission)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
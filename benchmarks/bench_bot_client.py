@@ -0,0 +1,89 @@
+"""
+Бенчмарк: задержка отправки анкеты в Telegram
+Сравнивает старый путь (новый Bot + asyncio.run на каждую анкету)
+с общим Bot на фоновом loop из bot.py
+
+Запуск: python benchmarks/bench_bot_client.py --runs 50 --latency 0.02 --connect-latency 0.1
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import start_server  # noqa: E402
+
+TEST_DATA = {
+    'name': 'Бенчмарк',
+    'age': '25',
+    'height': '175',
+    'weight': '55',
+    'citizenship': 'Россия',
+    'telegram': '@bench',
+    'whatsapp': '+7 999 999-99-99',
+    'experience': 'Есть опыт',
+    'countries': '',
+}
+
+
+def report(name: str, timings: list[float]) -> float:
+    timings = sorted(timings)
+    p50 = statistics.median(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<28} p50={p50 * 1000:8.1f} ms  p99={p99 * 1000:8.1f} ms  mean={statistics.mean(timings) * 1000:8.1f} ms")
+    return p50
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.02, help="задержка ответа API, сек")
+    parser.add_argument('--connect-latency', type=float, default=0.1, help="стоимость нового соединения, сек")
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency, connect_latency=args.connect_latency)
+    base_url = f"http://127.0.0.1:{server.server_port}/bot"
+    os.environ['BOT_TOKEN'] = '123:fake'
+    os.environ['GROUP_ID'] = '-100'
+    os.environ['TELEGRAM_API_BASE_URL'] = base_url
+
+    import bot
+    from telegram import Bot
+
+    async def legacy_send():
+        legacy_bot = Bot(token=bot.BOT_TOKEN, base_url=base_url)
+        await legacy_bot.send_message(chat_id=bot.GROUP_ID, text='legacy', parse_mode='HTML')
+
+    legacy = []
+    server.reset_stats()
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        asyncio.run(legacy_send())
+        legacy.append(time.perf_counter() - started)
+    legacy_connections = server.connections
+
+    # Прогрев: инициализация общего Bot (getMe) не входит в замер
+    bot.run_coroutine(bot.get_bot())
+    shared = []
+    server.reset_stats()
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        assert bot.send_application(TEST_DATA)
+        shared.append(time.perf_counter() - started)
+    shared_connections = server.connections
+    bot.shutdown()
+
+    print(f"runs={args.runs} latency={args.latency}s connect_latency={args.connect_latency}s")
+    legacy_p50 = report("новый Bot + asyncio.run", legacy)
+    shared_p50 = report("общий Bot + фоновый loop", shared)
+    print(f"соединений: {legacy_connections} -> {shared_connections}")
+    print(f"ускорение p50: x{legacy_p50 / shared_p50:.1f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Бенчмарк: анкета с большим видео одним POST /api/submit против
+возобновляемой загрузки частями (/api/uploads, resumable_upload.py)
+на медленном канале с обрывами соединения
+
+Клиент отправляет тело со скоростью --bandwidth (общей для всех его соединений),
+после каждого мегабайта соединение обрывается с вероятностью --drop-rate.
+Одиночный POST после обрыва начинается заново, при загрузке частями
+повторяется только оборванная часть (--parallel частей одновременно).
+Замеряются: время до принятия анкеты, повторно переданные байты и занятость
+воркера сервера - самый длинный запрос и сумма времени всех запросов
+(синхронный воркер gunicorn занят медленным клиентом все это время)
+
+Запуск: python benchmarks/bench_chunked_upload.py --video-mb 40 --bandwidth 16 --drop-rate 0.02
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BOUNDARY = 'benchboundary9QmX2c'
+MB = 1024 * 1024
+BLOCK = 64 * 1024
+MAX_ATTEMPTS = 50
+
+
+class Link:
+    """Канал клиента: общая полоса для всех соединений и случайные обрывы"""
+
+    def __init__(self, bandwidth: float, drop_rate: float, seed: int):
+        self.bandwidth = bandwidth * MB
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._next_free = time.perf_counter()
+        self._lock = threading.Lock()
+        self.sent = 0
+
+    def send(self, conn: http.client.HTTPConnection, data: bytes) -> bool:
+        """Отправляет блоками с ограничением скорости; False - соединение оборвалось"""
+        for start in range(0, len(data), BLOCK):
+            block = data[start:start + BLOCK]
+            with self._lock:
+                self._next_free = max(self._next_free, time.perf_counter()) + len(block) / self.bandwidth
+                wait = self._next_free - time.perf_counter()
+                dropped = self._random.random() < self.drop_rate * len(block) / MB
+                self.sent += len(block)
+            if wait > 0:
+                time.sleep(wait)
+            if dropped:
+                conn.sock.close()
+                return False
+            conn.send(block)
+        return True
+
+
+class RequestTimer:
+    """WSGI-обертка: время каждого запроса от начала до отдачи ответа"""
+
+    def __init__(self, app):
+        self.app = app
+        self.durations = []
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        try:
+            return list(self.app(environ, start_response))
+        finally:
+            with self._lock:
+                self.durations.append(time.perf_counter() - started)
+
+
+def request(port: int, method: str, path: str, body: bytes, headers: dict, link: Link | None):
+    """(статус, JSON ответа) или None при обрыве"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        conn.putrequest(method, path)
+        for name, value in dict(headers, **{'Content-Length': str(len(body))}).items():
+            conn.putheader(name, value)
+        conn.endheaders()
+        if link is None:
+            conn.send(body)
+        elif not link.send(conn, body):
+            return None
+        response = conn.getresponse()
+        return response.status, json.loads(response.read() or b'{}')
+    except (OSError, http.client.HTTPException):
+        return None
+    finally:
+        conn.close()
+
+
+def form_body(fields: dict, files: list[tuple[str, str, bytes]]) -> bytes:
+    parts = [f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, values in fields.items() for value in (values if isinstance(values, list) else [values])]
+    for field, filename, data in files:
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{BOUNDARY}--\r\n'.encode())
+    return b''.join(parts)
+
+
+def single_post(port: int, files: list, link: Link) -> int:
+    """Анкета одним запросом; после обрыва - заново. Возвращает число попыток"""
+    body = form_body({'name': 'Бенчмарк'}, files)
+    headers = {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'}
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        result = request(port, 'POST', '/api/submit', body, headers, link)
+        if result is not None and result[0] == 202:
+            return attempt
+    raise RuntimeError("анкета не принята")
+
+
+def chunked(port: int, files: list, link: Link, parallel: int) -> int:
+    """Загрузка частями и анкета со ссылками на загрузки. Возвращает число оборванных частей"""
+    json_headers = {'Content-Type': 'application/json'}
+    uploads = []
+    for field, filename, data in files:
+        status, upload = request(port, 'POST', '/api/uploads',
+                                 json.dumps({'filename': filename, 'size': len(data)}).encode(), json_headers, None)
+        uploads.append((field, upload, data))
+
+    chunk_jobs = [(upload, data, chunk) for _, upload, data in uploads for chunk in range(upload['chunks'])]
+    dropped = 0
+    dropped_lock = threading.Lock()
+
+    def put(job):
+        nonlocal dropped
+        upload, data, chunk = job
+        offset = chunk * upload['chunk_size']
+        body = data[offset:offset + upload['chunk_size']]
+        for _ in range(MAX_ATTEMPTS):
+            result = request(port, 'PUT', f"/api/uploads/{upload['upload_id']}?offset={offset}", body,
+                             {'Content-Type': 'application/octet-stream'}, link)
+            if result is not None and result[0] == 200:
+                return
+            with dropped_lock:
+                dropped += 1
+        raise RuntimeError("часть не принята")
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        list(pool.map(put, chunk_jobs))
+
+    fields = {'name': 'Бенчмарк', 'photo_uploads': [], 'video_upload': []}
+    for field, upload, _ in uploads:
+        request(port, 'POST', f"/api/uploads/{upload['upload_id']}/finalize", b'', {}, None)
+        fields['photo_uploads' if field == 'photos' else 'video_upload'].append(upload['upload_id'])
+    status, _ = request(port, 'POST', '/api/submit', form_body(fields, []),
+                        {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'}, None)
+    if status != 202:
+        raise RuntimeError(f"анкета не принята: HTTP {status}")
+    return dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=3)
+    parser.add_argument('--photo-mb', type=float, default=3)
+    parser.add_argument('--video-mb', type=float, default=40)
+    parser.add_argument('--bandwidth', type=float, default=16, help="МБ/с канала клиента")
+    parser.add_argument('--drop-rate', type=float, default=0.02, help="вероятность обрыва на каждый МБ")
+    parser.add_argument('--parallel', type=int, default=3, help="частей одновременно")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update({'DATA_DIR': tmp, 'UPLOAD_FOLDER': os.path.join(tmp, 'uploads'),
+                       'QUEUE_DB_PATH': os.path.join(tmp, 'jobs.sqlite3')})
+    os.chdir(ROOT)
+    import logging
+    logging.disable(logging.CRITICAL)
+    import server
+    import resumable_upload
+    from werkzeug.serving import make_server
+    server.app.config['MAX_CONTENT_LENGTH'] = 1024 * MB
+
+    files = [('photos', f'photo_{i}.jpg', os.urandom(int(args.photo_mb * MB))) for i in range(args.photos)]
+    files.append(('video', 'video.mp4', os.urandom(int(args.video_mb * MB))))
+    payload = sum(len(data) for _, _, data in files)
+    print(f"Анкета {payload / MB:.0f} МБ, канал {args.bandwidth} МБ/с, обрыв {args.drop_rate:.0%} на МБ, "
+          f"части по {resumable_upload.UPLOAD_CHUNK_SIZE // MB} МБ x{args.parallel}")
+
+    for name in ('один POST', 'частями'):
+        timer = RequestTimer(server.app)
+        httpd = make_server('127.0.0.1', 0, timer, threaded=True)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        link = Link(args.bandwidth, args.drop_rate, args.seed)
+
+        started = time.perf_counter()
+        if name == 'один POST':
+            outcome = f"попыток {single_post(httpd.server_port, files, link)}"
+        else:
+            outcome = f"оборвано частей {chunked(httpd.server_port, files, link, args.parallel)}"
+        elapsed = time.perf_counter() - started
+        httpd.shutdown()
+
+        print(f"{name:<10} {elapsed:6.1f} с  {outcome:<20} передано повторно {(link.sent - payload) / MB:6.1f} МБ  "
+              f"воркер: самый длинный запрос {max(timer.durations):5.2f} с, "
+              f"всего {sum(timer.durations):6.1f} с в {len(timer.durations)} запросах")
+
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Бенчмарк: память воркера доставки при отправке анкеты в Telegram
+Сравнивает InputFile из python-telegram-bot (содержимое файла читается в
+память целиком) с потоковой отправкой открытого файла (bot._StreamedFile).
+Каждый вариант запускается в отдельном процессе, имитация Bot API
+(fake_bot_api.py) - тоже: ее разбор multipart не попадает в пиковый RSS
+
+Запуск: python benchmarks/bench_delivery_memory.py --photos 20 --photo-mb 5 --video-mb 45
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from bench_bot_client import TEST_DATA  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def write_file(path: str, size: int) -> str:
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        while size > 0:
+            f.write(block[:min(size, len(block))])
+            size -= len(block)
+    return path
+
+
+def run_variant(variant: str, args) -> None:
+    os.environ['BOT_TOKEN'] = '123:fake'
+    os.environ['GROUP_ID'] = '-100'
+    os.environ['TELEGRAM_API_BASE_URL'] = f"http://127.0.0.1:{args.port}/bot"
+    os.environ['TELEGRAM_CHAT_LIMIT'] = str(10 ** 6)
+    os.environ['TELEGRAM_ALBUM_CONCURRENCY'] = str(args.album_concurrency)
+
+    import bot
+    from telegram import InputMediaPhoto, InputMediaVideo
+
+    if variant == 'inputfile':
+        def load_media(kind, path, caption=None, file_id=None):
+            parse_mode = 'HTML' if caption else None
+            with open(path, 'rb') as media_file:
+                if kind == 'video':
+                    return InputMediaVideo(media=media_file, caption=caption, parse_mode=parse_mode)
+                return InputMediaPhoto(media=media_file, caption=caption, parse_mode=parse_mode)
+
+        bot._load_media = load_media
+
+    tmp = tempfile.mkdtemp()
+    photos = [write_file(os.path.join(tmp, f"photo_{i}.jpg"), int(args.photo_mb * 1024 * 1024))
+              for i in range(args.photos)]
+    video = write_file(os.path.join(tmp, 'video.mp4'), int(args.video_mb * 1024 * 1024)) if args.video_mb else None
+
+    bot.run_coroutine(bot.get_bot())
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    success = bot.send_application(TEST_DATA, photos, video)
+    elapsed = time.perf_counter() - started
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    bot.shutdown()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    print(json.dumps({
+        'variant': variant,
+        'success': success,
+        'seconds': elapsed,
+        'rss_peak_mb': rss_peak / 1024,
+        'rss_growth_mb': (rss_peak - rss_before) / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=20)
+    parser.add_argument('--photo-mb', type=float, default=5)
+    parser.add_argument('--video-mb', type=float, default=45)
+    parser.add_argument('--album-concurrency', type=int, default=2, help="TELEGRAM_ALBUM_CONCURRENCY")
+    parser.add_argument('--variant', choices=['inputfile', 'streaming'])
+    parser.add_argument('--port', type=int)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args)
+        return
+
+    port = free_port()
+    api = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'fake_bot_api.py'), '--port', str(port)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(0.5)
+        payload_mb = args.photos * args.photo_mb + args.video_mb
+        print(f"Анкета: {args.photos} фото по {args.photo_mb} МБ + видео {args.video_mb} МБ = {payload_mb:.0f} МБ, "
+              f"TELEGRAM_ALBUM_CONCURRENCY={args.album_concurrency}")
+        for variant in ('inputfile', 'streaming'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--variant', variant, '--port', str(port),
+                 '--photos', str(args.photos), '--photo-mb', str(args.photo_mb), '--video-mb', str(args.video_mb),
+                 '--album-concurrency', str(args.album_concurrency)],
+                capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            result = json.loads(output)
+            print(f"{variant:<10} {'доставлено' if result['success'] else 'ошибка':<10} "
+                  f"{result['seconds']:6.2f} с  RSS пик {result['rss_peak_mb']:6.1f} МБ "
+                  f"(+{result['rss_growth_mb']:.1f})")
+    finally:
+        api.terminate()
+        api.wait()
+
+
+if __name__ == "__main__":
+    main()
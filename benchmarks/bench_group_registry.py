@@ -0,0 +1,57 @@
+"""
+Бенчмарк проверки группы в balance_bot при росте числа групп:
+прежний список ALL_GROUPS (поиск перебором на каждое сообщение) против
+реестра group_registry.GroupRegistry (словарь по group_id)
+
+Сообщения приходят из групп вразнобой, в том числе из чужих групп,
+которых нет в списке (для них перебор проходит весь список)
+
+Запуск: python benchmarks/bench_group_registry.py --groups 3,100,1000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from group_registry import GroupRegistry  # noqa: E402
+
+MESSAGES = 200_000
+
+
+def per_lookup(check, chat_ids: list[int]) -> float:
+    """Среднее время одной проверки, нс"""
+    started = time.perf_counter()
+    for chat_id in chat_ids:
+        check(chat_id)
+    return (time.perf_counter() - started) / len(chat_ids) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--groups', default='3,100,1000')
+    parser.add_argument('--foreign', type=float, default=0.3, help="доля сообщений из неотслеживаемых групп")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    print(f"{'групп':>6} {'список':>10} {'реестр':>10}")
+    for count in (int(value) for value in args.groups.split(',')):
+        group_ids = [-1000000000000 - i for i in range(count)]
+        chat_ids = [rng.choice(group_ids) if rng.random() > args.foreign else -2000000000000 - rng.randrange(10**6)
+                    for _ in range(MESSAGES)]
+
+        all_groups = list(group_ids)
+        registry = GroupRegistry()
+        registry.load([{'group_id': group_id, 'group_name': f'Group {group_id}', 'language': 'zh'}
+                       for group_id in group_ids])
+
+        legacy = per_lookup(lambda chat_id: chat_id in all_groups, chat_ids)
+        current = per_lookup(registry.get, chat_ids)
+        print(f"{count:>6} {legacy:7.0f} нс {current:7.0f} нс")
+
+
+if __name__ == "__main__":
+    main()
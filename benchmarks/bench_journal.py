@@ -0,0 +1,141 @@
+"""
+Бенчмарк локального журнала balance_bot (write-behind)
+Supabase заменен клиентом в памяти с задержкой --db-latency на вызов RPC.
+Сравнивает задержку ответа в группу при синхронной записи в БД
+и с журналом, затем проверяет восстановление:
+  - Supabase недоступен: ответы продолжаются, выгрузка догоняет после восстановления
+  - рестарт между записью в БД и отметкой в журнале: повторная выгрузка не создает дублей
+
+Запуск: python benchmarks/bench_journal.py --updates 300 --db-latency 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp(prefix="balance-journal-")
+os.environ['BALANCE_JOURNAL_PATH'] = os.path.join(_tmp, 'journal.sqlite3')
+
+# load_balance_bot задает SUPABASE_* до импорта balance_bot
+from load_balance_bot import (  # noqa: E402
+    FakeSupabase, check_ledger, load_seed_groups, make_update, unlimited_scheduler
+)
+
+import balance_bot  # noqa: E402
+from balance_journal import BalanceJournal  # noqa: E402
+
+
+def reset(fake: FakeSupabase, journal: BalanceJournal | None) -> None:
+    balance_bot.supabase = fake
+    balance_bot.journal = journal
+    balance_bot.balance_cache = balance_bot.BalanceCache()
+    for group_id in balance_bot.groups.group_ids():
+        balance_bot.balance_cache.set(group_id, Decimal('0'))
+    balance_bot._group_locks.clear()
+    balance_bot.send_scheduler = unlimited_scheduler()
+
+
+async def run(updates: list, concurrency: int, flush: bool) -> list[float]:
+    """Обрабатывает апдейты, возвращает задержки ответа (секунды)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def process(update):
+        async with semaphore:
+            started = time.perf_counter()
+            await balance_bot.handle_message(update, None)
+            latencies.append(time.perf_counter() - started)
+
+    flusher = asyncio.create_task(balance_bot.flush_journal_periodically()) if flush else None
+    await asyncio.gather(*(process(update) for update in updates))
+    if flusher is not None:
+        flusher.cancel()
+    return latencies
+
+
+def make_updates(count: int, first_message_id: int = 1) -> list:
+    groups = balance_bot.groups.group_ids()
+    return [
+        make_update(groups[i % len(groups)], first_message_id + i, f"+{100 + i}", 0.0)
+        for i in range(count)
+    ]
+
+
+def report(name: str, latencies: list[float], fake: FakeSupabase) -> None:
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<20} p50 {statistics.median(latencies) * 1000:8.1f} мс  p99 {p99 * 1000:8.1f} мс  "
+          f"вызовов БД {fake.calls:>4}  порядок {'OK' if check_ledger(fake) else 'НАРУШЕН'}")
+
+
+def balances_match(fake: FakeSupabase) -> bool:
+    return all(
+        fake.balances.get(group_id, Decimal('0')) == balance_bot.balance_cache.get(group_id)
+        for group_id in balance_bot.groups.group_ids()
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=300)
+    parser.add_argument('--db-latency', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args()
+
+    balance_bot.logger.disabled = True
+    balance_bot.BALANCE_FLUSH_INTERVAL = 0.1
+    load_seed_groups()
+    print(f"{args.updates} апдейтов, БД {args.db_latency * 1000:.0f} мс на вызов, "
+          f"конкурентность {args.concurrency}")
+
+    fake = FakeSupabase(args.db_latency)
+    reset(fake, None)
+    report("синхронная запись", asyncio.run(run(make_updates(args.updates), args.concurrency, False)), fake)
+
+    fake = FakeSupabase(args.db_latency)
+    journal = BalanceJournal(os.path.join(_tmp, 'bench.sqlite3'))
+    reset(fake, journal)
+    latencies = asyncio.run(run(make_updates(args.updates), args.concurrency, True))
+    balance_bot.flush_journal()
+    report("журнал", latencies, fake)
+    print(f"  в БД {sum(len(rows) for rows in fake.ledger.values())} операций, "
+          f"балансы {'совпадают' if balances_match(fake) else 'РАСХОДЯТСЯ'} с кэшем")
+
+    # Supabase недоступен: ответы не ждут БД, операции копятся в журнале
+    fake = FakeSupabase(args.db_latency)
+    fake.fail = True
+    journal = BalanceJournal(os.path.join(_tmp, 'outage.sqlite3'))
+    reset(fake, journal)
+    latencies = asyncio.run(run(make_updates(args.updates), args.concurrency, True))
+    pending = journal.pending_count()
+    fake.fail = False
+    balance_bot.flush_journal()
+    print(f"Supabase недоступен: p50 ответа {statistics.median(latencies) * 1000:.1f} мс, "
+          f"в журнале {pending}, после восстановления выгружено "
+          f"{sum(len(rows) for rows in fake.ledger.values())}, "
+          f"балансы {'совпадают' if balances_match(fake) else 'РАСХОДЯТСЯ'}")
+
+    # Рестарт после записи в БД, но до отметки в журнале: выгрузка повторяется целиком
+    fake = FakeSupabase(0.0)
+    path = os.path.join(_tmp, 'restart.sqlite3')
+    reset(fake, BalanceJournal(path))
+    asyncio.run(run(make_updates(args.updates), args.concurrency, False))
+    balance_bot.apply_journal_batch(balance_bot.journal.pending(args.updates))
+    restarted = BalanceJournal(path)
+    balance_bot.journal = restarted
+    replayed = balance_bot.flush_journal()
+    rows = sum(len(rows) for rows in fake.ledger.values())
+    print(f"Рестарт: повторно выгружено {replayed}, строк в БД {rows} "
+          f"({'без дублей' if rows == args.updates else 'ДУБЛИ'}), порядок "
+          f"{'OK' if check_ledger(fake) else 'НАРУШЕН'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Бенчмарк выгрузки и проверки истории балансов (ledger_export.py) на
+синтетической истории с внесенными нарушениями
+
+Supabase заменен клиентом в памяти с тем же построителем запросов
+(select/eq/gt/gte/lt/order/limit): ответ проходит через JSON, как от
+PostgREST, а каждый запрос ждет --latency мс (сеть и БД). Замеряются:
+- чтение по одному запросу и параллельными отрезками (--workers)
+- проверка цепочки numpy по странице целиком против цикла по строкам
+- выгрузка в CSV.gz и Parquet
+Проверка должна найти ровно внесенные нарушения
+
+Запуск: python benchmarks/bench_ledger_export.py --rows 2000000 --latency 20 --workers 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ledger_export  # noqa: E402
+
+GROUPS = 10
+USERS = 50
+
+
+class Query:
+    def __init__(self, store, table: str):
+        self.store = store
+        self.table = table
+        self.filters = []
+        self.desc = False
+        self.count = None
+
+    def select(self, columns: str):
+        self.columns = [column.strip() for column in columns.split(',')]
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, 'eq', value))
+        return self
+
+    def gt(self, column, value):
+        self.filters.append((column, 'gt', value))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append((column, 'gte', value))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append((column, 'lt', value))
+        return self
+
+    def order(self, column, desc=False):
+        self.desc = desc
+        return self
+
+    def limit(self, count):
+        self.count = count
+        return self
+
+    def execute(self):
+        time.sleep(self.store.latency)
+        with self.store.lock:
+            self.store.requests += 1
+        rows = self.store.query(self)
+        return type('Response', (), {'data': json.loads(json.dumps(rows))})()
+
+
+class FakeSupabase:
+    """История по группам: массивы numpy, строки собираются под запрос (не больше max_rows, как в PostgREST)"""
+
+    def __init__(self, rows: int, breaks: int, latency: float, max_rows: int, seed: int):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.max_rows = max_rows
+        self.requests = 0
+        rng = np.random.default_rng(seed)
+        group_of = rng.integers(0, GROUPS, rows)
+        amount = rng.integers(100, 50_000, rows) * np.where(rng.random(rows) < 0.8, 1, -1)
+        self.groups = {}
+        for group in range(GROUPS):
+            mask = group_of == group
+            ids = np.flatnonzero(mask) + 1
+            cents = amount[mask]
+            new = np.cumsum(cents)
+            self.groups[-1000 - group] = {
+                'id': ids, 'amount': cents, 'previous': new - cents, 'new': new, 'user': rng.integers(1, USERS, len(ids)),
+            }
+        self.current = {group: int(data['new'][-1]) if len(data['new']) else 0 for group, data in self.groups.items()}
+
+        # Нарушения: разрыв цепочки и неверная сумма строки; оба меняют сумму
+        # операций группы (sum), а правка group_balances - еще и balance
+        picker = random.Random(seed)
+        self.injected = {'chain': 0, 'amount': 0, 'sum': 0, 'balance': 0}
+        group_ids = list(self.groups)
+        touched = {group_ids[0]}
+        for _ in range(breaks):
+            group = picker.choice(group_ids)
+            data = self.groups[group]
+            index = picker.randrange(1, len(data['id']))
+            kind = picker.choice(('chain', 'amount'))
+            if kind == 'chain':
+                # Строка потеряна из середины: previous не совпадает с new предыдущей
+                data['previous'][index] += 1
+            data['amount'][index] -= 1
+            touched.add(group)
+            self.injected[kind] += 1
+        self.current[group_ids[0]] += 100
+        self.injected['sum'] = len(touched)
+        self.injected['balance'] = 1
+
+    def table(self, name: str) -> Query:
+        return Query(self, name)
+
+    def query(self, q: Query) -> list[dict]:
+        if q.table == 'group_balances':
+            return [{'group_id': group, 'current_balance': cents / 100} for group, cents in self.current.items()]
+        if q.table in ('balance_archives', 'balance_snapshots'):
+            return []
+        filters = {op: value for column, op, value in q.filters if column == 'id'}
+        group = next(value for column, op, value in q.filters if column == 'group_id')
+        data = self.groups[group]
+        ids = data['id']
+        lo = 0
+        if 'gt' in filters:
+            lo = np.searchsorted(ids, filters['gt'], 'right')
+        elif 'gte' in filters:
+            lo = np.searchsorted(ids, filters['gte'], 'left')
+        hi = np.searchsorted(ids, filters['lt'], 'left') if 'lt' in filters else len(ids)
+        count = min(q.count or self.max_rows, self.max_rows)
+        index = range(hi - 1, max(lo, hi - count) - 1, -1) if q.desc else range(lo, min(hi, lo + count))
+        return [{
+            'id': int(ids[i]), 'group_id': group, 'user_id': int(data['user'][i]),
+            'username': f"user{data['user'][i]}", 'amount': int(data['amount'][i]) / 100,
+            'previous_balance': int(data['previous'][i]) / 100, 'new_balance': int(data['new'][i]) / 100,
+            'transaction_type': 'add' if data['amount'][i] > 0 else 'subtract', 'message_id': int(ids[i]),
+            'created_at': '2025-11-01T12:00:00+00:00',
+        } for i in index]
+
+
+def loop_audit(pages) -> int:
+    """Та же проверка цепочки и сумм строки циклом по строкам"""
+    breaks = 0
+    last = {}
+    for page in pages:
+        for row in page:
+            previous = round(row['previous_balance'] * 100)
+            new = round(row['new_balance'] * 100)
+            if previous != last.get(row['group_id'], 0):
+                breaks += 1
+            if new - previous != round(row['amount'] * 100):
+                breaks += 1
+            last[row['group_id']] = new
+    return breaks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--breaks', type=int, default=25, help="внесенных нарушений")
+    parser.add_argument('--latency', type=float, default=20, help="мс на запрос")
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    store = FakeSupabase(args.rows, args.breaks, args.latency / 1000, args.page_size, args.seed)
+    print(f"{args.rows:,} строк, {GROUPS} групп, страница {args.page_size}, задержка {args.latency:g} мс; "
+          f"внесено нарушений: {store.injected}")
+    tmp = tempfile.mkdtemp(prefix="ledger-export-")
+
+    for workers in (1, args.workers):
+        store.requests = 0
+        result = ledger_export.run(store, audit=True, workers=workers, page_size=args.page_size,
+                                   breaks_path=os.path.join(tmp, 'breaks.csv'))
+        found = result['audit']['breaks']
+        assert found == {k: v for k, v in store.injected.items() if v}, f"найдено {found}"
+        print(f"чтение + проверка, отрезков x{workers:<2}: {result['seconds']:6.1f} с, "
+              f"{result['rows'] / result['seconds']:>9,.0f} строк/с, запросов {store.requests}, найдено {found}")
+
+    # Проверка без сети: страницы уже в памяти
+    store.latency = 0
+    slices = ledger_export.plan_slices(store, sorted(store.groups), 1, args.page_size)
+    pages = list(ledger_export.stream_pages(store, slices, args.page_size, 1))
+    started = time.perf_counter()
+    auditor = ledger_export.LedgerAudit()
+    for page in pages:
+        auditor.add_page(page[0]['group_id'], ledger_export.page_arrays(page))
+    numpy_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    loop_breaks = loop_audit(pages)
+    loop_seconds = time.perf_counter() - started
+    assert loop_breaks == sum(auditor.breaks.values())
+    print(f"проверка без сети: numpy {args.rows / numpy_seconds:>12,.0f} строк/с, "
+          f"цикл по строкам {args.rows / loop_seconds:>12,.0f} строк/с")
+
+    for name in ('ledger.csv.gz', 'ledger.parquet'):
+        if name.endswith('.parquet') and ledger_export.pa is None:
+            print("Parquet пропущен: pyarrow не установлен")
+            continue
+        path = os.path.join(tmp, name)
+        result = ledger_export.run(store, output=path, audit=False, workers=args.workers, page_size=args.page_size)
+        print(f"выгрузка {name:<15} {result['seconds']:6.1f} с, {result['rows'] / result['seconds']:>9,.0f} строк/с, "
+              f"{os.path.getsize(path) / 1024 / 1024:6.1f} МБ")
+
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
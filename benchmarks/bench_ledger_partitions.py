@@ -0,0 +1,260 @@
+"""
+Бенчмарк истории балансов: одна таблица balance_transactions против месячных
+секций со снимками балансов (supabase_schema.sql, ledger_archive.py)
+на синтетической истории, растущей месяц за месяцем
+
+Postgres в окружении нет, поэтому секции воспроизведены в SQLite отдельными
+таблицами по месяцам с теми же индексами; запрос к секционированной таблице
+с условием на created_at читает только секции своего периода - здесь он
+сразу идет в таблицу месяца. На каждой контрольной точке измеряются:
+- запись: пачки по --batch операций в текущий месяц (как выгрузка журнала бота)
+- проверка баланса группы: вся история против снимка + операций после него
+В конце - удаление самого старого месяца: DELETE по дате из одной таблицы
+против выгрузки секции в CSV.gz и DROP TABLE
+
+Запуск: python benchmarks/bench_ledger_partitions.py --rows-per-month 100000 --checkpoints 3,12,36
+"""
+
+import argparse
+import csv
+import gzip
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+DAY = 86400
+MONTH = 30 * DAY
+GROUPS = 10
+USERS = 50
+BULK = 10_000
+START = 1_600_000_000
+
+COLUMNS = ('id', 'group_id', 'user_id', 'username', 'amount', 'previous_balance', 'new_balance',
+           'transaction_type', 'message_id', 'created_at')
+
+TABLE = """
+CREATE TABLE {name} (
+    id INTEGER NOT NULL,
+    group_id INTEGER NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    amount INTEGER NOT NULL,
+    previous_balance INTEGER NOT NULL,
+    new_balance INTEGER NOT NULL,
+    transaction_type TEXT NOT NULL,
+    message_id INTEGER,
+    created_at INTEGER NOT NULL,
+    PRIMARY KEY (id, created_at)
+);
+CREATE INDEX idx_{name}_group_id ON {name}(group_id, created_at);
+CREATE INDEX idx_{name}_created_at ON {name}(created_at DESC);
+CREATE UNIQUE INDEX idx_{name}_group_message ON {name}(group_id, message_id, created_at);
+"""
+
+SNAPSHOTS = """
+CREATE TABLE balance_snapshots (
+    group_id INTEGER NOT NULL,
+    taken_at INTEGER NOT NULL,
+    balance INTEGER NOT NULL,
+    transactions_count INTEGER NOT NULL,
+    PRIMARY KEY (group_id, taken_at)
+);
+"""
+
+# Проверка баланса по всей истории
+FULL_REPLAY = "SELECT SUM(amount), COUNT(*) FROM balance_transactions WHERE group_id = ?"
+
+# Последний снимок + операции текущего месяца после него (verify_group_balances)
+LATEST_SNAPSHOT = """
+SELECT taken_at, balance FROM balance_snapshots WHERE group_id = ? ORDER BY taken_at DESC LIMIT 1
+"""
+RECENT_SUM = "SELECT SUM(amount), COUNT(*) FROM {name} WHERE group_id = ? AND created_at >= ?"
+PREVIOUS_SNAPSHOT = """
+SELECT balance, transactions_count FROM balance_snapshots WHERE group_id = ? ORDER BY taken_at DESC LIMIT 1
+"""
+
+
+def partition_name(month: int) -> str:
+    return f"balance_transactions_m{month:03d}"
+
+
+def connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-65536")
+    return conn
+
+
+class Ledger:
+    """Генератор операций: балансы и message_id групп растут как в боте"""
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        self.balances = [0] * GROUPS
+        self.message_ids = [0] * GROUPS
+        self.next_id = 1
+
+    def month_rows(self, month: int, count: int) -> list[tuple]:
+        start = START + month * MONTH
+        times = sorted(start + self.rng.randrange(MONTH) for _ in range(count))
+        rows = []
+        for created_at in times:
+            group = self.rng.randrange(GROUPS)
+            user_id = self.rng.randrange(1, USERS + 1)
+            amount = self.rng.randrange(100, 50_000) * (1 if self.rng.random() < 0.8 else -1)
+            previous = self.balances[group]
+            self.balances[group] = previous + amount
+            self.message_ids[group] += 1
+            rows.append((self.next_id, group, user_id, f"user{user_id}", amount, previous, previous + amount,
+                         'add' if amount > 0 else 'subtract', self.message_ids[group], created_at))
+            self.next_id += 1
+        return rows
+
+
+def insert(conn: sqlite3.Connection, table: str, rows: list[tuple]) -> None:
+    conn.execute("BEGIN")
+    conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+    conn.execute("COMMIT")
+
+
+def timed_batches(conn: sqlite3.Connection, table: str, rows: list[tuple], batch: int) -> list[float]:
+    """Время записи каждой пачки, мс"""
+    samples = []
+    for start in range(0, len(rows), batch):
+        started = time.perf_counter()
+        insert(conn, table, rows[start:start + batch])
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def take_snapshots(conn: sqlite3.Connection, month: int) -> None:
+    """Снимки на начало следующего месяца: предыдущий снимок + операции месяца"""
+    taken_at = START + (month + 1) * MONTH
+    conn.execute("BEGIN")
+    for group in range(GROUPS):
+        previous = conn.execute(PREVIOUS_SNAPSHOT, (group,)).fetchone() or (0, 0)
+        amount, count = conn.execute(RECENT_SUM.format(name=partition_name(month)),
+                                     (group, START + month * MONTH)).fetchone()
+        conn.execute("INSERT INTO balance_snapshots VALUES (?, ?, ?, ?)",
+                     (group, taken_at, previous[0] + (amount or 0), previous[1] + count))
+    conn.execute("COMMIT")
+
+
+def verify_partitioned(conn: sqlite3.Connection, group: int, month: int) -> int:
+    snapshot = conn.execute(LATEST_SNAPSHOT, (group,)).fetchone()
+    taken_at, balance = snapshot if snapshot else (0, 0)
+    amount, _ = conn.execute(RECENT_SUM.format(name=partition_name(month)), (group, taken_at)).fetchone()
+    return balance + (amount or 0)
+
+
+def median_ms(func, repeat: int) -> tuple[float, object]:
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows-per-month', type=int, default=100_000)
+    parser.add_argument('--checkpoints', default='3,12,36', help="месяцев истории на контрольных точках")
+    parser.add_argument('--batch', type=int, default=200, help="операций в пачке записи")
+    parser.add_argument('--batches', type=int, default=100, help="измеряемых пачек на контрольной точке")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    checkpoints = sorted(int(value) for value in args.checkpoints.split(','))
+
+    tmp = tempfile.mkdtemp(prefix="ledger-partitions-")
+    single = connect(os.path.join(tmp, 'single.sqlite3'))
+    single.executescript(TABLE.format(name='balance_transactions'))
+    partitioned = connect(os.path.join(tmp, 'partitioned.sqlite3'))
+    partitioned.executescript(SNAPSHOTS)
+
+    ledger = Ledger(seed=42)
+    timed_rows = args.batch * args.batches
+    group = 0
+
+    print(f"{GROUPS} групп, {args.rows_per_month:,} операций в месяц; медиана, мс")
+    print(f"{'':>20} | {'запись пачки, p50 / p99':^31} | {'проверка баланса группы':^40}")
+    print(f"{'месяцев':>7} {'строк':>12} | {'одна таблица':>15} {'секции':>15} | "
+          f"{'вся история':>25} {'снимок + месяц':>14}")
+    month = 0
+    for checkpoint in checkpoints:
+        while month < checkpoint:
+            if month > 0:
+                # Предыдущий месяц закрыт - снимок на его конец
+                take_snapshots(partitioned, month - 1)
+            rows = ledger.month_rows(month, args.rows_per_month)
+            name = partition_name(month)
+            partitioned.executescript(TABLE.format(name=name))
+            # Конец последнего месяца контрольной точки пишется измеряемыми пачками
+            bulk_rows, tail = (rows[:-timed_rows], rows[-timed_rows:]) if month == checkpoint - 1 else (rows, [])
+            for start in range(0, len(bulk_rows), BULK):
+                insert(single, 'balance_transactions', bulk_rows[start:start + BULK])
+                insert(partitioned, name, bulk_rows[start:start + BULK])
+            if tail:
+                single_insert = timed_batches(single, 'balance_transactions', tail, args.batch)
+                partitioned_insert = timed_batches(partitioned, name, tail, args.batch)
+            month += 1
+
+        full_ms, (full_sum, full_rows) = median_ms(
+            lambda: single.execute(FULL_REPLAY, (group,)).fetchone(), args.repeat)
+        snap_ms, snap_sum = median_ms(lambda: verify_partitioned(partitioned, group, month - 1), args.repeat)
+        assert full_sum == snap_sum == ledger.balances[group], "балансы не сходятся"
+        print(f"{checkpoint:>7} {month * args.rows_per_month:>12,} | "
+              f"{statistics.median(single_insert):>6.2f} / {percentile(single_insert, 0.99):<6.2f} "
+              f"{statistics.median(partitioned_insert):>6.2f} / {percentile(partitioned_insert, 0.99):<6.2f} | "
+              f"{full_ms:>8.2f} ({full_rows:>10,} строк) {snap_ms:>14.2f}")
+
+    # Удаление самого старого месяца
+    cutoff = START + MONTH
+    started = time.perf_counter()
+    single.execute("DELETE FROM balance_transactions WHERE created_at < ?", (cutoff,))
+    delete_seconds = time.perf_counter() - started
+
+    name = partition_name(0)
+    path = os.path.join(tmp, f"{name}.csv.gz")
+    started = time.perf_counter()
+    rows = 0
+    last_id = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        while True:
+            page = partitioned.execute(f"SELECT * FROM {name} WHERE id > ? ORDER BY id LIMIT 5000",
+                                       (last_id,)).fetchall()
+            writer.writerows(page)
+            rows += len(page)
+            if len(page) < 5000:
+                break
+            last_id = page[-1][0]
+    export_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    partitioned.execute(f"DROP TABLE {name}")
+    drop_seconds = time.perf_counter() - started
+    with gzip.open(path, 'rb') as f:
+        raw_bytes = f.seek(0, os.SEEK_END)
+    print(f"Удаление месяца ({rows:,} строк): DELETE из одной таблицы {delete_seconds:.2f} с; "
+          f"выгрузка секции {export_seconds:.2f} с ({os.path.getsize(path) / 1024 / 1024:.1f} МБ gzip, "
+          f"~{raw_bytes / os.path.getsize(path):.1f}x) + DROP TABLE {drop_seconds * 1000:.1f} мс")
+
+    single.close()
+    partitioned.close()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Бенчмарк кэша file_id (media_cache.py): повторная отправка анкеты с теми же
+фото и видео через имитацию Bot API с ограниченной скоростью загрузки
+
+Одна и та же анкета (--photos фото и видео) отправляется --resubmits раз
+подряд без кэша (MEDIA_CACHE=0) и с кэшем. Имитация принимает тело запроса
+со скоростью --bandwidth МБ/с (канал сервера до api.telegram.org).
+Замеряются: время отправки каждой анкеты, байты, полученные Bot API,
+и счетчик media_cache_bytes_saved_total. Отдельно - скорость хеширования
+содержимого по блокам против записи файла без хеша
+
+Запуск: python benchmarks/bench_media_cache.py --photos 5 --photo-mb 2 --video-mb 20 --resubmits 3
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fake_bot_api import FakeBotAPIHandler, start_server  # noqa: E402
+from bench_bot_client import TEST_DATA  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def throttle(bandwidth: float) -> None:
+    """Чтение тела запроса имитацией не быстрее bandwidth байт/с"""
+    original = FakeBotAPIHandler._handle
+
+    def handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        time.sleep(length / bandwidth)
+        return original(self)
+
+    FakeBotAPIHandler._handle = handle
+
+
+def hashing_speed(size_mb: int, tmp: str) -> tuple[float, float]:
+    """МБ/с записи файла блоками по 64 КБ без хеша и с BlockDigest"""
+    import media_cache
+    data = os.urandom(64 * 1024)
+    blocks = size_mb * MB // len(data)
+    speeds = []
+    for with_digest in (False, True):
+        digest = media_cache.BlockDigest()
+        started = time.perf_counter()
+        with open(os.path.join(tmp, 'hash.bin'), 'wb') as f:
+            for _ in range(blocks):
+                f.write(data)
+                if with_digest:
+                    digest.update(data)
+        speeds.append(size_mb / (time.perf_counter() - started))
+    return speeds[0], speeds[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=5)
+    parser.add_argument('--photo-mb', type=float, default=2)
+    parser.add_argument('--video-mb', type=float, default=20)
+    parser.add_argument('--resubmits', type=int, default=3, help="отправок одной и той же анкеты")
+    parser.add_argument('--bandwidth', type=float, default=20, help="МБ/с до Bot API")
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="media-cache-")
+    throttle(args.bandwidth * MB)
+    server = start_server(latency=args.latency)
+    os.environ.update({
+        'BOT_TOKEN': '123:fake', 'GROUP_ID': '-100', 'DATA_DIR': tmp,
+        # Альбомы идут подряд в один чат - окно лимита чата сокращено, чтобы не ждать его
+        'TELEGRAM_CHAT_WINDOW': '0.1',
+        'TELEGRAM_API_BASE_URL': f"http://127.0.0.1:{server.server_port}/bot",
+    })
+    logging.disable(logging.CRITICAL)
+    import bot
+    import media_cache
+
+    photos = []
+    for index in range(args.photos):
+        path = os.path.join(tmp, f'photo_{index}.jpg')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(int(args.photo_mb * MB)))
+        photos.append(path)
+    video = os.path.join(tmp, 'video.mp4')
+    with open(video, 'wb') as f:
+        f.write(os.urandom(int(args.video_mb * MB)))
+    digests = {path: media_cache.file_digest(path) for path in photos + [video]}
+
+    print(f"Анкета: {args.photos} фото по {args.photo_mb:g} МБ и видео {args.video_mb:g} МБ, "
+          f"канал до Bot API {args.bandwidth:g} МБ/с, отправок {args.resubmits}")
+    for enabled in (False, True):
+        media_cache.MEDIA_CACHE = enabled
+        server.reset_stats()
+        saved_before = media_cache.MEDIA_CACHE_BYTES_SAVED.value(kind='photo') + \
+            media_cache.MEDIA_CACHE_BYTES_SAVED.value(kind='video')
+        timings = []
+        for _ in range(args.resubmits):
+            started = time.perf_counter()
+            assert bot.send_application(TEST_DATA, photos, video, digests)
+            timings.append(time.perf_counter() - started)
+        saved = media_cache.MEDIA_CACHE_BYTES_SAVED.value(kind='photo') + \
+            media_cache.MEDIA_CACHE_BYTES_SAVED.value(kind='video') - saved_before
+        print(f"{'с кэшем' if enabled else 'без кэша':<9} отправки: {' / '.join(f'{t:5.2f}' for t in timings)} с, "
+              f"получено Bot API {server.bytes_received / MB:7.1f} МБ, сэкономлено {saved / MB:6.1f} МБ")
+
+    plain, hashed = hashing_speed(256, tmp)
+    print(f"Запись файла: без хеша {plain:,.0f} МБ/с, с хешем по блокам {hashed:,.0f} МБ/с")
+
+    bot.shutdown()
+    server.shutdown()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Бенчмарк: доставка анкеты с 10 фото
+Сравнивает старую схему (текст + send_photo в цикле) с альбомами sendMediaGroup
+Обе схемы идут через планировщик отправок (send_scheduler.py). Лимит чата
+Telegram (20 сообщений в минуту) по умолчанию снят - иначе замер показывает
+ожидание окна, а не отправку; --telegram-limits включает его
+--applications - сколько анкет отправляется одновременно (как разные воркеры
+доставки): на них влияет --chat-concurrency, альбомы одной анкеты идут по порядку
+
+Запуск: python benchmarks/bench_media_group.py --photos 10 --photo-size 300000 --latency 0.3
+        python benchmarks/bench_media_group.py --photos 20 --applications 2 --chat-concurrency 2
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import start_server  # noqa: E402
+from bench_bot_client import TEST_DATA  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=10)
+    parser.add_argument('--photo-size', type=int, default=300_000, help="размер фото, байт")
+    parser.add_argument('--latency', type=float, default=0.3, help="время обработки запроса в API, сек")
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--applications', type=int, default=1, help="анкет одновременно")
+    parser.add_argument('--chat-concurrency', type=int, default=1,
+                        help="TELEGRAM_CHAT_CONCURRENCY: одновременных запросов с медиа в чат")
+    parser.add_argument('--telegram-limits', action='store_true', help="лимит чата Telegram в планировщике")
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency)
+    os.environ['BOT_TOKEN'] = '123:fake'
+    os.environ['GROUP_ID'] = '-100'
+    os.environ['TELEGRAM_API_BASE_URL'] = f"http://127.0.0.1:{server.server_port}/bot"
+    os.environ['TELEGRAM_CHAT_CONCURRENCY'] = str(args.chat_concurrency)
+    if not args.telegram_limits:
+        os.environ['TELEGRAM_CHAT_LIMIT'] = str(10 ** 6)
+
+    import bot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        photos = []
+        for i in range(args.photos):
+            path = os.path.join(tmp, f"photo_{i}.jpg")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(args.photo_size))
+            photos.append(path)
+
+        async def legacy_send_one():
+            shared = await bot.get_bot()
+            await bot.call_with_retry(shared.send_message, chat_id=bot.GROUP_ID,
+                                      text=bot.format_application(TEST_DATA), parse_mode='HTML')
+            for path in photos:
+                with open(path, 'rb') as photo_file:
+                    await bot.call_with_retry(shared.send_photo, chat_id=bot.GROUP_ID, photo=photo_file,
+                                              priority=bot.PRIORITY_MEDIA)
+
+        async def legacy_send():
+            await asyncio.gather(*[legacy_send_one() for _ in range(args.applications)])
+
+        async def album_send():
+            await asyncio.gather(*[bot.send_application_to_group(TEST_DATA, photos)
+                                   for _ in range(args.applications)])
+
+        bot.run_coroutine(bot.get_bot())
+
+        for name, run in (
+            ("send_photo в цикле", lambda: bot.run_coroutine(legacy_send())),
+            ("альбомы sendMediaGroup", lambda: bot.run_coroutine(album_send())),
+        ):
+            server.reset_stats()
+            started = time.perf_counter()
+            for _ in range(args.runs):
+                run()
+            elapsed = (time.perf_counter() - started) / args.runs
+            calls = sum(server.calls.values()) / args.runs / args.applications
+            print(f"{name:<26} {elapsed * 1000:8.1f} ms/прогон  {calls:5.1f} вызовов API/анкета")
+
+    bot.shutdown()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Бенчмарк: обработка фото перед отправкой (media_processing.process_photo)
+Генерирует снимки размера камеры телефона (JPEG с EXIF и HEIC)
+и показывает сокращение байт на отправку и CPU на файл
+
+Запуск: python benchmarks/bench_media_processing.py --photos 3 --width 4032 --height 3024
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import media_processing  # noqa: E402
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def make_photo(path: str, width: int, height: int, seed: int) -> None:
+    """Фото с шумом и градиентом (сжимается примерно как реальный снимок) и EXIF"""
+    noise = Image.effect_noise((width, height), 40 + seed).convert('L')
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.merge('RGB', (noise, gradient, Image.blend(noise, gradient, 0.5)))
+
+    exif = Image.Exif()
+    exif[0x010F] = 'Apple'  # Make
+    exif[0x0110] = 'iPhone 15 Pro'  # Model
+    exif[0x0112] = 6  # Orientation: повернуть на 90°
+    fmt = 'HEIF' if path.endswith('.heic') else 'JPEG'
+    image.save(path, fmt, quality=95, exif=exif)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=3)
+    parser.add_argument('--width', type=int, default=4032)
+    parser.add_argument('--height', type=int, default=3024)
+    args = parser.parse_args()
+
+    if Image is None:
+        print("Pillow не установлен - обработка фото отключена")
+        return
+
+    extensions = ['jpg']
+    if media_processing.register_heif_opener is not None:
+        extensions.append('heic')
+
+    tmp = tempfile.mkdtemp()
+    try:
+        for extension in extensions:
+            total_in = total_out = total_cpu = 0
+            for i in range(args.photos):
+                path = os.path.join(tmp, f"photo_{i}.{extension}")
+                make_photo(path, args.width, args.height, i)
+                stats = media_processing.process_photo(path)
+                with Image.open(stats['path']) as result:
+                    assert not result.getexif(), "EXIF должен быть удален"
+                    size = result.size
+                total_in += stats['bytes_in']
+                total_out += stats['bytes_out']
+                total_cpu += stats['cpu_seconds']
+
+            print(f"{extension:<5} {args.photos} x {args.width}x{args.height} -> {size[0]}x{size[1]}: "
+                  f"{total_in / 1024 / 1024:6.1f} МБ -> {total_out / 1024 / 1024:6.1f} МБ "
+                  f"(-{(1 - total_out / total_in) * 100:.0f}%), CPU {total_cpu / args.photos * 1000:.0f} мс/файл")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Бенчмарк накладных расходов metrics.py: стоимость записи счетчика,
+гистограммы и замера with, в один поток и из нескольких потоков
+(как воркеры доставки и пул Supabase), и время отдачи /metrics
+
+Запуск: python benchmarks/bench_metrics.py --iterations 200000 --threads 8
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+
+def per_call(func, iterations: int) -> float:
+    """Среднее время одного вызова, мкс"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def threaded(func, iterations: int, threads: int) -> float:
+    """Среднее время вызова при threads потоках, пишущих одновременно, мкс"""
+    per_thread = iterations // threads
+    workers = [threading.Thread(target=lambda: [func() for _ in range(per_thread)]) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (per_thread * threads) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=200_000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    counter = metrics.counter('bench_total', "Счетчик бенчмарка", ('result',))
+    histogram = metrics.histogram('bench_seconds', "Гистограмма бенчмарка", ('method', 'result'))
+
+    def timed():
+        with histogram.time(method='send_message', result='ok'):
+            pass
+
+    cases = (
+        ("пустой вызов", lambda: None),
+        ("Counter.inc", lambda: counter.inc(result='parsed')),
+        ("Histogram.observe", lambda: histogram.observe(0.042, method='send_message', result='ok')),
+        ("with Histogram.time", timed),
+    )
+    print(f"{'операция':<22} {'1 поток':>10} {f'{args.threads} потоков':>12}")
+    for name, func in cases:
+        print(f"{name:<22} {per_call(func, args.iterations):8.2f} мкс "
+              f"{threaded(func, args.iterations, args.threads):8.2f} мкс")
+
+    # Реалистичный набор рядов: методы Telegram, таблицы Supabase, обработчики
+    for method in ('send_message', 'send_media_group', 'send_photo', 'send_video', 'reply_text'):
+        for result in ('ok', 'error', 'retry_after'):
+            metrics.TELEGRAM_REQUEST_SECONDS.observe(0.1, method=method, result=result)
+    for table in ('group_balances', 'apply_balance_journal', 'balance_rollups', 'balance_user_rollups'):
+        metrics.SUPABASE_REQUEST_SECONDS.observe(0.05, table=table, operation='select')
+    for handler in ('message', 'sync', 'today', 'week', 'top'):
+        metrics.BALANCE_HANDLER_SECONDS.observe(0.08, handler=handler)
+
+    body = metrics.render()
+    render_ms = per_call(metrics.render, 200) / 1000
+    print(f"/metrics: {len(body.splitlines())} строк, {len(body.encode()):,} Б, {render_ms:.2f} мс на запрос")
+
+
+if __name__ == "__main__":
+    main()
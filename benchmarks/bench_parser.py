@@ -0,0 +1,94 @@
+"""
+Микробенчмарк разбора сообщений balance_bot
+Корпус похож на реальную переписку в группах: в основном обычные
+сообщения (русский/китайский текст, ссылки, эмодзи, числа в тексте)
+и около 10% операций +N/-N в разных форматах
+
+Запуск: python benchmarks/bench_parser.py --messages 200000 --balance-share 0.1
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from balance_parser import parse_amount  # noqa: E402
+
+CHATTER = [
+    "Добрый вечер всем", "Кто сегодня на смене?", "ок", "👍", "Спасибо!",
+    "Клиент приедет в 21:30, адрес скину позже", "https://maps.app.goo.gl/abc123",
+    "Сколько осталось на балансе?", "Завтра выходной", "+7 999 123-45-67",
+    "今天谁上班？", "好的", "收到", "客人十点到", "明天见", "谢谢大家", "😂😂😂",
+    "2 часа, 3000", "打车花了 120", "Оплата картой прошла", "-", "+", "++",
+    "ну +- так", "在路上", "9:00 встреча у метро", "-_-", "+ok",
+]
+
+LEGACY_FORMS = ["+1000", "-5000", "+1,000", "-2 500", "+1000.50", "+ 300", "-12,345.67"]
+NEW_FORMS = ["＋1000", "－500", "+1000¥", "+¥800", "+1万", "-1.5万", "+3000元", "+1，000"]
+
+
+def legacy_parse(text: str):
+    """Прежний разбор из handle_message: строка шаблона, re.match на text.strip()"""
+    pattern = r'^([+\-])\s*(\d{1,3}(?:[,\s]?\d{3})*(?:\.\d{1,2})?)$'
+    match = re.match(pattern, text.strip())
+    if not match:
+        return None
+    amount_str = match.group(2).replace(',', '').replace(' ', '')
+    try:
+        amount = Decimal(amount_str)
+    except InvalidOperation:
+        return None
+    return -amount if match.group(1) == '-' else amount
+
+
+def build_corpus(size: int, balance_share: float, seed: int = 42) -> list[str]:
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        if rng.random() < balance_share:
+            corpus.append(rng.choice(LEGACY_FORMS + NEW_FORMS))
+        else:
+            corpus.append(rng.choice(CHATTER))
+    return corpus
+
+
+def run(name: str, parser, corpus: list[str]) -> tuple[float, int]:
+    started = time.perf_counter()
+    parsed = 0
+    for text in corpus:
+        if parser(text) is not None:
+            parsed += 1
+    elapsed = time.perf_counter() - started
+    print(f"{name:<22} {len(corpus) / elapsed:12,.0f} сообщений/с  распознано {parsed}")
+    return elapsed, parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--balance-share', type=float, default=0.1)
+    args = parser.parse_args()
+
+    for text in LEGACY_FORMS:
+        assert parse_amount(text) == legacy_parse(text), text
+    for text in NEW_FORMS:
+        assert parse_amount(text) is not None and legacy_parse(text) is None, text
+
+    corpus = build_corpus(args.messages, args.balance_share)
+    chatter_only = build_corpus(args.messages, 0.0)
+
+    print(f"Корпус: {args.messages} сообщений, операций {args.balance_share:.0%}")
+    run("legacy", legacy_parse, corpus)
+    run("balance_parser", parse_amount, corpus)
+    print("Только переписка:")
+    run("legacy", legacy_parse, chatter_only)
+    run("balance_parser", parse_amount, chatter_only)
+
+
+if __name__ == "__main__":
+    main()
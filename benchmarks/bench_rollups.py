@@ -0,0 +1,252 @@
+"""
+Бенчмарк отчетов balance_bot: сканирование balance_transactions против
+агрегатов balance_rollups / balance_user_rollups на синтетической истории
+
+Postgres в окружении нет, поэтому схема воспроизведена в SQLite с теми же
+индексами, что в supabase_schema.sql (group_id, created_at). Агрегаты
+ведутся так же, как триггер уровня оператора: каждая пачка вставок
+агрегируется один раз и добавляется через ON CONFLICT DO UPDATE.
+Дни считаются по UTC+8 (Asia/Shanghai). История растянута на --days дней,
+поэтому с ростом числа строк растет и объем каждого дня
+
+Запуск: python benchmarks/bench_rollups.py --checkpoints 300000,1000000,3000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+HOUR = 3600
+DAY = 86400
+TZ_OFFSET = 8 * HOUR
+GROUPS = [-1002774266933, -1002468561827, -1003698590476]
+USERS = 20
+BATCH = 10_000
+WEEK_DAYS = 7
+
+SCHEMA = """
+CREATE TABLE balance_transactions (
+    id INTEGER PRIMARY KEY,
+    group_id INTEGER NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    amount INTEGER NOT NULL,
+    previous_balance INTEGER NOT NULL,
+    new_balance INTEGER NOT NULL,
+    created_at INTEGER NOT NULL
+);
+CREATE INDEX idx_balance_transactions_group_id ON balance_transactions(group_id);
+CREATE INDEX idx_balance_transactions_created_at ON balance_transactions(created_at DESC);
+
+CREATE TABLE balance_rollups (
+    group_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    period_start INTEGER NOT NULL,
+    deposits_count INTEGER NOT NULL,
+    deposits_sum INTEGER NOT NULL,
+    withdrawals_count INTEGER NOT NULL,
+    withdrawals_sum INTEGER NOT NULL,
+    opening_balance INTEGER NOT NULL,
+    closing_balance INTEGER NOT NULL,
+    PRIMARY KEY (group_id, period, period_start)
+);
+
+CREATE TABLE balance_user_rollups (
+    group_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    period_start INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    deposits_count INTEGER NOT NULL,
+    deposits_sum INTEGER NOT NULL,
+    withdrawals_count INTEGER NOT NULL,
+    withdrawals_sum INTEGER NOT NULL,
+    PRIMARY KEY (group_id, period, period_start, user_id)
+);
+"""
+
+UPSERT_GROUP = """
+INSERT INTO balance_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (group_id, period, period_start) DO UPDATE SET
+    deposits_count = deposits_count + excluded.deposits_count,
+    deposits_sum = deposits_sum + excluded.deposits_sum,
+    withdrawals_count = withdrawals_count + excluded.withdrawals_count,
+    withdrawals_sum = withdrawals_sum + excluded.withdrawals_sum,
+    closing_balance = excluded.closing_balance
+"""
+
+UPSERT_USER = """
+INSERT INTO balance_user_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (group_id, period, period_start, user_id) DO UPDATE SET
+    username = excluded.username,
+    deposits_count = deposits_count + excluded.deposits_count,
+    deposits_sum = deposits_sum + excluded.deposits_sum,
+    withdrawals_count = withdrawals_count + excluded.withdrawals_count,
+    withdrawals_sum = withdrawals_sum + excluded.withdrawals_sum
+"""
+
+# Отчеты напрямую по истории (как пришлось бы без агрегатов)
+RAW_TODAY = """
+SELECT SUM(amount > 0), SUM(MAX(amount, 0)), SUM(amount < 0), SUM(MAX(-amount, 0))
+FROM balance_transactions WHERE group_id = ? AND created_at >= ?
+"""
+RAW_WEEK = """
+SELECT (created_at + 28800) / 86400 AS day, SUM(MAX(amount, 0)), SUM(MAX(-amount, 0)), MAX(id)
+FROM balance_transactions WHERE group_id = ? AND created_at >= ? GROUP BY day ORDER BY day
+"""
+RAW_TOP = """
+SELECT user_id, SUM(MAX(amount, 0)) AS deposits, SUM(amount > 0), SUM(MAX(-amount, 0))
+FROM balance_transactions WHERE group_id = ? AND created_at >= ?
+GROUP BY user_id ORDER BY deposits DESC LIMIT 10
+"""
+
+# Те же отчеты по агрегатам (запросы balance_reports.py)
+ROLLUP_TODAY = """
+SELECT * FROM balance_rollups WHERE group_id = ? AND period = 'day' AND period_start >= ?
+"""
+ROLLUP_WEEK = """
+SELECT * FROM balance_rollups WHERE group_id = ? AND period = 'day' AND period_start >= ?
+ORDER BY period_start
+"""
+ROLLUP_TOP = """
+SELECT * FROM balance_user_rollups WHERE group_id = ? AND period = 'day' AND period_start >= ?
+"""
+
+
+def day_start(ts: int) -> int:
+    return (ts + TZ_OFFSET) // DAY * DAY - TZ_OFFSET
+
+
+def rollup_batch(rows: list[tuple]) -> tuple[list, list]:
+    """Агрегаты пачки по часу и дню: для групп и для пользователей"""
+    groups: dict[tuple, list] = {}
+    users: dict[tuple, list] = {}
+    for _id, group_id, user_id, username, amount, previous, new, created_at in rows:
+        deposit = amount > 0
+        for period, start in (('hour', created_at // HOUR * HOUR), ('day', day_start(created_at))):
+            key = (group_id, period, start)
+            agg = groups.get(key)
+            if agg is None:
+                agg = groups[key] = [0, 0, 0, 0, previous, new]
+            agg[5] = new
+            user_key = key + (user_id,)
+            user_agg = users.get(user_key)
+            if user_agg is None:
+                user_agg = users[user_key] = [username, 0, 0, 0, 0]
+            if deposit:
+                agg[0] += 1
+                agg[1] += amount
+                user_agg[1] += 1
+                user_agg[2] += amount
+            else:
+                agg[2] += 1
+                agg[3] -= amount
+                user_agg[3] += 1
+                user_agg[4] -= amount
+    return ([key + tuple(agg) for key, agg in groups.items()],
+            [key + tuple(agg) for key, agg in users.items()])
+
+
+def generate(conn: sqlite3.Connection, first_id: int, count: int, now: int, days: int,
+             balances: dict, rng: random.Random) -> float:
+    """Добавляет count транзакций пачками по BATCH; возвращает время записи агрегатов"""
+    span = days * DAY
+    rollup_seconds = 0.0
+    next_id = first_id
+    remaining = count
+    while remaining:
+        size = min(BATCH, remaining)
+        # Время равномерно по истории, внутри пачки - по возрастанию (как в реальной записи)
+        times = sorted(now - rng.randrange(span) for _ in range(size))
+        rows = []
+        for created_at in times:
+            group_id = rng.choice(GROUPS)
+            user_id = rng.randrange(1, USERS + 1)
+            amount = rng.randrange(100, 50_000) * (1 if rng.random() < 0.8 else -1)
+            previous = balances[group_id]
+            balances[group_id] = previous + amount
+            rows.append((next_id, group_id, user_id, f"user{user_id}", amount, previous, previous + amount,
+                         created_at))
+            next_id += 1
+        with conn:
+            conn.executemany("INSERT INTO balance_transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            started = time.perf_counter()
+            group_rows, user_rows = rollup_batch(rows)
+            conn.executemany(UPSERT_GROUP, group_rows)
+            conn.executemany(UPSERT_USER, user_rows)
+            rollup_seconds += time.perf_counter() - started
+        remaining -= size
+    return rollup_seconds
+
+
+def timed(conn: sqlite3.Connection, sql: str, params: tuple, repeat: int) -> float:
+    """Медиана времени запроса, мс"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--checkpoints', default='300000,1000000,3000000',
+                        help='размеры истории (строк), на которых измеряются отчеты')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    checkpoints = [int(value) for value in args.checkpoints.split(',')]
+
+    path = os.path.join(tempfile.mkdtemp(prefix="balance-rollups-"), 'ledger.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    rng = random.Random(42)
+    now = int(time.time())
+    today = day_start(now)
+    week = today - (WEEK_DAYS - 1) * DAY
+    balances = {group_id: 0 for group_id in GROUPS}
+    group_id = GROUPS[0]
+
+    print(f"История за {args.days} дней, {len(GROUPS)} группы, {USERS} пользователей; медиана, мс")
+    print(f"{'строк':>10} | {'today':>14} | {'week':>14} | {'top':>14} | агрегаты при записи")
+    print(f"{'':>10} | {'история  агрег':>14} | {'история  агрег':>14} | {'история  агрег':>14} |")
+    written = 0
+    for checkpoint in checkpoints:
+        started = time.perf_counter()
+        rollup_seconds = generate(conn, written + 1, checkpoint - written, now, args.days, balances, rng)
+        write_seconds = time.perf_counter() - started
+        overhead = rollup_seconds / max(write_seconds - rollup_seconds, 1e-9)
+        written = checkpoint
+        conn.execute("ANALYZE")
+
+        results = []
+        for raw_sql, rollup_sql, since in ((RAW_TODAY, ROLLUP_TODAY, today),
+                                           (RAW_WEEK, ROLLUP_WEEK, week),
+                                           (RAW_TOP, ROLLUP_TOP, week)):
+            results.append(timed(conn, raw_sql, (group_id, since), args.repeat))
+            results.append(timed(conn, rollup_sql, (group_id, since), args.repeat))
+        print(f"{checkpoint:>10,} | {results[0]:6.2f} {results[1]:6.2f} | {results[2]:6.2f} {results[3]:6.2f} | "
+              f"{results[4]:6.2f} {results[5]:6.2f} | +{overhead:.0%} ко времени вставки")
+
+    rollup_rows = conn.execute("SELECT COUNT(*) FROM balance_rollups").fetchone()[0]
+    user_rows = conn.execute("SELECT COUNT(*) FROM balance_user_rollups").fetchone()[0]
+    print(f"Строк агрегатов: групп {rollup_rows:,}, пользователей {user_rows:,}")
+
+    # Агрегаты совпадают с пересчетом по истории (как refresh_balance_rollups)
+    raw = conn.execute(RAW_WEEK, (group_id, week)).fetchall()
+    rolled = conn.execute(ROLLUP_WEEK, (group_id, week)).fetchall()
+    same = [(row[1], row[2]) for row in raw] == [(row[4], row[6]) for row in rolled]
+    print(f"Проверка недели по истории: {'OK' if same else 'РАСХОЖДЕНИЕ'}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
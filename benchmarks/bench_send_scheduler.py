@@ -0,0 +1,158 @@
+"""
+Бенчмарк планировщика отправок (send_scheduler.py) на всплеске сообщений
+Имитация Bot API соблюдает лимиты Telegram: 20 сообщений на чат за окно
+и 30 сообщений в секунду на бота, сверх лимита отвечает 429 с retry_after.
+Окно чата сокращено в --time-scale раз (по умолчанию 60 с -> 6 с), чтобы
+прогон занимал секунды, а не минуты
+
+Всплеск: --balance-messages подтверждений баланса в каждую из --groups групп
+и --applications анкет по --photos фото в группу анкет, одновременно.
+Сравнивает прямые вызовы (прежнее поведение: ответ баланса без повторов,
+анкета - до 3 попыток с ожиданием retry_after) с планировщиком
+
+Запуск: python benchmarks/bench_send_scheduler.py --groups 3 --balance-messages 40 --applications 4
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import start_server  # noqa: E402
+from bench_bot_client import TEST_DATA  # noqa: E402
+
+CHAT_LIMIT = 20
+GLOBAL_LIMIT = 30
+APP_GROUP = '-100'
+
+
+def lower_bound(per_chat: dict, window: float) -> float:
+    """Минимально возможное время доставки при лимитах (без учета сети)"""
+    chat_bound = max(max(0, count - CHAT_LIMIT) / CHAT_LIMIT * window for count in per_chat.values())
+    global_bound = max(0, sum(per_chat.values()) - GLOBAL_LIMIT) / GLOBAL_LIMIT
+    return max(chat_bound, global_bound)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--groups', type=int, default=3)
+    parser.add_argument('--balance-messages', type=int, default=40, help="подтверждений в каждую группу")
+    parser.add_argument('--applications', type=int, default=4)
+    parser.add_argument('--photos', type=int, default=15)
+    parser.add_argument('--time-scale', type=float, default=10.0)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    window = 60.0 / args.time_scale
+    server = start_server(latency=args.latency, chat_limit=CHAT_LIMIT, chat_window=window,
+                          global_limit=GLOBAL_LIMIT)
+    os.environ['BOT_TOKEN'] = '123:fake'
+    os.environ['GROUP_ID'] = APP_GROUP
+    os.environ['TELEGRAM_API_BASE_URL'] = f"http://127.0.0.1:{server.server_port}/bot"
+    os.environ['TELEGRAM_CHAT_WINDOW'] = str(window)
+
+    import bot
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    logging.getLogger('bot').setLevel(logging.CRITICAL)
+    logging.getLogger('send_scheduler').setLevel(logging.ERROR)
+    from send_scheduler import PRIORITY_BALANCE, retry_after_seconds
+    from telegram.error import RetryAfter
+
+    groups = [str(-1000 - i) for i in range(args.groups)]
+    per_chat = {group: args.balance_messages for group in groups}
+    # Текст анкеты уходит подписью к первому альбому
+    per_chat[APP_GROUP] = args.applications * args.photos
+
+    class DirectSender:
+        """Прежнее поведение call_with_retry: вызов сразу, на RetryAfter - до 3 попыток с ожиданием"""
+
+        async def submit(self, chat_id, func, /, *args, priority=None, cost=None, description='', **kwargs):
+            for attempt in range(1, 4):
+                try:
+                    return await func(*args, **kwargs)
+                except RetryAfter as e:
+                    if attempt == 3:
+                        raise
+                    await asyncio.sleep(retry_after_seconds(e))
+
+    scheduler_factory = bot.get_scheduler
+
+    async def burst(photos, scheduled: bool):
+        shared = await bot.get_bot()
+        bot.get_scheduler = scheduler_factory if scheduled else DirectSender
+        latencies = []
+        dropped = 0
+
+        async def balance_reply(group, index):
+            nonlocal dropped
+            started = time.perf_counter()
+            try:
+                if scheduled:
+                    await bot.get_scheduler().submit(group, shared.send_message, chat_id=group, text=f"+{index}",
+                                                     priority=PRIORITY_BALANCE)
+                else:
+                    await shared.send_message(chat_id=group, text=f"+{index}")
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                dropped += 1
+
+        async def application():
+            nonlocal dropped
+            ok = await bot.send_application_to_group(TEST_DATA, photos)
+            dropped += 0 if ok else 1
+
+        tasks = [application() for _ in range(args.applications)]
+        for index in range(args.balance_messages):
+            tasks.extend(balance_reply(group, index) for group in groups)
+        started = time.perf_counter()
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started, latencies, dropped
+
+    with tempfile.TemporaryDirectory() as tmp:
+        photos = []
+        for i in range(args.photos):
+            path = os.path.join(tmp, f"photo_{i}.jpg")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(10_000))
+            photos.append(path)
+
+        bot.run_coroutine(bot.get_bot())
+        expected = sum(per_chat.values())
+        print(f"Всплеск: {args.groups} групп x {args.balance_messages} подтверждений, {args.applications} анкет "
+              f"x {args.photos} фото = {expected} сообщений; лимиты {CHAT_LIMIT}/{window:.0f} с на чат, "
+              f"{GLOBAL_LIMIT}/с всего")
+        print(f"Нижняя граница времени доставки: {lower_bound(per_chat, window):.1f} с")
+
+        for name, scheduled in (("прямые вызовы", False), ("планировщик", True)):
+            # Окна лимитов предыдущего прогона должны истечь
+            time.sleep(window + 1)
+            server.sent.clear()
+            server.rate_limited = 0
+            elapsed, latencies, dropped = bot.run_coroutine(burst(photos, scheduled))
+            messages = 0
+            for _, method, params in list(server.sent):
+                media = params.get('media') or '[]'
+                messages += len(json.loads(media) if isinstance(media, str) else media) \
+                    if method == 'sendMediaGroup' else 1
+            p50 = statistics.median(latencies) if latencies else 0
+            p99 = sorted(latencies)[int(len(latencies) * 0.99) - 1] if latencies else 0
+            print(f"{name:<15} {elapsed:6.1f} с  доставлено {messages}/{expected}  потеряно вызовов {dropped}  "
+                  f"429: {server.rate_limited}  подтверждения p50 {p50:.2f} с p99 {p99:.2f} с")
+
+        print(f"Метрики планировщика: {bot.run_coroutine(_stats(bot))}")
+        bot.shutdown()
+
+
+async def _stats(bot_module):
+    return bot_module.get_scheduler().stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Бенчмарк отдачи статики лендинга: прежняя схема (static_folder='.' и
+send_from_directory, чтение с диска на каждый запрос, без сжатия) против
+static_assets.py (память, gzip/brotli, ETag, immutable)
+
+Измеряются запросы в секунду через WSGI test client (без сети) и байты,
+которые уходят клиенту при первом визите и при повторном: прежде браузер
+перепроверял каждый файл и получал его целиком или 304 по mtime, теперь
+файлы с хешем берутся из кэша без запроса, а index.html отвечает 304
+
+Запуск: python benchmarks/bench_static.py --requests 2000
+"""
+
+import argparse
+import gzip
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request, send_from_directory  # noqa: E402
+
+import static_assets  # noqa: E402
+
+ROOT = static_assets.STATIC_ROOT
+BROWSER_HEADERS = {'Accept-Encoding': 'gzip, deflate, br'}
+
+
+def legacy_app() -> Flask:
+    """Схема до static_assets.py"""
+    app = Flask(__name__, static_folder=ROOT, static_url_path='')
+
+    @app.route('/')
+    def index():
+        return send_from_directory(ROOT, 'index.html')
+
+    return app
+
+
+def current_app() -> Flask:
+    app = Flask(__name__, static_folder=None)
+    index_asset, assets = static_assets.build_assets(ROOT)
+
+    @app.route('/')
+    def index():
+        return index_asset.response(request)
+
+    @app.route('/<path:filename>')
+    def static_file(filename):
+        return assets[filename].response(request)
+
+    return app
+
+
+def page_paths(client) -> list[str]:
+    """Главная и файлы, на которые она ссылается"""
+    response = client.get('/')
+    html = response.get_data(as_text=False)
+    if response.headers.get('Content-Encoding') == 'gzip':
+        html = gzip.decompress(html)
+    return ['/'] + ['/' + path.lstrip('./') for path in
+                    re.findall(r'(?:href|src)="((?:\./|/)?(?:styles|script)[^"]*)"', html.decode())]
+
+
+def visit(client, paths: list[str], validators: dict, cached: set) -> int:
+    """Один визит браузера; возвращает (запросов, байт тела ответов)"""
+    requests_made = transferred = 0
+    for path in paths:
+        if path in cached:
+            continue
+        headers = dict(BROWSER_HEADERS)
+        if path in validators:
+            headers.update(validators[path])
+        response = client.get(path, headers=headers)
+        requests_made += 1
+        transferred += len(response.data)
+        if response.status_code == 200:
+            if 'immutable' in response.headers.get('Cache-Control', ''):
+                cached.add(path)
+            elif response.headers.get('ETag'):
+                validators[path] = {'If-None-Match': response.headers['ETag']}
+            elif response.headers.get('Last-Modified'):
+                validators[path] = {'If-Modified-Since': response.headers['Last-Modified']}
+    return requests_made, transferred
+
+
+def rps(client, path: str, count: int, headers: dict) -> float:
+    started = time.perf_counter()
+    for _ in range(count):
+        client.get(path, headers=headers).close()
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"brotli: {'да' if static_assets.brotli is not None else 'нет (только gzip)'}")
+    print(f"{'схема':<10} {'/ rps':>8} {'css rps':>8} {'js rps':>8} {'1-й визит':>16} {'повторный':>16}")
+    for name, app in (('прежняя', legacy_app()), ('память', current_app())):
+        client = app.test_client()
+        paths = page_paths(client)
+        validators, cached = {}, set()
+        first = visit(client, paths, validators, cached)
+        repeat = visit(client, paths, validators, cached)
+        results = [rps(client, path, args.requests, BROWSER_HEADERS) for path in paths]
+        print(f"{name:<10} {results[0]:8.0f} {results[1]:8.0f} {results[2]:8.0f} "
+              f"{first[0]} зап. {first[1]:7,} Б {repeat[0]} зап. {repeat[1]:7,} Б")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Бенчмарк: прием анкеты с большим видео
+Сравнивает старый путь (временный файл werkzeug + photo.save() в uploads/)
+с потоковой записью upload_storage.UploadRequest.
+Каждый вариант запускается в отдельном процессе: пиковый RSS (ru_maxrss)
+и дисковый ввод-вывод (/proc/self/io) не смешиваются
+
+Запуск: python benchmarks/bench_upload.py --video-mb 100 --photos 5 --photo-mb 4
+"""
+
+import argparse
+import http.client
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BOUNDARY = 'benchboundary7MA4YWxkTrZu0gW'
+CHUNK = 1024 * 1024
+
+
+def multipart_body(photos: int, photo_size: int, video_size: int):
+    """Генерирует тело multipart блоками по 1 МБ (клиент тоже не держит файл в памяти)"""
+    def part_header(name, filename=None):
+        disposition = f'form-data; name="{name}"'
+        if filename:
+            disposition += f'; filename="{filename}"'
+        return f'--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n'.encode()
+
+    def file_chunks(size):
+        block = b'\0' * CHUNK
+        while size > 0:
+            yield block[:min(size, CHUNK)]
+            size -= CHUNK
+
+    yield part_header('name') + 'Бенчмарк'.encode() + b'\r\n'
+    for i in range(photos):
+        yield part_header('photos', f'photo_{i}.jpg')
+        yield from file_chunks(photo_size)
+        yield b'\r\n'
+    yield part_header('video', 'video.mp4')
+    yield from file_chunks(video_size)
+    yield f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def body_length(photos: int, photo_size: int, video_size: int) -> int:
+    header_only = sum(len(chunk) for chunk in multipart_body(photos, 0, 0))
+    return header_only + photos * photo_size + video_size
+
+
+def proc_io() -> dict:
+    with open('/proc/self/io') as f:
+        return {key: int(value) for key, value in (line.split(': ') for line in f)}
+
+
+def legacy_app(upload_dir: str):
+    """Старый обработчик: werkzeug пишет во временный файл, затем save() копирует в uploads/"""
+    from flask import Flask, request, jsonify
+    from werkzeug.utils import secure_filename
+
+    app = Flask('legacy')
+    app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
+
+    @app.route('/api/submit', methods=['POST'])
+    def submit():
+        for storage in request.files.getlist('photos') + request.files.getlist('video'):
+            filepath = os.path.join(upload_dir, f"{int(time.time())}_{secure_filename(storage.filename)}")
+            storage.save(filepath)
+        return jsonify({'success': True}), 200
+
+    return app
+
+
+def run_variant(variant: str, args) -> None:
+    tmp = tempfile.mkdtemp()
+    os.environ['UPLOAD_FOLDER'] = tmp
+    os.environ['QUEUE_DB_PATH'] = os.path.join(tmp, 'jobs.sqlite3')
+    os.environ['TMPDIR'] = tmp
+    tempfile.tempdir = tmp
+
+    if variant == 'legacy':
+        app = legacy_app(tmp)
+    else:
+        os.chdir(ROOT)
+        import server
+        server.app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
+        app = server.app
+
+    from werkzeug.serving import make_server
+    httpd = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    photo_size = int(args.photo_mb * 1024 * 1024)
+    video_size = int(args.video_mb * 1024 * 1024)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    io_before = proc_io()
+    started = time.perf_counter()
+
+    conn = http.client.HTTPConnection('127.0.0.1', httpd.server_port, timeout=300)
+    conn.putrequest('POST', '/api/submit')
+    conn.putheader('Content-Type', f'multipart/form-data; boundary={BOUNDARY}')
+    conn.putheader('Content-Length', str(body_length(args.photos, photo_size, video_size)))
+    conn.endheaders()
+    for chunk in multipart_body(args.photos, photo_size, video_size):
+        conn.send(chunk)
+    response = conn.getresponse()
+    response.read()
+
+    elapsed = time.perf_counter() - started
+    io_after = proc_io()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    httpd.shutdown()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    print(json.dumps({
+        'variant': variant,
+        'status': response.status,
+        'seconds': elapsed,
+        'rss_peak_mb': rss_peak / 1024,
+        'rss_growth_mb': (rss_peak - rss_before) / 1024,
+        'disk_write_mb': (io_after['wchar'] - io_before['wchar']) / 1024 / 1024,
+        'disk_read_mb': (io_after['rchar'] - io_before['rchar']) / 1024 / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--photos', type=int, default=5)
+    parser.add_argument('--photo-mb', type=float, default=4)
+    parser.add_argument('--video-mb', type=float, default=100)
+    parser.add_argument('--variant', choices=['legacy', 'streaming'])
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args)
+        return
+
+    payload_mb = args.photos * args.photo_mb + args.video_mb
+    print(f"Тело запроса: {args.photos} фото по {args.photo_mb} МБ + видео {args.video_mb} МБ = {payload_mb:.0f} МБ")
+    for variant in ('legacy', 'streaming'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--variant', variant, '--photos', str(args.photos),
+             '--photo-mb', str(args.photo_mb), '--video-mb', str(args.video_mb)],
+            capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        print(f"{variant:<10} HTTP {result['status']}  {result['seconds']:6.2f} с  "
+              f"RSS пик {result['rss_peak_mb']:6.1f} МБ (+{result['rss_growth_mb']:.1f})  "
+              f"запись {result['disk_write_mb']:7.1f} МБ  чтение {result['disk_read_mb']:7.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
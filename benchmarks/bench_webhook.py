@@ -0,0 +1,140 @@
+"""
+Бенчмарк: задержка ответа balance_bot в режимах polling и webhook
+Апдейт "+100" доставляется боту через имитацию Bot API (getUpdates)
+или POST-запросом на webhook; замеряется время до получения sendMessage.
+Сетевой путь Telegram <-> бот эмулируется задержкой --network-latency
+в обе стороны. Supabase заменен клиентом в памяти
+
+Запуск: python benchmarks/bench_webhook.py --messages 30 --network-latency 0.03
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import start_server  # noqa: E402
+from load_balance_bot import FakeSupabase, load_seed_groups  # noqa: E402
+
+WEBHOOK_SECRET = 'bench-secret'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_update(chat_id: int, message_id: int) -> dict:
+    return {
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'bench'},
+            'from': {'id': 1, 'is_bot': False, 'first_name': 'Bench', 'username': 'bench'},
+            'text': '+100',
+        }
+    }
+
+
+def post_webhook(port: int, update: dict, secret: str) -> int:
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{port}/telegram/balance",
+        data=json.dumps(dict(update, update_id=update['message']['message_id'])).encode(),
+        headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+async def measure(server, mode: str, messages: int, network_latency: float) -> list[float]:
+    import balance_bot
+
+    application = balance_bot.build_application()
+    await application.initialize()
+    await application.start()
+
+    port = free_port()
+    if mode == 'webhook':
+        await application.updater.start_webhook(
+            listen='127.0.0.1', port=port, url_path='telegram/balance',
+            webhook_url=f"http://127.0.0.1:{port}/telegram/balance",
+            secret_token=WEBHOOK_SECRET, allowed_updates=balance_bot.ALLOWED_UPDATES,
+        )
+        rejected = await asyncio.to_thread(post_webhook, port, make_update(balance_bot.GROUP_RU, 10 ** 6), 'wrong')
+        print(f"webhook с неверным секретом: HTTP {rejected}")
+    else:
+        await application.updater.start_polling(
+            poll_interval=0, timeout=10, allowed_updates=balance_bot.ALLOWED_UPDATES
+        )
+
+    latencies = []
+    for i in range(messages):
+        update = make_update(balance_bot.GROUP_RU, i + 1)
+        sent_before = len(server.sent)
+        started = time.perf_counter()
+        if mode == 'webhook':
+            # Путь Telegram -> бот
+            await asyncio.sleep(network_latency)
+            await asyncio.to_thread(post_webhook, port, update, WEBHOOK_SECRET)
+        else:
+            server.push_update(update)
+
+        def wait_reply():
+            with server.message_sent:
+                server.message_sent.wait_for(lambda: len(server.sent) > sent_before, timeout=10)
+                return server.sent[sent_before][0]
+
+        latencies.append(await asyncio.to_thread(wait_reply) - started)
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=30)
+    parser.add_argument('--network-latency', type=float, default=0.03, help="задержка Telegram <-> бот, сек")
+    parser.add_argument('--db-latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = start_server(latency=args.network_latency)
+
+    import balance_bot
+    balance_bot.BOT_TOKEN = '123:fake'
+    balance_bot.TELEGRAM_API_BASE_URL = f"http://127.0.0.1:{server.server_port}/bot"
+    balance_bot.BALANCE_RECONCILE_INTERVAL = 0
+    balance_bot.group_registry.BALANCE_REGISTRY_TTL = 0
+    balance_bot.logger.disabled = True
+
+    for mode in ('polling', 'webhook'):
+        balance_bot.supabase = FakeSupabase(args.db_latency)
+        balance_bot.balance_cache = balance_bot.BalanceCache()
+        # post_init (и warm_up_cache) вызывается только из run_polling/run_webhook,
+        # а очередь отправки привязана к циклу событий - у каждого режима свой
+        load_seed_groups()
+        balance_bot.send_scheduler = None
+        server.reset_stats()
+        latencies = sorted(asyncio.run(measure(server, mode, args.messages, args.network_latency)))
+        print(f"{mode:<8} p50={statistics.median(latencies) * 1000:7.1f} ms  "
+              f"p99={latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:7.1f} ms  "
+              f"вызовов API: {sum(server.calls.values())} ({', '.join(f'{k}={v}' for k, v in sorted(server.calls.items()))})")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
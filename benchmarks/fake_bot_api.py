@@ -0,0 +1,335 @@
+"""
+Локальная имитация Telegram Bot API для бенчмарков
+Отвечает на методы, которые используют bot.py и balance_bot.py,
+и умеет добавлять задержку ответа и задержку установки соединения
+(эмуляция TLS-рукопожатия с api.telegram.org). С --chat-limit/--global-limit
+соблюдает лимиты Telegram и отвечает 429 с retry_after, как настоящий API.
+Сбои методов send*: --error-rate - доля ответов 502 Bad Gateway,
+--flood-rate - доля ответов 429 с retry_after=--flood-retry-after
+независимо от лимитов
+
+Запуск: python benchmarks/fake_bot_api.py --port 8081 --latency 0.05 --connect-latency 0.15
+"""
+
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class FakeBotAPIServer(ThreadingHTTPServer):
+    """HTTP сервер с настройками имитации и счетчиками вызовов"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, connect_latency=0.0,
+                 chat_limit=0, chat_window=60.0, global_limit=0, global_window=1.0,
+                 error_rate=0.0, flood_rate=0.0, flood_retry_after=1, seed=None):
+        super().__init__(address, FakeBotAPIHandler)
+        self.latency = latency
+        self.connect_latency = connect_latency
+        # Случайные сбои отправки: доля ответов 502 и 429
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.flood_retry_after = flood_retry_after
+        self._random = random.Random(seed)
+        self.injected_errors = 0
+        # Лимиты отправки (0 - без лимита): сообщений за окно в секундах
+        self.chat_limit = chat_limit
+        self.chat_window = chat_window
+        self.global_limit = global_limit
+        self.global_window = global_window
+        self._chat_sends = {}
+        self._global_sends = deque()
+        self.rate_limited = 0
+        self.calls = {}
+        self.connections = 0
+        self.bytes_received = 0
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Очередь апдейтов для getUpdates и журнал отправленных сообщений
+        self.updates = []
+        self._update_ids = itertools.count(1)
+        self.updates_ready = threading.Condition()
+        self.sent = []
+        self.message_sent = threading.Condition()
+
+    def push_update(self, update: dict) -> int:
+        """Добавляет апдейт для getUpdates, возвращает его update_id"""
+        with self.updates_ready:
+            update = dict(update, update_id=next(self._update_ids))
+            self.updates.append(update)
+            self.updates_ready.notify_all()
+        return update['update_id']
+
+    def take_updates(self, offset: int, timeout: float) -> list:
+        """Long polling: ждет апдейты с update_id >= offset не дольше timeout"""
+        deadline = time.monotonic() + timeout
+        with self.updates_ready:
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            while not self.updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.updates_ready.wait(remaining)
+            return list(self.updates)
+
+    def record_sent(self, method: str, params: dict) -> None:
+        with self.message_sent:
+            self.sent.append((time.perf_counter(), method, params))
+            self.message_sent.notify_all()
+
+    def check_rate(self, chat_id, cost: int) -> int:
+        """
+        Скользящее окно лимитов: 0 - отправка разрешена (и учтена),
+        иначе retry_after в секундах (округление вверх, как у Telegram)
+        """
+        now = time.monotonic()
+        with self._lock:
+            windows = []
+            if self.chat_limit:
+                windows.append((self._chat_sends.setdefault(chat_id, deque()), self.chat_limit, self.chat_window))
+            if self.global_limit:
+                windows.append((self._global_sends, self.global_limit, self.global_window))
+
+            retry_after = 0.0
+            for sends, limit, window in windows:
+                while sends and sends[0] <= now - window:
+                    sends.popleft()
+                needed = min(cost, limit)
+                if len(sends) + needed > limit:
+                    # Ждем, пока из окна уйдет столько отправок, чтобы поместилась эта
+                    retry_after = max(retry_after, sends[len(sends) + needed - limit - 1] + window - now)
+            if retry_after > 0:
+                self.rate_limited += 1
+                return max(1, math.ceil(retry_after))
+
+            for sends, _limit, _window in windows:
+                sends.extend([now] * cost)
+            return 0
+
+    def inject_fault(self) -> str | None:
+        """Случайный сбой отправки: 'error' (502), 'flood' (429) или None"""
+        if not self.error_rate and not self.flood_rate:
+            return None
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.error_rate:
+                self.injected_errors += 1
+                return 'error'
+            if roll < self.error_rate + self.flood_rate:
+                self.rate_limited += 1
+                return 'flood'
+        return None
+
+    def next_message_id(self) -> int:
+        with self._lock:
+            return next(self._message_ids)
+
+    def record_call(self, method: str, size: int) -> None:
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.bytes_received += size
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.calls = {}
+            self.connections = 0
+            self.bytes_received = 0
+            self.rate_limited = 0
+            self.injected_errors = 0
+
+
+def _parse_params(content_type: str, body: bytes) -> dict:
+    """Разбирает параметры запроса (JSON, urlencoded или multipart)"""
+    if not body:
+        return {}
+
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        # python-telegram-bot шлет обычные параметры формой
+        return dict(parse_qsl(body.decode()))
+
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename():
+                params[name] = {'filename': part.get_filename(), 'size': len(part.get_payload(decode=True) or b'')}
+            else:
+                params[name] = (part.get_payload(decode=True) or b'').decode()
+        return params
+
+    return {}
+
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов вида /bot<token>/<method>"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # Новое соединение: имитируем стоимость TCP+TLS рукопожатия
+        with self.server._lock:
+            self.server.connections += 1
+        if self.server.connect_latency:
+            time.sleep(self.server.connect_latency)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        method = self.path.rstrip('/').rsplit('/', 1)[-1]
+        params = _parse_params(self.headers.get('Content-Type', ''), body)
+
+        self.server.record_call(method, len(body))
+        if method.startswith('send'):
+            fault = self.server.inject_fault()
+            if fault == 'error':
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                self._send(502, {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'})
+                return
+            media = params.get('media') or '[]'
+            cost = len(json.loads(media) if isinstance(media, str) else media) if method == 'sendMediaGroup' else 1
+            retry_after = self.server.flood_retry_after if fault == 'flood' else \
+                self.server.check_rate(params.get('chat_id'), cost)
+            if retry_after:
+                self._send(429, {'ok': False, 'error_code': 429,
+                                 'description': f'Too Many Requests: retry after {retry_after}',
+                                 'parameters': {'retry_after': retry_after}})
+                return
+        result = self._result_for(method, params)
+        # Задержка после формирования ответа: для getUpdates она добавляется
+        # к моменту появления апдейта, как сетевой путь от Telegram до бота
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if method.startswith('send'):
+            self.server.record_sent(method, params)
+        if result is None:
+            self._send(404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'})
+        else:
+            self._send(200, {'ok': True, 'result': result})
+
+    def _message(self, params: dict, **extra) -> dict:
+        chat_id = params.get('chat_id', 0)
+        message = {
+            'message_id': self.server.next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'supergroup', 'title': 'Fake group'},
+        }
+        message.update(extra)
+        return message
+
+    def _result_for(self, method: str, params: dict):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot',
+                    'can_join_groups': True, 'can_read_all_group_messages': True,
+                    'supports_inline_queries': False}
+        if method == 'sendMessage':
+            return self._message(params, text=params.get('text', ''))
+        if method == 'sendPhoto':
+            message_id = self.server.next_message_id()
+            return self._message(params, photo=[{
+                'file_id': f'photo-{message_id}', 'file_unique_id': f'uphoto-{message_id}',
+                'width': 1280, 'height': 960,
+            }])
+        if method == 'sendVideo':
+            message_id = self.server.next_message_id()
+            return self._message(params, video={
+                'file_id': f'video-{message_id}', 'file_unique_id': f'uvideo-{message_id}',
+                'width': 1280, 'height': 720, 'duration': 10,
+            })
+        if method == 'sendMediaGroup':
+            media = params.get('media') or '[]'
+            if isinstance(media, str):
+                media = json.loads(media)
+            messages = []
+            for item in media:
+                message_id = self.server.next_message_id()
+                kind = item.get('type', 'photo')
+                if kind == 'video':
+                    extra = {'video': {'file_id': f'video-{message_id}', 'file_unique_id': f'uvideo-{message_id}',
+                                       'width': 1280, 'height': 720, 'duration': 10}}
+                else:
+                    extra = {'photo': [{'file_id': f'photo-{message_id}', 'file_unique_id': f'uphoto-{message_id}',
+                                        'width': 1280, 'height': 960}]}
+                messages.append(self._message(params, **extra))
+            return messages
+        if method == 'getUpdates':
+            return self.server.take_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0))
+        if method in ('setWebhook', 'deleteWebhook', 'close', 'logOut'):
+            return True
+        return None
+
+    def _send(self, status: int, payload: dict) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server(host='127.0.0.1', port=0, latency=0.0, connect_latency=0.0, **limits) -> FakeBotAPIServer:
+    """
+    Запускает сервер в фоновом потоке и возвращает его (порт в server.server_port)
+    limits: chat_limit, chat_window, global_limit, global_window,
+    сбои: error_rate, flood_rate, flood_retry_after, seed
+    """
+    server = FakeBotAPIServer((host, port), latency=latency, connect_latency=connect_latency, **limits)
+    thread = threading.Thread(target=server.serve_forever, name="fake-bot-api", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Имитация Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, сек")
+    parser.add_argument('--connect-latency', type=float, default=0.0, help="задержка нового соединения, сек")
+    parser.add_argument('--chat-limit', type=int, default=0, help="сообщений в чат за --chat-window (20 у Telegram)")
+    parser.add_argument('--chat-window', type=float, default=60.0)
+    parser.add_argument('--global-limit', type=int, default=0, help="сообщений в секунду на бота (30 у Telegram)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля отправок с ответом 502")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="доля отправок с ответом 429")
+    parser.add_argument('--flood-retry-after', type=int, default=1, help="retry_after в ответах 429, сек")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    server = FakeBotAPIServer((args.host, args.port), latency=args.latency, connect_latency=args.connect_latency,
+                              chat_limit=args.chat_limit, chat_window=args.chat_window,
+                              global_limit=args.global_limit, error_rate=args.error_rate,
+                              flood_rate=args.flood_rate, flood_retry_after=args.flood_retry_after,
+                              seed=args.seed)
+    print(f"Fake Bot API: http://{args.host}:{server.server_port}/bot<token>/<method>")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
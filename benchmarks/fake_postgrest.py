@@ -0,0 +1,432 @@
+"""
+Локальная имитация Supabase REST API (PostgREST) для бенчмарков
+Таблицы хранятся в памяти. Поддерживаются запросы, которые клиент supabase-py
+делает из balance_bot.py, group_registry.py и balance_reports.py: select с
+фильтрами (eq, neq, gt, gte, lt, lte, in, is), order, limit, insert, upsert
+(on_conflict), update, delete и функции apply_balance_transaction и
+apply_balance_journal с той же логикой, что в supabase_schema.sql.
+Триггеры агрегатов (balance_rollups) не эмулируются: отчеты получают пустые таблицы
+
+Задержка ответа, доля ответов 503 (--error-rate), лимит запросов в секунду
+с ответом 429 (--rate-limit) и полная недоступность (server.unavailable)
+настраиваются. Клиенту достаточно SUPABASE_URL=http://127.0.0.1:<port>
+и любого ключа вида JWT
+
+Запуск: python benchmarks/fake_postgrest.py --port 54321 --latency 0.02 --error-rate 0.01
+"""
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+FAKE_KEY = 'eyJhbGciOiJIUzI1NiJ9.e30.fake'
+
+# Уникальные ключи таблиц (как UNIQUE в supabase_schema.sql)
+UNIQUE_KEYS = {
+    'group_balances': ('group_id',),
+    'balance_transactions': ('group_id', 'message_id'),
+    'balance_rollups': ('group_id', 'period', 'period_start'),
+    'balance_user_rollups': ('group_id', 'period', 'period_start', 'user_id'),
+}
+# Значения по умолчанию при вставке
+DEFAULTS = {
+    'group_balances': {'current_balance': '0.00', 'language': 'ru', 'active': True},
+}
+# Изменение этих полей двигает settings_updated_at (триггер touch_group_settings)
+SETTINGS_FIELDS = ('group_name', 'language', 'currency', 'min_amount', 'max_amount', 'active')
+
+
+class PostgRESTError(Exception):
+    """Ошибка запроса в формате PostgREST"""
+
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.payload = {'code': code, 'message': message, 'details': None, 'hint': None}
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _sort_key(value):
+    """Значение для сравнения: числа - Decimal, даты - datetime, остальное - как есть"""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float, Decimal)):
+        return Decimal(str(value))
+    text = str(value)
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        pass
+    try:
+        moment = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        return text
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def _matches(row: dict, column: str, condition: str) -> bool:
+    """Фильтр PostgREST вида column=op.value"""
+    negate = condition.startswith('not.')
+    if negate:
+        condition = condition[4:]
+    op, _, operand = condition.partition('.')
+    value = row.get(column)
+
+    if op == 'is':
+        result = value is None if operand == 'null' else value is (operand == 'true')
+    elif op == 'in':
+        options = {_sort_key(item.strip('"')) for item in operand.strip('()').split(',') if item}
+        result = _sort_key(value) in options
+    elif value is None:
+        result = False
+    else:
+        left, right = _sort_key(value), _sort_key(operand)
+        if isinstance(left, bool):
+            right = operand == 'true'
+        try:
+            result = {
+                'eq': lambda: left == right,
+                'neq': lambda: left != right,
+                'gt': lambda: left > right,
+                'gte': lambda: left >= right,
+                'lt': lambda: left < right,
+                'lte': lambda: left <= right,
+            }[op]()
+        except KeyError:
+            raise PostgRESTError(400, 'PGRST100', f'unknown operator "{op}"')
+        except TypeError:
+            result = False
+    return not result if negate else result
+
+
+class FakePostgRESTServer(ThreadingHTTPServer):
+    """HTTP сервер с таблицами в памяти, настройками сбоев и счетчиками вызовов"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, error_rate=0.0, rate_limit=0, seed=None):
+        super().__init__(address, FakePostgRESTHandler)
+        self.latency = latency
+        self.error_rate = error_rate  # доля запросов с ответом 503
+        self.rate_limit = rate_limit  # запросов в секунду (0 - без лимита), сверх - 429
+        self.unavailable = False  # все запросы получают 503
+        self._random = random.Random(seed)
+        self._requests = deque()
+        self.tables: dict[str, list[dict]] = {}
+        self._ids = itertools.count(1)
+        self.calls = {}
+        self.errors = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self.functions = {
+            'apply_balance_transaction': self._apply_balance_transaction,
+            'apply_balance_journal': self._apply_balance_journal,
+        }
+
+    # Учет и сбои
+
+    def record_call(self, key: str) -> None:
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.calls = {}
+            self.errors = 0
+            self.rate_limited = 0
+
+    def inject_fault(self) -> PostgRESTError | None:
+        """Ошибка, которую нужно вернуть вместо ответа (недоступность, лимит, случайный сбой)"""
+        with self._lock:
+            if self.unavailable or (self.error_rate and self._random.random() < self.error_rate):
+                self.errors += 1
+                return PostgRESTError(503, 'PGRST000', 'Could not connect with the database')
+            if self.rate_limit:
+                now = time.monotonic()
+                while self._requests and self._requests[0] <= now - 1.0:
+                    self._requests.popleft()
+                if len(self._requests) >= self.rate_limit:
+                    self.rate_limited += 1
+                    return PostgRESTError(429, 'PGRST429', 'Too Many Requests')
+                self._requests.append(now)
+        return None
+
+    # Таблицы (вызывать под self._lock)
+
+    def rows(self, table: str) -> list[dict]:
+        return self.tables.setdefault(table, [])
+
+    def _find(self, table: str, row: dict, columns: tuple) -> dict | None:
+        key = tuple(_sort_key(row.get(column)) for column in columns)
+        for existing in self.rows(table):
+            if tuple(_sort_key(existing.get(column)) for column in columns) == key:
+                return existing
+        return None
+
+    def _insert_row(self, table: str, values: dict, on_conflict: tuple | None = None,
+                    resolution: str | None = None) -> dict | None:
+        """Вставка с проверкой уникальности; None - строка пропущена (ignore-duplicates)"""
+        columns = on_conflict or UNIQUE_KEYS.get(table)
+        existing = self._find(table, values, columns) if columns else None
+        if existing is not None:
+            if resolution == 'merge':
+                self._update_row(table, existing, values)
+                return existing
+            if resolution == 'ignore':
+                return None
+            raise PostgRESTError(409, '23505', f'duplicate key value violates unique constraint on {table}')
+
+        now = _now()
+        row = dict(DEFAULTS.get(table, {}))
+        row.update({'id': next(self._ids), 'created_at': now})
+        if table == 'group_balances':
+            row.update({'updated_at': now, 'settings_updated_at': now})
+        row.update(values)
+        self.rows(table).append(row)
+        return row
+
+    def _update_row(self, table: str, row: dict, values: dict) -> None:
+        if table == 'group_balances':
+            now = _now()
+            if any(field in values and values[field] != row.get(field) for field in SETTINGS_FIELDS):
+                row['settings_updated_at'] = now
+            row['updated_at'] = now
+        row.update(values)
+
+    # REST
+
+    def select(self, table: str, filters: list, order: str | None, limit: int | None, offset: int) -> list[dict]:
+        with self._lock:
+            rows = [dict(row) for row in self.rows(table)
+                    if all(_matches(row, column, condition) for column, condition in filters)]
+        for part in reversed((order or '').split(',')):
+            if not part:
+                continue
+            column, _, direction = part.partition('.')
+            present = [row for row in rows if row.get(column) is not None]
+            missing = [row for row in rows if row.get(column) is None]
+            present.sort(key=lambda row: _sort_key(row[column]), reverse=direction.startswith('desc'))
+            rows = present + missing
+        rows = rows[offset:]
+        return rows if limit is None else rows[:limit]
+
+    def insert(self, table: str, values: list[dict], on_conflict: tuple | None, resolution: str | None) -> list[dict]:
+        with self._lock:
+            inserted = [self._insert_row(table, row, on_conflict, resolution) for row in values]
+            return [dict(row) for row in inserted if row is not None]
+
+    def update(self, table: str, filters: list, values: dict) -> list[dict]:
+        with self._lock:
+            updated = []
+            for row in self.rows(table):
+                if all(_matches(row, column, condition) for column, condition in filters):
+                    self._update_row(table, row, values)
+                    updated.append(dict(row))
+            return updated
+
+    def delete(self, table: str, filters: list) -> list[dict]:
+        with self._lock:
+            rows = self.rows(table)
+            deleted = [row for row in rows if all(_matches(row, column, condition) for column, condition in filters)]
+            self.tables[table] = [row for row in rows if row not in deleted]
+            return deleted
+
+    # Функции (supabase_schema.sql)
+
+    def _ensure_group(self, group_id: int, name: str | None, language: str | None) -> dict:
+        row = self._find('group_balances', {'group_id': group_id}, ('group_id',))
+        if row is None:
+            row = self._insert_row('group_balances', {
+                'group_id': group_id, 'group_name': name or f'Group {group_id}',
+                'current_balance': '0.00', 'language': language or 'zh',
+            })
+        return row
+
+    def _apply_balance_transaction(self, params: dict):
+        group_id = int(params['p_group_id'])
+        amount = Decimal(str(params['p_amount']))
+        with self._lock:
+            group = self._ensure_group(group_id, params.get('p_group_name'), params.get('p_language'))
+            previous = Decimal(str(group['current_balance']))
+            new = previous + amount
+            self._insert_row('balance_transactions', {
+                'group_id': group_id, 'user_id': params.get('p_user_id'),
+                'username': params.get('p_username') or 'Unknown', 'amount': str(amount),
+                'previous_balance': str(previous), 'new_balance': str(new),
+                'transaction_type': 'add' if amount > 0 else 'subtract', 'message_id': params.get('p_message_id'),
+            })
+            self._update_row('group_balances', group, {'current_balance': str(new)})
+        return [{'previous_balance': str(previous), 'new_balance': str(new)}]
+
+    def _apply_balance_journal(self, params: dict):
+        items = sorted(params['p_items'], key=lambda item: item['seq'])
+        inserted = 0
+        with self._lock:
+            latest = {}
+            for item in items:
+                self._ensure_group(int(item['group_id']), item.get('group_name'), item.get('language'))
+            for item in items:
+                row = self._insert_row('balance_transactions', {
+                    field: item.get(field) for field in (
+                        'group_id', 'user_id', 'username', 'amount', 'previous_balance', 'new_balance',
+                        'transaction_type', 'message_id', 'created_at',
+                    )
+                }, resolution='ignore')
+                if row is not None:
+                    latest[int(item['group_id'])] = row['new_balance']
+                    inserted += 1
+            for group_id, balance in latest.items():
+                group = self._find('group_balances', {'group_id': group_id}, ('group_id',))
+                self._update_row('group_balances', group, {'current_balance': str(balance)})
+        return inserted
+
+    def call(self, name: str, params: dict):
+        function = self.functions.get(name)
+        if function is None:
+            raise PostgRESTError(404, 'PGRST202', f'Could not find the function public.{name}')
+        return function(params)
+
+
+def _columns(row: dict, select: str | None) -> dict:
+    if not select or select == '*':
+        return row
+    return {column: row.get(column) for column in select.split(',') if column}
+
+
+class FakePostgRESTHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов вида /rest/v1/<таблица> и /rest/v1/rpc/<функция>"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle()
+
+    def do_HEAD(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_PATCH(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/')
+        params = parse_qsl(url.query, keep_blank_values=True)
+        prefer = self.headers.get('Prefer', '')
+
+        if not path.startswith('/rest/v1/'):
+            self._send(404, {'message': 'Not Found'})
+            return
+        resource = path[len('/rest/v1/'):]
+        self.server.record_call(f'{self.command} {resource}')
+
+        fault = self.server.inject_fault()
+        try:
+            if fault is not None:
+                raise fault
+            status, result = self._dispatch(resource, params, body, prefer)
+        except PostgRESTError as e:
+            status, result = e.status, e.payload
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        headers = {}
+        if status == 429:
+            headers['Retry-After'] = '1'
+        if isinstance(result, list):
+            headers['Content-Range'] = f'0-{max(len(result) - 1, 0)}/*'
+        if status < 300 and self.command != 'GET' and not resource.startswith('rpc/') \
+                and 'return=representation' not in prefer:
+            result = None
+        self._send(status, result, headers)
+
+    def _dispatch(self, resource: str, params: list, body, prefer: str):
+        options = {}
+        filters = []
+        for key, value in params:
+            if key in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns'):
+                options[key] = value
+            else:
+                filters.append((key, value))
+        select = options.get('select', '').replace(' ', '')
+        limit = int(options['limit']) if 'limit' in options else None
+
+        if resource.startswith('rpc/'):
+            return 200, self.server.call(resource[len('rpc/'):], body or {})
+
+        if self.command in ('GET', 'HEAD'):
+            rows = self.server.select(resource, filters, options.get('order'), limit, int(options.get('offset', 0)))
+            return 200, [_columns(row, select) for row in rows]
+        if self.command == 'POST':
+            resolution = 'merge' if 'resolution=merge-duplicates' in prefer else \
+                'ignore' if 'resolution=ignore-duplicates' in prefer else None
+            on_conflict = tuple(options['on_conflict'].split(',')) if options.get('on_conflict') else None
+            values = body if isinstance(body, list) else [body]
+            return 201, [_columns(row, select) for row in self.server.insert(resource, values, on_conflict, resolution)]
+        if self.command == 'PATCH':
+            return 200, [_columns(row, select) for row in self.server.update(resource, filters, body or {})]
+        if self.command == 'DELETE':
+            return 200, [_columns(row, select) for row in self.server.delete(resource, filters)]
+        raise PostgRESTError(405, 'PGRST117', f'Unsupported HTTP method: {self.command}')
+
+    def _send(self, status: int, payload, headers: dict | None = None) -> None:
+        data = b'' if payload is None or self.command == 'HEAD' else json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server(host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, rate_limit=0,
+                 seed=None) -> FakePostgRESTServer:
+    """Запускает сервер в фоновом потоке и возвращает его (порт в server.server_port)"""
+    server = FakePostgRESTServer((host, port), latency=latency, error_rate=error_rate,
+                                 rate_limit=rate_limit, seed=seed)
+    thread = threading.Thread(target=server.serve_forever, name="fake-postgrest", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Имитация Supabase REST (PostgREST)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, сек")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля запросов с ответом 503")
+    parser.add_argument('--rate-limit', type=int, default=0, help="запросов в секунду, сверх - 429")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    server = FakePostgRESTServer((args.host, args.port), latency=args.latency, error_rate=args.error_rate,
+                                 rate_limit=args.rate_limit, seed=args.seed)
+    print(f"Fake PostgREST: SUPABASE_URL=http://{args.host}:{server.server_port} SUPABASE_KEY={FAKE_KEY}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
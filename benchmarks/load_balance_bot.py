@@ -0,0 +1,176 @@
+"""
+Нагрузочный тест balance_bot.handle_message на потоке синтетических апдейтов
+Supabase заменен клиентом в памяти с задержкой --db-latency на запрос,
+ответы в Telegram - задержкой --reply-latency.
+
+Сравнивает блокирующий вызов БД прямо в event loop (прежнее поведение)
+с пулом потоков run_db при разной конкурентности, и проверяет,
+что история каждой группы осталась непрерывной и упорядоченной
+
+Запуск: python benchmarks/load_balance_bot.py --updates 300 --db-latency 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:9')
+os.environ.setdefault('SUPABASE_KEY', 'eyJhbGciOiJIUzI1NiJ9.e30.fake')
+
+import balance_bot  # noqa: E402
+from send_scheduler import SendScheduler  # noqa: E402
+
+
+class FakeSupabase:
+    """Минимальная замена клиента: rpc('apply_balance_transaction') и rpc('apply_balance_journal')"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.balances = {}
+        self.ledger = {}
+        self.calls = 0
+        self.fail = False  # имитация недоступности Supabase
+        self._lock = threading.Lock()
+
+    def rpc(self, name, params):
+        if name == 'apply_balance_journal':
+            return SimpleNamespace(execute=lambda: self._apply_journal(params['p_items']))
+        return SimpleNamespace(execute=lambda: self._apply(params))
+
+    def _apply_journal(self, items):
+        """Как SQL-функция: пропускает уже записанные (group_id, message_id)"""
+        time.sleep(self.latency)
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("Supabase недоступен")
+        inserted = 0
+        with self._lock:
+            for item in sorted(items, key=lambda item: item['seq']):
+                rows = self.ledger.setdefault(item['group_id'], [])
+                if any(row[0] == item['message_id'] for row in rows):
+                    continue
+                rows.append((item['message_id'], Decimal(item['previous_balance']), Decimal(item['new_balance'])))
+                self.balances[item['group_id']] = Decimal(item['new_balance'])
+                inserted += 1
+        return SimpleNamespace(data=inserted)
+
+    def _apply(self, params):
+        time.sleep(self.latency)
+        self.calls += 1
+        group_id = params['p_group_id']
+        amount = Decimal(params['p_amount'])
+        with self._lock:
+            previous = self.balances.get(group_id, Decimal('0'))
+            new = previous + amount
+            self.balances[group_id] = new
+            self.ledger.setdefault(group_id, []).append((params['p_message_id'], previous, new))
+        return SimpleNamespace(data=[{'previous_balance': str(previous), 'new_balance': str(new)}])
+
+
+def load_seed_groups() -> list[int]:
+    """
+    Заполняет реестр групп бота исходными группами с нулевым балансом
+    (вместо warm_up_cache, без Supabase), возвращает их id
+    """
+    rows = [
+        {'group_id': group_id, 'group_name': config['name'], 'language': config['language'], 'current_balance': '0'}
+        for group_id, config in balance_bot.SEED_GROUPS.items()
+    ]
+    balance_bot.groups.load(rows)
+    balance_bot.balance_cache.load(rows)
+    return balance_bot.groups.group_ids()
+
+
+def unlimited_scheduler() -> SendScheduler:
+    """Планировщик без лимитов Telegram: бенчмарк меряет только обработку апдейтов"""
+    return SendScheduler(global_limit=10**9, chat_limit=10**9)
+
+
+def make_update(chat_id: int, message_id: int, text: str, reply_latency: float):
+    async def reply_text(text, parse_mode=None):
+        await asyncio.sleep(reply_latency)
+
+    message = SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id),
+        text=text,
+        from_user=SimpleNamespace(id=1, username='load'),
+        message_id=message_id,
+        reply_text=reply_text,
+    )
+    return SimpleNamespace(message=message)
+
+
+async def run(updates: list, concurrency: int) -> float:
+    """Обрабатывает апдейты как Application с concurrent_updates(concurrency)"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(update):
+        async with semaphore:
+            await balance_bot.handle_message(update, None)
+
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(process(update)) for update in updates]
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started
+
+
+def check_ledger(fake: FakeSupabase) -> bool:
+    """Номера сообщений в истории каждой группы идут по возрастанию, цепочка балансов непрерывна"""
+    for rows in fake.ledger.values():
+        message_ids = [row[0] for row in rows]
+        if message_ids != sorted(message_ids):
+            return False
+        if any(prev[2] != row[1] for prev, row in zip(rows, rows[1:])):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=300)
+    parser.add_argument('--db-latency', type=float, default=0.05)
+    parser.add_argument('--reply-latency', type=float, default=0.03)
+    args = parser.parse_args()
+
+    balance_bot.logger.disabled = True
+    # Сравниваются варианты синхронной записи в БД, журнал - в bench_journal.py
+    balance_bot.journal = None
+    groups = load_seed_groups()
+    updates = [
+        make_update(groups[i % len(groups)], i + 1, f"+{100 + i}", args.reply_latency)
+        for i in range(args.updates)
+    ]
+
+    async def blocking_run_db(func, *a, **kw):
+        return func(*a, **kw)
+
+    original_run_db = balance_bot.run_db
+    print(f"{args.updates} апдейтов в {len(groups)} группах, БД {args.db_latency * 1000:.0f} мс, "
+          f"ответ {args.reply_latency * 1000:.0f} мс")
+    for name, run_db, concurrency in (
+        ("блокирующий вызов", blocking_run_db, 1),
+        ("блокирующий вызов", blocking_run_db, 64),
+        ("пул потоков", original_run_db, 1),
+        ("пул потоков", original_run_db, 64),
+    ):
+        fake = FakeSupabase(args.db_latency)
+        balance_bot.supabase = fake
+        balance_bot.balance_cache = balance_bot.BalanceCache()
+        balance_bot._group_locks.clear()
+        balance_bot.send_scheduler = unlimited_scheduler()
+        balance_bot.run_db = run_db
+
+        elapsed = asyncio.run(run(updates, concurrency))
+        print(f"{name:<18} конкурентность {concurrency:>3}: {args.updates / elapsed:7.1f} сообщений/с  "
+              f"порядок {'OK' if check_ledger(fake) else 'НАРУШЕН'}")
+
+
+if __name__ == "__main__":
+    main()
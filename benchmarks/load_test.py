@@ -0,0 +1,367 @@
+"""
+Сквозной нагрузочный тест без настоящего Telegram и Supabase
+Поднимает fake_bot_api.py и fake_postgrest.py, направляет на них server.py,
+delivery_worker.py и balance_bot.py (TELEGRAM_API_BASE_URL, SUPABASE_URL)
+и прогоняет два сценария:
+  submit  - клиенты параллельно отправляют POST /api/submit с фото на HTTP сервер
+            Flask; время ответа и время до доставки анкеты в Telegram (статус done)
+  balance - апдейты "+N"/"-N" в нескольких группах идут через очередь Application
+            в balance_bot.handle_message (post_init, журнал, планировщик - как в
+            работе); время от апдейта до получения ответа имитацией Bot API
+Для каждого сценария - p50/p99 и пропускная способность, счетчики сбоев
+и проверка данных: все анкеты доставлены, балансы в БД равны сумме операций
+
+Задержки и сбои задаются отдельно для Bot API (--api-*) и Supabase (--db-*):
+доля ошибок 502/503, доля ответов 429 от Bot API, лимит запросов в секунду к Supabase
+
+Запуск: python benchmarks/load_test.py --submits 40 --updates 600 --api-latency 0.05 --db-latency 0.02
+        python benchmarks/load_test.py --scenario balance --api-error-rate 0.02 --db-error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import http.client
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_bot_api  # noqa: E402
+import fake_postgrest  # noqa: E402
+
+BOUNDARY = 'loadtestboundary3f9a1c'
+SUBMIT_GROUP_ID = -1001000000001
+UNLIMITED = str(10 ** 6)
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float('nan')
+
+
+def latency_summary(values: list[float], scale: float = 1000, unit: str = 'мс') -> str:
+    return f"p50 {percentile(values, 0.5) * scale:.1f} {unit}  p99 {percentile(values, 0.99) * scale:.1f} {unit}"
+
+
+def configure_environment(args, api, db, workdir: str) -> None:
+    """Переменные окружения читаются модулями при импорте - задаются до него"""
+    os.environ.update({
+        'BOT_TOKEN': '123:load-test',
+        'GROUP_ID': str(SUBMIT_GROUP_ID),
+        'TELEGRAM_API_BASE_URL': f"http://127.0.0.1:{api.server_port}/bot",
+        'SUPABASE_URL': f"http://127.0.0.1:{db.server_port}",
+        'SUPABASE_KEY': fake_postgrest.FAKE_KEY,
+        'DATA_DIR': workdir,
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'QUEUE_DB_PATH': os.path.join(workdir, 'jobs.sqlite3'),
+        'BALANCE_JOURNAL_PATH': os.path.join(workdir, 'balance_journal.sqlite3'),
+        'BALANCE_JOURNAL': '0' if args.sync_db else '1',
+        'BALANCE_RECONCILE_INTERVAL': '0',
+        'BALANCE_REGISTRY_TTL': '0',
+        'DELIVERY_WORKERS': str(args.workers),
+        'DELIVERY_POLL_INTERVAL': '0.05',
+        'DELIVERY_BACKOFF_BASE': '0.5',
+        'DELIVERY_BACKOFF_MAX': '5',
+        # Меряется путь обработки анкеты: отказы 429/503 допуска исказили бы замер
+        # (допуск под нагрузкой - bench_admission.py)
+        'ADMISSION': '0',
+    })
+    if not args.telegram_limits:
+        # Меряется сам путь обработки; лимиты Telegram - в bench_send_scheduler.py
+        os.environ.update({'TELEGRAM_GLOBAL_LIMIT': UNLIMITED, 'TELEGRAM_CHAT_LIMIT': UNLIMITED})
+
+
+def make_photo() -> bytes:
+    """Настоящий JPEG: воркер доставки прогоняет фото через media_processing"""
+    from PIL import Image
+
+    image = Image.effect_noise((1600, 1200), 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def multipart_body(index: int, photos: int, photo: bytes) -> bytes:
+    parts = []
+    fields = {'name': f'Нагрузка {index}', 'age': '25', 'height': '175', 'weight': '55',
+              'citizenship': 'RU', 'telegram': '@load', 'experience': 'нет', 'about': 'нагрузочный тест'}
+    for name, value in fields.items():
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for i in range(photos):
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="photos"; filename="photo_{i}.jpg"\r\n'
+                     f'Content-Type: image/jpeg\r\n\r\n'.encode() + photo + b'\r\n')
+    parts.append(f'--{BOUNDARY}--\r\n'.encode())
+    return b''.join(parts)
+
+
+def post_submit(port: int, body: bytes) -> tuple[float, int, str | None]:
+    """Один POST /api/submit: (время ответа, HTTP статус, job_id)"""
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('POST', '/api/submit', body=body,
+                     headers={'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'})
+        response = conn.getresponse()
+        payload = response.read()
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    job_id = json.loads(payload).get('job_id') if response.status == 202 else None
+    return elapsed, response.status, job_id
+
+
+def run_submit(args, api) -> bool:
+    """Сценарий submit; False - не все анкеты приняты (202) или доставлены"""
+    import bot
+    import delivery_worker
+    import job_queue
+    import media_processing
+    import server
+    from werkzeug.serving import make_server
+
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, name="load-http", daemon=True).start()
+    stop_workers = delivery_worker.start_workers(args.workers)
+    api.reset_stats()
+
+    photo = make_photo()
+    bodies = [multipart_body(i, args.photos, photo) for i in range(args.submits)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as clients:
+        results = list(clients.map(lambda body: post_submit(httpd.server_port, body), bodies))
+    accepted_in = time.perf_counter() - started
+
+    job_ids = [job_id for _, _, job_id in results if job_id]
+    deadline = time.monotonic() + args.timeout
+    jobs = {}
+    while time.monotonic() < deadline:
+        jobs = {job_id: job_queue.get_job(job_id) for job_id in job_ids}
+        if all(job['status'] in (job_queue.STATUS_DONE, job_queue.STATUS_FAILED) for job in jobs.values()):
+            break
+        time.sleep(0.05)
+    delivered_in = time.perf_counter() - started
+
+    stop_workers.set()
+    httpd.shutdown()
+    bot.shutdown()
+    media_processing.shutdown()
+
+    done = [job for job in jobs.values() if job['status'] == job_queue.STATUS_DONE]
+    delivery = [job['updated_at'] - job['created_at'] for job in done]
+    retries = sum(job['attempts'] - 1 for job in done)
+    statuses = {}
+    for _, status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+
+    print(f"submit   {args.submits} анкет по {args.photos} фото, {args.concurrency} клиентов, "
+          f"{args.workers} воркеров доставки")
+    print(f"  ответ /api/submit: {latency_summary([elapsed for elapsed, _, _ in results])}, "
+          f"{args.submits / accepted_in:.1f} анкет/с, статусы {statuses}")
+    print(f"  доставка: {latency_summary(delivery, 1, 'с')}, {len(done) / delivered_in:.1f} анкет/с, "
+          f"доставлено {len(done)}/{args.submits}, повторных попыток {retries}")
+    print(f"  Bot API: {sum(api.calls.values())} вызовов "
+          f"({', '.join(f'{k}={v}' for k, v in sorted(api.calls.items()))}), "
+          f"502: {api.injected_errors}, 429: {api.rate_limited}")
+
+    rejected = args.submits - statuses.get(202, 0)
+    if rejected:
+        print(f"  ОШИБКА: не приняты {rejected} из {args.submits} анкет, статусы {statuses}")
+    return not rejected and len(done) == args.submits
+
+
+def make_update(chat_id: int, message_id: int, text: str) -> dict:
+    return {
+        'update_id': message_id,
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'load'},
+            'from': {'id': 1000 + message_id % 7, 'is_bot': False, 'first_name': 'Load',
+                     'username': f'load{message_id % 7}'},
+            'text': text,
+        }
+    }
+
+
+def replied_to(params: dict) -> int | None:
+    """message_id, на которое отвечает sendMessage"""
+    reply = params.get('reply_parameters')
+    if reply:
+        return json.loads(reply)['message_id'] if isinstance(reply, str) else reply['message_id']
+    reply_to = params.get('reply_to_message_id')
+    return int(reply_to) if reply_to else None
+
+
+def seed_groups(db, count: int) -> list[int]:
+    """Группы нагрузки в group_balances (исходные группы бот зарегистрирует сам)"""
+    group_ids = [-1009000000000 - i for i in range(count)]
+    db.insert('group_balances', [
+        {'group_id': group_id, 'group_name': f'Load {i}', 'language': 'ru' if i % 2 else 'zh', 'current_balance': '0.00'}
+        for i, group_id in enumerate(group_ids)
+    ], None, None)
+    return group_ids
+
+
+async def drive_balance(args, api, group_ids: list[int]) -> tuple[dict, dict, float]:
+    """Подает апдейты в Application и ждет ответы; возвращает (отправлено, получено, время)"""
+    import balance_bot
+    import metrics
+    from telegram import Update
+
+    application = balance_bot.build_application()
+    await application.initialize()
+    # post_init вызывается только из run_polling/run_webhook: прогрев кэша и выгрузка журнала
+    await balance_bot.post_init(application)
+    await application.start()
+    try:
+        rng = random.Random(args.seed)
+        failed_before = metrics.BALANCE_MESSAGES.value(result='failed')
+        sent_before = len(api.sent)
+        pushed = {}
+        started = time.perf_counter()
+        for i in range(args.updates):
+            amount = rng.randint(1, 5000)
+            text = f"-{amount}" if rng.random() < 0.3 else f"+{amount}"
+            message_id = i + 1
+            update = Update.de_json(make_update(group_ids[i % len(group_ids)], message_id, text), application.bot)
+            pushed[message_id] = time.perf_counter()
+            await application.update_queue.put(update)
+            if args.update_rate:
+                await asyncio.sleep(max(0.0, started + (i + 1) / args.update_rate - time.perf_counter()))
+
+        # Ждем ответ или ошибку обработки по каждому апдейту
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            failed = metrics.BALANCE_MESSAGES.value(result='failed') - failed_before
+            if len(api.sent) - sent_before + failed >= args.updates:
+                break
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        replies = {}
+        for sent_at, method, params in api.sent[sent_before:]:
+            message_id = replied_to(params) if method == 'sendMessage' else None
+            if message_id in pushed:
+                replies.setdefault(message_id, sent_at)
+    finally:
+        await application.stop()
+        await balance_bot.post_shutdown(application)
+        for task in ('flush_task', 'reconcile_task', 'registry_task'):
+            if task in application.bot_data:
+                application.bot_data[task].cancel()
+        await application.shutdown()
+    return pushed, replies, elapsed
+
+
+def run_balance(args, api, db) -> None:
+    import balance_bot
+    import metrics
+
+    group_ids = seed_groups(db, args.groups)
+    api.reset_stats()
+    db.reset_stats()
+    pushed, replies, elapsed = asyncio.run(drive_balance(args, api, group_ids))
+    latencies = [replies[message_id] - pushed[message_id] for message_id in replies]
+
+    # Журнал мог не выгрузиться при сбоях Supabase - дожимаем, как фоновая выгрузка
+    if balance_bot.journal is not None:
+        deadline = time.monotonic() + args.timeout
+        while balance_bot.journal.pending_count() and time.monotonic() < deadline:
+            try:
+                balance_bot.flush_journal()
+            except Exception:
+                time.sleep(0.1)
+
+    # Баланс каждой группы в БД равен сумме ее операций, цепочка балансов
+    # непрерывна и идет в порядке сообщений (ответ мог не дойти, а операция - записаться)
+    stored = {row['group_id']: Decimal(str(row['current_balance']))
+              for row in db.select('group_balances', [], None, None, 0)}
+    ledger = {}
+    for row in db.select('balance_transactions', [], 'id', None, 0):
+        ledger.setdefault(row['group_id'], []).append(row)
+    broken = []
+    for group_id, rows in ledger.items():
+        total = sum((Decimal(str(row['amount'])) for row in rows), Decimal('0'))
+        chained = all(Decimal(str(prev['new_balance'])) == Decimal(str(row['previous_balance']))
+                      and prev['message_id'] < row['message_id'] for prev, row in zip(rows, rows[1:]))
+        if stored.get(group_id) != total or not chained:
+            broken.append(group_id)
+    transactions = sum(len(rows) for rows in ledger.values())
+
+    mode = 'синхронная запись' if balance_bot.journal is None else 'журнал'
+    rate = f"{args.update_rate:.0f} апдейтов/с" if args.update_rate else "все сразу"
+    print(f"balance  {args.updates} апдейтов в {len(group_ids)} группах ({rate}), {mode}")
+    print(f"  ответ: {latency_summary(latencies)}, {len(replies) / elapsed:.1f} сообщений/с, "
+          f"ответов {len(replies)}/{args.updates}, ошибок обработки "
+          f"{metrics.BALANCE_MESSAGES.value(result='failed'):.0f}")
+    print(f"  БД: операций {transactions}, балансы и история "
+          f"{'согласованы' if not broken else f'НЕ согласованы в {len(broken)} группах'}")
+    print(f"  Bot API: {sum(api.calls.values())} вызовов, 502: {api.injected_errors}, 429: {api.rate_limited}; "
+          f"Supabase: {sum(db.calls.values())} запросов, 503: {db.errors}, 429: {db.rate_limited}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['submit', 'balance', 'all'], default='all')
+    parser.add_argument('--submits', type=int, default=40)
+    parser.add_argument('--photos', type=int, default=3, help="фото в анкете")
+    parser.add_argument('--concurrency', type=int, default=8, help="параллельных клиентов /api/submit")
+    parser.add_argument('--workers', type=int, default=2, help="воркеров доставки")
+    parser.add_argument('--updates', type=int, default=600)
+    parser.add_argument('--groups', type=int, default=5, help="групп нагрузки (кроме исходных)")
+    parser.add_argument('--update-rate', type=float, default=0, help="апдейтов в секунду (0 - все сразу)")
+    parser.add_argument('--sync-db', action='store_true', help="без журнала: запись в Supabase до ответа")
+    parser.add_argument('--api-latency', type=float, default=0.05, help="задержка Bot API, сек")
+    parser.add_argument('--api-error-rate', type=float, default=0.0, help="доля отправок с ответом 502")
+    parser.add_argument('--api-flood-rate', type=float, default=0.0, help="доля отправок с ответом 429")
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help="лимиты Telegram в имитации Bot API и в планировщике отправок")
+    parser.add_argument('--db-latency', type=float, default=0.02, help="задержка Supabase, сек")
+    parser.add_argument('--db-error-rate', type=float, default=0.0, help="доля запросов с ответом 503")
+    parser.add_argument('--db-rate-limit', type=int, default=0, help="запросов в секунду к Supabase, сверх - 429")
+    parser.add_argument('--timeout', type=float, default=120, help="ожидание доставки/ответов, сек")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="логи модулей")
+    args = parser.parse_args()
+
+    limits = {'chat_limit': 20, 'global_limit': 30} if args.telegram_limits else {}
+    api = fake_bot_api.start_server(latency=args.api_latency, error_rate=args.api_error_rate,
+                                    flood_rate=args.api_flood_rate, seed=args.seed, **limits)
+    db = fake_postgrest.start_server(latency=args.db_latency, error_rate=args.db_error_rate,
+                                     rate_limit=args.db_rate_limit, seed=args.seed)
+    workdir = tempfile.mkdtemp(prefix='escortwork-load-')
+    configure_environment(args, api, db, workdir)
+    if not args.verbose:
+        # Лог на каждое сообщение искажает замер, сбои видны в счетчиках
+        logging.disable(logging.CRITICAL)
+
+    print(f"Bot API: задержка {args.api_latency * 1000:.0f} мс, 502 {args.api_error_rate:.0%}, "
+          f"429 {args.api_flood_rate:.0%}, лимиты Telegram {'да' if args.telegram_limits else 'нет'} | "
+          f"Supabase: задержка {args.db_latency * 1000:.0f} мс, 503 {args.db_error_rate:.0%}, "
+          f"лимит {args.db_rate_limit or '-'} запросов/с")
+    ok = True
+    try:
+        if args.scenario in ('submit', 'all'):
+            ok = run_submit(args, api)
+        if args.scenario in ('balance', 'all'):
+            run_balance(args, api, db)
+    finally:
+        api.shutdown()
+        db.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
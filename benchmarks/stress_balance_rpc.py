@@ -0,0 +1,126 @@
+"""
+Нагрузочный тест записи баланса: старый read-modify-write (3 HTTP вызова)
+против apply_balance_transaction (1 вызов rpc)
+
+По умолчанию запускается против имитации Supabase (fake_postgrest.py) с
+задержкой ответа --latency. С --supabase - против проекта из SUPABASE_URL и
+SUPABASE_KEY; только тестового: тест удаляет транзакции группы --group-id
+и заново создает строку ее баланса
+
+Запуск: python benchmarks/stress_balance_rpc.py --threads 8 --per-thread 25 --latency 0.02
+        SUPABASE_URL=... SUPABASE_KEY=... python benchmarks/stress_balance_rpc.py --supabase
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_postgrest import FAKE_KEY, start_server  # noqa: E402
+
+# balance_bot импортируется в main(): клиент Supabase создается при импорте
+balance_bot = None
+supabase = None
+
+
+def read_balance(group_id: int) -> Decimal:
+    """Баланс из базы, минуя кэш balance_bot (его обновляет только путь rpc)"""
+    rows = supabase.table('group_balances').select('current_balance').eq('group_id', group_id).execute().data
+    return Decimal(str(rows[0]['current_balance']))
+
+
+def legacy_update(group_id: int, amount: Decimal, user_id: int, message_id: int) -> None:
+    """Прежняя реализация update_balance: чтение, расчет в Python, update и insert"""
+    previous_balance = read_balance(group_id)
+    new_balance = previous_balance + amount
+    supabase.table('group_balances').update({'current_balance': str(new_balance)}).eq('group_id', group_id).execute()
+    supabase.table('balance_transactions').insert({
+        'group_id': group_id, 'user_id': user_id, 'username': 'stress', 'amount': str(amount),
+        'previous_balance': str(previous_balance), 'new_balance': str(new_balance),
+        'transaction_type': 'add', 'message_id': message_id,
+    }).execute()
+
+
+def rpc_update(group_id: int, amount: Decimal, user_id: int, message_id: int) -> None:
+    balance_bot.update_balance(group_id, amount, user_id, 'stress', message_id)
+
+
+def reset_group(group_id: int) -> None:
+    """Пустая история группы: иначе второй прогон повторяет message_id первого"""
+    supabase.table('balance_transactions').delete().eq('group_id', group_id).execute()
+    supabase.table('group_balances').delete().eq('group_id', group_id).execute()
+    supabase.table('group_balances').insert({
+        'group_id': group_id, 'group_name': 'stress test', 'current_balance': '0.00', 'language': 'ru'
+    }).execute()
+
+
+def run(name: str, func, group_id: int, threads: int, per_thread: int) -> None:
+    reset_group(group_id)
+    amount = Decimal('1.00')
+    timings = []
+
+    def worker(thread_index: int) -> None:
+        for i in range(per_thread):
+            started = time.perf_counter()
+            func(group_id, amount, thread_index, thread_index * per_thread + i)
+            timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+
+    expected = amount * threads * per_thread
+    actual = read_balance(group_id)
+    rows = supabase.table('balance_transactions').select('previous_balance,new_balance') \
+        .eq('group_id', group_id).order('id').execute().data
+    chain_breaks = sum(
+        1 for prev, row in zip(rows, rows[1:])
+        if Decimal(str(row['previous_balance'])) != Decimal(str(prev['new_balance']))
+    )
+
+    timings.sort()
+    print(f"{name:<8} p50={statistics.median(timings) * 1000:7.1f} ms  "
+          f"p99={timings[int(len(timings) * 0.99) - 1] * 1000:7.1f} ms  "
+          f"{len(timings) / elapsed:6.1f} tx/s  баланс {actual} из {expected}  "
+          f"потеряно {expected - actual}  разрывов цепочки {chain_breaks}")
+
+
+def main():
+    global balance_bot, supabase
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--group-id', type=int, default=-999000000001)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--per-thread', type=int, default=25)
+    parser.add_argument('--latency', type=float, default=0.02, help="задержка ответа имитации Supabase, сек")
+    parser.add_argument('--supabase', action='store_true', help="настоящий проект из SUPABASE_URL/SUPABASE_KEY")
+    args = parser.parse_args()
+
+    if not args.supabase:
+        server = start_server(latency=args.latency)
+        os.environ['SUPABASE_URL'] = f"http://127.0.0.1:{server.server_port}"
+        os.environ['SUPABASE_KEY'] = FAKE_KEY
+    elif not os.getenv('SUPABASE_URL') or not os.getenv('SUPABASE_KEY'):
+        parser.error("--supabase требует SUPABASE_URL и SUPABASE_KEY")
+
+    import balance_bot
+    supabase = balance_bot.supabase
+    # Лог каждой операции заслоняет результат; предупреждения кэша баланса здесь
+    # ожидаемы - бот меняет баланс группы под блокировкой, тест нарочно без нее
+    logging.disable(logging.WARNING)
+
+    run('legacy', legacy_update, args.group_id, args.threads, args.per_thread)
+    run('rpc', rpc_update, args.group_id, args.threads, args.per_thread)
+    supabase.table('balance_transactions').delete().eq('group_id', args.group_id).execute()
+    supabase.table('group_balances').delete().eq('group_id', args.group_id).execute()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,43 @@
 import logging
 import asyncio
 import os
-from telegram import Bot
-from telegram.error import TelegramError
+import shutil
+import threading
+import uuid
+from telegram import Bot, InputFile, InputMediaPhoto, InputMediaVideo
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, TimedOut
+from telegram.request import HTTPXRequest
+import media_cache
+import media_processing
+from send_scheduler import PRIORITY_MEDIA, PRIORITY_TEXT, SendScheduler
 
 # Настройки
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GROUP_ID = os.getenv("GROUP_ID")
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
+TELEGRAM_FILE_BASE_URL = os.getenv("TELEGRAM_FILE_BASE_URL", "https://api.telegram.org/file/bot")
+
+# Пул соединений httpx (один на процесс, переиспользуется между анкетами)
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "16"))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "10"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "30"))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv("TELEGRAM_WRITE_TIMEOUT", "120"))  # загрузка видео
+TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "30"))
+SEND_TIMEOUT = float(os.getenv("TELEGRAM_SEND_TIMEOUT", "600"))  # на всю анкету
+
+# Альбомы (sendMediaGroup)
+MEDIA_GROUP_LIMIT = 10  # максимум элементов в альбоме
+CAPTION_LIMIT = 1024  # максимум символов в подписи
+# Альбомов анкеты, читаемых в память заранее (в чат они уходят по одному, по порядку)
+ALBUM_CONCURRENCY = int(os.getenv("TELEGRAM_ALBUM_CONCURRENCY", "2"))
+SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))
+
+# Итог отправки файла анкеты
+ITEM_SENT = 'sent'
+ITEM_FAILED = 'failed'  # повтор не поможет: Telegram не принял файл или он не читается
+ITEM_RETRY = 'retry'  # сбой сети или Telegram: файл отправится при повторе задачи
+# Ключ текста анкеты в списке доставленного (рядом с путями файлов)
+TEXT_KEY = 'text'
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,21 +46,127 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Фоновый event loop и общий Bot процесса
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+_bot = None
+_bot_lock = None
+_scheduler = None
 
-async def send_application_to_group(data, photos=None, video=None):
-    """
-    Отправляет анкету в Telegram группу
 
-    Args:
-        data: словарь с данными анкеты
-        photos: список путей к фото файлам
-        video: путь к видео файлу
+def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """Тело фонового потока: крутит event loop бесконечно"""
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
     """
-    bot = Bot(token=BOT_TOKEN)
+    Возвращает фоновый event loop процесса (создает при первом вызове)
+    После fork (воркеры gunicorn) создается новый loop, т.к. поток не наследуется
+    """
+    global _loop, _loop_pid, _bot, _bot_lock, _scheduler
+
+    if _loop is not None and _loop_pid == os.getpid():
+        return _loop
+
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_run_loop, args=(loop,), name="telegram-loop", daemon=True)
+            thread.start()
+            _bot = None
+            _bot_lock = None
+            _scheduler = None
+            _loop_pid = os.getpid()
+            _loop = loop
+
+    return _loop
+
+
+async def get_bot() -> Bot:
+    """Возвращает общий инициализированный Bot (вызывать только внутри фонового loop)"""
+    global _bot, _bot_lock
+
+    if _bot is not None:
+        return _bot
+
+    if _bot_lock is None:
+        _bot_lock = asyncio.Lock()
+
+    async with _bot_lock:
+        if _bot is None:
+            request = HTTPXRequest(
+                connection_pool_size=TELEGRAM_POOL_SIZE,
+                connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+                read_timeout=TELEGRAM_READ_TIMEOUT,
+                write_timeout=TELEGRAM_WRITE_TIMEOUT,
+                pool_timeout=TELEGRAM_POOL_TIMEOUT,
+            )
+            bot = Bot(
+                token=BOT_TOKEN,
+                base_url=TELEGRAM_API_BASE_URL,
+                base_file_url=TELEGRAM_FILE_BASE_URL,
+                request=request,
+            )
+            await bot.initialize()
+            _bot = bot
+            logger.info("Telegram Bot инициализирован")
+
+    return _bot
+
+
+def get_scheduler() -> SendScheduler:
+    """Планировщик отправок процесса (вызывать только внутри фонового loop)"""
+    global _scheduler
+
+    if _scheduler is None:
+        _scheduler = SendScheduler()
+    return _scheduler
+
+
+def run_coroutine(coro, timeout: float | None = None):
+    """Выполняет корутину в фоновом loop из синхронного кода (Flask, воркеры)"""
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+async def _shutdown_bot() -> None:
+    """Останавливает планировщик и закрывает соединения общего Bot"""
+    global _bot, _scheduler
+
+    if _scheduler is not None:
+        await _scheduler.close()
+        _scheduler = None
+    if _bot is not None:
+        await _bot.shutdown()
+        _bot = None
+
+
+def shutdown() -> None:
+    """Останавливает общий Bot и фоновый loop"""
+    global _loop
+
+    if _loop is None or _loop_pid != os.getpid():
+        return
 
     try:
-        # Формируем текст сообщения
-        message = f"""
+        run_coroutine(_shutdown_bot(), timeout=10)
+    except Exception as e:
+        logger.warning(f"Ошибка остановки Telegram Bot: {e}")
+
+    _loop.call_soon_threadsafe(_loop.stop)
+    _loop = None
+
+
+def format_application(data) -> str:
+    """Формирует текст анкеты (HTML)"""
+    message = f"""
 🆕 <b>НОВАЯ АНКЕТА МОДЕЛИ</b>
 
 👤 <b>Имя:</b> {data.get('name', 'Не указано')}
@@ -42,41 +179,334 @@ async def send_application_to_group(data, photos=None, video=None):
 💼 <b>Опыт:</b> {data.get('experience', 'Не указано')}
 """
 
-        if data.get('countries'):
-            message += f"🗺️ <b>Страны опыта:</b> {data.get('countries')}\n"
+    if data.get('countries'):
+        message += f"🗺️ <b>Страны опыта:</b> {data.get('countries')}\n"
+
+    return message
 
-        # Отправляем текстовое сообщение
-        await bot.send_message(
-            chat_id=GROUP_ID,
-            text=message,
-            parse_mode='HTML'
-        )
 
-        # Отправляем фото если есть
-        if photos:
-            for photo_path in photos:
+async def call_with_retry(func, *args, description: str = '', priority: int = PRIORITY_TEXT, cost: int = 1,
+                          **kwargs):
+    """
+    Вызывает метод Bot API через планировщик отправок (лимиты Telegram, приоритет)
+    RetryAfter обрабатывает планировщик, сетевые ошибки - экспоненциальная задержка,
+    BadRequest и прочие ошибки запроса не повторяются
+    """
+    for attempt in range(1, SEND_RETRIES + 1):
+        try:
+            return await get_scheduler().submit(
+                kwargs.get('chat_id'), func, *args, priority=priority, cost=cost, description=description, **kwargs
+            )
+        except (BadRequest, RetryAfter):
+            raise
+        except (TimedOut, NetworkError) as e:
+            delay = 2 ** attempt
+            error = e
+
+        if attempt == SEND_RETRIES:
+            raise error
+
+        logger.warning(f"{description}: {error}. Повтор {attempt + 1}/{SEND_RETRIES} через {delay:.0f} с")
+        await asyncio.sleep(delay)
+
+
+class _StreamedFile(InputFile):
+    """
+    Файл для multipart-запроса, который не читается в память целиком
+    InputFile из python-telegram-bot хранит все содержимое файла (до 50 МБ видео
+    на каждый элемент альбома); здесь в запрос передается открытый файл, и httpx
+    отправляет его блоками, перематывая к началу при повторе запроса
+    """
+
+    __slots__ = ('_file',)
+
+    def __init__(self, path: str):
+        super().__init__(b'', filename=os.path.basename(path), attach=True)
+        self._file = open(path, 'rb')
+
+    @property
+    def field_tuple(self):
+        return self.filename, self._file, self.mimetype
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _load_media(kind: str, path: str, caption: str | None = None, file_id: str | None = None):
+    """
+    Создает InputMedia для альбома: по file_id из кэша (файл не читается)
+    или с открытым файлом (_StreamedFile, закрывается через _close_media)
+    """
+    parse_mode = 'HTML' if caption else None
+    media = file_id or _StreamedFile(path)
+    if kind == 'video':
+        return InputMediaVideo(media=media, caption=caption, parse_mode=parse_mode, supports_streaming=True)
+    return InputMediaPhoto(media=media, caption=caption, parse_mode=parse_mode)
+
+
+def _close_media(media) -> None:
+    """Закрывает файл, открытый _load_media"""
+    if isinstance(media.media, _StreamedFile):
+        media.media.close()
+
+
+def _message_file_id(message, kind: str) -> str | None:
+    """file_id файла из отправленного сообщения (для фото - самый большой размер)"""
+    if kind == 'video':
+        return message.video.file_id if getattr(message, 'video', None) else None
+    return message.photo[-1].file_id if getattr(message, 'photo', None) else None
+
+
+def _remember_media(items: list, file_ids: list, messages: list) -> None:
+    """Запоминает file_id загруженных файлов и учитывает байты, не загруженные повторно"""
+    for (kind, path, digest), file_id, message in zip(items, file_ids, messages):
+        if file_id:
+            media_cache.saved(kind, path)
+            continue
+        new_file_id = _message_file_id(message, kind)
+        if digest and new_file_id:
+            try:
+                media_cache.store(digest, kind, new_file_id, os.path.getsize(path))
+            except OSError:
+                pass
+
+
+def _processed_copy(kind: str, path: str) -> str:
+    """
+    Обработанная копия файла (media_processing: без EXIF, уменьшенная) для
+    загрузки вместо отклоненного file_id. Файлы с file_id воркер доставки не
+    обрабатывает; исходник остается на месте для повторной попытки
+    """
+    copy = os.path.join(os.path.dirname(path), f"{uuid.uuid4().hex}.{path.rsplit('.', 1)[-1]}")
+    shutil.copyfile(path, copy)
+    try:
+        process = media_processing.process_video if kind == 'video' else media_processing.process_photo
+        return process(copy)['path']
+    except Exception as e:
+        logger.warning(f"Не удалось обработать {path}, отправляем как есть: {e}")
+        return copy
+
+
+async def _send_single(bot: Bot, item: tuple, media, file_id: str | None = None, unprocessed: bool = False) -> str:
+    """
+    Отправляет один элемент отдельным сообщением (с повторами), возвращает ITEM_*
+    Если Telegram не принял file_id из кэша, запись удаляется и файл загружается;
+    unprocessed - файл не проходил media_processing, загружается его обработанная копия
+    """
+    kind, path, digest = item
+    reloaded = None  # файл, открытый здесь вместо отклоненного file_id
+    try:
+        while True:
+            try:
+                if kind == 'video':
+                    message = await call_with_retry(
+                        bot.send_video, chat_id=GROUP_ID, video=media.media, caption=media.caption,
+                        parse_mode=media.parse_mode, supports_streaming=True, description=f"Видео {path}",
+                        priority=PRIORITY_MEDIA
+                    )
+                else:
+                    message = await call_with_retry(
+                        bot.send_photo, chat_id=GROUP_ID, photo=media.media, caption=media.caption,
+                        parse_mode=media.parse_mode, description=f"Фото {path}", priority=PRIORITY_MEDIA
+                    )
+                await asyncio.to_thread(_remember_media, [item], [file_id], [message])
+                return ITEM_SENT
+            except BadRequest as e:
+                if not file_id:
+                    logger.error(f"Ошибка отправки {'видео' if kind == 'video' else 'фото'} {path}: {e}")
+                    return ITEM_FAILED
+                logger.warning(f"file_id для {path} не принят ({e}), загружаем файл")
+                await asyncio.to_thread(media_cache.invalidate, digest, kind)
                 try:
-                    with open(photo_path, 'rb') as photo_file:
-                        await bot.send_photo(
-                            chat_id=GROUP_ID,
-                            photo=photo_file
-                        )
+                    if unprocessed:
+                        upload_path = await asyncio.to_thread(_processed_copy, kind, path)
+                        try:
+                            # Открытый файл остается доступен после удаления копии
+                            media = reloaded = await asyncio.to_thread(_load_media, kind, upload_path,
+                                                                       media.caption)
+                        finally:
+                            os.remove(upload_path)
+                    else:
+                        media = reloaded = await asyncio.to_thread(_load_media, kind, path, media.caption)
                 except Exception as e:
-                    logger.error(f"Ошибка отправки фото {photo_path}: {e}")
+                    logger.error(f"Не удалось прочитать {'видео' if kind == 'video' else 'фото'} {path}: {e}")
+                    return ITEM_FAILED
+                file_id = None
+            except Exception as e:
+                logger.error(f"Ошибка отправки {'видео' if kind == 'video' else 'фото'} {path}: {e}")
+                return ITEM_RETRY
+    finally:
+        if reloaded is not None:
+            _close_media(reloaded)
+
+
+class _AlbumTurns:
+    """
+    Очередь альбомов одной анкеты: файлы следующего альбома читаются, пока
+    отправляется предыдущий, а в чат альбомы уходят строго по порядку
+    """
+
+    def __init__(self, count: int):
+        self.loading = [asyncio.Event() for _ in range(count)]
+        self.sent = [asyncio.Event() for _ in range(count)]
 
-        # Отправляем видео если есть
-        if video:
+
+async def _send_album(bot: Bot, items: list, caption: str | None, semaphore: asyncio.Semaphore,
+                      known_file_ids: dict | None = None, turns: _AlbumTurns | None = None,
+                      index: int = 0) -> tuple[list[str], bool]:
+    """
+    Отправляет до 10 элементов (kind, path, digest) одним альбомом (sendMediaGroup)
+    Файлы, уже отправленные раньше (media_cache), уходят по file_id без загрузки
+    known_file_ids - file_id, найденные воркером доставки до обработки медиа
+    (тогда кэш повторно не опрашивается); None - поиск по кэшу здесь
+    turns, index - место альбома в анкете: отправка только после предыдущего
+    Файл, который не удалось прочитать, пропускается, остальные уходят альбомом;
+    если альбом не принят, элементы отправляются по одному с повторами
+    Возвращает (ITEM_* для каждого элемента, дошла ли подпись)
+    """
+    # Семафор занимается по порядку альбомов: альбом под семафором ждет только
+    # предыдущие, которые его уже получили
+    if turns is not None and index:
+        await turns.loading[index - 1].wait()
+    async with semaphore:
+        if turns is not None:
+            turns.loading[index].set()
+        try:
+            return await _deliver_album(bot, items, caption, known_file_ids,
+                                        turns.sent[index - 1] if turns is not None and index else None)
+        finally:
+            if turns is not None:
+                turns.sent[index].set()
+
+
+async def _deliver_album(bot: Bot, items: list, caption: str | None, known_file_ids: dict | None,
+                         previous_sent: asyncio.Event | None) -> tuple[list[str], bool]:
+    """Читает файлы альбома и отправляет его после previous_sent (см. _send_album)"""
+    # Файлы открываются только под семафором: открыто не больше ALBUM_CONCURRENCY альбомов
+    statuses = [ITEM_FAILED] * len(items)
+    ready = []  # (индекс, InputMedia, file_id)
+    try:
+        for index, (kind, path, digest) in enumerate(items):
             try:
-                with open(video, 'rb') as video_file:
-                    await bot.send_video(
-                        chat_id=GROUP_ID,
-                        video=video_file,
-                        caption="📹 Видео презентация"
-                    )
+                if known_file_ids is None:
+                    file_id = await asyncio.to_thread(media_cache.lookup, digest, kind)
+                else:
+                    file_id = known_file_ids.get(path)
+                # Подпись - у первого прочитанного файла
+                media = await asyncio.to_thread(_load_media, kind, path, None if ready else caption, file_id)
             except Exception as e:
-                logger.error(f"Ошибка отправки видео {video}: {e}")
+                logger.error(f"Не удалось прочитать {'видео' if kind == 'video' else 'фото'} {path}: {e}")
+                continue
+            ready.append((index, media, file_id))
+
+        if previous_sent is not None:
+            await previous_sent.wait()
+        if not ready:
+            return statuses, False
+
+        # file_id от воркера - у необработанного файла
+        unprocessed = [known_file_ids is not None and bool(file_id) for _, _, file_id in ready]
+        if len(ready) == 1:
+            index, media, file_id = ready[0]
+            statuses[index] = await _send_single(bot, items[index], media, file_id, unprocessed[0])
+            return statuses, statuses[index] == ITEM_SENT
+
+        try:
+            # Альбом занимает в лимитах Telegram столько сообщений, сколько в нем файлов
+            messages = await call_with_retry(
+                bot.send_media_group, chat_id=GROUP_ID, media=[media for _, media, _ in ready],
+                description="Альбом", priority=PRIORITY_MEDIA, cost=len(ready)
+            )
+            await asyncio.to_thread(_remember_media, [items[index] for index, _, _ in ready],
+                                    [file_id for _, _, file_id in ready], messages)
+            for index, _, _ in ready:
+                statuses[index] = ITEM_SENT
+            return statuses, True
+        except Exception as e:
+            logger.warning(f"Альбом из {len(ready)} файлов не отправлен ({e}), отправляем по одному")
+
+        for (index, media, file_id), raw in zip(ready, unprocessed):
+            statuses[index] = await _send_single(bot, items[index], media, file_id, raw)
+        return statuses, statuses[ready[0][0]] == ITEM_SENT
+    finally:
+        for _, media, _ in ready:
+            _close_media(media)
+
+
+async def send_application_to_group(data, photos=None, video=None, digests=None, file_ids=None, delivered=None):
+    """
+    Отправляет анкету в Telegram группу
+    Фото и видео уходят альбомами по 10 штук, текст анкеты - подписью к первому альбому
+    Возвращает False, если часть анкеты не дошла из-за сбоя сети или Telegram и
+    ее стоит отправить повторно; файлы, которые Telegram не принял, повтором не
+    исправить - они только логируются
+
+    Args:
+        data: словарь с данными анкеты
+        photos: список путей к фото файлам
+        video: путь к видео файлу
+        digests: {путь: хеш содержимого} - для отправки повторных файлов по file_id
+        file_ids: {путь: file_id}, уже найденные в кэше воркером доставки (эти файлы
+            не обработаны); None - file_id ищутся в кэше по digests
+        delivered: уже доставленное прошлыми попытками - пути файлов и TEXT_KEY;
+            дополняется по ходу отправки, повтор отправляет только остальное
+    """
+    delivered = [] if delivered is None else delivered
+    try:
+        bot = await get_bot()
+        message = format_application(data)
+        text_needed = TEXT_KEY not in delivered
+
+        digests = digests or {}
+        items = [('photo', path, digests.get(path)) for path in photos or [] if path not in delivered]
+        if video and video not in delivered:
+            items.append(('video', video, digests.get(video)))
+
+        if not text_needed:
+            # Текст ушел прошлой попыткой - оставшиеся файлы подписываются именем
+            caption = f"📎 Файлы анкеты: {data.get('name', 'Не указано')}" if items else None
+        elif items and len(message) <= CAPTION_LIMIT:
+            caption = message
+        else:
+            # Подпись к альбому ограничена 1024 символами - длинный текст шлем отдельно
+            caption = None
+            await call_with_retry(
+                bot.send_message, chat_id=GROUP_ID, text=message, parse_mode='HTML', description="Текст анкеты"
+            )
+            delivered.append(TEXT_KEY)
+            text_needed = False
+
+        albums = [items[i:i + MEDIA_GROUP_LIMIT] for i in range(0, len(items), MEDIA_GROUP_LIMIT)]
+        semaphore = asyncio.Semaphore(ALBUM_CONCURRENCY)
+        turns = _AlbumTurns(len(albums))
+        results = await asyncio.gather(*[
+            _send_album(bot, album, caption if index == 0 else None, semaphore, file_ids, turns, index)
+            for index, album in enumerate(albums)
+        ])
+
+        statuses = []
+        for album, (album_statuses, _) in zip(albums, results):
+            statuses.extend(album_statuses)
+            delivered.extend(path for (_, path, _), status in zip(album, album_statuses) if status == ITEM_SENT)
+        if text_needed and results and results[0][1]:
+            delivered.append(TEXT_KEY)
+        elif text_needed:
+            # Файл с подписью не дошел - текст анкеты не должен потеряться
+            await call_with_retry(
+                bot.send_message, chat_id=GROUP_ID, text=message, parse_mode='HTML', description="Текст анкеты"
+            )
+            delivered.append(TEXT_KEY)
 
-        logger.info("Анкета успешно отправлена в группу")
+        failed = statuses.count(ITEM_FAILED)
+        retry = statuses.count(ITEM_RETRY)
+        if retry:
+            logger.error(f"Анкета отправлена частично: {retry} из {len(statuses)} файлов отправятся повторно"
+                         + (f", {failed} не приняты Telegram" if failed else ""))
+            return False
+        if failed:
+            logger.error(f"Анкета отправлена, но {failed} из {len(statuses)} файлов не приняты Telegram")
+        else:
+            logger.info(f"Анкета успешно отправлена в группу ({len(statuses)} файлов, {len(albums)} альбомов)")
         return True
 
     except TelegramError as e:
@@ -88,9 +518,10 @@ async def send_application_to_group(data, photos=None, video=None):
 
 
 # Функция для синхронного вызова
-def send_application(data, photos=None, video=None):
-    """Синхронная обертка для отправки анкеты"""
-    return asyncio.run(send_application_to_group(data, photos, video))
+def send_application(data, photos=None, video=None, digests=None, file_ids=None, delivered=None):
+    """Синхронная обертка для отправки анкеты (через общий Bot и фоновый loop)"""
+    return run_coroutine(send_application_to_group(data, photos, video, digests, file_ids, delivered),
+                         timeout=SEND_TIMEOUT)
 
 
 if __name__ == "__main__":
@@ -112,4 +543,5 @@ if __name__ == "__main__":
     if result:
         print("✅ Успешно отправлено!")
     else:
-        print("❌ Ошибка отправки")
\ No newline at end of file
+        print("❌ Ошибка отправки")
+    shutdown()
\ No newline at end of file
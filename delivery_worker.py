@@ -0,0 +1,185 @@
+"""
+Пул воркеров доставки анкет в Telegram
+Забирает задачи из job_queue, отправляет их через bot.py
+и повторяет неудачные попытки с экспоненциальной задержкой
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+
+import job_queue
+import media_cache
+import media_processing
+import metrics
+from bot import SEND_TIMEOUT, send_application
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Настройки
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "2"))
+POLL_INTERVAL = float(os.getenv("DELIVERY_POLL_INTERVAL", "1.0"))  # секунд
+# Порт метрик Prometheus при запуске отдельным процессом (0 - отключить)
+DELIVERY_METRICS_PORT = int(os.getenv("DELIVERY_METRICS_PORT", "9102"))
+
+
+def remove_files(payload: dict) -> None:
+    """Удаляет загруженные файлы задачи"""
+    paths = list(payload.get('photos') or [])
+    if payload.get('video'):
+        paths.append(payload['video'])
+
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def process_job(job: dict) -> None:
+    """Выполняет одну задачу доставки"""
+    job_id = job['id']
+    payload = job['payload']
+
+    stage = 'processing_media'
+    started = time.perf_counter()
+    # Уже доставленное прошлыми попытками: повтор отправляет только остальное
+    delivered = list(payload.get('delivered') or [])
+    try:
+        if not payload.get('media_processed'):
+            # Аренда продлевается на каждый этап по его таймауту: перекодирование
+            # и отправка вместе дольше DELIVERY_LEASE_TIMEOUT
+            if not job_queue.renew_lease(job_id, job['attempts'], media_processing.MEDIA_STAGE_TIMEOUT):
+                logger.warning(f"Задача {job_id} передана другому воркеру, обработка прервана")
+                return
+            # Перекодирование в пуле процессов; новые пути сохраняем до отправки,
+            # чтобы повторная попытка не ссылалась на удаленные исходники
+            job_queue.update_progress(job_id, {'stage': 'processing_media', 'attempt': job['attempts']})
+            photos = list(payload.get('photos') or [])
+            video = payload.get('video')
+            digests = payload.get('media_digests') or {}
+            # Файлы, уже отправленные раньше, уйдут по file_id - их не обрабатываем
+            file_ids = {}
+            for kind, path in [('photo', path) for path in photos] + [('video', video)]:
+                file_id = media_cache.lookup(digests.get(path), kind) if path else None
+                if file_id:
+                    file_ids[path] = file_id
+            pending_photos = [path for path in photos if path not in file_ids]
+            pending_video = video if video not in file_ids else None
+            new_photos, new_video = media_processing.prepare_media(
+                pending_photos, pending_video, payload.get('images_optimized', False)
+            )
+            renamed = dict(zip(pending_photos, new_photos))
+            if pending_video:
+                renamed[pending_video] = new_video
+            payload['photos'] = [renamed.get(path, path) for path in photos]
+            payload['video'] = renamed.get(video, video)
+            # Хеш исходного файла переходит к обработанному: обработка детерминирована,
+            # поэтому повторный файл дает тот же результат и тот же file_id
+            payload['media_digests'] = {renamed.get(path, path): digest for path, digest in digests.items()}
+            payload['media_file_ids'] = file_ids
+            payload['media_processed'] = True
+            job_queue.update_payload(job_id, payload)
+            metrics.DELIVERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, result='ok')
+
+        stage = 'sending'
+        started = time.perf_counter()
+        if not job_queue.renew_lease(job_id, job['attempts'], SEND_TIMEOUT):
+            # Аренда истекла во время обработки медиа и задачу забрал другой воркер
+            logger.warning(f"Задача {job_id} передана другому воркеру, отправка пропущена")
+            return
+        job_queue.update_progress(job_id, {'stage': 'sending', 'attempt': job['attempts']})
+        success = send_application(payload['data'], payload.get('photos'), payload.get('video'),
+                                   payload.get('media_digests'), payload.get('media_file_ids'), delivered)
+        error = None if success else 'Ошибка при отправке анкеты'
+        metrics.DELIVERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage,
+                                               result='ok' if success else 'error')
+    except Exception as e:
+        metrics.DELIVERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, result='error')
+        success = False
+        error = str(e)
+
+    files = list(payload.get('photos') or []) + ([payload['video']] if payload.get('video') else [])
+    sent = sum(1 for path in files if path in delivered)
+    if success:
+        job_queue.mark_done(job_id)
+        # failed - файлы, которые Telegram не принял (повтор их не исправит)
+        job_queue.update_progress(job_id, {'stage': 'delivered', 'attempt': job['attempts'],
+                                           'delivered': sent, 'failed': len(files) - sent})
+        remove_files(payload)
+        logger.info(f"Задача {job_id} доставлена (попытка {job['attempts']})")
+        return
+
+    if delivered != list(payload.get('delivered') or []):
+        payload['delivered'] = delivered
+        job_queue.update_payload(job_id, payload)
+    job_queue.update_progress(job_id, {'stage': stage, 'attempt': job['attempts'],
+                                       'delivered': sent, 'failed': len(files) - sent})
+    will_retry = job_queue.mark_failed_attempt(job_id, job['attempts'], error)
+    if will_retry:
+        logger.warning(f"Задача {job_id} не доставлена (попытка {job['attempts']}): {error}. Повтор позже")
+    else:
+        remove_files(payload)
+        logger.error(f"Задача {job_id} окончательно не доставлена после {job['attempts']} попыток: {error}")
+
+
+def worker_loop(stop_event: threading.Event) -> None:
+    """Основной цикл воркера: берет задачи пока они есть, иначе ждет"""
+    while not stop_event.is_set():
+        try:
+            job = job_queue.claim_next()
+        except Exception as e:
+            logger.error(f"Ошибка чтения очереди: {e}")
+            job = None
+
+        if job is None:
+            stop_event.wait(POLL_INTERVAL)
+            continue
+
+        process_job(job)
+
+
+def start_workers(count: int = DELIVERY_WORKERS) -> threading.Event:
+    """
+    Запускает пул воркеров в фоновых потоках
+    Возвращает событие, установка которого останавливает пул
+    """
+    stop_event = threading.Event()
+    for i in range(count):
+        thread = threading.Thread(
+            target=worker_loop,
+            args=(stop_event,),
+            name=f"delivery-worker-{i + 1}",
+            daemon=True
+        )
+        thread.start()
+
+    logger.info(f"Запущено воркеров доставки: {count}")
+    return stop_event
+
+
+def main():
+    """Запускает пул воркеров как отдельный процесс"""
+    stop_event = start_workers()
+    metrics.start_http_server(DELIVERY_METRICS_PORT)
+
+    def terminate(signum, frame):
+        logger.info("Остановка воркеров доставки...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+
+    stop_event.wait()
+    media_processing.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Реестр групп balance_bot
+Группы и их настройки (язык, валюта, лимиты суммы) хранятся в group_balances.
+При запуске реестр загружается в словарь по group_id: проверка, что сообщение
+пришло из отслеживаемой группы, - одно обращение к словарю при любом числе групп
+
+Изменения подхватываются без рестарта: раз в BALANCE_REGISTRY_TTL секунд
+читаются только строки с новым settings_updated_at (его двигает триггер
+при изменении настроек, а не баланса), а команды /enroll и /unenroll
+применяют изменение сразу
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Период опроса изменений реестра, секунд (0 - только при запуске и командами)
+BALANCE_REGISTRY_TTL = float(os.getenv("BALANCE_REGISTRY_TTL", "60"))
+# Запас при опросе: транзакция могла получить settings_updated_at раньше,
+# чем стала видна (now() - время начала транзакции)
+POLL_OVERLAP = timedelta(seconds=30)
+
+LANGUAGES = ('ru', 'zh')
+DEFAULT_LANGUAGE = 'zh'  # как раньше для групп без конфигурации
+DEFAULT_CURRENCY = '¥'
+# Лимиты суммы транзакции, если у группы не заданы свои
+DEFAULT_MIN_AMOUNT = Decimal('0.01')
+DEFAULT_MAX_AMOUNT = Decimal('999999999.99')
+
+SETTINGS_COLUMNS = ('group_id, group_name, language, currency, min_amount, max_amount, active, '
+                    'current_balance, settings_updated_at')
+
+
+def _decimal(value, default: Decimal) -> Decimal:
+    return default if value is None else Decimal(str(value))
+
+
+def settings_from_row(row: dict) -> dict:
+    """Настройки группы из строки group_balances (пустые поля - значения по умолчанию)"""
+    group_id = int(row['group_id'])
+    language = row.get('language')
+    return {
+        'group_id': group_id,
+        'name': row.get('group_name') or f'Group {group_id}',
+        'language': language if language in LANGUAGES else DEFAULT_LANGUAGE,
+        'currency': row.get('currency') or DEFAULT_CURRENCY,
+        'min_amount': _decimal(row.get('min_amount'), DEFAULT_MIN_AMOUNT),
+        'max_amount': _decimal(row.get('max_amount'), DEFAULT_MAX_AMOUNT),
+        'active': row.get('active', True) is not False,
+    }
+
+
+def default_settings(group_id: int) -> dict:
+    """Настройки группы, которой нет в реестре"""
+    return settings_from_row({'group_id': group_id})
+
+
+class GroupRegistry:
+    """Группы по group_id; неактивные (после /unenroll) хранятся, но не отслеживаются"""
+
+    def __init__(self):
+        self._groups: dict[int, dict] = {}
+        self._lock = threading.Lock()
+        self.version: str | None = None  # наибольший settings_updated_at из прочитанных строк
+
+    def get(self, group_id: int) -> dict | None:
+        """Настройки отслеживаемой группы или None"""
+        settings = self._groups.get(group_id)
+        if settings is None or not settings['active']:
+            return None
+        return settings
+
+    def __contains__(self, group_id: int) -> bool:
+        return self.get(group_id) is not None
+
+    def known(self, group_id: int) -> bool:
+        """Группа есть в group_balances (в том числе отключенная)"""
+        return group_id in self._groups
+
+    def config(self, group_id: int) -> dict:
+        """Настройки группы для записи в БД (имя, язык) - и для неизвестных групп"""
+        return self._groups.get(group_id) or default_settings(group_id)
+
+    def group_ids(self) -> list[int]:
+        """Отслеживаемые группы"""
+        return [group_id for group_id, settings in self._groups.items() if settings['active']]
+
+    def load(self, rows: list[dict]) -> int:
+        """Заменяет реестр строками group_balances, возвращает число отслеживаемых групп"""
+        groups = {}
+        for row in rows:
+            settings = settings_from_row(row)
+            groups[settings['group_id']] = settings
+        with self._lock:
+            # Словарь заменяется целиком: обработчики читают его без блокировки
+            self._groups = groups
+            self.version = self._max_version(rows, None)
+        return len(self.group_ids())
+
+    def apply(self, rows: list[dict]) -> list[int]:
+        """Применяет измененные строки, возвращает group_id, у которых изменились настройки"""
+        changed = []
+        with self._lock:
+            groups = dict(self._groups)
+            for row in rows:
+                settings = settings_from_row(row)
+                if groups.get(settings['group_id']) != settings:
+                    groups[settings['group_id']] = settings
+                    changed.append(settings['group_id'])
+            self._groups = groups
+            self.version = self._max_version(rows, self.version)
+        return changed
+
+    @staticmethod
+    def _max_version(rows: list[dict], current: str | None) -> str | None:
+        versions = [row['settings_updated_at'] for row in rows if row.get('settings_updated_at')]
+        if current is not None:
+            versions.append(current)
+        return max(versions, key=datetime.fromisoformat) if versions else None
+
+    def since(self) -> str | None:
+        """С какого settings_updated_at читать изменения при следующем опросе"""
+        if self.version is None:
+            return None
+        return (datetime.fromisoformat(self.version) - POLL_OVERLAP).isoformat()
+
+
+def fetch_groups(client, since: str | None = None) -> list[dict]:
+    """Строки реестра из group_balances (since - только измененные после этого момента)"""
+    query = client.table('group_balances').select(SETTINGS_COLUMNS)
+    if since is not None:
+        query = query.gte('settings_updated_at', since)
+    response = metrics.timed_execute(query, 'group_balances', 'select')
+    return response.data or []
+
+
+def enroll_group(client, group_id: int, name: str, language: str, currency: str) -> dict:
+    """
+    Регистрирует группу (или включает отключенную) и возвращает ее строку
+    Баланс существующей группы не меняется: upsert пишет только переданные поля
+    """
+    response = metrics.timed_execute(client.table('group_balances').upsert({
+        'group_id': group_id,
+        'group_name': name,
+        'language': language,
+        'currency': currency,
+        'active': True,
+    }, on_conflict='group_id'), 'group_balances', 'upsert')
+    return response.data[0]
+
+
+def set_group_active(client, group_id: int, active: bool) -> dict | None:
+    """Включает/отключает учет в группе, возвращает обновленную строку"""
+    response = metrics.timed_execute(
+        client.table('group_balances').update({'active': active}).eq('group_id', group_id),
+        'group_balances', 'update'
+    )
+    return response.data[0] if response.data else None
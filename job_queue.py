@@ -0,0 +1,243 @@
+"""
+Надёжная локальная очередь задач доставки анкет
+Хранится в SQLite (режим WAL), поэтому переживает рестарт и общая
+для всех воркеров gunicorn и процесса delivery_worker.py
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Настройки очереди
+DATA_DIR = os.getenv("DATA_DIR", "data")
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH", os.path.join(DATA_DIR, "jobs.sqlite3"))
+MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "6"))
+BACKOFF_BASE = float(os.getenv("DELIVERY_BACKOFF_BASE", "5"))  # секунд
+BACKOFF_MAX = float(os.getenv("DELIVERY_BACKOFF_MAX", "600"))  # секунд
+LEASE_TIMEOUT = float(os.getenv("DELIVERY_LEASE_TIMEOUT", "900"))  # секунд, до первого продления
+# Запас аренды сверх таймаута этапа доставки (renew_lease)
+LEASE_HEADROOM = float(os.getenv("DELIVERY_LEASE_HEADROOM", "120"))  # секунд
+
+# Статусы задач
+STATUS_QUEUED = 'queued'
+STATUS_PROCESSING = 'processing'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progress TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_run_at REAL NOT NULL,
+    locked_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_next_run ON jobs(status, next_run_at);
+"""
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """Открывает соединение с базой очереди (создает схему при первом вызове)"""
+    global _schema_ready
+
+    if not _schema_ready:
+        os.makedirs(os.path.dirname(QUEUE_DB_PATH) or '.', exist_ok=True)
+
+    conn = sqlite3.connect(QUEUE_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(_SCHEMA)
+                _schema_ready = True
+
+    return conn
+
+
+def _row_to_job(row: sqlite3.Row) -> dict:
+    """Преобразует строку таблицы в словарь задачи"""
+    return {
+        'id': row['id'],
+        'status': row['status'],
+        'payload': json.loads(row['payload']),
+        'progress': json.loads(row['progress']) if row['progress'] else None,
+        'attempts': row['attempts'],
+        'last_error': row['last_error'],
+        'next_run_at': row['next_run_at'],
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at'],
+    }
+
+
+def backoff_delay(attempts: int) -> float:
+    """Экспоненциальная задержка перед повтором: 5с, 10с, 20с ... до BACKOFF_MAX"""
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+
+
+def enqueue(payload: dict) -> str:
+    """Ставит задачу в очередь и возвращает её id"""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, status, payload, attempts, next_run_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, 0, ?, ?, ?)",
+            (job_id, STATUS_QUEUED, json.dumps(payload, ensure_ascii=False), now, now, now)
+        )
+    finally:
+        conn.close()
+
+    logger.info(f"Задача {job_id} поставлена в очередь")
+    return job_id
+
+
+def claim_next() -> dict | None:
+    """
+    Атомарно забирает следующую готовую задачу
+    Задачи, чья аренда истекла (воркер упал), тоже возвращаются в работу
+    """
+    now = time.time()
+
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT * FROM jobs "
+            "WHERE (status = ? AND next_run_at <= ?) OR (status = ? AND locked_until < ?) "
+            "ORDER BY next_run_at LIMIT 1",
+            (STATUS_QUEUED, now, STATUS_PROCESSING, now)
+        ).fetchone()
+
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = attempts + 1, locked_until = ?, updated_at = ? WHERE id = ?",
+            (STATUS_PROCESSING, now + LEASE_TIMEOUT, now, row['id'])
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    job = _row_to_job(row)
+    job['status'] = STATUS_PROCESSING
+    job['attempts'] += 1
+    return job
+
+
+def renew_lease(job_id: str, attempts: int, seconds: float) -> bool:
+    """
+    Продлевает аренду задачи на seconds + LEASE_HEADROOM перед очередным этапом
+    Возвращает False, если задачу уже забрал другой воркер (аренда истекла
+    и claim_next выдал ее повторно с другим номером попытки) - тогда
+    продолжать нельзя, иначе анкета уйдет в группу дважды
+    """
+    now = time.time()
+
+    conn = _connect()
+    try:
+        cursor = conn.execute(
+            "UPDATE jobs SET locked_until = ?, updated_at = ? WHERE id = ? AND status = ? AND attempts = ?",
+            (now + seconds + LEASE_HEADROOM, now, job_id, STATUS_PROCESSING, attempts)
+        )
+    finally:
+        conn.close()
+
+    return cursor.rowcount == 1
+
+
+def update_progress(job_id: str, progress: dict) -> None:
+    """Сохраняет прогресс доставки (для эндпоинта статуса)"""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(progress, ensure_ascii=False), time.time(), job_id)
+        )
+    finally:
+        conn.close()
+
+
+def update_payload(job_id: str, payload: dict) -> None:
+    """Перезаписывает данные задачи (например, пути после обработки медиа)"""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET payload = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(payload, ensure_ascii=False), time.time(), job_id)
+        )
+    finally:
+        conn.close()
+
+
+def mark_done(job_id: str) -> None:
+    """Отмечает задачу как успешно выполненную"""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, locked_until = NULL, last_error = NULL, updated_at = ? WHERE id = ?",
+            (STATUS_DONE, time.time(), job_id)
+        )
+    finally:
+        conn.close()
+
+
+def mark_failed_attempt(job_id: str, attempts: int, error: str) -> bool:
+    """
+    Регистрирует неудачную попытку
+    Возвращает True если задача будет повторена, False если попытки исчерпаны
+    """
+    now = time.time()
+    will_retry = attempts < MAX_ATTEMPTS
+
+    conn = _connect()
+    try:
+        if will_retry:
+            conn.execute(
+                "UPDATE jobs SET status = ?, next_run_at = ?, locked_until = NULL, last_error = ?, updated_at = ? "
+                "WHERE id = ?",
+                (STATUS_QUEUED, now + backoff_delay(attempts), error, now, job_id)
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET status = ?, locked_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                (STATUS_FAILED, error, now, job_id)
+            )
+    finally:
+        conn.close()
+
+    return will_retry
+
+
+def get_job(job_id: str) -> dict | None:
+    """Возвращает задачу по id или None"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+
+    return _row_to_job(row) if row else None
@@ -0,0 +1,183 @@
+"""
+Обслуживание истории балансов (balance_transactions) в Supabase
+История разбита на месячные секции, на начало каждого месяца хранятся
+снимки балансов групп (см. supabase_schema.sql). Старые секции выгружаются
+в сжатые CSV-файлы (cold storage) и удаляются из БД целиком - без DELETE
+по миллионам строк; агрегаты отчетов (balance_rollups) при этом остаются
+
+Секция удаляется, только если число строк в БД совпало с файлом и на конец
+месяца есть снимок баланса каждой ее группы, поэтому проверка баланса
+(снимок + операции после него) не зависит от того, что ушло в архив
+
+Запуск (по cron, например раз в сутки):
+  python ledger_archive.py maintain                        # секции вперед и снимки
+  python ledger_archive.py archive --retention-months 12   # выгрузка и удаление старых секций
+  python ledger_archive.py verify                          # сверка балансов по снимкам
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import metrics
+from ledger_export import COLUMNS, iter_pages
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+LEDGER_ARCHIVE_DIR = os.getenv("LEDGER_ARCHIVE_DIR", os.path.join(DATA_DIR, "ledger_archive"))
+LEDGER_RETENTION_MONTHS = int(os.getenv("LEDGER_RETENTION_MONTHS", "12"))  # месяцев истории в БД
+
+# Блок чтения файла при подсчете контрольной суммы
+HASH_BLOCK = 1024 * 1024
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def retention_cutoff(months: int, now: datetime | None = None) -> datetime:
+    """Начало месяца months месяцев назад (UTC): секции, закончившиеся до него, уходят в архив"""
+    now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    month_index = now.year * 12 + now.month - 1 - months
+    return datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(HASH_BLOCK):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_partition(client, partition: str, path: str) -> int:
+    """
+    Пишет строки секции в CSV (gzip) по возрастанию id: страницы с условием
+    id > последнего (ledger_export.iter_pages), поэтому в памяти одна страница,
+    а запрос страницы не замедляется к концу секции
+    Файл появляется под итоговым именем только целиком. Возвращает число строк
+    """
+    tmp_path = path + '.tmp'
+    rows = 0
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for page in iter_pages(client, partition):
+            writer.writerows([row[column] for column in COLUMNS] for row in page)
+            rows += len(page)
+    os.replace(tmp_path, path)
+    return rows
+
+
+def maintain(client) -> dict:
+    """Секции на месяцы вперед и снимки на начало закрытых месяцев (maintain_balance_ledger)"""
+    result = metrics.timed_execute(client.rpc('maintain_balance_ledger', {}), 'maintain_balance_ledger', 'rpc').data
+    if result and (result.get('partitions_created') or result.get('snapshots')):
+        logger.info(f"Обслуживание истории: создано секций {result.get('partitions_created')}, "
+                    f"снимков {result.get('snapshots')}")
+    return result or {}
+
+
+def archive(client, retention_months: int = LEDGER_RETENTION_MONTHS, dry_run: bool = False) -> list[dict]:
+    """
+    Выгружает в LEDGER_ARCHIVE_DIR и удаляет секции, закончившиеся раньше
+    retention_months месяцев назад, от старых к новым. Останавливается на
+    первой секции без снимка на конец месяца (maintain еще не закрыл месяц)
+    Возвращает список выгруженных секций
+    """
+    cutoff = retention_cutoff(retention_months)
+    partitions = metrics.timed_execute(
+        client.rpc('list_balance_partitions', {}), 'list_balance_partitions', 'rpc'
+    ).data or []
+    os.makedirs(LEDGER_ARCHIVE_DIR, exist_ok=True)
+
+    archived = []
+    for partition in partitions:
+        name = partition['partition_name']
+        if _parse_time(partition['month_end']) > cutoff:
+            break
+        if not partition['archivable']:
+            logger.warning(f"Секция {name}: нет снимка балансов на конец месяца, архив остановлен")
+            break
+        if dry_run:
+            logger.info(f"Секция {name} будет выгружена в архив")
+            archived.append({'partition': name})
+            continue
+
+        file_name = f"{name}.csv.gz"
+        path = os.path.join(LEDGER_ARCHIVE_DIR, file_name)
+        rows = export_partition(client, name, path)
+        sha256 = file_sha256(path)
+        # БД сверяет число строк под блокировкой секции: если после выгрузки
+        # в нее попала запоздавшая операция, секция не удаляется
+        metrics.timed_execute(client.rpc('drop_balance_partition', {
+            'p_partition': name,
+            'p_rows': rows,
+            'p_file': file_name,
+            'p_sha256': sha256,
+        }), 'drop_balance_partition', 'rpc')
+        logger.info(f"Секция {name} выгружена в {path} ({rows} строк, {os.path.getsize(path)} байт) и удалена")
+        archived.append({'partition': name, 'rows': rows, 'file': path, 'sha256': sha256})
+    return archived
+
+
+def verify(client) -> list[dict]:
+    """Сверка current_balance групп с последним снимком и операциями после него; возвращает расхождения"""
+    rows = metrics.timed_execute(client.rpc('verify_group_balances', {}), 'verify_group_balances', 'rpc').data or []
+    mismatches = []
+    for row in rows:
+        computed = Decimal(str(row['computed_balance']))
+        current = Decimal(str(row['current_balance'] or 0))
+        status = 'OK' if computed == current else 'РАСХОЖДЕНИЕ'
+        logger.info(f"Группа {row['group_id']}: снимок {row['snapshot_balance']} на {row['snapshot_at']}, "
+                    f"операций после него {row['recent_transactions']}, расчет {computed}, "
+                    f"в group_balances {current} - {status}")
+        if computed != current:
+            mismatches.append(row)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание и архив истории балансов")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('maintain', help="секции на месяцы вперед и месячные снимки балансов")
+    archive_parser = subparsers.add_parser('archive', help="выгрузка старых секций в файлы и удаление из БД")
+    archive_parser.add_argument('--retention-months', type=int, default=LEDGER_RETENTION_MONTHS)
+    archive_parser.add_argument('--dry-run', action='store_true', help="только показать секции для архива")
+    subparsers.add_parser('verify', help="сверка балансов: снимок + операции после него")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        logger.error("SUPABASE_URL или SUPABASE_KEY не установлены!")
+        sys.exit(1)
+
+    from supabase import create_client
+    client = create_client(supabase_url, supabase_key)
+
+    if args.command == 'maintain':
+        maintain(client)
+    elif args.command == 'archive':
+        # Сначала закрываем месяцы, чтобы у секций были снимки
+        maintain(client)
+        archived = archive(client, args.retention_months, args.dry_run)
+        logger.info(f"Секций {'к выгрузке' if args.dry_run else 'выгружено'}: {len(archived)}")
+    elif args.command == 'verify':
+        mismatches = verify(client)
+        if mismatches:
+            logger.error(f"Расхождений: {len(mismatches)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+"""
+Выгрузка истории балансов (balance_transactions) и проверка ее целостности
+История читается из Supabase постранично по ключу (group_id, id): страница -
+строки группы с id больше последнего прочитанного (индекс
+idx_balance_transactions_group_seq), поэтому запрос не замедляется к концу
+истории, как с offset, а в памяти только страницы в пути. Диапазон id группы
+делится на отрезки, которые читаются параллельно (--workers), а пишутся по
+порядку - файл отсортирован по (group_id, id)
+
+Проверка идет по странице целиком (numpy, суммы в копейках int64):
+- chain: previous_balance строки равен new_balance предыдущей строки группы
+- amount: new_balance - previous_balance = amount
+- start: первая строка группы начинается с 0 (или со снимка на конец архива)
+- balance: последний new_balance и начало + сумма операций равны
+  group_balances.current_balance
+Каждое нарушение пишется в отчет (--breaks), в лог - первые BREAKS_LOG_LIMIT
+
+Запуск:
+  python ledger_export.py export ledger.csv.gz              # CSV (gzip по расширению .gz)
+  python ledger_export.py export ledger.parquet --audit     # Parquet (нужен pyarrow) и проверка
+  python ledger_export.py audit --breaks breaks.csv          # только проверка
+"""
+
+import argparse
+import csv
+import gzip
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+LEDGER_EXPORT_PAGE_SIZE = int(os.getenv("LEDGER_EXPORT_PAGE_SIZE", "1000"))  # строк в запросе (max rows Supabase)
+LEDGER_EXPORT_WORKERS = int(os.getenv("LEDGER_EXPORT_WORKERS", "4"))  # параллельных запросов
+EXPORT_RETRIES = 5
+PREFETCH_PAGES = 4  # страниц, прочитанных вперед, на отрезок
+PARQUET_ROW_GROUP = 100_000
+BREAKS_LOG_LIMIT = 20
+
+COLUMNS = ('id', 'group_id', 'user_id', 'username', 'amount', 'previous_balance', 'new_balance',
+           'transaction_type', 'message_id', 'created_at')
+MONEY_COLUMNS = ('amount', 'previous_balance', 'new_balance')
+BREAK_COLUMNS = ('group_id', 'id', 'check', 'expected', 'actual')
+
+
+def _execute(query, operation: str = 'export') -> list[dict]:
+    """Запрос с повторами: выгрузка идет долго, единичный сбой сети не должен ее обрывать"""
+    for attempt in range(1, EXPORT_RETRIES + 1):
+        try:
+            return metrics.timed_execute(query, 'balance_transactions', operation).data
+        except Exception as e:
+            if attempt == EXPORT_RETRIES:
+                raise
+            delay = min(2 ** attempt, 30)
+            logger.warning(f"Ошибка запроса истории (попытка {attempt}), повтор через {delay} с: {e}")
+            time.sleep(delay)
+
+
+def iter_pages(client, table: str = 'balance_transactions', page_size: int = LEDGER_EXPORT_PAGE_SIZE,
+               group_id: int | None = None, id_from: int | None = None, id_to: int | None = None):
+    """
+    Страницы строк по возрастанию id (keyset: id > последнего прочитанного)
+    Конец - пустая страница: сервер может отдавать меньше page_size строк (max rows)
+    """
+    last_id = None
+    while True:
+        query = client.table(table).select(','.join(COLUMNS)).order('id').limit(page_size)
+        if group_id is not None:
+            query = query.eq('group_id', group_id)
+        if id_to is not None:
+            query = query.lt('id', id_to)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        elif id_from is not None:
+            query = query.gte('id', id_from)
+        page = _execute(query)
+        if not page:
+            return
+        yield page
+        last_id = page[-1]['id']
+
+
+def _edge_id(client, group_id: int, desc: bool) -> int | None:
+    rows = _execute(
+        client.table('balance_transactions').select('id').eq('group_id', group_id).order('id', desc=desc).limit(1),
+        'export_plan'
+    )
+    return rows[0]['id'] if rows else None
+
+
+def plan_slices(client, group_ids: list[int], parts: int, page_size: int) -> list[tuple[int, int, int]]:
+    """Отрезки (group_id, id_from, id_to) по порядку; диапазон id группы делится на parts частей"""
+    slices = []
+    for group_id in group_ids:
+        first = _edge_id(client, group_id, desc=False)
+        if first is None:
+            continue
+        last = _edge_id(client, group_id, desc=True)
+        count = parts if last - first > page_size * parts else 1
+        bounds = [first + (last + 1 - first) * i // count for i in range(count)] + [last + 1]
+        slices.extend((group_id, lo, hi) for lo, hi in zip(bounds, bounds[1:]) if hi > lo)
+    return slices
+
+
+def stream_pages(client, slices: list[tuple[int, int, int]], page_size: int, workers: int):
+    """
+    Страницы всех отрезков по порядку; отрезки читаются параллельно, каждый -
+    не больше PREFETCH_PAGES страниц вперед (память не зависит от объема истории)
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=PREFETCH_PAGES) for _ in slices]
+
+    def fetch(slice_index: int) -> None:
+        group_id, id_from, id_to = slices[slice_index]
+        target = queues[slice_index]
+        try:
+            for page in iter_pages(client, page_size=page_size, group_id=group_id, id_from=id_from, id_to=id_to):
+                while True:
+                    if stop.is_set():
+                        return
+                    try:
+                        target.put(page, timeout=0.5)
+                        break
+                    except queue.Full:
+                        pass
+            target.put(None)
+        except Exception as e:
+            target.put(e)
+
+    # Отрезки запускаются по порядку: самый ранний незавершенный всегда читается
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ledger-export")
+    for slice_index in range(len(slices)):
+        executor.submit(fetch, slice_index)
+    try:
+        for source in queues:
+            while (item := source.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _cents(values: list) -> np.ndarray:
+    """Суммы (числа JSON или строки) в копейки int64 - сравнение без ошибок округления"""
+    return np.rint(np.asarray(values, dtype=np.float64) * 100).astype(np.int64)
+
+
+def page_arrays(page: list[dict]) -> dict:
+    """Колонки страницы: id и денежные поля как массивы int64 (копейки)"""
+    arrays = {'id': np.fromiter((row['id'] for row in page), dtype=np.int64, count=len(page))}
+    for column in MONEY_COLUMNS:
+        arrays[column] = _cents([row[column] for row in page])
+    return arrays
+
+
+def format_cents(cents: int) -> str:
+    sign = '-' if cents < 0 else ''
+    units, fraction = divmod(abs(int(cents)), 100)
+    return f"{sign}{units}.{fraction:02d}"
+
+
+class LedgerAudit:
+    """Проверка цепочки балансов и сумм: страницы одной группы приходят по возрастанию id"""
+
+    def __init__(self, breaks_path: str | None = None, start_balances: dict[int, int] | None = None):
+        self.groups: dict[int, dict] = {}
+        self.start_balances = start_balances or {}
+        self.breaks = {}
+        self._breaks_file = open(breaks_path, 'w', newline='', encoding='utf-8') if breaks_path else None
+        self._breaks_writer = csv.writer(self._breaks_file) if self._breaks_file else None
+        if self._breaks_writer:
+            self._breaks_writer.writerow(BREAK_COLUMNS)
+
+    def _break(self, group_id: int, row_id, check: str, expected: int, actual: int) -> None:
+        count = self.breaks.get(check, 0) + 1
+        self.breaks[check] = count
+        if self._breaks_writer:
+            self._breaks_writer.writerow((group_id, row_id, check, format_cents(expected), format_cents(actual)))
+        if sum(self.breaks.values()) <= BREAKS_LOG_LIMIT:
+            logger.warning(f"Нарушение {check}: группа {group_id}, строка {row_id}, "
+                           f"ожидалось {format_cents(expected)}, в истории {format_cents(actual)}")
+
+    def add_page(self, group_id: int, arrays: dict) -> None:
+        ids, amount = arrays['id'], arrays['amount']
+        previous, new = arrays['previous_balance'], arrays['new_balance']
+
+        state = self.groups.get(group_id)
+        if state is None:
+            start = self.start_balances.get(group_id, 0)
+            state = self.groups[group_id] = {'rows': 0, 'sum': 0, 'start': start, 'last_new': start}
+            if previous[0] != start:
+                self._break(group_id, int(ids[0]), 'start', start, int(previous[0]))
+                # Дальше цепочка проверяется от фактического начала
+                state['last_new'] = int(previous[0])
+
+        expected_previous = np.empty_like(previous)
+        expected_previous[0] = state['last_new']
+        expected_previous[1:] = new[:-1]
+        for index in np.flatnonzero(previous != expected_previous):
+            self._break(group_id, int(ids[index]), 'chain', int(expected_previous[index]), int(previous[index]))
+        for index in np.flatnonzero(new - previous != amount):
+            self._break(group_id, int(ids[index]), 'amount', int(previous[index] + amount[index]), int(new[index]))
+
+        state['rows'] += len(ids)
+        state['sum'] += int(amount.sum())
+        state['last_new'] = int(new[-1])
+
+    def finish(self, current_balances: dict[int, int]) -> dict:
+        """Сверка с group_balances.current_balance; возвращает итог проверки"""
+        for group_id in sorted(set(current_balances) | set(self.groups)):
+            current = current_balances.get(group_id, 0)
+            state = self.groups.get(group_id)
+            if state is None:
+                start = self.start_balances.get(group_id, 0)
+                if current != start:
+                    self._break(group_id, None, 'balance', start, current)
+                continue
+            if state['start'] + state['sum'] != current:
+                self._break(group_id, None, 'sum', state['start'] + state['sum'], current)
+            if state['last_new'] != current:
+                self._break(group_id, None, 'balance', state['last_new'], current)
+        if self._breaks_file:
+            self._breaks_file.close()
+        return {
+            'groups': len(self.groups),
+            'rows': sum(state['rows'] for state in self.groups.values()),
+            'breaks': dict(self.breaks),
+        }
+
+
+class CsvLedgerWriter:
+    def __init__(self, path: str):
+        self._file = gzip.open(path, 'wt', encoding='utf-8', newline='') if path.endswith('.gz') \
+            else open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+
+    def write(self, page: list[dict], arrays: dict) -> None:
+        money = [[format_cents(value) for value in arrays[column].tolist()] for column in MONEY_COLUMNS]
+        self._writer.writerows(
+            (row['id'], row['group_id'], row['user_id'], row['username'], amount, previous, new,
+             row['transaction_type'], row['message_id'], row['created_at'])
+            for row, amount, previous, new in zip(page, *money)
+        )
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetLedgerWriter:
+    """Parquet: суммы - decimal(15, 2) как в БД, время - timestamp UTC; группы строк по PARQUET_ROW_GROUP"""
+
+    def __init__(self, path: str):
+        if pa is None:
+            raise RuntimeError("Для Parquet нужен pyarrow: pip install pyarrow")
+        self.schema = pa.schema([
+            ('id', pa.int64()), ('group_id', pa.int64()), ('user_id', pa.int64()), ('username', pa.string()),
+            ('amount', pa.decimal128(15, 2)), ('previous_balance', pa.decimal128(15, 2)),
+            ('new_balance', pa.decimal128(15, 2)), ('transaction_type', pa.string()),
+            ('message_id', pa.int64()), ('created_at', pa.timestamp('us', tz='UTC')),
+        ])
+        self._writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        self._pages = []
+        self._rows = 0
+
+    @staticmethod
+    def _decimal(cents: np.ndarray):
+        # decimal128 хранит целое без масштаба: младшие 64 бита - копейки, старшие - знак
+        words = np.empty((len(cents), 2), dtype='<i8')
+        words[:, 0] = cents
+        words[:, 1] = cents >> 63
+        return pa.Array.from_buffers(pa.decimal128(15, 2), len(cents), [None, pa.py_buffer(words.tobytes())])
+
+    def write(self, page: list[dict], arrays: dict) -> None:
+        self._pages.append((page, arrays))
+        self._rows += len(page)
+        if self._rows >= PARQUET_ROW_GROUP:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pages:
+            return
+        rows = [row for page, _ in self._pages for row in page]
+        columns = {}
+        for name in ('group_id', 'user_id', 'username', 'transaction_type', 'message_id'):
+            columns[name] = pa.array([row[name] for row in rows], type=self.schema.field(name).type)
+        columns['id'] = pa.array(np.concatenate([arrays['id'] for _, arrays in self._pages]))
+        for name in MONEY_COLUMNS:
+            columns[name] = self._decimal(np.concatenate([arrays[name] for _, arrays in self._pages]))
+        columns['created_at'] = pa.array([row['created_at'] for row in rows]).cast(
+            pa.timestamp('us', tz='UTC'))
+        self._writer.write_table(pa.table([columns[name] for name in self.schema.names], schema=self.schema))
+        self._pages = []
+        self._rows = 0
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+def open_writer(path: str, fmt: str | None = None):
+    fmt = fmt or ('parquet' if path.endswith('.parquet') else 'csv')
+    return ParquetLedgerWriter(path) if fmt == 'parquet' else CsvLedgerWriter(path)
+
+
+def fetch_current_balances(client) -> dict[int, int]:
+    rows = _execute(client.table('group_balances').select('group_id, current_balance').order('group_id'),
+                    'export_plan')
+    return {int(row['group_id']): int(cents) for row, cents in
+            zip(rows, _cents([row['current_balance'] or 0 for row in rows]))}
+
+
+def fetch_start_balances(client) -> dict[int, int]:
+    """
+    Баланс групп на начало хранимой истории: снимок на конец последнего
+    архивного месяца (ledger_archive.py); без архива история начинается с 0
+    """
+    archives = _execute(
+        client.table('balance_archives').select('month_end').order('month_end', desc=True).limit(1), 'export_plan'
+    )
+    if not archives:
+        return {}
+    rows = _execute(client.table('balance_snapshots').select('group_id, balance')
+                    .eq('taken_at', archives[0]['month_end']), 'export_plan')
+    return {int(row['group_id']): int(cents) for row, cents in zip(rows, _cents([row['balance'] for row in rows]))}
+
+
+def run(client, output: str | None = None, fmt: str | None = None, audit: bool = True,
+        breaks_path: str | None = None, group_ids: list[int] | None = None,
+        workers: int = LEDGER_EXPORT_WORKERS, page_size: int = LEDGER_EXPORT_PAGE_SIZE) -> dict:
+    """
+    Читает историю (всю или групп group_ids), пишет в output и/или проверяет
+    Возвращает {'rows', 'seconds', 'audit': итог проверки или None}
+    """
+    started = time.perf_counter()
+    current_balances = fetch_current_balances(client)
+    if group_ids is None:
+        group_ids = sorted(current_balances)
+    slices = plan_slices(client, group_ids, workers, page_size)
+    writer = open_writer(output, fmt) if output else None
+    auditor = LedgerAudit(breaks_path, fetch_start_balances(client)) if audit else None
+
+    rows = 0
+    try:
+        for page in stream_pages(client, slices, page_size, workers):
+            arrays = page_arrays(page)
+            if writer:
+                writer.write(page, arrays)
+            if auditor:
+                auditor.add_page(page[0]['group_id'], arrays)
+            rows += len(page)
+    finally:
+        if writer:
+            writer.close()
+
+    result = None
+    if auditor:
+        result = auditor.finish({group_id: current_balances.get(group_id, 0) for group_id in group_ids})
+    seconds = time.perf_counter() - started
+    logger.info(f"Прочитано строк: {rows} за {seconds:.1f} с ({rows / max(seconds, 1e-9):.0f} строк/с)")
+    return {'rows': rows, 'seconds': seconds, 'audit': result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка истории балансов и проверка целостности")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help="выгрузка в CSV или Parquet")
+    export_parser.add_argument('output', help="файл: .csv, .csv.gz или .parquet")
+    export_parser.add_argument('--format', choices=('csv', 'parquet'), help="по умолчанию - по расширению")
+    export_parser.add_argument('--audit', action='store_true', help="проверить историю во время выгрузки")
+    audit_parser = subparsers.add_parser('audit', help="только проверка целостности")
+    for sub in (export_parser, audit_parser):
+        sub.add_argument('--group-id', type=int, action='append', help="только эти группы (можно несколько)")
+        sub.add_argument('--breaks', help="CSV со всеми найденными нарушениями")
+        sub.add_argument('--workers', type=int, default=LEDGER_EXPORT_WORKERS)
+        sub.add_argument('--page-size', type=int, default=LEDGER_EXPORT_PAGE_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        logger.error("SUPABASE_URL или SUPABASE_KEY не установлены!")
+        sys.exit(1)
+
+    from supabase import create_client
+    client = create_client(supabase_url, supabase_key)
+
+    result = run(
+        client,
+        output=args.output if args.command == 'export' else None,
+        fmt=getattr(args, 'format', None),
+        audit=args.command == 'audit' or args.audit,
+        breaks_path=args.breaks,
+        group_ids=args.group_id,
+        workers=args.workers,
+        page_size=args.page_size,
+    )
+    if result['audit'] is not None:
+        breaks = result['audit']['breaks']
+        if breaks:
+            logger.error(f"Нарушений: {sum(breaks.values())} ({', '.join(f'{k}: {v}' for k, v in breaks.items())})")
+            sys.exit(1)
+        logger.info(f"Нарушений нет: групп {result['audit']['groups']}, строк {result['audit']['rows']}")
+
+
+if __name__ == "__main__":
+    main()
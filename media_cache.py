@@ -0,0 +1,198 @@
+"""
+Кэш file_id Telegram по содержимому файлов
+Анкету часто отправляют повторно с теми же фото и видео (после ошибки формы).
+Хеш содержимого считается еще при приеме загрузки, по мере записи файла, а после
+отправки запоминается file_id, который вернул Telegram: повторный файл уходит
+по file_id без загрузки байтов
+
+Хеш - SHA-256 от списка SHA-256 блоков по DIGEST_BLOCK байт: так его можно
+считать и потоково (multipart), и по частям, принятым в любом порядке
+(resumable_upload.py), и у одного файла он одинаковый при любом способе загрузки
+
+Кэш хранится в SQLite (data/media_cache.sqlite3), поэтому общий для всех
+воркеров gunicorn и процесса доставки и переживает рестарт. Записи удаляются
+через MEDIA_CACHE_TTL секунд без использования и сверх MEDIA_CACHE_MAX_ENTRIES
+(сначала давно не использованные)
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+MEDIA_CACHE = os.getenv("MEDIA_CACHE", "1") == "1"
+MEDIA_CACHE_DB_PATH = os.getenv("MEDIA_CACHE_DB_PATH", os.path.join(DATA_DIR, "media_cache.sqlite3"))
+MEDIA_CACHE_TTL = float(os.getenv("MEDIA_CACHE_TTL", str(30 * 24 * 3600)))  # секунд без использования
+MEDIA_CACHE_MAX_ENTRIES = int(os.getenv("MEDIA_CACHE_MAX_ENTRIES", "20000"))
+
+# Блок хеширования (части resumable_upload должны быть кратны ему)
+DIGEST_BLOCK = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media_files (
+    digest TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    file_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    PRIMARY KEY (digest, kind)
+);
+CREATE INDEX IF NOT EXISTS idx_media_files_last_used ON media_files(last_used_at);
+"""
+
+MEDIA_CACHE_REQUESTS = metrics.counter(
+    'media_cache_requests_total', "Поиск file_id по хешу файла: hit - найден, miss - нет, stale - отклонен Telegram",
+    ('kind', 'result')
+)
+MEDIA_CACHE_BYTES_SAVED = metrics.counter(
+    'media_cache_bytes_saved_total', "Байты файлов, отправленных по file_id вместо загрузки", ('kind',)
+)
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """Открывает соединение с базой кэша (создает схему при первом вызове)"""
+    global _schema_ready
+
+    if not _schema_ready:
+        os.makedirs(os.path.dirname(MEDIA_CACHE_DB_PATH) or '.', exist_ok=True)
+
+    conn = sqlite3.connect(MEDIA_CACHE_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(_SCHEMA)
+                _schema_ready = True
+
+    return conn
+
+
+class BlockDigest:
+    """Потоковый хеш содержимого: данные подаются по порядку кусками любого размера"""
+
+    def __init__(self):
+        self.blocks = []
+        self._block = hashlib.sha256()
+        self._filled = 0
+
+    def update(self, data) -> None:
+        view = memoryview(data)
+        while view:
+            take = min(len(view), DIGEST_BLOCK - self._filled)
+            self._block.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == DIGEST_BLOCK:
+                self.blocks.append(self._block.digest())
+                self._block = hashlib.sha256()
+                self._filled = 0
+
+    def block_digests(self) -> bytes:
+        """Хеши блоков, включая неполный последний"""
+        tail = [self._block.digest()] if self._filled else []
+        return b''.join(self.blocks + tail)
+
+    def hexdigest(self) -> str:
+        return combine(self.block_digests())
+
+
+def combine(block_digests: bytes) -> str:
+    """Хеш файла из хешей его блоков по порядку"""
+    return hashlib.sha256(block_digests).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """Хеш файла на диске (если при загрузке он не был посчитан)"""
+    digest = BlockDigest()
+    with open(path, 'rb') as f:
+        while block := f.read(DIGEST_BLOCK):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def lookup(digest: str | None, kind: str) -> str | None:
+    """file_id ранее отправленного файла или None; продлевает жизнь записи"""
+    if not MEDIA_CACHE or not digest:
+        return None
+    now = time.time()
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "UPDATE media_files SET hits = hits + 1, last_used_at = ? "
+            "WHERE digest = ? AND kind = ? AND last_used_at >= ? RETURNING file_id",
+            (now, digest, kind, now - MEDIA_CACHE_TTL)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Ошибка чтения кэша file_id: {e}")
+        return None
+    finally:
+        conn.close()
+    MEDIA_CACHE_REQUESTS.inc(kind=kind, result='hit' if row else 'miss')
+    return row['file_id'] if row else None
+
+
+def store(digest: str | None, kind: str, file_id: str, size: int) -> None:
+    """Запоминает file_id отправленного файла и удаляет лишние записи"""
+    if not MEDIA_CACHE or not digest or not file_id:
+        return
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "INSERT INTO media_files (digest, kind, file_id, size, created_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (digest, kind) DO UPDATE SET file_id = excluded.file_id, size = excluded.size, "
+            "last_used_at = excluded.last_used_at",
+            (digest, kind, file_id, size, now, now)
+        )
+        conn.execute("DELETE FROM media_files WHERE last_used_at < ?", (now - MEDIA_CACHE_TTL,))
+        conn.execute(
+            "DELETE FROM media_files WHERE rowid IN ("
+            "SELECT rowid FROM media_files ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (MEDIA_CACHE_MAX_ENTRIES,)
+        )
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        logger.warning(f"Ошибка записи в кэш file_id: {e}")
+    finally:
+        conn.close()
+
+
+def invalidate(digest: str | None, kind: str) -> None:
+    """Удаляет file_id, который Telegram не принял (другой бот, файл удален)"""
+    if not digest:
+        return
+    MEDIA_CACHE_REQUESTS.inc(kind=kind, result='stale')
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM media_files WHERE digest = ? AND kind = ?", (digest, kind))
+    except sqlite3.Error as e:
+        logger.warning(f"Ошибка удаления из кэша file_id: {e}")
+    finally:
+        conn.close()
+
+
+def saved(kind: str, path: str) -> None:
+    """Учитывает байты файла, отправленного по file_id"""
+    try:
+        MEDIA_CACHE_BYTES_SAVED.inc(os.path.getsize(path), kind=kind)
+    except OSError:
+        pass
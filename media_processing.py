@@ -0,0 +1,252 @@
+"""
+Подготовка медиа перед отправкой в Telegram
+Фото: HEIC -> JPEG, уменьшение до MAX_PHOTO_EDGE, удаление EXIF
+Видео: (опционально) перекодирование в H.264 MP4 в пределах VIDEO_MAX_BYTES
+
+Работа идет в пуле процессов (ProcessPoolExecutor), который вызывает
+delivery_worker.py, поэтому воркеры веб-сервера на ней не блокируются.
+Pillow, pillow-heif и ffmpeg необязательны: без них файл уходит как есть
+"""
+
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    from pillow_heif import register_heif_opener
+except ImportError:
+    register_heif_opener = None
+
+if Image is not None and register_heif_opener is not None:
+    register_heif_opener()
+
+logger = logging.getLogger(__name__)
+
+# Настройки
+MEDIA_PROCESSING = os.getenv("MEDIA_PROCESSING", "1") == "1"
+MEDIA_PROCESS_WORKERS = int(os.getenv("MEDIA_PROCESS_WORKERS", str(min(2, os.cpu_count() or 1))))
+MAX_PHOTO_EDGE = int(os.getenv("MAX_PHOTO_EDGE", "2560"))  # Telegram не показывает фото больше
+PHOTO_JPEG_QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY", "85"))
+VIDEO_TRANSCODE = os.getenv("VIDEO_TRANSCODE", "0") == "1"
+VIDEO_MAX_BYTES = int(os.getenv("VIDEO_MAX_BYTES", str(48 * 1024 * 1024)))  # лимит Bot API - 50 МБ
+VIDEO_MAX_HEIGHT = int(os.getenv("VIDEO_MAX_HEIGHT", "720"))
+VIDEO_AUDIO_BITRATE = 128_000  # бит/с
+VIDEO_PROBE_TIMEOUT = 60  # секунд
+VIDEO_TRANSCODE_TIMEOUT = int(os.getenv("VIDEO_TRANSCODE_TIMEOUT", "900"))  # секунд
+# Верхняя граница этапа подготовки медиа (по ней продлевается аренда задачи)
+MEDIA_STAGE_TIMEOUT = VIDEO_PROBE_TIMEOUT + VIDEO_TRANSCODE_TIMEOUT
+FFMPEG = shutil.which("ffmpeg")
+FFPROBE = shutil.which("ffprobe")
+
+# Фото, пережатые в браузере (script.js), приходят в JPEG
+CLIENT_OPTIMIZED_EXTENSIONS = {'jpg', 'jpeg'}
+# Метаданные JPEG, с которыми фото без перекодирования не отправляется
+PHOTO_METADATA_KEYS = ('exif', 'xmp', 'comment')
+
+_executor = None
+_executor_pid = None
+
+
+def _new_path(path: str, extension: str) -> str:
+    return os.path.join(os.path.dirname(path), f"{uuid.uuid4().hex}.{extension}")
+
+
+def _stats(path: str, new_path: str, bytes_in: int, cpu_started: float) -> dict:
+    return {
+        'path': new_path,
+        'bytes_in': bytes_in,
+        'bytes_out': os.path.getsize(new_path),
+        'cpu_seconds': time.process_time() - cpu_started,
+        'changed': new_path != path,
+    }
+
+
+def process_photo(path: str) -> dict:
+    """
+    Перекодирует фото в JPEG: поворот по EXIF, уменьшение, без метаданных
+    Результат отправляется всегда, даже если он не меньше исходного: в исходном
+    файле остаются EXIF с GPS и данными телефона
+    """
+    cpu_started = time.process_time()
+    bytes_in = os.path.getsize(path)
+
+    if Image is None:
+        return _stats(path, path, bytes_in, cpu_started)
+
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail((MAX_PHOTO_EDGE, MAX_PHOTO_EDGE), Image.LANCZOS)
+
+        new_path = _new_path(path, 'jpg')
+        # exif не передаем - метаданные (GPS, модель телефона) не уходят в группу
+        image.save(new_path, 'JPEG', quality=PHOTO_JPEG_QUALITY, optimize=True, progressive=True)
+
+    os.remove(path)
+    return _stats(path, new_path, bytes_in, cpu_started)
+
+
+def check_client_photo(path: str) -> dict:
+    """
+    Фото, пережатое браузером: флаг клиента не проверить, поэтому читается только
+    заголовок JPEG. Без метаданных и в пределах MAX_PHOTO_EDGE фото уходит как
+    есть, иначе - полная обработка process_photo
+    """
+    cpu_started = time.process_time()
+    bytes_in = os.path.getsize(path)
+
+    if Image is None:
+        return _stats(path, path, bytes_in, cpu_started)
+
+    with Image.open(path) as image:
+        clean = (
+            image.format == 'JPEG'
+            and max(image.size) <= MAX_PHOTO_EDGE
+            and not image.getexif()
+            and not any(key in image.info for key in PHOTO_METADATA_KEYS)
+        )
+    if not clean:
+        return process_photo(path)
+    return _stats(path, path, bytes_in, cpu_started)
+
+
+def _video_duration(path: str) -> float | None:
+    """Длительность видео в секундах (через ffprobe)"""
+    if not FFPROBE:
+        return None
+    result = subprocess.run(
+        [FFPROBE, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+        capture_output=True, text=True, timeout=VIDEO_PROBE_TIMEOUT
+    )
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+
+def process_video(path: str) -> dict:
+    """
+    Перекодирует видео в H.264 MP4 (faststart) с битрейтом под VIDEO_MAX_BYTES
+    Выполняется только при VIDEO_TRANSCODE=1 и наличии ffmpeg
+    """
+    cpu_started = time.process_time()
+    bytes_in = os.path.getsize(path)
+    extension = path.rsplit('.', 1)[-1].lower()
+
+    if not VIDEO_TRANSCODE or not FFMPEG:
+        return _stats(path, path, bytes_in, cpu_started)
+
+    if extension == 'mp4' and bytes_in <= VIDEO_MAX_BYTES:
+        return _stats(path, path, bytes_in, cpu_started)
+
+    duration = _video_duration(path)
+    if not duration:
+        return _stats(path, path, bytes_in, cpu_started)
+
+    # 5% запас на контейнер
+    video_bitrate = int(VIDEO_MAX_BYTES * 8 * 0.95 / duration) - VIDEO_AUDIO_BITRATE
+    if video_bitrate < 200_000:
+        logger.warning(f"Видео {path} слишком длинное для {VIDEO_MAX_BYTES} байт, отправляем как есть")
+        return _stats(path, path, bytes_in, cpu_started)
+
+    new_path = _new_path(path, 'mp4')
+    children_started = resource.getrusage(resource.RUSAGE_CHILDREN)
+    subprocess.run(
+        [FFMPEG, '-y', '-v', 'error', '-i', path,
+         '-vf', f"scale=-2:'min({VIDEO_MAX_HEIGHT},ih)'",
+         '-c:v', 'libx264', '-preset', 'veryfast', '-b:v', str(video_bitrate),
+         '-maxrate', str(video_bitrate), '-bufsize', str(video_bitrate * 2),
+         '-c:a', 'aac', '-b:a', str(VIDEO_AUDIO_BITRATE),
+         '-map_metadata', '-1', '-movflags', '+faststart', new_path],
+        check=True, capture_output=True, timeout=VIDEO_TRANSCODE_TIMEOUT
+    )
+
+    os.remove(path)
+    stats = _stats(path, new_path, bytes_in, cpu_started)
+    # ffmpeg работает в дочернем процессе - его CPU не виден через process_time
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    stats['cpu_seconds'] += (children.ru_utime - children_started.ru_utime) + \
+        (children.ru_stime - children_started.ru_stime)
+    return stats
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor, _executor_pid
+
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(max_workers=MEDIA_PROCESS_WORKERS)
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def prepare_media(photos: list | None, video: str | None,
+                  images_optimized: bool = False) -> tuple[list, str | None]:
+    """
+    Подготавливает файлы анкеты в пуле процессов
+    images_optimized - фото уже уменьшены и пережаты в JPEG браузером (script.js):
+    у JPEG проверяется только заголовок (check_client_photo), фото других
+    форматов все равно обрабатываются
+    Возвращает новые пути (photos, video); при ошибке для файла остается исходный путь
+    """
+    photos = list(photos or [])
+    if not MEDIA_PROCESSING:
+        return photos, video
+
+    executor = _get_executor()
+    photo_futures = [
+        executor.submit(
+            check_client_photo
+            if images_optimized and path.rsplit('.', 1)[-1].lower() in CLIENT_OPTIMIZED_EXTENSIONS
+            else process_photo,
+            path
+        )
+        for path in photos
+    ]
+    video_future = executor.submit(process_video, video) if video else None
+
+    new_photos = []
+    for path, future in zip(photos, photo_futures):
+        try:
+            stats = future.result()
+            new_photos.append(stats['path'])
+            if not stats['changed']:
+                logger.info(f"Фото {path} уже сжато клиентом, обработка пропущена")
+                continue
+            logger.info(f"Фото {path}: {stats['bytes_in']} -> {stats['bytes_out']} байт "
+                        f"за {stats['cpu_seconds'] * 1000:.0f} мс CPU")
+        except Exception as e:
+            logger.warning(f"Не удалось обработать фото {path}, отправляем как есть: {e}")
+            new_photos.append(path)
+
+    new_video = video
+    if video_future is not None:
+        try:
+            stats = video_future.result()
+            new_video = stats['path']
+            if stats['changed']:
+                logger.info(f"Видео {video}: {stats['bytes_in']} -> {stats['bytes_out']} байт "
+                            f"за {stats['cpu_seconds']:.1f} с")
+        except Exception as e:
+            logger.warning(f"Не удалось перекодировать видео {video}, отправляем как есть: {e}")
+
+    return new_photos, new_video
+
+
+def shutdown() -> None:
+    """Останавливает пул процессов"""
+    global _executor
+
+    if _executor is not None and _executor_pid == os.getpid():
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
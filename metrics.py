@@ -0,0 +1,296 @@
+"""
+Метрики процесса в текстовом формате Prometheus
+Счетчики и гистограммы задержек по этапам: сохранение загрузки, каждый метод
+Telegram API, каждый запрос Supabase, обработчик целиком. Веб-сервер отдает
+их на /metrics, balance_bot и delivery_worker - на отдельном порту
+(start_http_server)
+
+Запись метрики - словарь и bisect под блокировкой (порядка микросекунды),
+поэтому метрики включены всегда. Метрики живут в памяти процесса: у каждого
+воркера gunicorn свои значения
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")  # адрес отдельного порта метрик
+
+# Границы гистограмм, секунд: от быстрых ответов кэша до загрузки видео
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry: dict[str, 'Metric'] = {}
+_registry_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Общая часть метрик: имя, описание, имена меток"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        """Строки вида (суффикс имени, метки, значение)"""
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Монотонный счетчик"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        return [('', _labels_text(self.labelnames, key), value) for key, value in values]
+
+
+class _Timer:
+    """Замер времени блока with или корутины (декоратор)"""
+
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram: 'Histogram', labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels):
+                return await func(*args, **kwargs)
+        return wrapper
+
+
+class Histogram(Metric):
+    """Гистограмма значений (задержек в секундах) с накопительными корзинами"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики по корзинам (последняя - +Inf), сумма, количество]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels) -> _Timer:
+        """with histogram.time(stage='...'): ... или @histogram.time(...) для корутины"""
+        return _Timer(self, labels)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+
+        samples = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                samples.append(('_bucket', _labels_text(self.labelnames, key, le), cumulative))
+            labels = _labels_text(self.labelnames, key)
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class Callback(Metric):
+    """
+    Значение, которое читается в момент запроса метрик (размер очереди, статистика кэша)
+    callback возвращает число, словарь {значения меток: число} или None (нет данных)
+    """
+
+    def __init__(self, name: str, documentation: str, callback, kind: str = 'gauge', labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self) -> list:
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning(f"Метрика {self.name} не прочитана: {e}")
+            return []
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            return [('', '', value)]
+        return [('', _labels_text(self.labelnames, key if isinstance(key, tuple) else (key,)), item)
+                for key, item in value.items()]
+
+
+def _register(metric: Metric) -> Metric:
+    """Регистрирует метрику; повторная регистрация того же имени возвращает существующую"""
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None and not isinstance(metric, Callback):
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+    return _register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def register_callback(name: str, documentation: str, callback, kind: str = 'gauge', labelnames: tuple = ()) -> None:
+    """Значение, вычисляемое при запросе метрик; повторная регистрация заменяет callback"""
+    _register(Callback(name, documentation, callback, kind, labelnames))
+
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Метрики, общие для нескольких модулей
+HTTP_REQUEST_SECONDS = histogram(
+    'http_request_seconds', "Время обработки HTTP запроса веб-сервером", ('endpoint', 'method', 'status')
+)
+UPLOAD_STAGE_SECONDS = histogram(
+    'upload_stage_seconds', "Этапы приема анкеты: прием и запись файлов, постановка в очередь", ('stage',)
+)
+DELIVERY_STAGE_SECONDS = histogram(
+    'delivery_stage_seconds', "Этапы доставки анкеты воркером: обработка медиа, отправка", ('stage', 'result')
+)
+TELEGRAM_REQUEST_SECONDS = histogram(
+    'telegram_request_seconds', "Время вызова метода Telegram Bot API (без ожидания в очереди)", ('method', 'result')
+)
+TELEGRAM_QUEUE_SECONDS = histogram(
+    'telegram_queue_seconds', "Ожидание сообщения в очереди отправки до вызова Bot API", ('lane',)
+)
+SUPABASE_REQUEST_SECONDS = histogram(
+    'supabase_request_seconds', "Время запроса к Supabase по таблицам и функциям", ('table', 'operation')
+)
+SUPABASE_ERRORS = counter(
+    'supabase_errors_total', "Запросы к Supabase, завершившиеся ошибкой", ('table', 'operation')
+)
+BALANCE_HANDLER_SECONDS = histogram(
+    'balance_handler_seconds', "Обработчик balance_bot целиком, до отправки ответа", ('handler',)
+)
+BALANCE_MESSAGES = counter(
+    'balance_messages_total', "Сообщения с суммой: parsed - распознаны, rejected - не прошли валидацию, "
+    "failed - ошибка обработки", ('result',)
+)
+
+
+def timed_execute(query, table: str, operation: str):
+    """Выполняет запрос Supabase (query.execute()) с замером времени и учетом ошибок"""
+    started = time.perf_counter()
+    try:
+        return query.execute()
+    except Exception:
+        SUPABASE_ERRORS.inc(table=table, operation=operation)
+        raise
+    finally:
+        SUPABASE_REQUEST_SECONDS.observe(time.perf_counter() - started, table=table, operation=operation)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = METRICS_LISTEN) -> ThreadingHTTPServer | None:
+    """
+    Отдает /metrics на отдельном порту в фоновом потоке (для процессов без Flask)
+    port 0 - метрики по HTTP не отдаются
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info(f"Метрики: http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,359 @@
+"""
+Возобновляемая загрузка файлов частями
+Клиент создает загрузку (имя и размер файла), отправляет части PUT-запросами
+по смещению - параллельно и в любом порядке - и завершает загрузку.
+Каждая часть пишется сразу на свое место в файле блоками, без буферизации
+в памяти. Обрыв соединения теряет одну часть, а не весь файл: по статусу
+загрузки клиент досылает только недостающие части
+
+Состояние загрузок хранится в SQLite (data/uploads.sqlite3), поэтому части
+одного файла могут принимать разные воркеры gunicorn. Незавершенные загрузки
+удаляются через UPLOAD_TTL секунд. Хеш содержимого для кэша file_id
+(media_cache.py) считается по блокам при записи каждой части
+"""
+
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import media_cache
+from upload_storage import (
+    UPLOAD_FOLDER, ALLOWED_PHOTO_EXTENSIONS, ALLOWED_VIDEO_EXTENSIONS, file_extension
+)
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+UPLOADS_DB_PATH = os.getenv("UPLOADS_DB_PATH", os.path.join(DATA_DIR, "uploads.sqlite3"))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(4 * 1024 * 1024)))  # байт в части
+UPLOAD_MAX_PHOTO_BYTES = int(os.getenv("UPLOAD_MAX_PHOTO_BYTES", str(30 * 1024 * 1024)))
+# Bot API принимает видео до 50 МБ: больше имеет смысл принимать, только если
+# media_processing.py перекодирует его под VIDEO_MAX_BYTES (VIDEO_TRANSCODE=1)
+BOT_API_MAX_VIDEO_BYTES = 50 * 1024 * 1024
+VIDEO_TRANSCODE = os.getenv("VIDEO_TRANSCODE", "0") == "1"
+UPLOAD_MAX_VIDEO_BYTES = int(os.getenv(
+    "UPLOAD_MAX_VIDEO_BYTES", str(500 * 1024 * 1024 if VIDEO_TRANSCODE else BOT_API_MAX_VIDEO_BYTES)
+))
+if not VIDEO_TRANSCODE and UPLOAD_MAX_VIDEO_BYTES > BOT_API_MAX_VIDEO_BYTES:
+    logger.warning(f"UPLOAD_MAX_VIDEO_BYTES={UPLOAD_MAX_VIDEO_BYTES} больше лимита Bot API без VIDEO_TRANSCODE=1, "
+                   f"используется {BOT_API_MAX_VIDEO_BYTES}")
+    UPLOAD_MAX_VIDEO_BYTES = BOT_API_MAX_VIDEO_BYTES
+UPLOAD_TTL = float(os.getenv("UPLOAD_TTL", str(24 * 3600)))  # секунд на загрузку до удаления
+
+# Блок записи части на диск
+WRITE_BLOCK = 64 * 1024
+
+# Статусы загрузок
+STATUS_UPLOADING = 'uploading'
+STATUS_COMPLETE = 'complete'
+STATUS_USED = 'used'  # файл передан анкете, им владеет очередь доставки
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    digest TEXT
+);
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    upload_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    digests BLOB,
+    PRIMARY KEY (upload_id, chunk)
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_created_at ON uploads(created_at);
+"""
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """Открывает соединение с базой загрузок (создает схему при первом вызове)"""
+    global _schema_ready
+
+    if not _schema_ready:
+        os.makedirs(os.path.dirname(UPLOADS_DB_PATH) or '.', exist_ok=True)
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+    conn = sqlite3.connect(UPLOADS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.executescript(_SCHEMA)
+                _add_missing_columns(conn)
+                _schema_ready = True
+
+    return conn
+
+
+def _add_missing_columns(conn: sqlite3.Connection) -> None:
+    """Колонки хешей в базе, созданной до кэша file_id"""
+    for table, column, kind in (('uploads', 'digest', 'TEXT'), ('upload_chunks', 'digests', 'BLOB')):
+        columns = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+
+def _chunk_count(size: int, chunk_size: int) -> int:
+    return math.ceil(size / chunk_size)
+
+
+def _upload_info(conn: sqlite3.Connection, row: sqlite3.Row) -> dict:
+    """Статус загрузки для клиента: какие части уже приняты"""
+    received = [chunk for (chunk,) in conn.execute(
+        "SELECT chunk FROM upload_chunks WHERE upload_id = ? ORDER BY chunk", (row['id'],)
+    )]
+    return {
+        'upload_id': row['id'],
+        'filename': row['filename'],
+        'size': row['size'],
+        'chunk_size': row['chunk_size'],
+        'chunks': _chunk_count(row['size'], row['chunk_size']),
+        'received': received,
+        'status': row['status'],
+    }
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def max_size(extension: str) -> int:
+    """Допустимый размер файла по расширению (0 - расширение не принимается)"""
+    if extension in ALLOWED_PHOTO_EXTENSIONS:
+        return UPLOAD_MAX_PHOTO_BYTES
+    if extension in ALLOWED_VIDEO_EXTENSIONS:
+        return UPLOAD_MAX_VIDEO_BYTES
+    return 0
+
+
+def create_upload(filename: str, size: int) -> dict:
+    """
+    Создает загрузку и пустой файл нужного размера
+    ValueError - недопустимое расширение или размер
+    """
+    extension = file_extension(filename)
+    limit = max_size(extension)
+    if not limit:
+        raise ValueError("Недопустимый тип файла")
+    if size <= 0 or size > limit:
+        raise ValueError(f"Недопустимый размер файла (максимум {limit // (1024 * 1024)} МБ)")
+
+    purge_expired()
+
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(UPLOAD_FOLDER, f"{upload_id}.{extension}.part")
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO uploads (id, filename, extension, size, chunk_size, status, path, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (upload_id, filename, extension, size, UPLOAD_CHUNK_SIZE, STATUS_UPLOADING, path, now, now)
+        )
+        row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        return _upload_info(conn, row)
+    finally:
+        conn.close()
+
+
+def get_upload(upload_id: str) -> dict | None:
+    """Статус загрузки или None"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        return _upload_info(conn, row) if row is not None else None
+    finally:
+        conn.close()
+
+
+def write_chunk(upload_id: str, offset: int, stream, length: int | None) -> dict | None:
+    """
+    Пишет часть, начинающуюся с offset, из потока запроса на ее место в файле
+    Повторная отправка той же части перезаписывает ее (идемпотентно)
+    Возвращает статус загрузки; None - загрузки нет; ValueError - неверная часть
+    """
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    if row['status'] != STATUS_UPLOADING:
+        raise ValueError("Загрузка уже завершена")
+
+    chunk_size = row['chunk_size']
+    if offset < 0 or offset >= row['size'] or offset % chunk_size:
+        raise ValueError(f"Смещение должно быть кратно {chunk_size} и меньше размера файла")
+    expected = min(chunk_size, row['size'] - offset)
+    if length != expected:
+        raise ValueError(f"Размер части должен быть {expected} байт")
+
+    # Часть, кратная блоку хеширования, хешируется по ходу записи;
+    # иначе хеш файла считается при завершении загрузки
+    digest = media_cache.BlockDigest() if chunk_size % media_cache.DIGEST_BLOCK == 0 else None
+    written = 0
+    with open(row['path'], 'r+b') as f:
+        f.seek(offset)
+        while written < expected:
+            block = stream.read(min(WRITE_BLOCK, expected - written))
+            if not block:
+                break
+            f.write(block)
+            if digest is not None:
+                digest.update(block)
+            written += len(block)
+    if written != expected:
+        # Обрыв соединения: часть не засчитывается, клиент отправит ее снова
+        raise ValueError("Часть получена не полностью")
+
+    conn = _connect()
+    try:
+        # Повторно отправленная часть перезаписала файл - хеши тоже заменяются
+        conn.execute(
+            "INSERT INTO upload_chunks (upload_id, chunk, digests) VALUES (?, ?, ?) "
+            "ON CONFLICT (upload_id, chunk) DO UPDATE SET digests = excluded.digests",
+            (upload_id, offset // chunk_size, digest.block_digests() if digest is not None else None)
+        )
+        conn.execute("UPDATE uploads SET updated_at = ? WHERE id = ?", (time.time(), upload_id))
+        return _upload_info(conn, row)
+    finally:
+        conn.close()
+
+
+def finalize_upload(upload_id: str) -> dict | None:
+    """
+    Завершает загрузку, если приняты все части (повторный вызов ничего не меняет)
+    None - загрузки нет; ValueError - получены не все части
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        if row['status'] == STATUS_UPLOADING:
+            (received,) = conn.execute(
+                "SELECT COUNT(*) FROM upload_chunks WHERE upload_id = ?", (upload_id,)
+            ).fetchone()
+            missing = _chunk_count(row['size'], row['chunk_size']) - received
+            if missing:
+                conn.execute("COMMIT")
+                raise ValueError(f"Не получено частей: {missing}")
+
+            chunk_digests = [digests for (digests,) in conn.execute(
+                "SELECT digests FROM upload_chunks WHERE upload_id = ? ORDER BY chunk", (upload_id,)
+            )]
+            if all(chunk_digests):
+                digest = media_cache.combine(b''.join(chunk_digests))
+            else:
+                digest = media_cache.file_digest(row['path'])
+
+            path = row['path'][:-len('.part')]
+            os.replace(row['path'], path)
+            conn.execute(
+                "UPDATE uploads SET status = ?, path = ?, digest = ?, updated_at = ? WHERE id = ?",
+                (STATUS_COMPLETE, path, digest, time.time(), upload_id)
+            )
+            conn.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (upload_id,))
+            row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+            logger.info(f"Загрузка {upload_id} завершена: {row['filename']}, {row['size']} байт")
+        conn.execute("COMMIT")
+        return _upload_info(conn, row)
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def claim_uploads(photo_ids: list[str], video_id: str | None = None) -> tuple[list[str], str | None, dict]:
+    """
+    Передает завершенные загрузки анкете, возвращает (пути фото, путь видео,
+    {путь: хеш содержимого})
+    Загрузку можно использовать один раз; файлы дальше удаляет воркер доставки
+    ValueError - загрузка не найдена, не завершена, недопустимого типа или
+    указана дважды (тогда ни одна загрузка не считается использованной)
+    """
+    claims = [(upload_id, ALLOWED_PHOTO_EXTENSIONS) for upload_id in photo_ids]
+    if video_id:
+        claims.append((video_id, ALLOWED_VIDEO_EXTENSIONS))
+    if not claims:
+        return [], None, {}
+    if len({upload_id for upload_id, _ in claims}) != len(claims):
+        raise ValueError("Загрузка указана несколько раз")
+
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        paths = []
+        digests = {}
+        for upload_id, allowed_extensions in claims:
+            row = conn.execute("SELECT * FROM uploads WHERE id = ?", (upload_id,)).fetchone()
+            if row is None or row['status'] != STATUS_COMPLETE:
+                raise ValueError(f"Загрузка {upload_id} не найдена или не завершена")
+            if row['extension'] not in allowed_extensions:
+                raise ValueError(f"Недопустимый тип файла: {row['filename']}")
+            # Загрузка переходит к анкете ровно один раз
+            claimed = conn.execute(
+                "UPDATE uploads SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (STATUS_USED, time.time(), upload_id, STATUS_COMPLETE)
+            )
+            if claimed.rowcount != 1:
+                raise ValueError(f"Загрузка {upload_id} уже использована")
+            paths.append(row['path'])
+            if row['digest']:
+                digests[row['path']] = row['digest']
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    if video_id:
+        return paths[:-1], paths[-1], digests
+    return paths, None, digests
+
+
+def purge_expired() -> int:
+    """Удаляет загрузки старше UPLOAD_TTL (файлы - если они не переданы анкете)"""
+    cutoff = time.time() - UPLOAD_TTL
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT id, status, path FROM uploads WHERE created_at < ?", (cutoff,)).fetchall()
+        for row in rows:
+            if row['status'] != STATUS_USED:
+                _remove_file(row['path'])
+            conn.execute("DELETE FROM upload_chunks WHERE upload_id = ?", (row['id'],))
+            conn.execute("DELETE FROM uploads WHERE id = ?", (row['id'],))
+    finally:
+        conn.close()
+
+    if rows:
+        logger.info(f"Удалено устаревших загрузок: {len(rows)}")
+    return len(rows)
@@ -71,6 +71,175 @@ function toggleExperienceDetails() {
   }
 }
 
+// Files go to /api/uploads in parts, several at a time: a dropped connection
+// resends only the lost part, and /api/submit gets upload ids instead of files
+const UPLOAD_PARALLEL = 3;
+const UPLOAD_RETRIES = 5;
+
+// 429/503 from the server's admission control carry Retry-After:
+// wait that long and send the same request again
+async function fetchWithRetry(url, options) {
+  for (let attempt = 1; ; attempt++) {
+    const response = await fetch(url, options);
+    if ((response.status !== 429 && response.status !== 503) || attempt >= UPLOAD_RETRIES) return response;
+    const retryAfter = Number(response.headers.get('Retry-After')) || 2 ** attempt;
+    await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+  }
+}
+
+async function uploadRequest(url, options) {
+  const response = await fetchWithRetry(url, options);
+  const result = await response.json();
+  if (!response.ok || !result.success) {
+    const error = new Error(result.message || 'HTTP ' + response.status);
+    error.status = response.status;
+    throw error;
+  }
+  return result;
+}
+
+async function putChunk(upload, file, chunk) {
+  const offset = chunk * upload.chunk_size;
+  const end = Math.min(offset + upload.chunk_size, file.size);
+  for (let attempt = 1; ; attempt++) {
+    try {
+      await uploadRequest(`/api/uploads/${upload.upload_id}?offset=${offset}`, {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/octet-stream' },
+        body: file.slice(offset, end)
+      });
+      return end - offset;
+    } catch (error) {
+      // Network errors and 5xx are retried with a growing pause, 4xx are not
+      if (attempt >= UPLOAD_RETRIES || (error.status && error.status < 500)) throw error;
+      await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** (attempt - 1)));
+    }
+  }
+}
+
+async function uploadFiles(files, onProgress) {
+  const uploads = await Promise.all(files.map(file => uploadRequest('/api/uploads', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size: file.size })
+  })));
+
+  // One queue of parts for all files: small photos don't wait for the video
+  const pending = [];
+  uploads.forEach((upload, index) => {
+    for (let chunk = 0; chunk < upload.chunks; chunk++) {
+      if (!upload.received.includes(chunk)) pending.push([upload, files[index], chunk]);
+    }
+  });
+  const total = files.reduce((sum, file) => sum + file.size, 0);
+  let sent = 0;
+  const worker = async () => {
+    while (pending.length) {
+      const [upload, file, chunk] = pending.shift();
+      sent += await putChunk(upload, file, chunk);
+      onProgress(sent / total);
+    }
+  };
+  await Promise.all(Array.from({ length: Math.min(UPLOAD_PARALLEL, pending.length) }, worker));
+
+  await Promise.all(uploads.map(upload => uploadRequest(`/api/uploads/${upload.upload_id}/finalize`, {
+    method: 'POST'
+  })));
+  return uploads.map(upload => upload.upload_id);
+}
+
+// Photos are downscaled and re-encoded to JPEG in the browser before upload,
+// like media_processing.py does on the server (MAX_PHOTO_EDGE, PHOTO_JPEG_QUALITY)
+const PHOTO_MAX_EDGE = 2560;
+const PHOTO_QUALITY = 0.85;
+
+// Runs in a Web Worker (OffscreenCanvas) or, without it, on the page
+async function resizeImage(file, maxEdge, quality) {
+  const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+  const scale = Math.min(1, maxEdge / Math.max(bitmap.width, bitmap.height));
+  const width = Math.round(bitmap.width * scale);
+  const height = Math.round(bitmap.height * scale);
+  let blob;
+  if (typeof OffscreenCanvas !== 'undefined') {
+    const canvas = new OffscreenCanvas(width, height);
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, width, height);
+    blob = await canvas.convertToBlob({ type: 'image/jpeg', quality });
+  } else {
+    const canvas = document.createElement('canvas');
+    canvas.width = width;
+    canvas.height = height;
+    canvas.getContext('2d').drawImage(bitmap, 0, 0, width, height);
+    blob = await new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', quality));
+  }
+  bitmap.close();
+  if (!blob) throw new Error('JPEG encoding failed');
+  return blob;
+}
+
+let imageWorker = null;
+
+function getImageWorker() {
+  if (imageWorker === null) {
+    imageWorker = false;
+    if (typeof Worker !== 'undefined' && typeof OffscreenCanvas !== 'undefined') {
+      try {
+        const source = resizeImage.toString() + `
+          onmessage = async ({ data }) => {
+            try {
+              postMessage({ id: data.id, blob: await resizeImage(data.file, data.maxEdge, data.quality) });
+            } catch (error) {
+              postMessage({ id: data.id, error: String(error) });
+            }
+          };`;
+        imageWorker = new Worker(URL.createObjectURL(new Blob([source], { type: 'text/javascript' })));
+      } catch (error) {
+        console.warn('Web Worker недоступен, фото сжимаются на странице:', error);
+      }
+    }
+  }
+  return imageWorker;
+}
+
+let imageJobId = 0;
+
+function resizeInWorker(worker, file) {
+  const id = ++imageJobId;
+  return new Promise((resolve, reject) => {
+    const onMessage = ({ data }) => {
+      if (data.id !== id) return;
+      worker.removeEventListener('message', onMessage);
+      if (data.error) reject(new Error(data.error));
+      else resolve(data.blob);
+    };
+    worker.addEventListener('message', onMessage);
+    worker.postMessage({ id, file, maxEdge: PHOTO_MAX_EDGE, quality: PHOTO_QUALITY });
+  });
+}
+
+// Returns { files, optimized }: optimized is true only if every photo was
+// re-encoded; otherwise the originals of failed photos are kept and the
+// server runs its own pass
+async function optimizePhotos(photos, onProgress) {
+  const worker = getImageWorker();
+  const files = [];
+  let optimized = true;
+  for (const [index, photo] of photos.entries()) {
+    try {
+      const blob = worker ? await resizeInWorker(worker, photo)
+        : await resizeImage(photo, PHOTO_MAX_EDGE, PHOTO_QUALITY);
+      const name = photo.name.replace(/\.[^.]*$/, '') + '.jpg';
+      files.push(new File([blob], name, { type: 'image/jpeg' }));
+    } catch (error) {
+      // HEIC outside Safari, broken files, old browsers: send as is
+      console.warn(`Фото ${photo.name} отправлено без сжатия:`, error);
+      files.push(photo);
+      optimized = false;
+    }
+    onProgress(index + 1, photos.length);
+  }
+  return { files, optimized };
+}
+
 async function submitForm() {
   const required = ['name', 'age', 'height', 'weight', 'citizenship', 'telegram', 'whatsapp'];
   for (const id of required) {
@@ -102,13 +271,9 @@ async function submitForm() {
   formData.append('experience', document.getElementById('experience').value);
   formData.append('countries', document.getElementById('countries').value || '');
 
-  // Add photos
-  const photosInput = document.getElementById('photos');
-  if (photosInput.files.length > 0) {
-    Array.from(photosInput.files).forEach(photo => {
-      formData.append('photos', photo);
-    });
-  }
+  let photos = Array.from(document.getElementById('photos').files).filter(file => file.size > 0);
+  const videoInput = document.getElementById('video');
+  const video = videoInput && videoInput.files.length > 0 ? videoInput.files[0] : null;
 
   // Show loading state
   const submitBtn = document.querySelector('.submit-btn');
@@ -118,7 +283,26 @@ async function submitForm() {
   submitBtn.style.opacity = '0.7';
 
   try {
-    const response = await fetch('/api/submit', {
+    if (photos.length > 0) {
+      const result = await optimizePhotos(photos, (done, total) => {
+        submitBtn.textContent = `Сжатие фото ${done}/${total}`;
+      });
+      photos = result.files;
+      if (result.optimized) formData.append('images_optimized', '1');
+    }
+
+    // Upload files first, the form then references them by upload id
+    const files = video ? photos.concat([video]) : photos;
+    if (files.length > 0) {
+      const uploadIds = await uploadFiles(files, progress => {
+        submitBtn.textContent = `Загрузка ${Math.round(progress * 100)}%`;
+      });
+      if (video) formData.append('video_upload', uploadIds.pop());
+      uploadIds.forEach(uploadId => formData.append('photo_uploads', uploadId));
+      submitBtn.textContent = 'Отправка...';
+    }
+
+    const response = await fetchWithRetry('/api/submit', {
       method: 'POST',
       body: formData
     });
@@ -145,7 +329,11 @@ async function submitForm() {
     }
   } catch (error) {
     console.error('Ошибка:', error);
-    alert('Ошибка соединения с сервером. Убедитесь, что сервер запущен.');
+    if (error.status) {
+      alert('Ошибка загрузки файла: ' + error.message);
+    } else {
+      alert('Ошибка соединения с сервером. Убедитесь, что сервер запущен.');
+    }
   } finally {
     submitBtn.textContent = originalText;
     submitBtn.disabled = false;
@@ -0,0 +1,315 @@
+"""
+Планировщик исходящих сообщений Telegram
+Все отправки процесса (анкеты в bot.py, ответы balance_bot) проходят через
+общую очередь с лимитами: глобальным (~30 сообщений в секунду на бота)
+и на каждый чат (~20 сообщений в минуту в группу). Очередь разбита на
+приоритеты: подтверждения баланса уходят раньше текста анкет, текст - раньше
+фото и видео. RetryAfter от Telegram приостанавливает чат на указанное
+время, и сообщение отправляется повторно, не теряясь
+
+Внутри чата сообщения отправляются по порядку и по одному: следующий
+запрос - только после ответа на предыдущий, поэтому в группе они стоят в
+порядке постановки в очередь. TELEGRAM_CHAT_CONCURRENCY > 1 разрешает
+параллельные запросы с фото и видео в один чат; Telegram может показать их
+в другом порядке, а альбомы анкет, которые доставляют разные воркеры,
+перемешиваются в группе
+
+Лимиты считаются скользящим окном, а не ведром токенов: ведро емкостью 20
+с пополнением 20 в минуту пропускает до 40 сообщений за минуту и получает 429
+
+Метрики: время каждого вызова Bot API и ожидания в очереди (metrics.py),
+глубина очереди всех планировщиков процесса
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+import weakref
+from collections import deque
+
+from telegram.error import RetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram Bot API (на один токен бота в этом процессе)
+TELEGRAM_GLOBAL_LIMIT = int(os.getenv("TELEGRAM_GLOBAL_LIMIT", "30"))  # сообщений в секунду
+TELEGRAM_CHAT_LIMIT = int(os.getenv("TELEGRAM_CHAT_LIMIT", "20"))  # сообщений в группу за окно
+TELEGRAM_CHAT_WINDOW = float(os.getenv("TELEGRAM_CHAT_WINDOW", "60"))  # секунд
+# Одновременных запросов с медиа в один чат (больше 1 - порядок в группе не гарантирован)
+TELEGRAM_CHAT_CONCURRENCY = int(os.getenv("TELEGRAM_CHAT_CONCURRENCY", "1"))
+# Запас к окну: сообщение доходит до Telegram позже, чем мы его учли
+WINDOW_MARGIN = 0.05
+# Сколько раз подряд сообщение переотправляется после RetryAfter
+TELEGRAM_RETRY_AFTER_LIMIT = int(os.getenv("TELEGRAM_RETRY_AFTER_LIMIT", "5"))
+
+# Приоритеты (меньше - раньше)
+PRIORITY_BALANCE = 0
+PRIORITY_TEXT = 1
+PRIORITY_MEDIA = 2
+LANES = {PRIORITY_BALANCE: 'balance', PRIORITY_TEXT: 'text', PRIORITY_MEDIA: 'media'}
+
+# Планировщики процесса (для метрик глубины очереди)
+_schedulers = weakref.WeakSet()
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """retry_after бывает int или timedelta в зависимости от версии python-telegram-bot"""
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+class WindowLimiter:
+    """Не больше limit сообщений за любые window секунд"""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window * (1 + WINDOW_MARGIN)
+        self.sent: deque = deque()
+        self.blocked_until = 0.0
+
+    def _expire(self, now: float) -> None:
+        while self.sent and self.sent[0] <= now - self.window:
+            self.sent.popleft()
+
+    def wait_time(self, cost: int, now: float) -> float:
+        """Через сколько секунд можно отправить cost сообщений (0 - сейчас)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._expire(now)
+        # Альбом больше лимита ждет пустого окна, а не бесконечно
+        excess = len(self.sent) + min(cost, self.limit) - self.limit
+        if excess <= 0:
+            return 0.0
+        return self.sent[excess - 1] + self.window - now
+
+    def take(self, cost: int, now: float) -> None:
+        self.sent.extend([now] * min(cost, self.limit))
+
+    def block(self, seconds: float, now: float) -> None:
+        """Пауза после RetryAfter: отправка не раньше чем через seconds"""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class _Entry:
+    """Сообщение в очереди"""
+
+    __slots__ = ('priority', 'seq', 'chat_id', 'cost', 'func', 'args', 'kwargs', 'description',
+                 'future', 'enqueued', 'retries')
+
+    def __init__(self, priority, seq, chat_id, cost, func, args, kwargs, description, future, enqueued):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.cost = cost
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.description = description
+        self.future = future
+        self.enqueued = enqueued
+        self.retries = 0
+
+    def sort_key(self) -> tuple:
+        return self.priority, self.seq
+
+
+class SendScheduler:
+    """
+    Очередь отправок одного event loop
+    enqueue() ставит вызов метода Bot API в очередь и возвращает future с результатом
+    """
+
+    def __init__(self, global_limit: int = TELEGRAM_GLOBAL_LIMIT, chat_limit: int = TELEGRAM_CHAT_LIMIT,
+                 chat_window: float = TELEGRAM_CHAT_WINDOW, retry_after_limit: int = TELEGRAM_RETRY_AFTER_LIMIT,
+                 chat_concurrency: int = TELEGRAM_CHAT_CONCURRENCY):
+        self.chat_limit = chat_limit
+        self.chat_window = chat_window
+        self.chat_concurrency = max(1, chat_concurrency)
+        self.retry_after_limit = retry_after_limit
+        self._global = WindowLimiter(global_limit, 1.0)
+        self._chats: dict = {}
+        self._pending: list[_Entry] = []  # по (priority, seq)
+        self._in_flight: dict = {}  # чат -> приоритеты выполняемых запросов
+        self._seq = itertools.count()
+        self._wakeup: asyncio.Event | None = None
+        self._dispatcher: asyncio.Task | None = None
+        # Метрики
+        self.sent = 0
+        self.failed = 0
+        self.retry_after = 0
+        self.max_depth = {lane: 0 for lane in LANES.values()}
+        self.wait_seconds = {lane: 0.0 for lane in LANES.values()}
+        _schedulers.add(self)
+
+    def enqueue(self, chat_id, func, /, *args, priority: int = PRIORITY_MEDIA, cost: float = 1,
+                description: str = '', **kwargs) -> asyncio.Future:
+        """
+        Ставит вызов func(*args, **kwargs) в очередь чата chat_id
+        cost - сколько сообщений занимает вызов (альбом - по числу элементов)
+        Вызывать из event loop; порядок вызовов enqueue сохраняется внутри чата
+        """
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch_loop())
+
+        entry = _Entry(priority, next(self._seq), chat_id, cost, func, args, kwargs, description,
+                       loop.create_future(), time.monotonic())
+        self._insert(entry)
+        lane = LANES.get(priority, 'media')
+        self.max_depth[lane] = max(self.max_depth[lane], self.queue_depth()[lane])
+        self._wakeup.set()
+        return entry.future
+
+    async def submit(self, chat_id, func, /, *args, **kwargs):
+        """Ставит вызов в очередь и ждет результат (исключения пробрасываются вызывающему)"""
+        return await self.enqueue(chat_id, func, *args, **kwargs)
+
+    def _insert(self, entry: _Entry) -> None:
+        key = entry.sort_key()
+        index = len(self._pending)
+        while index > 0 and self._pending[index - 1].sort_key() > key:
+            index -= 1
+        self._pending.insert(index, entry)
+
+    def _chat_limiter(self, chat_id) -> WindowLimiter:
+        limiter = self._chats.get(chat_id)
+        if limiter is None:
+            limiter = self._chats[chat_id] = WindowLimiter(self.chat_limit, self.chat_window)
+        return limiter
+
+    def _chat_free(self, entry: _Entry) -> bool:
+        """Можно ли отправить сообщение, пока в его чат выполняются другие запросы"""
+        running = self._in_flight.get(entry.chat_id)
+        if not running:
+            return True
+        return (entry.priority == PRIORITY_MEDIA and len(running) < self.chat_concurrency
+                and all(priority == PRIORITY_MEDIA for priority in running))
+
+    def _next_ready(self, now: float) -> tuple[_Entry | None, float | None]:
+        """Первое по приоритету сообщение, которое можно отправить сейчас, иначе - сколько ждать"""
+        seen = set()
+        best_wait = None
+        self._pending = [entry for entry in self._pending if not entry.future.done()]
+        for entry in self._pending:
+            if entry.chat_id in seen:
+                continue
+            # Очередь чата идет строго по порядку: дальше смотрим только первое сообщение чата
+            seen.add(entry.chat_id)
+            if not self._chat_free(entry):
+                continue
+            wait = max(self._chat_limiter(entry.chat_id).wait_time(entry.cost, now),
+                       self._global.wait_time(entry.cost, now))
+            if wait <= 0:
+                return entry, 0.0
+            best_wait = wait if best_wait is None else min(best_wait, wait)
+        return None, best_wait
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            now = time.monotonic()
+            entry, wait = self._next_ready(now)
+            if entry is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._pending.remove(entry)
+            self._chat_limiter(entry.chat_id).take(entry.cost, now)
+            self._global.take(entry.cost, now)
+            self._in_flight.setdefault(entry.chat_id, []).append(entry.priority)
+            lane = LANES.get(entry.priority, 'media')
+            self.wait_seconds[lane] += now - entry.enqueued
+            metrics.TELEGRAM_QUEUE_SECONDS.observe(now - entry.enqueued, lane=lane)
+            asyncio.get_running_loop().create_task(self._run(entry))
+
+    async def _run(self, entry: _Entry) -> None:
+        method = getattr(entry.func, '__name__', 'unknown')
+        started = time.monotonic()
+        try:
+            result = await entry.func(*entry.args, **entry.kwargs)
+        except RetryAfter as e:
+            metrics.TELEGRAM_REQUEST_SECONDS.observe(time.monotonic() - started, method=method, result='retry_after')
+            delay = retry_after_seconds(e)
+            self.retry_after += 1
+            self._chat_limiter(entry.chat_id).block(delay, time.monotonic())
+            entry.retries += 1
+            if entry.retries > self.retry_after_limit:
+                self.failed += 1
+                if not entry.future.done():
+                    entry.future.set_exception(e)
+            else:
+                logger.warning(f"{entry.description or 'Сообщение'}: Telegram просит подождать {delay:.0f} с "
+                               f"(чат {entry.chat_id}), повтор {entry.retries}/{self.retry_after_limit}")
+                # Сохраняет место в очереди: уйдет первым после паузы
+                self._insert(entry)
+        except Exception as e:
+            metrics.TELEGRAM_REQUEST_SECONDS.observe(time.monotonic() - started, method=method, result='error')
+            self.failed += 1
+            if not entry.future.done():
+                entry.future.set_exception(e)
+        else:
+            metrics.TELEGRAM_REQUEST_SECONDS.observe(time.monotonic() - started, method=method, result='ok')
+            self.sent += 1
+            if not entry.future.done():
+                entry.future.set_result(result)
+        finally:
+            running = self._in_flight.get(entry.chat_id)
+            if running:
+                running.remove(entry.priority)
+                if not running:
+                    del self._in_flight[entry.chat_id]
+            self._wakeup.set()
+
+    def queue_depth(self) -> dict:
+        """Число ожидающих сообщений по приоритетам"""
+        depth = {lane: 0 for lane in LANES.values()}
+        for entry in self._pending:
+            if not entry.future.done():
+                depth[LANES.get(entry.priority, 'media')] += 1
+        return depth
+
+    def in_flight(self) -> int:
+        """Число выполняемых вызовов Bot API"""
+        return sum(len(running) for running in self._in_flight.values())
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue_depth(),
+            'in_flight': self.in_flight(),
+            'max_depth': dict(self.max_depth),
+            'wait_seconds': dict(self.wait_seconds),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retry_after': self.retry_after,
+        }
+
+    async def close(self) -> None:
+        """Останавливает диспетчер; ожидающие сообщения отменяются"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for entry in self._pending:
+            entry.future.cancel()
+        self._pending = []
+
+
+def _queue_depth_metric() -> dict:
+    depth = {lane: 0 for lane in LANES.values()}
+    for scheduler in list(_schedulers):
+        for lane, count in scheduler.queue_depth().items():
+            depth[lane] += count
+    return depth
+
+
+metrics.register_callback('telegram_queue_depth', "Сообщений в очереди отправки по приоритетам",
+                          _queue_depth_metric, labelnames=('lane',))
+metrics.register_callback('telegram_in_flight', "Вызовов Bot API в процессе выполнения",
+                          lambda: sum(scheduler.in_flight() for scheduler in list(_schedulers)))
@@ -1,17 +1,24 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, abort, g, request, jsonify
 from flask_cors import CORS
 import os
-from werkzeug.utils import secure_filename
 import logging
-from bot import send_application
+import time
+import admission
+import job_queue
+import metrics
+import resumable_upload
+import static_assets
+from upload_storage import (
+    UPLOAD_FOLDER, ALLOWED_PHOTO_EXTENSIONS, ALLOWED_VIDEO_EXTENSIONS, UploadRequest, keep_upload, upload_digest
+)
 
-app = Flask(__name__, static_folder='.', static_url_path='')
+# Статика отдается из памяти (static_assets.py), а не из корня репозитория:
+# static_folder='.' открывал наружу .env, data/ и исходники
+app = Flask(__name__, static_folder=None)
+app.request_class = UploadRequest  # файлы стримятся сразу в uploads/
 CORS(app)  # Разрешаем CORS для frontend
 
 # Настройки
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_PHOTO_EXTENSIONS = {'png', 'jpg', 'jpeg', 'heic'}
-ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi'}
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100 MB
 
 # Создаем папку для загрузок если её нет
@@ -25,6 +32,69 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# index.html, styles.css и script.js в памяти: сжатые варианты и ETag готовы заранее
+INDEX_ASSET, STATIC_ASSETS = static_assets.build_assets()
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+# Эндпоинты, читающие тело: (макс. Content-Length, допустимые Content-Type,
+# занимает место в общем лимите одновременных запросов) - см. admission.py.
+# Часть загрузки держит воркер не дольше передачи UPLOAD_CHUNK_SIZE байт,
+# поэтому в общий лимит входят только анкеты целиком
+ADMISSION_POLICIES = {
+    'submit_application': (MAX_FILE_SIZE, ('multipart/form-data', 'application/x-www-form-urlencoded'), True),
+    'upload_create': (64 * 1024, ('application/json',), False),
+    'upload_chunk': (resumable_upload.UPLOAD_CHUNK_SIZE, None, False),
+}
+
+
+@app.before_request
+def admit_request():
+    """Допуск анкет и загрузок по заголовкам и лимитам - до чтения тела"""
+    policy = ADMISSION_POLICIES.get(request.endpoint)
+    if policy is None or request.method == 'OPTIONS':
+        return None
+
+    slot, rejected = admission.admit(request, request.endpoint, *policy)
+    if rejected is None:
+        g.admission_slot = slot
+        return None
+
+    status, message, retry_after = rejected
+    response = jsonify({
+        'success': False,
+        'message': message
+    })
+    response.status_code = status
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    # Тело не читается - соединение закрывается, чтобы клиент не досылал его
+    response.headers['Connection'] = 'close'
+    return response
+
+
+@app.teardown_request
+def release_admission(exc):
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        slot.release()
+
+
+@app.after_request
+def observe_request(response):
+    """Время запроса в метриках; endpoint - имя обработчика, а не путь (без роста числа меток)"""
+    started = g.get('request_started')
+    if started is not None:
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, endpoint=request.endpoint or 'fallback',
+            method=request.method, status=response.status_code
+        )
+    return response
+
 
 def allowed_file(filename, allowed_extensions):
     """Проверяет допустимость расширения файла"""
@@ -32,88 +102,207 @@ def allowed_file(filename, allowed_extensions):
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 
+def remove_files(paths):
+    """Удаляет файлы анкеты, которая не попала в очередь"""
+    for path in paths:
+        if not path:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
 @app.route('/api/submit', methods=['POST'])
 def submit_application():
     """Обработка отправки анкеты"""
+    # Файлы анкеты на диске: если она не поставлена в очередь, их некому удалить
+    photo_paths = []
+    video_path = None
     try:
+        # Разбор тела запроса: прием файлов от клиента и запись их в uploads/
+        with metrics.UPLOAD_STAGE_SECONDS.time(stage='receive_and_save'):
+            form = request.form
+            files = request.files
+
         # Получаем данные формы
         data = {
-            'name': request.form.get('name'),
-            'age': request.form.get('age'),
-            'height': request.form.get('height'),
-            'weight': request.form.get('weight'),
-            'citizenship': request.form.get('citizenship'),
-            'telegram': request.form.get('telegram'),
-            'whatsapp': request.form.get('whatsapp'),
-            'experience': request.form.get('experience'),
-            'countries': request.form.get('countries')
+            'name': form.get('name'),
+            'age': form.get('age'),
+            'height': form.get('height'),
+            'weight': form.get('weight'),
+            'citizenship': form.get('citizenship'),
+            'telegram': form.get('telegram'),
+            'whatsapp': form.get('whatsapp'),
+            'experience': form.get('experience'),
+            'countries': form.get('countries')
         }
 
         logger.info(f"Получена анкета от: {data.get('name')}")
 
-        # Обработка фото
-        photo_paths = []
-        if 'photos' in request.files:
-            photos = request.files.getlist('photos')
+        # Файлы, загруженные частями через /api/uploads, передаются по id.
+        # Проверяются до keep_upload: при отказе файлы из тела запроса еще
+        # временные и удаляются сами при его закрытии
+        try:
+            photo_paths, video_path, media_digests = resumable_upload.claim_uploads(
+                form.getlist('photo_uploads'), form.get('video_upload')
+            )
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+
+        # Обработка фото (файлы уже записаны в uploads/ во время чтения запроса);
+        # хеши содержимого посчитаны при записи - для отправки повторных файлов по file_id
+        if 'photos' in files:
+            photos = files.getlist('photos')
             for photo in photos:
                 if photo and photo.filename and allowed_file(photo.filename, ALLOWED_PHOTO_EXTENSIONS):
-                    filename = secure_filename(photo.filename)
-                    # Добавляем timestamp к имени файла для уникальности
-                    import time
-                    filename = f"{int(time.time())}_{filename}"
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    photo.save(filepath)
-                    photo_paths.append(filepath)
-                    logger.info(f"Сохранено фото: {filename}")
+                    filepath = keep_upload(photo)
+                    if filepath:
+                        photo_paths.append(filepath)
+                        media_digests[filepath] = upload_digest(photo)
+                        logger.info(f"Сохранено фото: {filepath}")
 
         # Обработка видео
-        video_path = None
-        if 'video' in request.files:
-            video = request.files['video']
+        if video_path is None and 'video' in files:
+            video = files['video']
             if video and video.filename and allowed_file(video.filename, ALLOWED_VIDEO_EXTENSIONS):
-                filename = secure_filename(video.filename)
-                import time
-                filename = f"{int(time.time())}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                video.save(filepath)
-                video_path = filepath
-                logger.info(f"Сохранено видео: {filename}")
-
-        # Отправляем в Telegram
-        success = send_application(data, photo_paths, video_path)
-
-        # Удаляем файлы после отправки
-        for photo_path in photo_paths:
-            try:
-                os.remove(photo_path)
-            except:
-                pass
-
-        if video_path:
-            try:
-                os.remove(video_path)
-            except:
-                pass
-
-        if success:
-            return jsonify({
-                'success': True,
-                'message': 'Анкета успешно отправлена!'
-            }), 200
-        else:
-            return jsonify({
-                'success': False,
-                'message': 'Ошибка при отправке анкеты'
-            }), 500
+                video_path = keep_upload(video)
+                if video_path:
+                    media_digests[video_path] = upload_digest(video)
+                    logger.info(f"Сохранено видео: {video_path}")
+
+        # script.js уже уменьшил и пережал фото - серверная обработка фото не нужна
+        images_optimized = form.get('images_optimized') == '1'
+
+        # Ставим доставку в очередь: файлы удалит воркер после отправки
+        with metrics.UPLOAD_STAGE_SECONDS.time(stage='enqueue'):
+            job_id = job_queue.enqueue({
+                'data': data,
+                'photos': photo_paths,
+                'video': video_path,
+                'images_optimized': images_optimized,
+                'media_digests': media_digests
+            })
+
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': f'/api/submit/{job_id}/status',
+            'message': 'Анкета принята и отправляется!'
+        }), 202
 
     except Exception as e:
         logger.error(f"Ошибка обработки анкеты: {e}")
+        remove_files(photo_paths + [video_path])
         return jsonify({
             'success': False,
             'message': f'Ошибка сервера: {str(e)}'
         }), 500
 
 
+@app.route('/api/uploads', methods=['POST'])
+def upload_create():
+    """Создание возобновляемой загрузки: JSON {filename, size} -> id, размер части"""
+    body = request.get_json(silent=True) or {}
+    size = body.get('size')
+    try:
+        upload = resumable_upload.create_upload(str(body.get('filename') or ''), size if isinstance(size, int) else 0)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+    return jsonify(dict(upload, success=True)), 201
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Статус загрузки: какие части приняты (для возобновления после обрыва)"""
+    upload = resumable_upload.get_upload(upload_id)
+    if upload is None:
+        return jsonify({
+            'success': False,
+            'message': 'Загрузка не найдена'
+        }), 404
+
+    return jsonify(dict(upload, success=True))
+
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Часть файла: тело запроса - байты с позиции ?offset=N"""
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({
+            'success': False,
+            'message': 'Не указано смещение части (?offset=)'
+        }), 400
+
+    try:
+        upload = resumable_upload.write_chunk(upload_id, offset, request.stream, request.content_length)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+    if upload is None:
+        return jsonify({
+            'success': False,
+            'message': 'Загрузка не найдена'
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'received': len(upload['received']),
+        'chunks': upload['chunks']
+    })
+
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def upload_finalize(upload_id):
+    """Завершение загрузки: после него id передается в /api/submit"""
+    try:
+        upload = resumable_upload.finalize_upload(upload_id)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 409
+
+    if upload is None:
+        return jsonify({
+            'success': False,
+            'message': 'Загрузка не найдена'
+        }), 404
+
+    return jsonify(dict(upload, success=True))
+
+
+@app.route('/api/submit/<job_id>/status', methods=['GET'])
+def submit_status(job_id):
+    """Статус доставки анкеты"""
+    job = job_queue.get_job(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Анкета не найдена'
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'job_id': job['id'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'progress': job['progress'],
+        'error': job['last_error']
+    })
+
+
 @app.route('/api/test', methods=['GET'])
 def test():
     """Тестовый эндпоинт"""
@@ -123,20 +312,38 @@ def test():
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Метрики воркера в формате Prometheus"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/')
 def index():
     """Отдача главной страницы"""
-    return send_from_directory('.', 'index.html')
+    return INDEX_ASSET.response(request)
+
+
+@app.route('/<path:filename>')
+def static_file(filename):
+    """Стили и скрипт: с хешем в имени - immutable, без хеша - с перепроверкой по ETag"""
+    asset = STATIC_ASSETS.get(filename)
+    if asset is None:
+        abort(404)
+    return asset.response(request)
 
 
 @app.errorhandler(404)
 def fallback(e):
     """Обработчик 404 для SPA - отдаем index.html"""
-    return send_from_directory('.', 'index.html'), 200
+    return INDEX_ASSET.response(request)
 
 
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 5000))
     print(f"🚀 Запуск сервера на порту {port}")
     print("📱 Telegram бот готов к отправке анкет")
+    # В режиме разработки воркеры доставки работают в том же процессе
+    from delivery_worker import start_workers
+    start_workers()
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
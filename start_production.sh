@@ -12,6 +12,7 @@ BIND_ADDR="0.0.0.0:${PORT:-10000}"
 mkdir -p logs
 BOT_LOG="logs/balance_bot.log"
 WEB_LOG="logs/web.log"
+DELIVERY_LOG="logs/delivery.log"
 
 # Аккуратное завершение
 terminate() {
@@ -24,5 +25,8 @@ trap terminate SIGTERM SIGINT
 echo "📊 Starting Balance Bot..."
 python3 balance_bot.py >>"$BOT_LOG" 2>&1 &
 
+echo "📮 Starting Delivery Workers (${DELIVERY_WORKERS:-2})..."
+python3 delivery_worker.py >>"$DELIVERY_LOG" 2>&1 &
+
 echo "🌐 Starting Web Server: gunicorn server:app --bind $BIND_ADDR --workers $WORKERS --timeout $TIMEOUT"
 exec gunicorn server:app --bind "$BIND_ADDR" --workers "$WORKERS" --timeout "$TIMEOUT" >>"$WEB_LOG" 2>&1
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Статика лендинга из памяти
+При импорте (в каждом воркере gunicorn) styles.css и script.js получают имена
+с хешем содержимого (styles.3f2a9c1b7d4e.css), index.html переписывается на эти
+имена, и для каждого файла заранее готовятся gzip и brotli варианты.
+Файлы с хешем кэшируются браузером навсегда (immutable), index.html
+перепроверяется по ETag и в ответ приходит 304 без тела
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # brotli не установлен - отдаем только gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_ROOT = os.path.dirname(os.path.abspath(__file__))
+INDEX_FILE = 'index.html'
+HASHED_ASSETS = ('styles.css', 'script.js')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+HASH_LENGTH = 12
+
+
+class StaticAsset:
+    """Файл в памяти: исходные байты, сжатые варианты и ETag"""
+
+    def __init__(self, body: bytes, content_type: str, cache_control: str):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+        self.variants = {'identity': body}
+
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+            if len(compressed) < len(body):
+                self.variants['br'] = compressed
+
+    def etag(self, encoding: str) -> str:
+        """Сильный ETag; у каждого варианта сжатия свой, как требует HTTP"""
+        return self.digest if encoding == 'identity' else f"{self.digest}-{encoding}"
+
+    def select_encoding(self, accept_encodings) -> str:
+        """brotli, затем gzip, если клиент их принимает"""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding
+        return 'identity'
+
+    def response(self, request) -> Response:
+        encoding = self.select_encoding(request.accept_encodings)
+        etag = self.etag(encoding)
+
+        # Содержимое всех вариантов одинаковое - 304 по ETag любого из них
+        if any(self.etag(variant) in request.if_none_match for variant in self.variants):
+            response = Response(status=304)
+        else:
+            response = Response(self.variants[encoding], content_type=self.content_type)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = self.cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+
+def hashed_name(filename: str, digest: str) -> str:
+    """styles.css -> styles.<hash>.css"""
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}.{digest}{extension}"
+
+
+def _content_type(filename: str) -> str:
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type.endswith('javascript'):
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def build_assets(root: str = STATIC_ROOT) -> tuple[StaticAsset, dict[str, StaticAsset]]:
+    """
+    Собирает статику в память
+    Возвращает (index.html, {путь: файл}); пути - с хешем (immutable)
+    и прежние имена без хеша для старых копий index.html (с перепроверкой)
+    """
+    assets = {}
+    with open(os.path.join(root, INDEX_FILE), encoding='utf-8') as index_file:
+        index_html = index_file.read()
+
+    for filename in HASHED_ASSETS:
+        with open(os.path.join(root, filename), 'rb') as asset_file:
+            body = asset_file.read()
+        content_type = _content_type(filename)
+        asset = StaticAsset(body, content_type, IMMUTABLE_CACHE_CONTROL)
+        versioned = hashed_name(filename, asset.digest)
+        assets[versioned] = asset
+        assets[filename] = StaticAsset(body, content_type, REVALIDATE_CACHE_CONTROL)
+
+        # href="styles.css" / src="./script.js" -> /styles.<hash>.css
+        index_html = re.sub(
+            r'(?<=["\'])(?:\./|/)?' + re.escape(filename) + r'(?=["\'])', '/' + versioned, index_html
+        )
+
+    index = StaticAsset(index_html.encode('utf-8'), 'text/html; charset=utf-8', REVALIDATE_CACHE_CONTROL)
+    logger.info(f"Статика собрана: {', '.join(name for name in assets if name not in HASHED_ASSETS)}"
+                f"{'' if brotli is not None else ' (без brotli)'}")
+    return index, assets
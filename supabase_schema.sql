@@ -47,7 +47,685 @@ CREATE TRIGGER update_group_balances_updated_at
     FOR EACH ROW
     EXECUTE FUNCTION update_updated_at_column();
 
+-- Атомарное применение транзакции: одна блокировка строки баланса,
+-- обновление баланса и запись в историю за один вызов (supabase.rpc)
+-- Параллельные сообщения в одной группе выполняются строго по очереди
+CREATE OR REPLACE FUNCTION apply_balance_transaction(
+    p_group_id BIGINT,
+    p_amount DECIMAL(15, 2),
+    p_user_id BIGINT,
+    p_username VARCHAR(255),
+    p_message_id BIGINT,
+    p_group_name VARCHAR(255) DEFAULT NULL,
+    p_language VARCHAR(10) DEFAULT 'zh'
+)
+RETURNS TABLE (previous_balance DECIMAL(15, 2), new_balance DECIMAL(15, 2))
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_new_balance DECIMAL(15, 2);
+BEGIN
+    -- Создаем запись баланса для новой группы
+    INSERT INTO group_balances (group_id, group_name, current_balance, language)
+    VALUES (p_group_id, COALESCE(p_group_name, 'Group ' || p_group_id), 0.00, p_language)
+    ON CONFLICT (group_id) DO NOTHING;
+
+    -- Блокировка строки баланса до конца транзакции: сообщения группы идут по очереди
+    PERFORM 1 FROM group_balances WHERE group_balances.group_id = p_group_id FOR UPDATE;
+
+    -- Повторная доставка того же сообщения возвращает уже записанные балансы
+    -- (уникальный индекс включает created_at, поэтому дубль проверяется здесь;
+    -- поиск ограничен последними днями - старые секции истории не читаются)
+    IF p_message_id IS NOT NULL THEN
+        RETURN QUERY
+        SELECT t.previous_balance, t.new_balance
+        FROM balance_transactions t
+        WHERE t.group_id = p_group_id AND t.message_id = p_message_id
+          AND t.created_at >= NOW() - INTERVAL '7 days'
+        LIMIT 1;
+        IF FOUND THEN
+            RETURN;
+        END IF;
+    END IF;
+
+    UPDATE group_balances
+    SET current_balance = group_balances.current_balance + p_amount
+    WHERE group_balances.group_id = p_group_id
+    RETURNING group_balances.current_balance INTO v_new_balance;
+
+    INSERT INTO balance_transactions (
+        group_id, user_id, username, amount, previous_balance, new_balance, transaction_type, message_id
+    )
+    VALUES (
+        p_group_id, p_user_id, COALESCE(p_username, 'Unknown'), p_amount,
+        v_new_balance - p_amount, v_new_balance,
+        CASE WHEN p_amount > 0 THEN 'add' ELSE 'subtract' END, p_message_id
+    );
+
+    RETURN QUERY SELECT v_new_balance - p_amount, v_new_balance;
+END;
+$$;
+
+-- Одно сообщение Telegram - не более одной транзакции: повторная выгрузка
+-- журнала бота (balance_journal.py) не создает дублей
+-- (после секционирования индекс - (group_id, message_id, created_at), см. ниже;
+-- время операции журнала при повторе то же самое)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_balance_transactions_group_message
+    ON balance_transactions(group_id, message_id);
+
+-- Пакетная выгрузка локального журнала бота: балансы уже посчитаны ботом
+-- (единственный писатель), функция записывает историю и выставляет
+-- group_balances.current_balance по последней записанной операции группы
+-- Уже записанные (group_id, message_id) пропускаются - вызов идемпотентен
+CREATE OR REPLACE FUNCTION apply_balance_journal(p_items JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_inserted INTEGER;
+BEGIN
+    INSERT INTO group_balances (group_id, group_name, current_balance, language)
+    SELECT DISTINCT ON (x.group_id) x.group_id, COALESCE(x.group_name, 'Group ' || x.group_id), 0.00,
+           COALESCE(x.language, 'zh')
+    FROM jsonb_to_recordset(p_items) AS x(group_id BIGINT, group_name VARCHAR(255), language VARCHAR(10))
+    ON CONFLICT (group_id) DO NOTHING;
+
+    WITH items AS (
+        SELECT *
+        FROM jsonb_to_recordset(p_items) AS x(
+            seq BIGINT, group_id BIGINT, user_id BIGINT, username VARCHAR(255), amount DECIMAL(15, 2),
+            previous_balance DECIMAL(15, 2), new_balance DECIMAL(15, 2), transaction_type VARCHAR(20),
+            message_id BIGINT, created_at TIMESTAMP WITH TIME ZONE
+        )
+    ), inserted AS (
+        INSERT INTO balance_transactions (
+            group_id, user_id, username, amount, previous_balance, new_balance, transaction_type, message_id, created_at
+        )
+        SELECT group_id, user_id, COALESCE(username, 'Unknown'), amount, previous_balance, new_balance,
+               transaction_type, message_id, created_at
+        FROM items
+        ORDER BY seq
+        ON CONFLICT (group_id, message_id, created_at) DO NOTHING
+        RETURNING id, group_id, new_balance
+    ), latest AS (
+        SELECT DISTINCT ON (group_id) group_id, new_balance
+        FROM inserted
+        ORDER BY group_id, id DESC
+    ), updated AS (
+        UPDATE group_balances
+        SET current_balance = latest.new_balance
+        FROM latest
+        WHERE group_balances.group_id = latest.group_id
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO v_inserted FROM inserted;
+
+    RETURN v_inserted;
+END;
+$$;
+
+-- Агрегаты для отчетов (/today, /week, /top): обновляются триггером
+-- при каждой записи в balance_transactions, поэтому отчеты читают
+-- несколько строк вместо сканирования всей истории
+-- period: 'hour' (начало часа) или 'day' (полночь по Asia/Shanghai,
+-- должна совпадать с BALANCE_REPORT_TIMEZONE бота)
+CREATE TABLE IF NOT EXISTS balance_rollups (
+    group_id BIGINT NOT NULL,
+    period VARCHAR(4) NOT NULL,
+    period_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    deposits_count INTEGER NOT NULL DEFAULT 0,
+    deposits_sum DECIMAL(18, 2) NOT NULL DEFAULT 0.00,
+    withdrawals_count INTEGER NOT NULL DEFAULT 0,
+    withdrawals_sum DECIMAL(18, 2) NOT NULL DEFAULT 0.00, -- по модулю
+    opening_balance DECIMAL(15, 2) NOT NULL,
+    closing_balance DECIMAL(15, 2) NOT NULL,
+    PRIMARY KEY (group_id, period, period_start)
+);
+
+-- Те же агрегаты в разрезе пользователя (операциониста)
+CREATE TABLE IF NOT EXISTS balance_user_rollups (
+    group_id BIGINT NOT NULL,
+    period VARCHAR(4) NOT NULL,
+    period_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    user_id BIGINT NOT NULL,
+    username VARCHAR(255),
+    deposits_count INTEGER NOT NULL DEFAULT 0,
+    deposits_sum DECIMAL(18, 2) NOT NULL DEFAULT 0.00,
+    withdrawals_count INTEGER NOT NULL DEFAULT 0,
+    withdrawals_sum DECIMAL(18, 2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (group_id, period, period_start, user_id)
+);
+
+-- Триггер уровня оператора: пачка из apply_balance_journal агрегируется
+-- одним запросом на таблицу, а не построчно
+CREATE OR REPLACE FUNCTION rollup_balance_transactions()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO balance_rollups (
+        group_id, period, period_start, deposits_count, deposits_sum,
+        withdrawals_count, withdrawals_sum, opening_balance, closing_balance
+    )
+    SELECT t.group_id, p.period, p.period_start,
+           COUNT(*) FILTER (WHERE t.amount > 0),
+           COALESCE(SUM(t.amount) FILTER (WHERE t.amount > 0), 0),
+           COUNT(*) FILTER (WHERE t.amount < 0),
+           COALESCE(-SUM(t.amount) FILTER (WHERE t.amount < 0), 0),
+           (ARRAY_AGG(t.previous_balance ORDER BY t.id))[1],
+           (ARRAY_AGG(t.new_balance ORDER BY t.id DESC))[1]
+    FROM inserted_rows t
+    CROSS JOIN LATERAL (VALUES
+        ('hour', date_trunc('hour', t.created_at)),
+        ('day', date_trunc('day', t.created_at, 'Asia/Shanghai'))
+    ) AS p(period, period_start)
+    GROUP BY t.group_id, p.period, p.period_start
+    ON CONFLICT (group_id, period, period_start) DO UPDATE SET
+        deposits_count = balance_rollups.deposits_count + EXCLUDED.deposits_count,
+        deposits_sum = balance_rollups.deposits_sum + EXCLUDED.deposits_sum,
+        withdrawals_count = balance_rollups.withdrawals_count + EXCLUDED.withdrawals_count,
+        withdrawals_sum = balance_rollups.withdrawals_sum + EXCLUDED.withdrawals_sum,
+        closing_balance = EXCLUDED.closing_balance;
+
+    INSERT INTO balance_user_rollups (
+        group_id, period, period_start, user_id, username,
+        deposits_count, deposits_sum, withdrawals_count, withdrawals_sum
+    )
+    SELECT t.group_id, p.period, p.period_start, COALESCE(t.user_id, 0),
+           (ARRAY_AGG(t.username ORDER BY t.id DESC))[1],
+           COUNT(*) FILTER (WHERE t.amount > 0),
+           COALESCE(SUM(t.amount) FILTER (WHERE t.amount > 0), 0),
+           COUNT(*) FILTER (WHERE t.amount < 0),
+           COALESCE(-SUM(t.amount) FILTER (WHERE t.amount < 0), 0)
+    FROM inserted_rows t
+    CROSS JOIN LATERAL (VALUES
+        ('hour', date_trunc('hour', t.created_at)),
+        ('day', date_trunc('day', t.created_at, 'Asia/Shanghai'))
+    ) AS p(period, period_start)
+    GROUP BY t.group_id, p.period, p.period_start, COALESCE(t.user_id, 0)
+    ON CONFLICT (group_id, period, period_start, user_id) DO UPDATE SET
+        username = EXCLUDED.username,
+        deposits_count = balance_user_rollups.deposits_count + EXCLUDED.deposits_count,
+        deposits_sum = balance_user_rollups.deposits_sum + EXCLUDED.deposits_sum,
+        withdrawals_count = balance_user_rollups.withdrawals_count + EXCLUDED.withdrawals_count,
+        withdrawals_sum = balance_user_rollups.withdrawals_sum + EXCLUDED.withdrawals_sum;
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE TRIGGER balance_transactions_rollup
+    AFTER INSERT ON balance_transactions
+    REFERENCING NEW TABLE AS inserted_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION rollup_balance_transactions();
+
+-- Полный пересчет агрегатов по истории (первичное заполнение или ремонт)
+-- Агрегаты архивных месяцев (balance_archives) сохраняются: их строк в БД уже нет
+CREATE OR REPLACE FUNCTION refresh_balance_rollups()
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_from TIMESTAMP WITH TIME ZONE;
+BEGIN
+    -- Новые транзакции ждут окончания пересчета
+    LOCK TABLE balance_transactions IN SHARE MODE;
+
+    -- Пересчет с первой полуночи по Asia/Shanghai после архива: день на
+    -- границе месяца частично в архиве, его агрегаты не трогаем
+    v_from := '-infinity';
+    IF to_regclass('balance_archives') IS NOT NULL THEN
+        SELECT COALESCE(MAX(month_end), '-infinity') INTO v_from FROM balance_archives;
+    END IF;
+    IF isfinite(v_from) AND date_trunc('day', v_from, 'Asia/Shanghai') < v_from THEN
+        v_from := date_trunc('day', v_from, 'Asia/Shanghai') + INTERVAL '1 day';
+    END IF;
+
+    DELETE FROM balance_rollups WHERE period_start >= v_from;
+    DELETE FROM balance_user_rollups WHERE period_start >= v_from;
+
+    INSERT INTO balance_rollups (
+        group_id, period, period_start, deposits_count, deposits_sum,
+        withdrawals_count, withdrawals_sum, opening_balance, closing_balance
+    )
+    SELECT t.group_id, p.period, p.period_start,
+           COUNT(*) FILTER (WHERE t.amount > 0),
+           COALESCE(SUM(t.amount) FILTER (WHERE t.amount > 0), 0),
+           COUNT(*) FILTER (WHERE t.amount < 0),
+           COALESCE(-SUM(t.amount) FILTER (WHERE t.amount < 0), 0),
+           (ARRAY_AGG(t.previous_balance ORDER BY t.id))[1],
+           (ARRAY_AGG(t.new_balance ORDER BY t.id DESC))[1]
+    FROM balance_transactions t
+    CROSS JOIN LATERAL (VALUES
+        ('hour', date_trunc('hour', t.created_at)),
+        ('day', date_trunc('day', t.created_at, 'Asia/Shanghai'))
+    ) AS p(period, period_start)
+    WHERE t.created_at >= v_from
+    GROUP BY t.group_id, p.period, p.period_start;
+
+    INSERT INTO balance_user_rollups (
+        group_id, period, period_start, user_id, username,
+        deposits_count, deposits_sum, withdrawals_count, withdrawals_sum
+    )
+    SELECT t.group_id, p.period, p.period_start, COALESCE(t.user_id, 0),
+           (ARRAY_AGG(t.username ORDER BY t.id DESC))[1],
+           COUNT(*) FILTER (WHERE t.amount > 0),
+           COALESCE(SUM(t.amount) FILTER (WHERE t.amount > 0), 0),
+           COUNT(*) FILTER (WHERE t.amount < 0),
+           COALESCE(-SUM(t.amount) FILTER (WHERE t.amount < 0), 0)
+    FROM balance_transactions t
+    CROSS JOIN LATERAL (VALUES
+        ('hour', date_trunc('hour', t.created_at)),
+        ('day', date_trunc('day', t.created_at, 'Asia/Shanghai'))
+    ) AS p(period, period_start)
+    WHERE t.created_at >= v_from
+    GROUP BY t.group_id, p.period, p.period_start, COALESCE(t.user_id, 0);
+END;
+$$;
+
+-- Первичное заполнение агрегатов по уже существующей истории
+SELECT refresh_balance_rollups() WHERE NOT EXISTS (SELECT 1 FROM balance_rollups);
+
+-- Реестр групп бота (group_registry.py): настройки группы хранятся рядом с балансом
+-- Пустые min_amount / max_amount - лимиты бота по умолчанию
+ALTER TABLE group_balances ADD COLUMN IF NOT EXISTS currency VARCHAR(8) NOT NULL DEFAULT '¥';
+ALTER TABLE group_balances ADD COLUMN IF NOT EXISTS min_amount DECIMAL(15, 2);
+ALTER TABLE group_balances ADD COLUMN IF NOT EXISTS max_amount DECIMAL(15, 2);
+ALTER TABLE group_balances ADD COLUMN IF NOT EXISTS active BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE group_balances ADD COLUMN IF NOT EXISTS settings_updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
+
+-- settings_updated_at меняется только при изменении настроек, а не баланса:
+-- бот опрашивает реестр запросом settings_updated_at >= последнего прочитанного
+CREATE OR REPLACE FUNCTION touch_group_settings()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF (NEW.group_name, NEW.language, NEW.currency, NEW.min_amount, NEW.max_amount, NEW.active)
+        IS DISTINCT FROM
+       (OLD.group_name, OLD.language, OLD.currency, OLD.min_amount, OLD.max_amount, OLD.active) THEN
+        NEW.settings_updated_at = NOW();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER group_balances_settings_touch
+    BEFORE UPDATE ON group_balances
+    FOR EACH ROW
+    EXECUTE FUNCTION touch_group_settings();
+
+CREATE INDEX IF NOT EXISTS idx_group_balances_settings_updated_at ON group_balances(settings_updated_at);
+
+-- Помесячное секционирование истории, снимки балансов и архив
+-- balance_transactions делится на секции по месяцам created_at (UTC):
+-- balance_transactions_y2025m11 и т.д., плюс секция по умолчанию для строк
+-- вне созданных месяцев. Вставки идут в маленькую секцию текущего месяца,
+-- запросы с условием на created_at читают только нужные секции, а старые
+-- месяцы выгружаются в сжатые файлы (ledger_archive.py) и удаляются целиком
+--
+-- balance_snapshots - баланс каждой группы на начало месяца: проверка
+-- баланса = последний снимок + операции после него, а не вся история
+
+-- Снимок: учтены все операции группы с created_at < taken_at
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    group_id BIGINT NOT NULL,
+    taken_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    balance DECIMAL(15, 2) NOT NULL,
+    transactions_count BIGINT NOT NULL,
+    last_transaction_id BIGINT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (group_id, taken_at),
+    FOREIGN KEY (group_id) REFERENCES group_balances(group_id) ON DELETE CASCADE
+);
+
+-- Выгруженные в архив и удаленные секции
+CREATE TABLE IF NOT EXISTS balance_archives (
+    partition_name VARCHAR(63) PRIMARY KEY,
+    month_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    month_end TIMESTAMP WITH TIME ZONE NOT NULL,
+    rows_count BIGINT NOT NULL,
+    file_name TEXT NOT NULL,
+    sha256 CHAR(64) NOT NULL,
+    archived_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+-- Имя секции месяца (границы месяцев - по UTC)
+CREATE OR REPLACE FUNCTION balance_partition_name(p_month TIMESTAMP WITH TIME ZONE)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT 'balance_transactions_' || to_char(p_month AT TIME ZONE 'UTC', '"y"YYYY"m"MM');
+$$;
+
+-- Создает секцию месяца, если ее нет; строки этого месяца, попавшие
+-- в секцию по умолчанию, переносятся в новую секцию
+CREATE OR REPLACE FUNCTION create_balance_partition(p_month TIMESTAMP WITH TIME ZONE)
+RETURNS TEXT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month TIMESTAMP := date_trunc('month', p_month AT TIME ZONE 'UTC');
+    v_start TIMESTAMP WITH TIME ZONE := v_month AT TIME ZONE 'UTC';
+    v_end TIMESTAMP WITH TIME ZONE := (v_month + INTERVAL '1 month') AT TIME ZONE 'UTC';
+    v_name TEXT := balance_partition_name(v_start);
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN v_name;
+    END IF;
+
+    -- Таблица наполняется до подключения: триггер агрегатов на переносе не срабатывает
+    EXECUTE format('CREATE TABLE %I (LIKE balance_transactions INCLUDING DEFAULTS)', v_name);
+    IF to_regclass('balance_transactions_default') IS NOT NULL THEN
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM balance_transactions_default '
+            'WHERE created_at >= $1 AND created_at < $2 RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved', v_name
+        ) USING v_start, v_end;
+    END IF;
+    EXECUTE format(
+        'ALTER TABLE balance_transactions ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        v_name, v_start, v_end
+    );
+    RETURN v_name;
+END;
+$$;
+
+-- Секции на текущий месяц и p_months_ahead вперед, а также на месяцы,
+-- строки которых оказались в секции по умолчанию (кроме архивных)
+CREATE OR REPLACE FUNCTION ensure_balance_partitions(p_months_ahead INTEGER DEFAULT 3)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_month TIMESTAMP WITH TIME ZONE;
+    v_created INTEGER := 0;
+BEGIN
+    FOR v_month IN
+        SELECT (date_trunc('month', NOW() AT TIME ZONE 'UTC') + make_interval(months => n)) AT TIME ZONE 'UTC'
+        FROM generate_series(0, p_months_ahead) AS n
+        UNION
+        SELECT DISTINCT date_trunc('month', d.created_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+        FROM balance_transactions_default d
+    LOOP
+        CONTINUE WHEN to_regclass(balance_partition_name(v_month)) IS NOT NULL;
+        IF EXISTS (SELECT 1 FROM balance_archives a WHERE a.partition_name = balance_partition_name(v_month)) THEN
+            RAISE WARNING 'Операции за архивный месяц % остались в balance_transactions_default',
+                balance_partition_name(v_month);
+            CONTINUE;
+        END IF;
+        PERFORM create_balance_partition(v_month);
+        v_created := v_created + 1;
+    END LOOP;
+    RETURN v_created;
+END;
+$$;
+
+-- Перевод существующей таблицы balance_transactions в секционированную
+-- (выполняется один раз; ключи секционированной таблицы включают created_at)
+DO $$
+DECLARE
+    v_month TIMESTAMP WITH TIME ZONE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'balance_transactions'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    LOCK TABLE balance_transactions IN ACCESS EXCLUSIVE MODE;
+    ALTER TABLE balance_transactions RENAME TO balance_transactions_unpartitioned;
+    ALTER TABLE balance_transactions_unpartitioned
+        RENAME CONSTRAINT balance_transactions_pkey TO balance_transactions_unpartitioned_pkey;
+    DROP INDEX IF EXISTS idx_balance_transactions_group_id;
+    DROP INDEX IF EXISTS idx_balance_transactions_created_at;
+    DROP INDEX IF EXISTS idx_balance_transactions_group_message;
+    ALTER SEQUENCE balance_transactions_id_seq OWNED BY NONE;
+
+    CREATE TABLE balance_transactions (
+        id BIGINT NOT NULL DEFAULT nextval('balance_transactions_id_seq'),
+        group_id BIGINT NOT NULL,
+        user_id BIGINT,
+        username VARCHAR(255),
+        amount DECIMAL(15, 2) NOT NULL,
+        previous_balance DECIMAL(15, 2) NOT NULL,
+        new_balance DECIMAL(15, 2) NOT NULL,
+        transaction_type VARCHAR(20) NOT NULL,
+        message_id BIGINT,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, created_at),
+        FOREIGN KEY (group_id) REFERENCES group_balances(group_id) ON DELETE CASCADE
+    ) PARTITION BY RANGE (created_at);
+    ALTER SEQUENCE balance_transactions_id_seq OWNED BY balance_transactions.id;
+
+    -- Индексы создаются в каждой секции; (group_id, created_at) - для
+    -- запросов «операции группы после снимка»
+    CREATE INDEX idx_balance_transactions_group_id ON balance_transactions(group_id, created_at);
+    CREATE INDEX idx_balance_transactions_created_at ON balance_transactions(created_at DESC);
+    CREATE UNIQUE INDEX idx_balance_transactions_group_message
+        ON balance_transactions(group_id, message_id, created_at);
+
+    CREATE TABLE balance_transactions_default PARTITION OF balance_transactions DEFAULT;
+    FOR v_month IN
+        SELECT DISTINCT date_trunc('month', COALESCE(created_at, NOW()) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+        FROM balance_transactions_unpartitioned
+    LOOP
+        PERFORM create_balance_partition(v_month);
+    END LOOP;
+    PERFORM ensure_balance_partitions();
+
+    -- Агрегаты уже учитывают эти строки: триггер создается после копирования
+    INSERT INTO balance_transactions (
+        id, group_id, user_id, username, amount, previous_balance, new_balance,
+        transaction_type, message_id, created_at
+    )
+    SELECT id, group_id, user_id, username, amount, previous_balance, new_balance,
+           transaction_type, message_id, COALESCE(created_at, NOW())
+    FROM balance_transactions_unpartitioned
+    ORDER BY id;
+    DROP TABLE balance_transactions_unpartitioned;
+
+    CREATE TRIGGER balance_transactions_rollup
+        AFTER INSERT ON balance_transactions
+        REFERENCING NEW TABLE AS inserted_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION rollup_balance_transactions();
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_balance_snapshots_taken_at ON balance_snapshots(taken_at);
+
+-- Снимки всех групп на момент p_at: предыдущий снимок + операции между ними
+-- (читаются только секции этого промежутка); повторный вызов пересчитывает снимок
+CREATE OR REPLACE FUNCTION take_balance_snapshots(p_at TIMESTAMP WITH TIME ZONE)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    INSERT INTO balance_snapshots (group_id, taken_at, balance, transactions_count, last_transaction_id)
+    SELECT g.group_id, p_at,
+           COALESCE(prev.balance, 0) + COALESCE(tx.amount, 0),
+           COALESCE(prev.transactions_count, 0) + COALESCE(tx.cnt, 0),
+           COALESCE(tx.last_id, prev.last_transaction_id)
+    FROM group_balances g
+    LEFT JOIN LATERAL (
+        SELECT s.taken_at, s.balance, s.transactions_count, s.last_transaction_id
+        FROM balance_snapshots s
+        WHERE s.group_id = g.group_id AND s.taken_at < p_at
+        ORDER BY s.taken_at DESC
+        LIMIT 1
+    ) prev ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT SUM(t.amount) AS amount, COUNT(*) AS cnt, MAX(t.id) AS last_id
+        FROM balance_transactions t
+        WHERE t.group_id = g.group_id
+          AND t.created_at >= COALESCE(prev.taken_at, '-infinity') AND t.created_at < p_at
+    ) tx ON TRUE
+    ON CONFLICT (group_id, taken_at) DO UPDATE SET
+        balance = EXCLUDED.balance,
+        transactions_count = EXCLUDED.transactions_count,
+        last_transaction_id = EXCLUDED.last_transaction_id,
+        created_at = NOW();
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$;
+
+-- Периодическое обслуживание (бот вызывает раз в BALANCE_LEDGER_MAINTENANCE_INTERVAL):
+-- секции на месяцы вперед и снимки на начало каждого закрытого месяца.
+-- Месяц закрывается через p_grace после окончания - время на выгрузку
+-- запоздавших операций журнала бота
+CREATE OR REPLACE FUNCTION maintain_balance_ledger(
+    p_months_ahead INTEGER DEFAULT 3,
+    p_grace INTERVAL DEFAULT INTERVAL '1 day'
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_partitions INTEGER;
+    v_snapshots INTEGER := 0;
+    v_next TIMESTAMP;
+    v_last TIMESTAMP := date_trunc('month', (NOW() - p_grace) AT TIME ZONE 'UTC');
+BEGIN
+    v_partitions := ensure_balance_partitions(p_months_ahead);
+
+    -- Следующий месяц после последнего месячного снимка (или после первой операции)
+    SELECT COALESCE(
+        (SELECT MAX(s.taken_at AT TIME ZONE 'UTC') + INTERVAL '1 month'
+         FROM balance_snapshots s
+         WHERE s.taken_at AT TIME ZONE 'UTC' = date_trunc('month', s.taken_at AT TIME ZONE 'UTC')),
+        (SELECT date_trunc('month', MIN(t.created_at) AT TIME ZONE 'UTC') + INTERVAL '1 month'
+         FROM balance_transactions t)
+    ) INTO v_next;
+
+    WHILE v_next IS NOT NULL AND v_next <= v_last LOOP
+        v_snapshots := v_snapshots + take_balance_snapshots(v_next AT TIME ZONE 'UTC');
+        v_next := v_next + INTERVAL '1 month';
+    END LOOP;
+
+    RETURN jsonb_build_object('partitions_created', v_partitions, 'snapshots', v_snapshots);
+END;
+$$;
+
+-- Месячные секции с границами; archivable - на конец месяца есть снимок,
+-- и секцию можно выгрузить в архив (ledger_archive.py)
+CREATE OR REPLACE FUNCTION list_balance_partitions()
+RETURNS TABLE (
+    partition_name TEXT,
+    month_start TIMESTAMP WITH TIME ZONE,
+    month_end TIMESTAMP WITH TIME ZONE,
+    archivable BOOLEAN
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT p.name, p.bounds[1]::TIMESTAMP WITH TIME ZONE, p.bounds[2]::TIMESTAMP WITH TIME ZONE,
+           EXISTS (SELECT 1 FROM balance_snapshots s WHERE s.taken_at = p.bounds[2]::TIMESTAMP WITH TIME ZONE)
+    FROM (
+        SELECT c.relname::TEXT AS name,
+               regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \(''([^'']+)''\) TO \(''([^'']+)''\)') AS bounds
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'balance_transactions'::regclass
+    ) p
+    WHERE p.bounds IS NOT NULL
+    ORDER BY 2;
+$$;
+
+-- Удаляет секцию, выгруженную в архив: число строк должно совпасть с файлом,
+-- у всех групп секции должен быть снимок на конец месяца, а более старых
+-- секций не должно остаться (архив идет от старых месяцев к новым)
+CREATE OR REPLACE FUNCTION drop_balance_partition(
+    p_partition TEXT,
+    p_rows BIGINT,
+    p_file TEXT,
+    p_sha256 TEXT
+)
+RETURNS BIGINT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_start TIMESTAMP WITH TIME ZONE;
+    v_end TIMESTAMP WITH TIME ZONE;
+    v_rows BIGINT;
+    v_missing BIGINT;
+BEGIN
+    SELECT p.month_start, p.month_end INTO v_start, v_end
+    FROM list_balance_partitions() p
+    WHERE p.partition_name = p_partition;
+    IF v_start IS NULL THEN
+        RAISE EXCEPTION 'Секция % не найдена', p_partition;
+    END IF;
+    IF EXISTS (SELECT 1 FROM list_balance_partitions() p WHERE p.month_start < v_start) THEN
+        RAISE EXCEPTION 'Есть более старые секции: архив идет от старых месяцев к новым';
+    END IF;
+
+    EXECUTE format('LOCK TABLE %I IN ACCESS EXCLUSIVE MODE', p_partition);
+
+    EXECUTE format(
+        'SELECT COUNT(DISTINCT t.group_id) FROM %I t WHERE NOT EXISTS ('
+        'SELECT 1 FROM balance_snapshots s WHERE s.group_id = t.group_id AND s.taken_at = $1)', p_partition
+    ) INTO v_missing USING v_end;
+    IF v_missing > 0 THEN
+        RAISE EXCEPTION 'Нет снимка на % у групп: %', v_end, v_missing;
+    END IF;
+
+    EXECUTE format('SELECT COUNT(*) FROM %I', p_partition) INTO v_rows;
+    IF v_rows <> p_rows THEN
+        RAISE EXCEPTION 'В секции % строк: %, в архиве: %', p_partition, v_rows, p_rows;
+    END IF;
+
+    EXECUTE format('ALTER TABLE balance_transactions DETACH PARTITION %I', p_partition);
+    EXECUTE format('DROP TABLE %I', p_partition);
+    INSERT INTO balance_archives (partition_name, month_start, month_end, rows_count, file_name, sha256)
+    VALUES (p_partition, v_start, v_end, v_rows, p_file, p_sha256);
+
+    RETURN v_rows;
+END;
+$$;
+
+-- Проверка балансов: последний снимок + операции после него против
+-- group_balances.current_balance (читаются только секции после снимка)
+CREATE OR REPLACE FUNCTION verify_group_balances()
+RETURNS TABLE (
+    group_id BIGINT,
+    snapshot_at TIMESTAMP WITH TIME ZONE,
+    snapshot_balance DECIMAL(15, 2),
+    recent_transactions BIGINT,
+    computed_balance DECIMAL(15, 2),
+    current_balance DECIMAL(15, 2)
+)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT g.group_id, snap.taken_at, COALESCE(snap.balance, 0), COALESCE(tx.cnt, 0),
+           COALESCE(snap.balance, 0) + COALESCE(tx.amount, 0), g.current_balance
+    FROM group_balances g
+    LEFT JOIN LATERAL (
+        SELECT s.taken_at, s.balance
+        FROM balance_snapshots s
+        WHERE s.group_id = g.group_id
+        ORDER BY s.taken_at DESC
+        LIMIT 1
+    ) snap ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT SUM(t.amount) AS amount, COUNT(*) AS cnt
+        FROM balance_transactions t
+        WHERE t.group_id = g.group_id AND t.created_at >= COALESCE(snap.taken_at, '-infinity')
+    ) tx ON TRUE
+    ORDER BY g.group_id;
+$$;
+
+-- Постраничное чтение истории группы по возрастанию id (ledger_export.py)
+CREATE INDEX IF NOT EXISTS idx_balance_transactions_group_seq ON balance_transactions(group_id, id);
+
+-- Секции на ближайшие месяцы и снимки по уже существующей истории
+SELECT maintain_balance_ledger();
+
 -- Инициализация балансов для трёх групп
+-- (бот и сам регистрирует эти группы при первом запуске; новые группы - командой /enroll)
 -- ВАЖНО: Замените ID на реальные ID ваших Telegram групп
 -- Получить ID группы можно добавив бота @userinfobot в группу
 --
@@ -66,4 +744,17 @@ ON CONFLICT (group_id) DO NOTHING;
 COMMENT ON TABLE group_balances IS 'Текущие балансы групп Telegram';
 COMMENT ON TABLE balance_transactions IS 'История всех транзакций балансов';
 COMMENT ON COLUMN group_balances.language IS 'Язык сообщений: ru (русский) или zh (китайский)';
-COMMENT ON COLUMN balance_transactions.transaction_type IS 'Тип транзакции: add (пополнение) или subtract (списание)';
\ No newline at end of file
+COMMENT ON COLUMN balance_transactions.transaction_type IS 'Тип транзакции: add (пополнение) или subtract (списание)';
+COMMENT ON FUNCTION apply_balance_transaction IS 'Атомарно применяет транзакцию и возвращает (previous_balance, new_balance)';
+COMMENT ON FUNCTION apply_balance_journal IS 'Идемпотентно записывает пачку операций из журнала бота, возвращает число новых строк';
+COMMENT ON TABLE balance_rollups IS 'Итоги группы по часам и дням (period = hour/day), ведутся триггером';
+COMMENT ON TABLE balance_user_rollups IS 'Итоги пользователей группы по часам и дням, ведутся триггером';
+COMMENT ON COLUMN group_balances.currency IS 'Символ валюты в ответах бота';
+COMMENT ON COLUMN group_balances.active IS 'FALSE - учет в группе отключен (/unenroll), баланс и история сохраняются';
+COMMENT ON COLUMN group_balances.settings_updated_at IS 'Время последнего изменения настроек группы (для опроса реестра ботом)';
+COMMENT ON FUNCTION refresh_balance_rollups IS 'Пересчитывает balance_rollups и balance_user_rollups по истории, кроме архивных месяцев';
+COMMENT ON TABLE balance_snapshots IS 'Баланс группы на момент taken_at (учтены операции с created_at < taken_at)';
+COMMENT ON TABLE balance_archives IS 'Секции balance_transactions, выгруженные в архивные файлы и удаленные';
+COMMENT ON FUNCTION maintain_balance_ledger IS 'Создает секции на месяцы вперед и снимки на начало закрытых месяцев';
+COMMENT ON FUNCTION drop_balance_partition IS 'Удаляет выгруженную в архив секцию после проверки числа строк и снимков';
+COMMENT ON FUNCTION verify_group_balances IS 'Баланс по последнему снимку и операциям после него против current_balance';
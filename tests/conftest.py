@@ -0,0 +1,26 @@
+"""
+Общая настройка тестов
+Модули читают настройки из окружения при импорте, поэтому очереди, кэши и
+загрузки направляются во временный каталог до импорта, а Bot API - на закрытый
+порт: тесты не трогают ни рабочие данные, ни настоящий Telegram
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+DATA_DIR = tempfile.mkdtemp(prefix='escortwork-tests-')
+os.environ.update({
+    'DATA_DIR': DATA_DIR,
+    'UPLOAD_FOLDER': os.path.join(DATA_DIR, 'uploads'),
+    'QUEUE_DB_PATH': os.path.join(DATA_DIR, 'jobs.sqlite3'),
+    'BOT_TOKEN': '123:test',
+    'GROUP_ID': '-100',
+    'TELEGRAM_API_BASE_URL': 'http://127.0.0.1:9/bot',
+    # Допуск проверяется отдельно (test_admission.py)
+    'ADMISSION': '0',
+})
@@ -0,0 +1,62 @@
+"""Допуск анкет: лимит по умолчанию оставляет свободный воркер, нагрузочный тест без сброса анкет"""
+
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import load_test
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_admission(workers: int, **env_overrides) -> subprocess.CompletedProcess:
+    env = {key: value for key, value in os.environ.items() if not key.startswith('ADMISSION')}
+    env.update(WORKERS=str(workers), **env_overrides)
+    return subprocess.run(
+        [sys.executable, '-c', 'import logging; logging.basicConfig(); '
+         'import admission; print(admission.ADMISSION_MAX_IN_FLIGHT)'],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+
+
+@pytest.mark.parametrize('workers, cap', [(2, 1), (3, 2), (4, 3)])
+def test_default_cap_leaves_a_worker_free(workers, cap):
+    result = import_admission(workers)
+    assert int(result.stdout) == cap
+    assert 'ADMISSION_MAX_IN_FLIGHT' not in result.stderr
+
+
+@pytest.mark.parametrize('workers, env', [(1, {}), (2, {'ADMISSION_MAX_IN_FLIGHT': '2'})])
+def test_cap_holding_every_worker_is_reported(workers, env):
+    result = import_admission(workers, **env)
+    assert int(result.stdout) >= workers
+    assert 'ADMISSION_MAX_IN_FLIGHT' in result.stderr
+
+
+def test_load_test_disables_admission():
+    saved = dict(os.environ)
+    os.environ.pop('ADMISSION', None)
+    try:
+        args = SimpleNamespace(sync_db=False, workers=2, telegram_limits=False)
+        service = SimpleNamespace(server_port=1)
+        load_test.configure_environment(args, service, service, '/tmp/load-test')
+        assert os.environ['ADMISSION'] == '0'
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def test_load_test_accepts_and_delivers_every_submit():
+    pytest.importorskip('PIL')
+    env = {key: value for key, value in os.environ.items() if not key.startswith('ADMISSION')}
+    result = subprocess.run(
+        [sys.executable, 'benchmarks/load_test.py', '--scenario', 'submit', '--submits', '6',
+         '--photos', '1', '--concurrency', '6', '--api-latency', '0', '--timeout', '60'],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "статусы {202: 6}" in result.stdout
+    assert "доставлено 6/6" in result.stdout
@@ -0,0 +1,103 @@
+"""Журнал баланса: повтор выгрузки не дублирует операции, старые записи удаляются"""
+
+import time
+from decimal import Decimal
+
+import pytest
+
+from balance_journal import BalanceJournal
+
+
+class Store:
+    """Идемпотентный приемник: операция учитывается один раз по (group_id, message_id)"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.applied = {}
+        self.calls = 0
+
+    def apply(self, entries):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('Supabase недоступен')
+        for entry in entries:
+            self.applied.setdefault((entry['group_id'], entry['message_id']), entry['new_balance'])
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'journal.sqlite3')
+
+
+def append(journal: BalanceJournal, message_id: int, previous: int, new: int):
+    return journal.append(-100, message_id, 1, 'user', Decimal(new - previous), Decimal(previous), Decimal(new))
+
+
+def test_repeated_update_returns_recorded_balances(path):
+    journal = BalanceJournal(path)
+    assert append(journal, 1, 0, 10) == (Decimal(0), Decimal(10), True)
+    # Повторный апдейт с тем же message_id не меняет баланс второй раз
+    assert append(journal, 1, 10, 20) == (Decimal(0), Decimal(10), False)
+    assert journal.pending_count() == 1
+
+
+def test_replay_after_failure_and_restart_applies_each_entry_once(path):
+    journal = BalanceJournal(path)
+    for message_id in range(5):
+        append(journal, message_id, message_id * 10, message_id * 10 + 10)
+
+    store = Store(failures=1)
+    with pytest.raises(ConnectionError):
+        journal.flush(store.apply, batch_size=2)
+    assert journal.pending_count() == 5
+
+    restarted = BalanceJournal(path)
+    assert restarted.flush(store.apply, batch_size=2) == 5
+    assert restarted.flush(store.apply, batch_size=2) == 0
+    assert store.applied == {(-100, message_id): str(message_id * 10 + 10) for message_id in range(5)}
+    assert restarted.latest_pending_balances() == {}
+
+
+def test_flush_prunes_entries_older_than_retention(path):
+    journal = BalanceJournal(path, retention=3600)
+    for message_id in range(3):
+        append(journal, message_id, 0, 10)
+    journal.flush(Store().apply, batch_size=10)
+    append(journal, 3, 10, 20)
+
+    conn = journal._connect()
+    try:
+        # Две выгруженные записи устарели; невыгруженная старая запись остается
+        conn.execute("UPDATE journal SET flushed_at = ? WHERE message_id IN (0, 1)", (time.time() - 7200,))
+        conn.execute("UPDATE journal SET created_at = ? WHERE message_id = 3", (time.time() - 7200,))
+    finally:
+        conn.close()
+
+    assert journal.prune() == 2
+    conn = journal._connect()
+    try:
+        remaining = [row[0] for row in conn.execute("SELECT message_id FROM journal ORDER BY message_id")]
+    finally:
+        conn.close()
+    assert remaining == [2, 3]
+    assert journal.pending_count() == 1
+
+
+def test_successful_flush_runs_prune(path):
+    journal = BalanceJournal(path, retention=-1)
+    append(journal, 1, 0, 10)
+    assert journal.flush(Store().apply, batch_size=10) == 1
+    conn = journal._connect()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM journal").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+def test_failed_flush_does_not_prune(path):
+    journal = BalanceJournal(path, retention=-1)
+    append(journal, 1, 0, 10)
+    with pytest.raises(ConnectionError):
+        journal.flush(Store(failures=1).apply, batch_size=10)
+    assert journal.pending_count() == 1
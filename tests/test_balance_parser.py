@@ -0,0 +1,44 @@
+"""Разбор сумм в сообщениях группы"""
+
+from decimal import Decimal
+
+import pytest
+
+from balance_parser import parse_amount
+
+
+@pytest.mark.parametrize('text, amount', [
+    ('+1000', '1000'),
+    ('-5000', '-5000'),
+    ('+1,000', '1000'),
+    ('+1 000', '1000'),
+    ('+1000.50', '1000.50'),
+    ('  +1000  ', '1000'),
+    # Полноширинные знаки и типографский минус
+    ('＋1000', '1000'),
+    ('－500', '-500'),
+    ('−500', '-500'),
+    # Неразрывные пробелы и полноширинная запятая между тысячами
+    ('+1 000', '1000'),
+    ('+1 000 000', '1000000'),
+    ('+1，000', '1000'),
+    # Валюта до или после суммы
+    ('+1000¥', '1000'),
+    ('+¥1000', '1000'),
+    ('－￥1000', '-1000'),
+    ('+1000元', '1000'),
+    # 万 - множитель 10 000
+    ('+1万', '10000'),
+    ('+1.5万', '15000'),
+    ('-2.0001万', '-20001'),
+    ('＋3 万元', '30000'),
+])
+def test_parse_amount(text, amount):
+    assert parse_amount(text) == Decimal(amount)
+
+
+@pytest.mark.parametrize('text', [
+    None, '', 'привет', '1000', '+', '+abc', '+10 apples', '+1,00', '+1000.123', '+1.23456万', '++100', '+1万5',
+])
+def test_not_an_amount(text):
+    assert parse_amount(text) is None
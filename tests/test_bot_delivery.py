@@ -0,0 +1,134 @@
+"""Частичная доставка анкеты: повтор отправляет только недоставленное"""
+
+import os
+import time
+
+import pytest
+from telegram.error import NetworkError
+
+import bot
+from send_scheduler import SendScheduler
+
+
+class FakeBot:
+    """Bot с отказами по путям файлов; запоминает, что ушло в группу"""
+
+    def __init__(self, broken=(), album_fails=False):
+        self.broken = set(broken)
+        self.album_fails = album_fails
+        self.sent = []
+        self.captions = []
+        self.albums = []
+
+    def _send(self, file, caption):
+        if file.filename in self.broken:
+            raise NetworkError('Сбой сети')
+        self.sent.append(file.filename)
+        if caption:
+            self.captions.append(caption)
+        return object()
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.captions.append(text)
+
+    async def send_media_group(self, chat_id, media):
+        if self.album_fails:
+            raise NetworkError('Сбой сети')
+        self.albums.append([item.media.filename for item in media])
+        return [self._send(item.media, item.caption) for item in media]
+
+    async def send_photo(self, chat_id, photo, caption=None, parse_mode=None):
+        return self._send(photo, caption)
+
+
+def make_photos(tmp_path, count):
+    paths = []
+    for index in range(count):
+        path = tmp_path / f'{index}.jpg'
+        path.write_bytes(b'jpeg')
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def photos(tmp_path):
+    return make_photos(tmp_path, 3)
+
+
+def send(fake, monkeypatch, photos, delivered):
+    async def get_bot():
+        return fake
+
+    monkeypatch.setattr(bot, 'get_bot', get_bot)
+    monkeypatch.setattr(bot, 'SEND_RETRIES', 1)
+    # Лимиты Telegram в тестах не нужны - только порядок и повторы
+    scheduler = SendScheduler(global_limit=1000, chat_limit=1000)
+    monkeypatch.setattr(bot, '_scheduler', scheduler)
+    try:
+        return bot.send_application({'name': 'Тест'}, photos, None, {}, None, delivered)
+    finally:
+        bot.run_coroutine(scheduler.close())
+
+
+def test_unreadable_file_does_not_block_the_album(monkeypatch, photos):
+    os.remove(photos[0])
+    fake = FakeBot()
+    delivered = []
+    assert send(fake, monkeypatch, photos, delivered) is True
+    assert sorted(os.path.basename(path) for path in fake.sent) == ['1.jpg', '2.jpg']
+    # Подпись перешла к первому прочитанному файлу
+    assert len(fake.captions) == 1 and 'Тест' in fake.captions[0]
+    assert set(delivered) == {photos[1], photos[2], bot.TEXT_KEY}
+
+
+def test_retry_sends_only_missing_files(monkeypatch, photos):
+    delivered = []
+    first = FakeBot(broken=[os.path.basename(photos[1])], album_fails=True)
+    assert send(first, monkeypatch, photos, delivered) is False
+    assert set(delivered) == {photos[0], photos[2], bot.TEXT_KEY}
+
+    second = FakeBot()
+    assert send(second, monkeypatch, photos, delivered) is True
+    assert [os.path.basename(path) for path in second.sent] == ['1.jpg']
+    # Текст анкеты не дублируется - у файла короткая подпись
+    assert second.captions == ['📎 Файлы анкеты: Тест']
+    assert set(delivered) == {*photos, bot.TEXT_KEY}
+
+
+def test_albums_of_one_application_keep_their_order(monkeypatch, tmp_path):
+    photos = make_photos(tmp_path, 2 * bot.MEDIA_GROUP_LIMIT + 3)
+    load_media = bot._load_media
+
+    def slow_first_album(kind, path, caption=None, file_id=None):
+        # Первый альбом читается дольше остальных, но уходит первым
+        if path in photos[:bot.MEDIA_GROUP_LIMIT]:
+            time.sleep(0.02)
+        return load_media(kind, path, caption, file_id)
+
+    monkeypatch.setattr(bot, '_load_media', slow_first_album)
+    fake = FakeBot()
+    assert send(fake, monkeypatch, photos, []) is True
+    assert [album[0] for album in fake.albums] == ['0.jpg', '10.jpg', '20.jpg']
+
+
+def test_files_are_streamed_to_bot_api_and_closed(monkeypatch, tmp_path):
+    fake_bot_api = pytest.importorskip('fake_bot_api')
+    server = fake_bot_api.start_server()
+    monkeypatch.setattr(bot, 'TELEGRAM_API_BASE_URL', f"http://127.0.0.1:{server.server_port}/bot")
+    monkeypatch.setattr(bot, '_bot', None)
+    monkeypatch.setattr(bot, '_scheduler', None)
+    photos = []
+    for index in range(2):
+        path = tmp_path / f'{index}.jpg'
+        path.write_bytes(os.urandom(300_000))
+        photos.append(str(path))
+
+    try:
+        assert bot.send_application({'name': 'Тест'}, photos) is True
+    finally:
+        bot.run_coroutine(bot._shutdown_bot())
+        server.shutdown()
+    assert server.calls.get('sendMediaGroup') == 1
+    assert server.bytes_received > 2 * 300_000
+    open_files = {os.path.realpath(f'/proc/self/fd/{fd}') for fd in os.listdir('/proc/self/fd')}
+    assert not open_files & set(photos)
@@ -0,0 +1,115 @@
+"""Аренда задач доставки: долгие этапы не отдают задачу второму воркеру"""
+
+import time
+
+import pytest
+
+import delivery_worker
+import job_queue
+import media_processing
+from bot import SEND_TIMEOUT
+
+
+@pytest.fixture(autouse=True)
+def empty_queue(monkeypatch):
+    conn = job_queue._connect()
+    try:
+        conn.execute("DELETE FROM jobs")
+    finally:
+        conn.close()
+    monkeypatch.setattr(media_processing, 'prepare_media', lambda photos, video, optimized=False: (photos, video))
+
+
+def locked_until(job_id: str) -> float:
+    conn = job_queue._connect()
+    try:
+        return conn.execute("SELECT locked_until FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def expire_lease(job_id: str) -> None:
+    conn = job_queue._connect()
+    try:
+        conn.execute("UPDATE jobs SET locked_until = ? WHERE id = ?", (time.time() - 1, job_id))
+    finally:
+        conn.close()
+
+
+def claim() -> dict:
+    job_queue.enqueue({'data': {'name': 'Тест'}, 'photos': [], 'video': None})
+    return job_queue.claim_next()
+
+
+def test_renewed_lease_covers_each_stage_timeout():
+    job = claim()
+    assert job_queue.renew_lease(job['id'], job['attempts'], media_processing.MEDIA_STAGE_TIMEOUT)
+    assert locked_until(job['id']) - time.time() > media_processing.MEDIA_STAGE_TIMEOUT
+    assert media_processing.MEDIA_STAGE_TIMEOUT > media_processing.VIDEO_TRANSCODE_TIMEOUT
+
+
+def test_send_runs_under_lease_longer_than_send_timeout(monkeypatch):
+    job = claim()
+    remaining = []
+
+    def send(data, photos, video, digests, file_ids, delivered):
+        remaining.append(locked_until(job['id']) - time.time())
+        return True
+
+    monkeypatch.setattr(delivery_worker, 'send_application', send)
+    delivery_worker.process_job(job)
+    assert remaining and remaining[0] > SEND_TIMEOUT
+    assert job_queue.get_job(job['id'])['status'] == job_queue.STATUS_DONE
+
+
+def test_reclaimed_job_is_not_sent_twice(monkeypatch):
+    first = claim()
+    expire_lease(first['id'])
+    second = job_queue.claim_next()
+    assert second['id'] == first['id'] and second['attempts'] == first['attempts'] + 1
+
+    sent = []
+    monkeypatch.setattr(delivery_worker, 'send_application', lambda *args: sent.append(args) or True)
+    delivery_worker.process_job(first)
+    assert sent == []
+    assert not job_queue.renew_lease(first['id'], first['attempts'], SEND_TIMEOUT)
+
+    # Задача остается у второго воркера: ни done, ни повтор от первого
+    job = job_queue.get_job(first['id'])
+    assert job['status'] == job_queue.STATUS_PROCESSING and job['attempts'] == second['attempts']
+
+    delivery_worker.process_job(second)
+    assert len(sent) == 1
+    assert job_queue.get_job(first['id'])['status'] == job_queue.STATUS_DONE
+
+
+def test_failed_send_keeps_delivered_files_for_retry(monkeypatch):
+    job_queue.enqueue({'data': {'name': 'Тест'}, 'photos': ['a.jpg', 'b.jpg'], 'video': None})
+    job = job_queue.claim_next()
+    calls = []
+
+    def send(data, photos, video, digests, file_ids, delivered):
+        calls.append(list(delivered))
+        if not delivered:
+            delivered.extend(['a.jpg', 'text'])
+            return False
+        delivered.append('b.jpg')
+        return True
+
+    monkeypatch.setattr(delivery_worker, 'send_application', send)
+    delivery_worker.process_job(job)
+    stored = job_queue.get_job(job['id'])
+    assert stored['status'] == job_queue.STATUS_QUEUED
+    assert stored['payload']['delivered'] == ['a.jpg', 'text']
+    assert stored['progress']['delivered'] == 1 and stored['progress']['failed'] == 1
+
+    conn = job_queue._connect()
+    try:
+        conn.execute("UPDATE jobs SET next_run_at = 0 WHERE id = ?", (job['id'],))
+    finally:
+        conn.close()
+    delivery_worker.process_job(job_queue.claim_next())
+    assert calls[1] == ['a.jpg', 'text']
+    stored = job_queue.get_job(job['id'])
+    assert stored['status'] == job_queue.STATUS_DONE
+    assert stored['progress']['delivered'] == 2 and stored['progress']['failed'] == 0
@@ -0,0 +1,60 @@
+"""Работа с Supabase через fake_postgrest.py: клиент supabase-py без сети и рабочей БД"""
+
+from decimal import Decimal
+
+import pytest
+from postgrest.exceptions import APIError
+from supabase import create_client
+
+import fake_postgrest
+import group_registry
+import ledger_export
+
+
+@pytest.fixture
+def fake():
+    server = fake_postgrest.start_server()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def client(fake):
+    return create_client(f"http://127.0.0.1:{fake.server_port}", fake_postgrest.FAKE_KEY)
+
+
+def apply(client, group_id: int, amount: str, message_id: int) -> dict:
+    return client.rpc('apply_balance_transaction', {
+        'p_group_id': group_id, 'p_amount': amount, 'p_user_id': 1, 'p_username': 'test',
+        'p_message_id': message_id, 'p_group_name': f'Group {group_id}', 'p_language': 'ru',
+    }).execute().data[0]
+
+
+def test_group_registry_roundtrip(client):
+    group_registry.enroll_group(client, -1001, 'Тест', 'ru', '¥')
+    rows = {row['group_id']: row for row in group_registry.fetch_groups(client)}
+    assert rows[-1001]['active'] is True
+
+    assert group_registry.set_group_active(client, -1001, False)['active'] is False
+    assert group_registry.set_group_active(client, -1002, False) is None
+
+
+def test_balance_transactions_pass_ledger_audit(client):
+    amounts = {-1001: ['100.50', '-20.25', '5'], -1002: ['7.10', '2.90']}
+    message_id = 0
+    for group_id, values in amounts.items():
+        for amount in values:
+            message_id += 1
+            row = apply(client, group_id, amount, message_id)
+        assert Decimal(str(row['new_balance'])) == sum(Decimal(value) for value in values)
+
+    result = ledger_export.run(client, audit=True, workers=2, page_size=2)
+    assert result['rows'] == sum(len(values) for values in amounts.values())
+    assert result['audit']['breaks'] == {}
+
+
+def test_injected_errors_reach_the_client(fake, client):
+    fake.error_rate = 1.0
+    with pytest.raises(APIError):
+        group_registry.fetch_groups(client)
+    assert fake.errors == 1
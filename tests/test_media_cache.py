@@ -0,0 +1,44 @@
+"""Хеш содержимого для кэша file_id: одинаков при любой нарезке и порядке частей"""
+
+import io
+import os
+
+import pytest
+
+import media_cache
+import resumable_upload
+
+BLOCK = media_cache.DIGEST_BLOCK
+CONTENT = os.urandom(5 * BLOCK + BLOCK // 2)
+
+
+def streaming_digest(content: bytes, piece: int) -> str:
+    digest = media_cache.BlockDigest()
+    for start in range(0, len(content), piece):
+        digest.update(content[start:start + piece])
+    return digest.hexdigest()
+
+
+@pytest.mark.parametrize('piece', [1000, BLOCK - 1, BLOCK, 3 * BLOCK + 7, len(CONTENT)])
+def test_digest_does_not_depend_on_piece_size(tmp_path, piece):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(CONTENT)
+    assert streaming_digest(CONTENT, piece) == media_cache.file_digest(str(path))
+
+
+def test_out_of_order_chunks_give_streaming_digest(monkeypatch):
+    chunk_size = 2 * BLOCK
+    monkeypatch.setattr(resumable_upload, 'UPLOAD_CHUNK_SIZE', chunk_size)
+    info = resumable_upload.create_upload('video.mp4', len(CONTENT))
+    for chunk in reversed(range(info['chunks'])):
+        part = CONTENT[chunk * chunk_size:(chunk + 1) * chunk_size]
+        resumable_upload.write_chunk(info['upload_id'], chunk * chunk_size, io.BytesIO(part), len(part))
+
+    # Хеш собирается из хешей блоков частей, файл целиком не перечитывается
+    def no_reread(path):
+        raise AssertionError('файл перечитан при завершении загрузки')
+
+    monkeypatch.setattr(media_cache, 'file_digest', no_reread)
+    resumable_upload.finalize_upload(info['upload_id'])
+    _, video, digests = resumable_upload.claim_uploads([], info['upload_id'])
+    assert digests[video] == streaming_digest(CONTENT, 64 * 1024)
@@ -0,0 +1,54 @@
+"""Обработка медиа: в группу не уходят метаданные фото (EXIF, GPS)"""
+
+import os
+
+import pytest
+
+import media_processing
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def save_photo(path: str, size=(64, 48), quality=30, exif: bool = True) -> str:
+    image = Image.effect_noise(size, 64).convert('RGB')
+    if not exif:
+        image.save(path, 'JPEG', quality=quality)
+        return path
+    metadata = Image.Exif()
+    metadata[0x010F] = 'PhoneMaker'  # Make
+    metadata[0x8825] = {2: (55.0, 45.0, 0.0)}  # GPSInfo
+    image.save(path, 'JPEG', quality=quality, exif=metadata.tobytes())
+    return path
+
+
+def test_process_photo_strips_exif_even_when_output_is_larger(tmp_path):
+    # Маленький JPEG низкого качества: перекодирование с PHOTO_JPEG_QUALITY его увеличивает
+    path = save_photo(str(tmp_path / 'small.jpg'), size=(200, 200), quality=5)
+    stats = media_processing.process_photo(path)
+    assert stats['changed'] and stats['bytes_out'] >= stats['bytes_in']
+    assert not os.path.exists(path)
+    with Image.open(stats['path']) as image:
+        assert not image.getexif()
+        assert 'exif' not in image.info
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(media_processing, 'MEDIA_PROCESSING', True)
+    yield
+    media_processing.shutdown()
+
+
+def test_client_flag_does_not_skip_exif_removal(tmp_path, pool):
+    path = save_photo(str(tmp_path / 'client.jpg'))
+    photos, _ = media_processing.prepare_media([path], None, images_optimized=True)
+    assert photos[0] != path
+    with Image.open(photos[0]) as image:
+        assert not image.getexif()
+
+
+@pytest.mark.parametrize('size, processed', [((64, 48), False), ((media_processing.MAX_PHOTO_EDGE + 1, 8), True)])
+def test_clean_client_jpeg_is_sent_as_is(tmp_path, pool, size, processed):
+    path = save_photo(str(tmp_path / 'client.jpg'), size=size, exif=False)
+    photos, _ = media_processing.prepare_media([path], None, images_optimized=True)
+    assert (photos[0] != path) == processed
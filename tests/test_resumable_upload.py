@@ -0,0 +1,71 @@
+"""Возобновляемая загрузка: части в любом порядке, завершение, передача анкете"""
+
+import io
+import os
+
+import pytest
+
+import media_cache
+import resumable_upload
+
+CHUNK = 1000
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(resumable_upload, 'UPLOAD_CHUNK_SIZE', CHUNK)
+
+
+def upload(content: bytes, filename: str = 'photo.jpg', order=None) -> dict:
+    info = resumable_upload.create_upload(filename, len(content))
+    chunks = list(range(info['chunks']))
+    for chunk in order or chunks:
+        part = content[chunk * CHUNK:(chunk + 1) * CHUNK]
+        resumable_upload.write_chunk(info['upload_id'], chunk * CHUNK, io.BytesIO(part), len(part))
+    return info
+
+
+def test_chunks_in_any_order_rebuild_the_file():
+    content = os.urandom(3 * CHUNK + 17)
+    info = upload(content, order=[3, 1, 0, 2])
+    assert resumable_upload.get_upload(info['upload_id'])['received'] == [0, 1, 2, 3]
+
+    done = resumable_upload.finalize_upload(info['upload_id'])
+    assert done['status'] == resumable_upload.STATUS_COMPLETE
+    paths, video, digests = resumable_upload.claim_uploads([info['upload_id']])
+    assert video is None
+    with open(paths[0], 'rb') as f:
+        assert f.read() == content
+    assert digests == {paths[0]: media_cache.file_digest(paths[0])}
+
+
+def test_finalize_requires_every_chunk():
+    info = upload(os.urandom(2 * CHUNK), order=[1])
+    with pytest.raises(ValueError):
+        resumable_upload.finalize_upload(info['upload_id'])
+
+
+@pytest.mark.parametrize('offset, length', [(CHUNK // 2, CHUNK), (0, CHUNK - 1), (5 * CHUNK, CHUNK)])
+def test_invalid_chunk_is_rejected(offset, length):
+    info = resumable_upload.create_upload('photo.jpg', 2 * CHUNK)
+    with pytest.raises(ValueError):
+        resumable_upload.write_chunk(info['upload_id'], offset, io.BytesIO(b'x' * length), length)
+
+
+def test_upload_is_claimed_once():
+    photo = upload(os.urandom(CHUNK))
+    video = upload(os.urandom(CHUNK), 'video.mp4')
+    for info in (photo, video):
+        resumable_upload.finalize_upload(info['upload_id'])
+
+    # Повтор id в одной анкете отклоняется целиком, загрузки остаются свободными
+    with pytest.raises(ValueError):
+        resumable_upload.claim_uploads([photo['upload_id'], photo['upload_id']])
+    with pytest.raises(ValueError):
+        resumable_upload.claim_uploads([video['upload_id']], video['upload_id'])
+    assert resumable_upload.get_upload(photo['upload_id'])['status'] == resumable_upload.STATUS_COMPLETE
+
+    paths, video_path, _ = resumable_upload.claim_uploads([photo['upload_id']], video['upload_id'])
+    assert len(paths) == 1 and video_path.endswith('.mp4')
+    with pytest.raises(ValueError):
+        resumable_upload.claim_uploads([photo['upload_id']])
@@ -0,0 +1,81 @@
+"""Планировщик отправок: порядок в чате, параллельные альбомы по настройке, лимиты"""
+
+import asyncio
+import time
+
+from send_scheduler import PRIORITY_MEDIA, PRIORITY_TEXT, SendScheduler
+
+CHAT = -100
+
+
+class Recorder:
+    """Вызов Bot API: записывает начало и конец, считает одновременные вызовы"""
+
+    def __init__(self, duration: float = 0.1):
+        self.duration = duration
+        self.running = 0
+        self.max_running = 0
+        self.calls = []
+
+    async def __call__(self, name):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        started = time.monotonic()
+        await asyncio.sleep(self.duration)
+        self.running -= 1
+        self.calls.append((name, started, time.monotonic()))
+        return name
+
+
+def run(scheduler: SendScheduler, sends: list) -> None:
+    async def main():
+        try:
+            await asyncio.gather(*[
+                scheduler.submit(CHAT, func, name, priority=priority, cost=cost)
+                for func, name, priority, cost in sends
+            ])
+        finally:
+            await scheduler.close()
+
+    asyncio.run(main())
+
+
+def test_albums_in_one_chat_run_concurrently():
+    recorder = Recorder()
+    scheduler = SendScheduler(global_limit=1000, chat_limit=1000, chat_concurrency=2)
+    run(scheduler, [(recorder, f'album-{i}', PRIORITY_MEDIA, 10) for i in range(4)])
+    assert recorder.max_running == 2
+    assert [name for name, _, _ in sorted(recorder.calls, key=lambda call: call[1])] == \
+        ['album-0', 'album-1', 'album-2', 'album-3']
+
+
+def test_single_request_per_chat_by_default():
+    recorder = Recorder()
+    scheduler = SendScheduler(global_limit=1000, chat_limit=1000)
+    run(scheduler, [(recorder, f'album-{i}', PRIORITY_MEDIA, 10) for i in range(3)])
+    assert recorder.max_running == 1
+    # Следующий запрос - только после ответа на предыдущий: порядок в группе сохраняется
+    calls = sorted(recorder.calls, key=lambda call: call[1])
+    assert [name for name, _, _ in calls] == ['album-0', 'album-1', 'album-2']
+    assert all(later[1] >= earlier[2] for earlier, later in zip(calls, calls[1:]))
+
+
+def test_text_is_not_sent_alongside_other_requests():
+    recorder = Recorder()
+    scheduler = SendScheduler(global_limit=1000, chat_limit=1000, chat_concurrency=2)
+    run(scheduler, [(recorder, 'text-0', PRIORITY_TEXT, 1), (recorder, 'text-1', PRIORITY_TEXT, 1),
+                    (recorder, 'album-0', PRIORITY_MEDIA, 5), (recorder, 'album-1', PRIORITY_MEDIA, 5)])
+    calls = {name: (started, finished) for name, started, finished in recorder.calls}
+    assert calls['text-1'][0] >= calls['text-0'][1]
+    assert calls['album-0'][0] >= calls['text-1'][1]
+    assert recorder.max_running == 2
+
+
+def test_chat_limit_applies_to_concurrent_albums():
+    recorder = Recorder(duration=0.01)
+    scheduler = SendScheduler(global_limit=1000, chat_limit=10, chat_window=0.5, chat_concurrency=2)
+    run(scheduler, [(recorder, f'album-{i}', PRIORITY_MEDIA, 5) for i in range(3)])
+    starts = sorted(started for _, started, _ in recorder.calls)
+    # Два альбома по 5 файлов заполняют окно: третий ждет, пока оно сдвинется
+    assert starts[1] - starts[0] < 0.1
+    assert starts[2] - starts[0] >= 0.5
@@ -0,0 +1,61 @@
+"""Статика из памяти: ETag по варианту сжатия, 304 без тела, имена с хешем"""
+
+import gzip
+
+import pytest
+
+import server
+import static_assets
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+def versioned(filename: str) -> str:
+    return static_assets.hashed_name(filename, server.STATIC_ASSETS[filename].digest)
+
+
+def test_index_links_hashed_assets(client):
+    response = client.get('/')
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    for filename in static_assets.HASHED_ASSETS:
+        assert f'/{versioned(filename)}' in html
+    assert response.headers['Cache-Control'] == static_assets.REVALIDATE_CACHE_CONTROL
+
+
+def test_hashed_asset_is_immutable(client):
+    response = client.get(f'/{versioned("styles.css")}')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == static_assets.IMMUTABLE_CACHE_CONTROL
+
+
+def test_each_encoding_has_its_own_etag(client):
+    plain = client.get('/', headers={'Accept-Encoding': 'identity'})
+    gzipped = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(gzipped.get_data()) == plain.get_data()
+    assert plain.headers['ETag'] != gzipped.headers['ETag']
+    assert gzipped.headers['Vary'] == 'Accept-Encoding'
+
+
+@pytest.mark.parametrize('cached, sent', [('identity', 'gzip'), ('gzip', 'gzip'), ('gzip', 'identity')])
+def test_matching_etag_returns_304_without_body(client, cached, sent):
+    etag = client.get('/', headers={'Accept-Encoding': cached}).headers['ETag']
+    response = client.get('/', headers={'Accept-Encoding': sent, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert response.headers['Cache-Control'] == static_assets.REVALIDATE_CACHE_CONTROL
+
+
+def test_stale_etag_returns_content(client):
+    response = client.get('/', headers={'If-None-Match': '"stale"'})
+    assert response.status_code == 200 and response.get_data()
+
+
+def test_source_files_are_not_served(client):
+    # Неизвестный путь - index.html (SPA), а не файл из корня репозитория
+    response = client.get('/server.py')
+    assert response.get_data() == client.get('/').get_data()
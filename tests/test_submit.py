@@ -0,0 +1,63 @@
+"""POST /api/submit: файлы анкеты, не поставленной в очередь, не остаются в uploads/"""
+
+import io
+import os
+
+import pytest
+
+import job_queue
+import resumable_upload
+import server
+from upload_storage import UPLOAD_FOLDER
+
+
+def uploaded_files() -> set:
+    return set(os.listdir(UPLOAD_FOLDER))
+
+
+def submit(**fields):
+    data = {'name': 'Тест', 'photos': (io.BytesIO(b'\xff\xd8' + os.urandom(4096)), 'photo.jpg')}
+    data.update(fields)
+    return server.app.test_client().post('/api/submit', data=data, content_type='multipart/form-data')
+
+
+def test_unknown_upload_id_removes_multipart_files():
+    before = uploaded_files()
+    response = submit(photo_uploads='missing-upload')
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+    assert uploaded_files() == before
+
+
+def test_duplicate_upload_id_is_rejected():
+    content = os.urandom(1024)
+    info = resumable_upload.create_upload('photo.jpg', len(content))
+    resumable_upload.write_chunk(info['upload_id'], 0, io.BytesIO(content), len(content))
+    resumable_upload.finalize_upload(info['upload_id'])
+
+    response = submit(photo_uploads=[info['upload_id'], info['upload_id']])
+    assert response.status_code == 400
+    assert resumable_upload.get_upload(info['upload_id'])['status'] == resumable_upload.STATUS_COMPLETE
+
+
+def test_enqueue_failure_removes_files(monkeypatch):
+    def fail(payload):
+        raise RuntimeError("база очереди недоступна")
+
+    monkeypatch.setattr(job_queue, 'enqueue', fail)
+    before = uploaded_files()
+    response = submit()
+    assert response.status_code == 500
+    assert uploaded_files() == before
+
+
+@pytest.mark.parametrize('with_video', [False, True])
+def test_accepted_submit_keeps_files(with_video):
+    fields = {'video': (io.BytesIO(os.urandom(4096)), 'video.mp4')} if with_video else {}
+    response = submit(**fields)
+    assert response.status_code == 202
+    payload = job_queue.get_job(response.get_json()['job_id'])['payload']
+    assert len(payload['photos']) == 1
+    assert os.path.exists(payload['photos'][0])
+    assert (payload['video'] is not None) == with_video
+    assert set(payload['media_digests']) == set(payload['photos'] + ([payload['video']] if with_video else []))
@@ -0,0 +1,134 @@
+"""
+Потоковое сохранение загружаемых файлов
+Части multipart пишутся блоками сразу в UPLOAD_FOLDER под уникальным именем,
+без промежуточного временного файла и повторного копирования через save();
+хеш содержимого для кэша file_id (media_cache.py) считается по ходу записи
+"""
+
+import logging
+import os
+import uuid
+
+from flask import Request
+from werkzeug.utils import secure_filename
+
+from media_cache import BlockDigest
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
+ALLOWED_PHOTO_EXTENSIONS = {'png', 'jpg', 'jpeg', 'heic'}
+ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi'}
+ALLOWED_EXTENSIONS = ALLOWED_PHOTO_EXTENSIONS | ALLOWED_VIDEO_EXTENSIONS
+
+
+def file_extension(filename: str | None) -> str:
+    """Возвращает расширение файла в нижнем регистре ('' если его нет)"""
+    filename = secure_filename(filename or '')
+    if '.' not in filename:
+        return ''
+    return filename.rsplit('.', 1)[1].lower()
+
+
+class UploadFile:
+    """
+    Файл загрузки на диске
+    Werkzeug пишет в него части multipart по мере чтения тела запроса,
+    поэтому в памяти держится только текущий блок
+    """
+
+    def __init__(self, extension: str):
+        self.path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}.{extension}")
+        self.size = 0
+        self.keep = False
+        self.digest = BlockDigest()
+        self._file = open(self.path, 'w+b')
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        self.digest.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read/seek/readline/flush/close и т.д. - напрямую к файлу
+        return getattr(self._file, name)
+
+    def discard(self) -> None:
+        """Закрывает и удаляет файл"""
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class _DiscardFile:
+    """Приемник для файлов с недопустимым расширением: ничего не сохраняет"""
+
+    size = 0
+
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+    def read(self, *args) -> bytes:
+        return b''
+
+    def readline(self, *args) -> bytes:
+        return b''
+
+    def seek(self, *args) -> int:
+        return 0
+
+    def tell(self) -> int:
+        return 0
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class UploadRequest(Request):
+    """
+    Request, который стримит файлы сразу в UPLOAD_FOLDER
+    Файлы, не помеченные keep=True, удаляются при закрытии запроса
+    (ошибка обработки, обрыв загрузки, лишние поля формы)
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        extension = file_extension(filename)
+        if extension not in ALLOWED_EXTENSIONS:
+            return _DiscardFile()
+
+        upload = UploadFile(extension)
+        self.__dict__.setdefault('_upload_files', []).append(upload)
+        return upload
+
+    def close(self) -> None:
+        super().close()
+        for upload in self.__dict__.get('_upload_files', []):
+            if not upload.keep:
+                upload.discard()
+
+
+def keep_upload(storage) -> str | None:
+    """
+    Помечает загруженный файл как нужный и возвращает путь к нему на диске
+    None - если файл пустой или был отброшен
+    """
+    stream = storage.stream
+    if not isinstance(stream, UploadFile) or stream.size == 0:
+        return None
+
+    stream.flush()
+    stream.keep = True
+    return stream.path
+
+
+def upload_digest(storage) -> str | None:
+    """Хеш содержимого загруженного файла (media_cache) или None"""
+    stream = storage.stream
+    if not isinstance(stream, UploadFile) or stream.size == 0:
+        return None
+    return stream.digest.hexdigest()